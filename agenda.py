@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Agenda de atendimentos: horários disponíveis e reserva sem conflito
+O dia é dividido em slots de `intervalo_minutos` a partir do primeiro horário
+de abertura da semana. Cada "vaga" (um técnico ativo atende `capacidade`
+clientes ao mesmo tempo; sem técnicos cadastrados vale `capacidade_padrao`)
+tem, por dia, um bitmap BIGINT em agenda_ocupacao com um bit por slot
+ocupado. A disponibilidade de vários dias sai de uma consulta por faixa de
+datas, e a reserva é um único UPDATE que escolhe uma vaga livre com
+FOR UPDATE: duas reservas simultâneas do mesmo horário não passam as duas.
+
+Os bitmaps são um resumo dos agendamentos: cancelar, excluir ou mudar um
+agendamento reconstrói o dia a partir da tabela agendamentos. O significado
+de cada bit depende da origem, do intervalo e das vagas da configuração;
+a assinatura deles fica em agenda_ocupacao_layout e, quando data/agenda.json
+muda algum desses valores, os bitmaps são reconstruídos antes da próxima
+consulta ou reserva.
+
+Horários de funcionamento, intervalo, duração por tipo de serviço e
+capacidade por técnico ficam em data/agenda.json.
+
+Uso:
+    python agenda.py reconstruir [AAAA-MM-DD]            # refaz os bitmaps a partir da data (padrão: hoje)
+    python agenda.py disponibilidade AAAA-MM-DD [dias] [tipo_servico]
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+ARQUIVO_CONFIG = 'data/agenda.json'
+
+# Usado quando data/agenda.json não existe (mesmos horários do formulário antigo)
+CONFIG_PADRAO = {
+    'intervalo_minutos': 30,
+    # Dia da semana (0 = segunda ... 6 = domingo) -> faixas [início, fim)
+    'horarios': {
+        '0': [['08:00', '12:00'], ['13:00', '18:00']],
+        '1': [['08:00', '12:00'], ['13:00', '18:00']],
+        '2': [['08:00', '12:00'], ['13:00', '18:00']],
+        '3': [['08:00', '12:00'], ['13:00', '18:00']],
+        '4': [['08:00', '12:00'], ['13:00', '18:00']],
+        '5': [['08:00', '12:00']],
+        '6': [],
+    },
+    'duracao_padrao_minutos': 30,
+    'duracoes_minutos': {},  # tipo de serviço -> minutos
+    'capacidade_padrao': 1,  # Atendimentos simultâneos quando não há técnicos ativos
+    'capacidade_por_tecnico': 1,
+    'capacidades': {},  # id do técnico -> atendimentos simultâneos
+    'antecedencia_maxima_dias': 60,
+}
+
+STATUS_LIVRES = ('cancelado',)  # Agendamentos nesses status não ocupam horário
+MAX_SLOTS = 63  # Bits usáveis em um BIGINT sem sinal negativo
+MAX_DIAS_CONSULTA = 31
+
+
+class HorarioIndisponivel(Exception):
+    """Horário fora do expediente ou sem vaga livre"""
+    pass
+
+
+def _minutos(hora):
+    """'08:30' -> 510"""
+    if not re.match(r'^\d{1,2}:\d{2}$', hora or ''):
+        raise ValueError(f'Hora inválida: {hora}')
+    horas, minutos = hora.split(':')
+    return int(horas) * 60 + int(minutos)
+
+
+class ConfigAgenda:
+    """Configuração já convertida para slots e máscaras de bits"""
+
+    def __init__(self, dados):
+        config = dict(CONFIG_PADRAO)
+        config.update(dados or {})
+        self.intervalo = int(config['intervalo_minutos'])
+        faixas = {int(dia): [(_minutos(a), _minutos(b)) for a, b in lista]
+                  for dia, lista in config['horarios'].items()}
+        inicios = [a for lista in faixas.values() for a, _ in lista]
+        self.origem = min(inicios) if inicios else 0
+        self.mascaras_abertas = {}
+        for dia in range(7):
+            mascara = 0
+            for inicio, fim in faixas.get(dia, []):
+                for minuto in range(inicio, fim, self.intervalo):
+                    indice = (minuto - self.origem) // self.intervalo
+                    if indice >= MAX_SLOTS:
+                        raise ValueError(f'Expediente longo demais para o intervalo de {self.intervalo} min '
+                                         f'(máximo {MAX_SLOTS} slots por dia)')
+                    mascara |= 1 << indice
+            self.mascaras_abertas[dia] = mascara
+        self.duracao_padrao = int(config['duracao_padrao_minutos'])
+        self.duracoes = {nome.strip().lower(): int(minutos) for nome, minutos in config['duracoes_minutos'].items()}
+        self.capacidade_padrao = max(int(config['capacidade_padrao']), 1)
+        self.capacidade_por_tecnico = max(int(config['capacidade_por_tecnico']), 0)
+        self.capacidades = {int(t): int(c) for t, c in config['capacidades'].items()}
+        self.antecedencia_maxima = int(config['antecedencia_maxima_dias'])
+        # O que define a posição dos bits e as vagas - durações e antecedência não entram
+        self.assinatura = hashlib.sha1(json.dumps([
+            self.origem, self.intervalo, self.capacidade_padrao, self.capacidade_por_tecnico,
+            sorted(self.capacidades.items()),
+        ]).encode('utf-8')).hexdigest()
+
+    def slot(self, hora):
+        """Índice do slot que começa em `hora` (None se não cai no início de um slot)"""
+        try:
+            deslocamento = _minutos(hora) - self.origem
+        except ValueError:
+            return None
+        if deslocamento < 0 or deslocamento % self.intervalo:
+            return None
+        indice = deslocamento // self.intervalo
+        return indice if indice < MAX_SLOTS else None
+
+    def hora(self, indice):
+        minutos = self.origem + indice * self.intervalo
+        return f'{minutos // 60:02d}:{minutos % 60:02d}'
+
+    def duracao(self, tipo_servico):
+        return self.duracoes.get((tipo_servico or '').strip().lower(), self.duracao_padrao)
+
+    def slots_necessarios(self, duracao_minutos):
+        return max(-(-int(duracao_minutos) // self.intervalo), 1)
+
+    def mascara(self, indice, quantidade):
+        return ((1 << quantidade) - 1) << indice
+
+    def mascara_aberta(self, dia):
+        return self.mascaras_abertas.get(dia.weekday(), 0)
+
+    def recursos(self, tecnicos_ids):
+        """Vagas (tecnico_id, vaga) - tecnico_id 0 quando não há técnicos ativos"""
+        vagas = [(tecnico_id, vaga) for tecnico_id in sorted(tecnicos_ids)
+                 for vaga in range(self.capacidades.get(tecnico_id, self.capacidade_por_tecnico))]
+        return vagas or [(0, vaga) for vaga in range(self.capacidade_padrao)]
+
+
+_cache_config = {'mtime': None, 'config': None}
+_lock_config = threading.Lock()
+
+
+def carregar_config(caminho=ARQUIVO_CONFIG):
+    """ConfigAgenda de data/agenda.json, relido só quando o arquivo muda"""
+    try:
+        mtime = os.path.getmtime(caminho)
+    except OSError:
+        mtime = None
+    with _lock_config:
+        if _cache_config['config'] is None or _cache_config['mtime'] != mtime:
+            dados = {}
+            if mtime is not None:
+                with open(caminho, 'r', encoding='utf-8') as f:
+                    dados = json.load(f)
+            _cache_config['config'] = ConfigAgenda(dados)
+            _cache_config['mtime'] = mtime
+        return _cache_config['config']
+
+
+def validar_horario(config, dia, hora, duracao_minutos, agora=None):
+    """Máscara de bits do atendimento - levanta HorarioIndisponivel se não cabe no expediente"""
+    agora = agora or datetime.now()
+    if dia < agora.date() or dia > agora.date() + timedelta(days=config.antecedencia_maxima):
+        raise HorarioIndisponivel('Fecha fuera del período disponible para agendamiento.')
+    indice = config.slot(hora)
+    if indice is None:
+        raise HorarioIndisponivel('Horario inválido.')
+    if dia == agora.date() and config.hora(indice) <= agora.strftime('%H:%M'):
+        raise HorarioIndisponivel('Ese horario ya pasó.')
+    quantidade = config.slots_necessarios(duracao_minutos)
+    if indice + quantidade > MAX_SLOTS:
+        raise HorarioIndisponivel('Horario fuera del horario de atención.')
+    mascara = config.mascara(indice, quantidade)
+    if mascara & config.mascara_aberta(dia) != mascara:
+        raise HorarioIndisponivel('Horario fuera del horario de atención.')
+    return mascara
+
+
+def distribuir(config, agendamentos, recursos):
+    """Monta os bitmaps {(tecnico_id, vaga): bitmap} de um dia a partir dos agendamentos
+
+    Cada agendamento vai para a primeira vaga livre do seu técnico (ou de qualquer
+    técnico, se não tem um ou se ele não está mais ativo). Os que não cabem - encaixes
+    feitos pelo admin acima da capacidade - são devolvidos na segunda posição.
+    """
+    bitmaps = {recurso: 0 for recurso in recursos}
+    tecnicos = {tecnico_id for tecnico_id, _ in recursos}
+    sem_vaga = []
+    for agendamento in sorted(agendamentos, key=lambda a: (a['tecnico_id'] not in tecnicos, a['hora'] or '')):
+        indice = config.slot(agendamento['hora'])
+        if indice is None:
+            continue
+        quantidade = min(config.slots_necessarios(agendamento['duracao_minutos'] or config.duracao_padrao),
+                         MAX_SLOTS - indice)
+        mascara = config.mascara(indice, quantidade)
+        candidatas = [r for r in recursos if r[0] == agendamento['tecnico_id']] or recursos
+        livre = next((r for r in candidatas if not bitmaps[r] & mascara), None)
+        if livre is None:
+            sem_vaga.append(agendamento)
+        else:
+            bitmaps[livre] |= mascara
+    return bitmaps, sem_vaga
+
+
+def horarios_livres(config, dia, bitmaps, slots, agora=None):
+    """[(hora, vagas_livres)] dos inícios em que o atendimento de `slots` slots cabe"""
+    agora = agora or datetime.now()
+    aberta = config.mascara_aberta(dia)
+    if not aberta or dia < agora.date():
+        return []
+    limite = agora.strftime('%H:%M') if dia == agora.date() else ''
+    livres = []
+    for indice in range(MAX_SLOTS - slots + 1):
+        mascara = config.mascara(indice, slots)
+        if mascara & aberta != mascara:
+            continue
+        hora = config.hora(indice)
+        if hora <= limite:
+            continue
+        vagas = sum(1 for bitmap in bitmaps if not bitmap & mascara)
+        if vagas:
+            livres.append((hora, vagas))
+    return livres
+
+
+def _disponibilidade(config, inicio, dias, tipo_servico, ocupacao, recursos, agora):
+    duracao = config.duracao(tipo_servico)
+    slots = config.slots_necessarios(duracao)
+    resultado = []
+    for deslocamento in range(dias):
+        dia = inicio + timedelta(days=deslocamento)
+        bitmaps = [ocupacao.get(dia, {}).get(recurso, 0) for recurso in recursos]
+        resultado.append({
+            'data': dia.isoformat(),
+            'horarios': [{'hora': hora, 'vagas': vagas}
+                         for hora, vagas in horarios_livres(config, dia, bitmaps, slots, agora)],
+        })
+    return {'intervalo_minutos': config.intervalo, 'duracao_minutos': duracao, 'dias': resultado}
+
+
+# ==================== POSTGRESQL ====================
+
+def garantir_tabela_ocupacao(engine):
+    """Colunas estruturadas e índice (data, hora) de agendamentos - retorna True se agenda_ocupacao está vazia
+
+    A tabela agenda_ocupacao em si vem do db.create_all() (models.AgendaOcupacao).
+    """
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS hora TIME"))
+        conn.execute(text("ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS duracao_minutos INTEGER"))
+        conn.execute(text("ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS data_atualizacao TIMESTAMP"))
+        conn.execute(text("UPDATE agendamentos SET data_atualizacao = data_criacao WHERE data_atualizacao IS NULL"))
+        conn.execute(text(
+            "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS tecnico_id INTEGER "
+            "REFERENCES tecnicos(id) ON DELETE SET NULL"
+        ))
+        # hora_agendamento era texto livre - só o que for HH:MM vira hora
+        conn.execute(text("""
+            UPDATE agendamentos SET hora = hora_agendamento::time
+            WHERE hora IS NULL AND hora_agendamento ~ '^[0-2]?[0-9]:[0-5][0-9]$'
+              AND split_part(hora_agendamento, ':', 1)::int < 24
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_agendamentos_data_hora ON agendamentos (data_agendamento, hora)"))
+        vazia = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM agenda_ocupacao)")).scalar()
+    return vazia
+
+
+_layout_conferido = {'assinatura': None}
+
+
+def _gravar_layout(session, assinatura):
+    session.execute(text("""
+        INSERT INTO agenda_ocupacao_layout (id, assinatura, data_atualizacao) VALUES (1, :assinatura, now())
+        ON CONFLICT (id) DO UPDATE SET assinatura = EXCLUDED.assinatura, data_atualizacao = now()
+    """), {'assinatura': assinatura})
+
+
+def conferir_layout(engine, config):
+    """Reconstrói os bitmaps (de hoje em diante) se foram montados com outra origem/intervalo/vagas
+
+    Transação própria. Cada worker só consulta o banco de novo quando a
+    configuração muda; a linha travada impede dois workers de reconstruírem
+    juntos. Retorna True se reconstruiu.
+    """
+    if _layout_conferido['assinatura'] == config.assinatura:
+        return False
+    with Session(bind=engine) as sessao:
+        sessao.execute(text(
+            "INSERT INTO agenda_ocupacao_layout (id, assinatura) VALUES (1, NULL) ON CONFLICT (id) DO NOTHING"
+        ))
+        gravada = sessao.execute(text("SELECT assinatura FROM agenda_ocupacao_layout WHERE id = 1 FOR UPDATE")).scalar()
+        reconstruiu = gravada != config.assinatura
+        if reconstruiu:
+            dias = reconstruir_a_partir_de(sessao, config)
+            _gravar_layout(sessao, config.assinatura)
+            print(f"Agenda: configuração de horários mudou, ocupação reconstruída ({dias} dias)")
+        sessao.commit()
+    _layout_conferido['assinatura'] = config.assinatura
+    return reconstruiu
+
+
+def _tecnicos_ativos(session):
+    return [linha[0] for linha in session.execute(text("SELECT id FROM tecnicos WHERE ativo IS NOT FALSE"))]
+
+
+def _ocupacao_banco(session, inicio, fim):
+    ocupacao = {}
+    linhas = session.execute(text("""
+        SELECT data, tecnico_id, vaga, bitmap FROM agenda_ocupacao
+        WHERE data BETWEEN :inicio AND :fim AND bitmap <> 0
+    """), {'inicio': inicio, 'fim': fim})
+    for dia, tecnico_id, vaga, bitmap in linhas:
+        ocupacao.setdefault(dia, {})[(tecnico_id, vaga)] = bitmap
+    return ocupacao
+
+
+def disponibilidade(session, config, inicio, dias, tipo_servico=None, agora=None):
+    """Horários livres de `dias` dias a partir de `inicio` (uma consulta para a faixa toda)"""
+    agora = agora or datetime.now()
+    dias = max(1, min(dias, MAX_DIAS_CONSULTA))
+    conferir_layout(session.get_bind(), config)
+    recursos = config.recursos(_tecnicos_ativos(session))
+    ocupacao = _ocupacao_banco(session, inicio, inicio + timedelta(days=dias - 1))
+    return _disponibilidade(config, inicio, dias, tipo_servico, ocupacao, recursos, agora)
+
+
+def reservar(session, config, dia, hora, duracao_minutos, agora=None):
+    """Ocupa o horário em uma vaga livre, na transação da sessão - retorna o tecnico_id (ou None)
+
+    O commit fica com quem chama, junto com o INSERT do agendamento. Levanta
+    HorarioIndisponivel se o horário não cabe no expediente ou se não há vaga.
+    """
+    mascara = validar_horario(config, dia, hora, duracao_minutos, agora)
+    conferir_layout(session.get_bind(), config)
+    recursos = config.recursos(_tecnicos_ativos(session))
+    session.execute(text("""
+        INSERT INTO agenda_ocupacao (data, tecnico_id, vaga, bitmap) VALUES (:data, :tecnico_id, :vaga, 0)
+        ON CONFLICT DO NOTHING
+    """), [{'data': dia, 'tecnico_id': t, 'vaga': v} for t, v in recursos])
+    # O FOR UPDATE reavalia "bitmap & :mascara = 0" na versão travada: se outra reserva
+    # ocupou a vaga enquanto esperávamos, a próxima vaga da ordenação é tentada
+    linha = session.execute(text("""
+        UPDATE agenda_ocupacao o SET bitmap = o.bitmap | :mascara
+        FROM (
+            SELECT data, tecnico_id, vaga FROM agenda_ocupacao
+            WHERE data = :data
+              AND (tecnico_id, vaga) IN (SELECT unnest(CAST(:tecnicos AS INTEGER[])), unnest(CAST(:vagas AS SMALLINT[])))
+              AND bitmap & :mascara = 0
+            ORDER BY length(replace(CAST(CAST(bitmap AS BIT(64)) AS TEXT), '0', '')), tecnico_id, vaga
+            LIMIT 1
+            FOR UPDATE
+        ) livre
+        WHERE (o.data, o.tecnico_id, o.vaga) = (livre.data, livre.tecnico_id, livre.vaga)
+        RETURNING o.tecnico_id
+    """), {
+        'data': dia, 'mascara': mascara,
+        'tecnicos': [t for t, _ in recursos], 'vagas': [v for _, v in recursos],
+    }).first()
+    if linha is None:
+        raise HorarioIndisponivel('El horario elegido ya no está disponible. Por favor, elija otro.')
+    return linha[0] or None
+
+
+def reconstruir_dias(session, config, dias):
+    """Refaz os bitmaps dos dias a partir dos agendamentos (na transação da sessão)"""
+    recursos = config.recursos(_tecnicos_ativos(session))
+    for dia in sorted(set(d for d in dias if d)):
+        # Trava as vagas do dia: uma reserva concorrente espera a reconstrução terminar
+        session.execute(text("SELECT 1 FROM agenda_ocupacao WHERE data = :data FOR UPDATE"), {'data': dia})
+        agendamentos = [dict(linha) for linha in session.execute(text("""
+            SELECT to_char(hora, 'HH24:MI') AS hora, duracao_minutos, tecnico_id, tipo_servico
+            FROM agendamentos
+            WHERE data_agendamento = :data AND hora IS NOT NULL
+              AND coalesce(status, 'pendente') <> ALL(CAST(:livres AS TEXT[]))
+        """), {'data': dia, 'livres': list(STATUS_LIVRES)}).mappings()]
+        for agendamento in agendamentos:
+            agendamento['duracao_minutos'] = agendamento['duracao_minutos'] or config.duracao(agendamento['tipo_servico'])
+        bitmaps, sem_vaga = distribuir(config, agendamentos, recursos)
+        if sem_vaga:
+            print(f"Aviso: {len(sem_vaga)} agendamento(s) acima da capacidade em {dia}")
+        # Atualiza no lugar (sem DELETE): uma reserva esperando o lock continua achando as linhas
+        session.execute(text("UPDATE agenda_ocupacao SET bitmap = 0 WHERE data = :data AND bitmap <> 0"), {'data': dia})
+        session.execute(text("""
+            INSERT INTO agenda_ocupacao (data, tecnico_id, vaga, bitmap) VALUES (:data, :tecnico_id, :vaga, :bitmap)
+            ON CONFLICT (data, tecnico_id, vaga) DO UPDATE SET bitmap = EXCLUDED.bitmap
+        """), [{'data': dia, 'tecnico_id': t, 'vaga': v, 'bitmap': b} for (t, v), b in bitmaps.items()])
+
+
+def reconstruir_a_partir_de(session, config, inicio=None):
+    """Refaz os bitmaps de todos os dias com agendamentos a partir de `inicio` (padrão: hoje)"""
+    inicio = inicio or date.today()
+    session.execute(text("UPDATE agenda_ocupacao SET bitmap = 0 WHERE data >= :inicio AND bitmap <> 0"), {'inicio': inicio})
+    dias = [linha[0] for linha in session.execute(text(
+        "SELECT DISTINCT data_agendamento FROM agendamentos WHERE data_agendamento >= :inicio"
+    ), {'inicio': inicio})]
+    reconstruir_dias(session, config, dias)
+    return len(dias)
+
+
+# ==================== MODO JSON ====================
+
+def _agendamentos_json_do_dia(config, agendamentos, dia):
+    iso = dia.isoformat()
+    return [{
+        'hora': a.get('hora_agendamento'),
+        'duracao_minutos': a.get('duracao_minutos') or config.duracao(a.get('tipo_servico')),
+        'tecnico_id': a.get('tecnico_id'),
+    } for a in agendamentos
+        if a.get('data_agendamento') == iso and a.get('status', 'pendente') not in STATUS_LIVRES]
+
+
+def disponibilidade_json(config, agendamentos, tecnicos_ids, inicio, dias, tipo_servico=None, agora=None):
+    """Mesma resposta de disponibilidade(), com os bitmaps montados na hora a partir do agendamentos.json"""
+    agora = agora or datetime.now()
+    dias = max(1, min(dias, MAX_DIAS_CONSULTA))
+    recursos = config.recursos(tecnicos_ids)
+    ocupacao = {}
+    for deslocamento in range(dias):
+        dia = inicio + timedelta(days=deslocamento)
+        ocupacao[dia], _ = distribuir(config, _agendamentos_json_do_dia(config, agendamentos, dia), recursos)
+    return _disponibilidade(config, inicio, dias, tipo_servico, ocupacao, recursos, agora)
+
+
+def reservar_json(config, agendamentos, tecnicos_ids, dia, hora, duracao_minutos, agora=None):
+    """Confere a vaga no agendamento.json - retorna o tecnico_id (quem chama segura o lock do arquivo)"""
+    mascara = validar_horario(config, dia, hora, duracao_minutos, agora)
+    recursos = config.recursos(tecnicos_ids)
+    bitmaps, _ = distribuir(config, _agendamentos_json_do_dia(config, agendamentos, dia), recursos)
+    livres = [r for r in recursos if not bitmaps[r] & mascara]
+    if not livres:
+        raise HorarioIndisponivel('El horario elegido ya no está disponible. Por favor, elija otro.')
+    tecnico_id, _ = min(livres, key=lambda r: (bin(bitmaps[r]).count('1'), r))
+    return tecnico_id or None
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] not in ('reconstruir', 'disponibilidade'):
+        print(__doc__)
+        sys.exit(1)
+    from app import app, db
+
+    config = carregar_config()
+    with app.app_context():
+        if args[0] == 'reconstruir':
+            inicio = date.fromisoformat(args[1]) if len(args) > 1 else None
+            garantir_tabela_ocupacao(db.engine)
+            dias = reconstruir_a_partir_de(db.session, config, inicio)
+            if inicio is None or inicio <= date.today():
+                _gravar_layout(db.session, config.assinatura)
+            db.session.commit()
+            print(f"Ocupação reconstruída para {dias} dia(s)")
+        else:
+            inicio = date.fromisoformat(args[1]) if len(args) > 1 else date.today()
+            dias = int(args[2]) if len(args) > 2 else 7
+            tipo = args[3] if len(args) > 3 else None
+            print(json.dumps(disponibilidade(db.session, config, inicio, dias, tipo), ensure_ascii=False, indent=2))
@@ -1,12 +1,22 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, send_file, Response
-from datetime import datetime
+from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session, send_file, send_from_directory, Response, g, stream_with_context, has_request_context
+from flask.sessions import SecureCookieSessionInterface
+from datetime import datetime, timedelta
+import hashlib
 import json
 import os
 import random
+import re
+import tempfile
+import threading
 import time
+from contextlib import contextmanager
 from functools import wraps
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape as xml_escape
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from io import BytesIO
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
@@ -14,7 +24,42 @@ from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from models import db, Cliente, Servico, Tecnico, OrdemServico, Comprovante, Cupom, Slide, Footer, Marca, Milestone, AdminUser, Agendamento, Contato, Imagem, PDFDocument, Fornecedor, ReparoRealizado, Video, PaginaServico, OrcamentoArCondicionado, Manual, LinkMenu, VisitCounter
+from models import db, Cliente, Servico, Tecnico, OrdemServico, Comprovante, Cupom, Slide, Footer, Marca, Milestone, AdminUser, Agendamento, Contato, Imagem, PDFDocument, Fornecedor, ReparoRealizado, Video, PaginaServico, OrcamentoArCondicionado, Manual, LinkMenu, VisitCounter, VisitaDiaria, OrdemStatusEvento, Peca, extrair_video_id, metadados_video
+from uploads import UploadInvalido, stream_upload, TIPOS_IMAGEM, TIPOS_PDF
+from storage import novo_writer, gravar_bytes, iter_blob, remover_blob, backend_da_chave
+from cache import LRUCache, RateLimiter
+from assets import carregar_manifesto, url_asset, responder_asset
+from compressao import CompressaoMiddleware
+from contador_visitas import ContadorVisitas
+from exportacao import FORMATOS as FORMATOS_PLANILHA, gerar_planilha
+from importacao import iniciar_importacao_em_background, estado_importacao
+from busca import garantir_indices_busca as garantir_indices_busca_db, buscar_banco, buscar_paginas_manuais, indice_de_clientes_json, POR_PAGINA as POR_PAGINA_BUSCA, MARCA_INICIO, MARCA_FIM
+from manuais_texto import agendar_extracao as agendar_extracao_manual
+from status_ordens import (STATUS_ORDEM, STATUS_FINAIS, SLA_HORAS, atualizar_status_em_lote, marcar_paga, historico_status,
+                           agregar as agregar_status_ordens, tempo_por_status, tempo_por_tecnico, sla_estourado)
+from precificacao import (ACESSOS as ACESSOS_ORCAMENTO_AR, tabela_vigente as tabela_preco_vigente,
+                          salvar_versao as salvar_versao_precos, historico_versoes as historico_precos,
+                          comparar_pendentes as comparar_orcamentos_pendentes,
+                          recalcular_pendentes as recalcular_orcamentos_pendentes)
+from calendario import evento_ics, gerar_ics, token_feed, token_valido
+from agenda import (HorarioIndisponivel, carregar_config as carregar_config_agenda, garantir_tabela_ocupacao,
+                    disponibilidade as disponibilidade_agenda, disponibilidade_json as disponibilidade_agenda_json,
+                    reservar as reservar_horario, reservar_json as reservar_horario_json,
+                    reconstruir_dias as reconstruir_agenda_dias, reconstruir_a_partir_de as reconstruir_agenda)
+from painel_tecnicos import SEMANAS_PADRAO as SEMANAS_PAINEL_TECNICOS, MAX_SEMANAS as MAX_SEMANAS_PAINEL_TECNICOS, painel_tecnicos
+from estoque import (EstoqueInsuficiente, garantir_indices_estoque as garantir_indices_estoque_db, buscar_pecas,
+                     registrar_pecas_ordem, devolver_pecas_ordem, repor_estoque, pecas_abaixo_minimo, consumo_por_peca,
+                     iniciar_backfill_em_background as iniciar_backfill_pecas, estado_backfill as estado_backfill_pecas)
+from exclusao_cliente import LIMITE_EXCLUSAO_SINCRONA, previa_exclusao, excluir_cliente, iniciar_exclusao_em_background, estado_exclusao
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.engine import Engine
+from markupsafe import Markup, escape
+from sqlalchemy.orm import Session as SessionORM
+
+try:
+    import fcntl
+except ImportError:  # Windows (desenvolvimento local): só o lock entre threads
+    fcntl = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'sua_chave_secreta_aqui_altere_em_producao')
@@ -22,6 +67,35 @@ app.secret_key = os.environ.get('SECRET_KEY', 'sua_chave_secreta_aqui_altere_em_
 # Configurar tamanho máximo de upload (350MB para dar margem aos 300MB de vídeo)
 app.config['MAX_CONTENT_LENGTH'] = 350 * 1024 * 1024  # 350MB
 
+# ==================== ASSETS ESTÁTICOS ====================
+# static/dist/ e manifest.json são gerados no build (python assets.py)
+carregar_manifesto()
+
+def url_for_com_assets(endpoint, **values):
+    """url_for dos templates - arquivos de static/ saem com o nome versionado do manifest"""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = url_asset(values['filename'])
+    return url_for(endpoint, **values)
+
+app.jinja_env.globals['url_for'] = url_for_com_assets
+
+def servir_estatico(filename):
+    """Rota /static - assets versionados com cache imutável e variantes pré-comprimidas"""
+    response = responder_asset(filename, request, send_from_directory)
+    if response is None:
+        response = app.send_static_file(filename)
+    return response
+
+app.view_functions['static'] = servir_estatico
+
+# Compressão gzip/brotli das respostas de texto (HTML, JSON...)
+app.wsgi_app = CompressaoMiddleware(app.wsgi_app)
+
+# IP do visitante: só o último salto do X-Forwarded-For é confiável (o que o proxy do Render
+# acrescentou) - os anteriores vêm do próprio cliente e podem ser forjados.
+# Com mais proxies na frente (ex: CDN), ajuste TRUSTED_PROXY_HOPS.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('TRUSTED_PROXY_HOPS', '1')), x_proto=0)
+
 # Configurações do Mercado Pago (REMOVIDO - sistema de loja removido)
 
 # Flag global para rastrear se o banco está disponível
@@ -31,6 +105,14 @@ DB_AVAILABLE = False
 _pagina_servico_id_column_exists = None
 _custos_adicionais_column_exists = None
 _video_columns_exist = False
+_video_metadata_columns_exist = False
+_blob_columns_exist = False
+_ordem_atualizacao_column_exists = False
+_busca_indices_exist = False
+_manual_texto_columns_exist = False
+_agenda_columns_exist = False
+_estoque_indices_exist = False
+_painel_indices_exist = False
 
 # ==================== FUNÇÃO use_database (DEFINIDA PRIMEIRO) ====================
 def use_database():
@@ -50,6 +132,7 @@ def use_database():
                     DB_AVAILABLE = True
                     return True
                 except:
+                    marcar_resposta_degradada()  # Banco configurado mas fora do ar: a página cai para o JSON
                     return False
         except:
             pass
@@ -220,6 +303,149 @@ def _garantir_colunas_video_internal():
     _video_columns_exist = True
     return True
 
+def _garantir_metadados_video_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _video_metadata_columns_exist
+    
+    if _video_metadata_columns_exist:
+        return True
+    
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE videos ADD COLUMN IF NOT EXISTS video_id VARCHAR(11)"))
+            conn.execute(db.text("ALTER TABLE videos ADD COLUMN IF NOT EXISTS embed_url VARCHAR(200)"))
+            conn.execute(db.text("ALTER TABLE videos ADD COLUMN IF NOT EXISTS thumbnail_url VARCHAR(200)"))
+            conn.execute(db.text("ALTER TABLE videos ADD COLUMN IF NOT EXISTS embed_html TEXT"))
+            conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_videos_video_id ON videos (video_id)"))
+            
+            # Backfill dos vídeos cadastrados antes das colunas existirem
+            pendentes = conn.execute(db.text(
+                "SELECT id, embed_code FROM videos WHERE video_id IS NULL AND embed_code IS NOT NULL"
+            )).fetchall()
+            for video_pk, embed_code in pendentes:
+                metadados = metadados_video(extrair_video_id(embed_code))
+                if metadados['video_id']:
+                    conn.execute(db.text("""
+                        UPDATE videos
+                        SET video_id = :video_id, embed_url = :embed_url,
+                            thumbnail_url = :thumbnail_url, embed_html = :embed_html
+                        WHERE id = :id
+                    """), dict(metadados, id=video_pk))
+            if pendentes:
+                print(f"Metadados calculados para {len(pendentes)} vídeo(s)")
+        _video_metadata_columns_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir metadados de vídeo: {e}")
+        return False
+
+def _garantir_colunas_blob_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _blob_columns_exist
+    
+    if _blob_columns_exist:
+        return True
+    
+    try:
+        with db.engine.begin() as conn:
+            # Uploads novos vão para o armazenamento de blobs - as colunas bytea passam a ser opcionais
+            for tabela, coluna_legado in (('imagens', 'dados'), ('manuais', 'pdf_data'), ('pdf_documents', 'dados')):
+                conn.execute(db.text(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS storage_key VARCHAR(200)"))
+                conn.execute(db.text(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS sha256 VARCHAR(64)"))
+                conn.execute(db.text(f"ALTER TABLE {tabela} ALTER COLUMN {coluna_legado} DROP NOT NULL"))
+        _blob_columns_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir colunas de blob: {e}")
+        return False
+
+def _garantir_colunas_texto_manual_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _manual_texto_columns_exist
+    
+    if _manual_texto_columns_exist:
+        return True
+    
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE manuais ADD COLUMN IF NOT EXISTS texto_status VARCHAR(20)"))
+            conn.execute(db.text("ALTER TABLE manuais ADD COLUMN IF NOT EXISTS texto_paginas INTEGER"))
+            conn.execute(db.text("ALTER TABLE manuais ADD COLUMN IF NOT EXISTS texto_reivindicado_em TIMESTAMP"))
+            # Manuais cadastrados antes da extração ficam pendentes (python manuais_texto.py processa)
+            conn.execute(db.text("UPDATE manuais SET texto_status = 'pendente' WHERE texto_status IS NULL"))
+        _manual_texto_columns_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir colunas de texto em manuais: {e}")
+        return False
+
+def _garantir_agenda_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _agenda_columns_exist
+    
+    if _agenda_columns_exist:
+        return True
+    
+    try:
+        ocupacao_vazia = garantir_tabela_ocupacao(db.engine)
+        if ocupacao_vazia:
+            # Primeira execução: bitmaps montados a partir dos agendamentos já existentes
+            dias = reconstruir_agenda(db.session, carregar_config_agenda())
+            db.session.commit()
+            print(f"DEBUG: ✅ Ocupação da agenda reconstruída ({dias} dias)")
+        _agenda_columns_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir colunas da agenda: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return False
+
+def _garantir_coluna_data_atualizacao_ordem_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _ordem_atualizacao_column_exists
+    
+    if _ordem_atualizacao_column_exists:
+        return True
+    
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(db.text("ALTER TABLE ordens_servico ADD COLUMN IF NOT EXISTS data_atualizacao TIMESTAMP"))
+            conn.execute(db.text("UPDATE ordens_servico SET data_atualizacao = data WHERE data_atualizacao IS NULL"))
+        _ordem_atualizacao_column_exists = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir coluna data_atualizacao em ordens_servico: {e}")
+        return False
+
+def _garantir_indices_busca_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _busca_indices_exist
+    
+    if _busca_indices_exist:
+        return True
+    
+    recursos = garantir_indices_busca_db(db.engine)
+    _busca_indices_exist = recursos['fts']
+    return _busca_indices_exist
+
+def _garantir_indices_estoque_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _estoque_indices_exist
+    
+    if _estoque_indices_exist:
+        return True
+    
+    try:
+        garantir_indices_estoque_db(db.engine)
+        _estoque_indices_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir índices do catálogo de peças: {e}")
+        return False
+
 def inicializar_links_menu_padrao():
     """Inicializa links padrão do menu se a tabela estiver vazia"""
     try:
@@ -248,10 +474,47 @@ def inicializar_links_menu_padrao():
         print(f"DEBUG: ⚠️ Não foi possível inicializar links do menu: {e}")
 
 def garantir_colunas_video():
-    """Garante que a coluna embed_code existe na tabela videos"""
+    """Garante as colunas embed_code e de metadados (video_id, embed_url...) na tabela videos"""
+    if not use_database():
+        return False
+    _garantir_colunas_video_internal()
+    return _garantir_metadados_video_internal()
+
+def garantir_coluna_data_atualizacao_ordem():
+    """Garante a coluna data_atualizacao na tabela ordens_servico"""
+    if not use_database():
+        return False
+    return _garantir_coluna_data_atualizacao_ordem_internal()
+
+def garantir_colunas_blob():
+    """Garante as colunas storage_key/sha256 em imagens, manuais e pdf_documents"""
+    if not use_database():
+        return False
+    return _garantir_colunas_blob_internal()
+
+def garantir_colunas_texto_manual():
+    """Garante as colunas texto_status/texto_paginas/texto_reivindicado_em na tabela manuais"""
+    if not use_database():
+        return False
+    return _garantir_colunas_texto_manual_internal()
+
+def garantir_agenda():
+    """Garante as colunas hora/duracao_minutos/tecnico_id de agendamentos e os bitmaps da agenda"""
+    if not use_database():
+        return False
+    return _garantir_agenda_internal()
+
+def garantir_indices_busca():
+    """Garante as colunas busca_tsv, os índices GIN e o pg_trgm da busca do admin"""
+    if not use_database():
+        return False
+    return _garantir_indices_busca_internal()
+
+def garantir_indices_estoque():
+    """Garante os índices de prefixo (nome/SKU) do autocomplete de peças"""
     if not use_database():
         return False
-    return _garantir_colunas_video_internal()
+    return _garantir_indices_estoque_internal()
 
 # Configuração do banco de dados (opcional)
 database_url = os.environ.get('DATABASE_URL', '')
@@ -338,6 +601,36 @@ if database_url:
                     except Exception as col_error:
                         print(f"DEBUG: ⚠️ Aviso ao criar colunas de vídeo (não crítico): {col_error}")
                     
+                    try:
+                        garantir_colunas_blob()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao criar colunas de blob (não crítico): {col_error}")
+                    
+                    try:
+                        garantir_coluna_data_atualizacao_ordem()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao criar coluna data_atualizacao (não crítico): {col_error}")
+                    
+                    try:
+                        garantir_colunas_texto_manual()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao criar colunas de texto dos manuais (não crítico): {col_error}")
+                    
+                    try:
+                        garantir_agenda()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao preparar a agenda (não crítico): {col_error}")
+                    
+                    try:
+                        garantir_indices_busca()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao criar índices de busca (não crítico): {col_error}")
+                    
+                    try:
+                        garantir_indices_estoque()
+                    except Exception as col_error:
+                        print(f"DEBUG: ⚠️ Aviso ao criar índices do catálogo de peças (não crítico): {col_error}")
+                    
                     # Inicializar links padrão do menu
                     try:
                         inicializar_links_menu_padrao()
@@ -453,6 +746,49 @@ def recriar_sessao():
         pass
     # SQLAlchemy cria automaticamente uma nova sessão na próxima operação
 
+def salvar_upload_imagem(file, referencia):
+    """Grava a imagem enviada em streaming no armazenamento de blobs e cria o registro Imagem
+    
+    O arquivo é copiado em blocos (validando tipo e tamanho e calculando o SHA-256),
+    sem ser lido inteiro para a memória. Levanta UploadInvalido se for rejeitado.
+    """
+    try:
+        info = stream_upload(file, novo_writer(db.session), MAX_FILE_SIZE, TIPOS_IMAGEM)
+        imagem = Imagem(
+            nome=secure_filename(file.filename),
+            storage_key=info['storage_key'],
+            sha256=info['sha256'],
+            tipo_mime=info['tipo_mime'],
+            tamanho=info['tamanho'],
+            referencia=f'{referencia}_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        )
+        db.session.add(imagem)
+        db.session.commit()
+        return imagem
+    except Exception:
+        db.session.rollback()
+        raise
+
+def resposta_blob(storage_key, mimetype, headers, tamanho=None):
+    """Serve um arquivo do armazenamento de blobs pelo caminho mais barato do backend:
+    redirect para URL pré-assinada (S3), sendfile (disco local) ou blocos (PostgreSQL)"""
+    backend = backend_da_chave(storage_key)
+    
+    url_externa = backend.url(storage_key, mimetype=mimetype, disposition=headers.get('Content-Disposition'))
+    if url_externa:
+        return redirect(url_externa)
+    
+    caminho = backend.caminho_local(storage_key)
+    if caminho:
+        resposta = send_file(caminho, mimetype=mimetype, conditional=True)
+        resposta.headers.update(headers)
+        return resposta
+    
+    headers = dict(headers)
+    if tamanho:
+        headers['Content-Length'] = str(tamanho)
+    return Response(iter_blob(db.engine, storage_key), mimetype=mimetype, headers=headers)
+
 # ==================== FUNÇÕES DE GARANTIA DE COLUNAS (DEFINIÇÕES ANTIGAS REMOVIDAS) ====================
 # As funções já foram definidas antes da inicialização do banco (linhas 90-189)
 
@@ -952,52 +1288,16 @@ def init_slides_file():
 
 init_slides_file()
 
-@app.before_request
-def count_visit():
-    # Contar apenas a página inicial do site
-    if request.path != '/':
-        return
-    
-    # Verificar se o usuário já visitou nesta sessão
-    if session.get('has_visited'):
+# Visitas são somadas em memória e gravadas em lote (ver contador_visitas.py)
+_contador_visitas = ContadorVisitas(app, db, estimar_unicos=os.environ.get('CONTADOR_VISITAS_UNICOS', '1') == '1')
+
+def registrar_visita():
+    """Conta uma visita da página inicial (sem escrita no banco na requisição)"""
+    if not use_database():
         return
-        
-    # Marcar como visitado na sessão
-    session['has_visited'] = True
-    # Define a sessão como permanente para durar o tempo configurado (padrão 31 dias)
-    session.permanent = True
-    
-    if use_database():
-        try:
-            # Tenta buscar o contador
-            counter = VisitCounter.query.get(1)
-            if not counter:
-                # Se não existe, cria
-                counter = VisitCounter(id=1, count=1)
-                db.session.add(counter)
-                db.session.commit()
-            else:
-                # Se existe, incrementa
-                # Usar SQL direto para evitar race conditions simples e ser mais eficiente
-                db.session.execute(db.text("UPDATE visit_counter SET count = count + 1 WHERE id = 1"))
-                db.session.commit()
-        except Exception as e:
-            # Se der erro (ex: tabela não existe), silenciar ou tentar criar
-            # print(f"Erro no contador: {e}")
-            try:
-                db.session.rollback()
-                # Tentar criar a tabela se o erro for de relação não existente
-                if 'relation' in str(e).lower() and 'does not exist' in str(e).lower():
-                    try:
-                        VisitCounter.__table__.create(db.engine)
-                        # Tentar novamente
-                        counter = VisitCounter(id=1, count=1)
-                        db.session.add(counter)
-                        db.session.commit()
-                    except:
-                        pass
-            except:
-                pass
+    # Identificador só para a estimativa de únicos - o IP não é armazenado
+    identificador = f"{ip_cliente()}|{request.headers.get('User-Agent', '')}"
+    _contador_visitas.registrar(identificador)
 
 @app.route('/favicon.ico')
 def favicon():
@@ -1008,7 +1308,205 @@ def favicon():
         # Se não encontrar, retornar 404
         return '', 404
 
+@app.route('/api/visita', methods=['POST'])
+def api_registrar_visita():
+    """Beacon da página inicial - conta a primeira visita do navegador
+    
+    O controle de "já visitou" fica em um cookie criado pelo JavaScript da
+    página, então o HTML de / não precisa de cookie de sessão e pode ser
+    servido do cache (ver pagina_publica_cacheada)
+    """
+    registrar_visita()
+    return '', 204
+
+# ==================== CACHE DE PÁGINAS PÚBLICAS ====================
+# Páginas iguais para todo visitante anônimo são renderizadas uma vez por versão de conteúdo.
+# A versão é o maior mtime entre um arquivo marcador (tocado a cada commit que altera
+# conteúdo público) e os JSON públicos, então vale para todos os workers.
+PAGINA_CACHE_MAX_AGE = 60
+PAGINA_CACHE_S_MAXAGE = 300
+ARQUIVO_VERSAO_CONTEUDO = 'data/.versao_conteudo'
+ARQUIVOS_CONTEUDO_JSON = (DATA_FILE, SLIDES_FILE, FOOTER_FILE, MARCAS_FILE, MILESTONES_FILE)
+MODELOS_CONTEUDO_PUBLICO = (Slide, Marca, Milestone, Servico, ReparoRealizado, Video, PaginaServico, Footer, LinkMenu)
+# Chaves de sessão que personalizam a página - com elas a resposta não é compartilhável
+CHAVES_SESSAO_PRIVADAS = ('admin_logged_in', 'client_logged_in', '_flashes')
+
+_paginas_cache = LRUCache(max_itens=500, ttl=PAGINA_CACHE_S_MAXAGE * 2)
+
+def versao_conteudo_publico():
+    """Versão atual do conteúdo público (mtime em ns)"""
+    versao = 0
+    for caminho in (ARQUIVO_VERSAO_CONTEUDO,) + ARQUIVOS_CONTEUDO_JSON:
+        try:
+            versao = max(versao, os.stat(caminho).st_mtime_ns)
+        except OSError:
+            pass
+    return versao
+
+def invalidar_paginas_publicas():
+    """Marca o conteúdo público como alterado - todas as páginas cacheadas expiram"""
+    try:
+        os.makedirs(os.path.dirname(ARQUIVO_VERSAO_CONTEUDO), exist_ok=True)
+        with open(ARQUIVO_VERSAO_CONTEUDO, 'w') as f:
+            f.write(str(time.time_ns()))
+    except Exception as e:
+        print(f"Erro ao atualizar versão do conteúdo público: {e}")
+    _paginas_cache.clear()
+
+@event.listens_for(SessionORM, 'after_flush')
+def _detectar_conteudo_publico_alterado(sessao, flush_context):
+    for obj in list(sessao.new) + list(sessao.dirty) + list(sessao.deleted):
+        if not isinstance(obj, MODELOS_CONTEUDO_PUBLICO):
+            continue
+        if isinstance(obj, PaginaServico) and obj in sessao.dirty:
+            # Edição de conteúdo só invalida a própria página; o menu (em todas as páginas)
+            # só muda com slug, título, ordem ou ativo
+            estado = sa_inspect(obj)
+            slugs = sessao.info.setdefault('paginas_servico_alteradas', set())
+            slugs.add(obj.slug)
+            slugs.update(estado.attrs.slug.history.deleted or ())
+            if not any(estado.attrs[campo].history.has_changes() for campo in CAMPOS_MENU_PAGINA_SERVICO):
+                continue
+        elif isinstance(obj, PaginaServico):
+            sessao.info.setdefault('paginas_servico_alteradas', set()).add(obj.slug)
+        sessao.info['conteudo_publico_alterado'] = True
+
+@event.listens_for(SessionORM, 'after_commit')
+def _invalidar_paginas_apos_commit(sessao):
+    for slug in sessao.info.pop('paginas_servico_alteradas', ()):
+        invalidar_pagina_servico(slug)
+    if sessao.info.pop('conteudo_publico_alterado', False):
+        invalidar_paginas_publicas()
+
+@event.listens_for(SessionORM, 'after_soft_rollback')
+def _descartar_conteudo_apos_rollback(sessao, previous_transaction):
+    sessao.info.pop('conteudo_publico_alterado', None)
+    sessao.info.pop('paginas_servico_alteradas', None)
+
+class SessaoSemCookiePublico(SecureCookieSessionInterface):
+    """Não grava cookie nem Vary: Cookie em páginas públicas cacheadas (sessão intacta)"""
+    
+    def save_session(self, app, session, response):
+        if g.get('resposta_publica') and not session.modified:
+            return
+        return super().save_session(app, session, response)
+
+app.session_interface = SessaoSemCookiePublico()
+
+def _requisicao_personalizada():
+    return request.method != 'GET' or any(chave in session for chave in CHAVES_SESSAO_PRIVADAS)
+
+def marcar_resposta_degradada():
+    """Marca a resposta atual como montada com dados de contingência (não vai para cache nem CDN)"""
+    if has_request_context():
+        g.resposta_degradada = True
+
+@event.listens_for(Engine, 'handle_error')
+def _marcar_falha_banco(contexto):
+    # As views públicas engolem o erro e caem para listas vazias - o HTML resultante não pode ser cacheado
+    marcar_resposta_degradada()
+
+def pagina_publica_cacheada(view=None, versao_extra=None):
+    """Decorator para páginas públicas: HTML em cache por versão, ETag e Cache-Control public
+    
+    versao_extra(**kwargs da rota) entra na chave do cache para páginas com
+    invalidação própria (ex: versao_pagina_servico). Páginas montadas com o
+    banco falhando (g.resposta_degradada) saem com no-store e não entram no cache.
+    """
+    if view is None:
+        return lambda v: pagina_publica_cacheada(v, versao_extra=versao_extra)
+    
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if _requisicao_personalizada():
+            return view(*args, **kwargs)
+        
+        versao = versao_conteudo_publico()
+        chave = (request.url, versao, versao_extra(**kwargs) if versao_extra else None)
+        item = _paginas_cache.get(chave)
+        if item is None:
+            response = app.make_response(view(*args, **kwargs))
+            if g.get('resposta_degradada'):
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+            if response.status_code != 200 or response.is_streamed or session.modified:
+                return response
+            corpo = response.get_data()
+            item = {
+                'corpo': corpo,
+                'content_type': response.content_type,
+                'etag': hashlib.sha1(corpo).hexdigest(),
+                'last_modified': datetime.fromtimestamp(max(versao, chave[2] or 0) / 1e9) if versao else datetime.now(),
+            }
+            _paginas_cache.set(chave, item)
+        
+        response = Response(item['corpo'], content_type=item['content_type'])
+        response.set_etag(item['etag'])
+        response.last_modified = item['last_modified']
+        response.headers['Cache-Control'] = f'public, max-age={PAGINA_CACHE_MAX_AGE}, s-maxage={PAGINA_CACHE_S_MAXAGE}'
+        g.resposta_publica = True
+        return response.make_conditional(request)
+    return wrapper
+
+# ==================== CACHE DAS PÁGINAS DE SERVIÇO ====================
+# Cada página de serviço tem a própria versão (mtime de um marcador por slug), então editar o
+# conteúdo de uma página não descarta o cache das demais. O índice de slugs ativos (para o
+# redirecionamento de slug inexistente) é recarregado só quando a versão global muda.
+DIR_VERSAO_PAGINAS_SERVICO = 'data/.versao_paginas_servico'
+CAMPOS_MENU_PAGINA_SERVICO = ('slug', 'titulo', 'ordem', 'ativo')
+_indice_paginas_servico = {'versao': None, 'slugs': frozenset(), 'primeira': None}
+_indice_paginas_servico_lock = threading.Lock()
+
+def _marcador_pagina_servico(slug):
+    return os.path.join(DIR_VERSAO_PAGINAS_SERVICO, hashlib.sha1(slug.encode('utf-8')).hexdigest())
+
+def versao_pagina_servico(slug):
+    """Versão do conteúdo de uma página de serviço (0 se nunca foi editada)"""
+    try:
+        return os.stat(_marcador_pagina_servico(slug)).st_mtime_ns
+    except OSError:
+        return 0
+
+def versao_paginas_servico():
+    """Versão da página de serviço editada por último (0 se nenhuma) - para o sitemap"""
+    try:
+        with os.scandir(DIR_VERSAO_PAGINAS_SERVICO) as entradas:
+            return max((entrada.stat().st_mtime_ns for entrada in entradas), default=0)
+    except OSError:
+        return 0
+
+def invalidar_pagina_servico(slug):
+    """Descarta o HTML cacheado de uma página de serviço (em todos os workers)"""
+    if not slug:
+        return
+    try:
+        os.makedirs(DIR_VERSAO_PAGINAS_SERVICO, exist_ok=True)
+        with open(_marcador_pagina_servico(slug), 'w') as f:
+            f.write(str(time.time_ns()))
+    except Exception as e:
+        print(f"Erro ao invalidar cache da página de serviço {slug}: {e}")
+
+def indice_paginas_servico():
+    """Slugs ativos e o primeiro pela ordem do menu - uma query por versão de conteúdo"""
+    versao = versao_conteudo_publico()
+    indice = _indice_paginas_servico
+    if indice['versao'] == versao:
+        return indice
+    with _indice_paginas_servico_lock:
+        if _indice_paginas_servico['versao'] == versao:
+            return _indice_paginas_servico
+        slugs = [linha[0] for linha in db.session.query(PaginaServico.slug).filter(
+            PaginaServico.ativo == True
+        ).order_by(PaginaServico.ordem).all()]
+        _indice_paginas_servico.update({
+            'versao': versao,
+            'slugs': frozenset(slugs),
+            'primeira': slugs[0] if slugs else None,
+        })
+    return _indice_paginas_servico
+
 @app.route('/')
+@pagina_publica_cacheada
 def index():
     # Carregar slides
     if use_database():
@@ -1262,7 +1760,7 @@ def index():
     if use_database():
         try:
             garantir_colunas_video()
-            videos_db = Video.query.filter_by(ativo=True).order_by(Video.ordem, Video.data_criacao.desc()).limit(6).all()
+            videos_db = Video.query.filter(Video.ativo == True, Video.video_id.isnot(None)).order_by(Video.ordem, Video.data_criacao.desc()).limit(6).all()
         except Exception as e:
             error_str = str(e).lower()
             if 'connection' not in error_str and 'refused' not in error_str:
@@ -1273,10 +1771,10 @@ def index():
             videos.append({
                 'id': v.id,
                 'titulo': v.titulo,
-                'embed_url': v.get_embed_url(),
-                'thumbnail_url': v.get_thumbnail_url(),
-                'embed_html': v.get_embed_html(),
-                'video_id': v.get_video_id(),
+                'embed_url': v.embed_url,
+                'thumbnail_url': v.thumbnail_url,
+                'embed_html': v.embed_html,
+                'video_id': v.video_id,
                 'ordem': v.ordem
             })
     else:
@@ -1285,6 +1783,7 @@ def index():
     return render_template('index.html', slides=slides, footer=footer_data, marcas=marcas, milestones=milestones, servicos=servicos, reparos=reparos, videos=videos)
 
 @app.route('/reparos')
+@pagina_publica_cacheada
 def todos_reparos():
     """Página que exibe todos os reparos realizados"""
     # Carregar footer do banco de dados
@@ -1345,6 +1844,7 @@ def todos_reparos():
     return render_template('reparos.html', footer=footer_data, reparos=reparos)
 
 @app.route('/sobre')
+@pagina_publica_cacheada
 def sobre():
     # Carregar footer do banco de dados
     footer_data = None
@@ -1383,9 +1883,9 @@ def servicos():
     # Tentar encontrar a primeira página de serviço ativa (ordenada por ordem)
     if use_database():
         try:
-            primeira_pagina = PaginaServico.query.filter_by(ativo=True).order_by(PaginaServico.ordem).first()
+            primeira_pagina = indice_paginas_servico()['primeira']
             if primeira_pagina:
-                return redirect(url_for('pagina_servico', slug=primeira_pagina.slug))
+                return redirect(url_for('pagina_servico', slug=primeira_pagina))
         except Exception as e:
             print(f"Erro ao buscar primeira página de serviço: {e}")
     
@@ -1393,6 +1893,7 @@ def servicos():
     return redirect(url_for('index'))
 
 @app.route('/servico/<slug>')
+@pagina_publica_cacheada(versao_extra=lambda slug: versao_pagina_servico(slug))
 def pagina_servico(slug):
     """Rota dinâmica para páginas de serviços individuais"""
     # SEMPRE usar banco de dados - não há fallback para JSON
@@ -1401,13 +1902,13 @@ def pagina_servico(slug):
         return redirect(url_for('index'))
     
     try:
-        pagina = PaginaServico.query.filter_by(slug=slug, ativo=True).first()
+        indice = indice_paginas_servico()
+        pagina = PaginaServico.query.filter_by(slug=slug, ativo=True).first() if slug in indice['slugs'] else None
         if not pagina:
             flash('Página de servicio no encontrada.', 'error')
             # Redirecionar para a primeira página disponível ou home
-            primeira_pagina = PaginaServico.query.filter_by(ativo=True).order_by(PaginaServico.ordem).first()
-            if primeira_pagina:
-                return redirect(url_for('pagina_servico', slug=primeira_pagina.slug))
+            if indice['primeira']:
+                return redirect(url_for('pagina_servico', slug=indice['primeira']))
             return redirect(url_for('index'))
     except Exception as e:
         print(f"Erro ao buscar página de serviço: {e}")
@@ -1553,6 +2054,125 @@ def contato():
     
     return render_template('contato.html', footer=footer_data)
 
+# ==================== RASTREAMENTO ====================
+# Códigos consultados que não existem - valor é o mtime do clients.json no momento da busca
+_rastreio_nao_encontrados = LRUCache(max_itens=5000, ttl=300)
+# Limite de buscas por IP - clientes atualizam a página de rastreio com frequência
+_rastreio_rate_limiter = RateLimiter(limite=30, janela=60)
+# Índice numero_ordem -> (cliente, ordem) do clients.json, reconstruído só quando o arquivo muda
+_indice_ordens_json = {'mtime': None, 'ordens': {}}
+
+def ip_cliente():
+    """IP real do visitante (remote_addr já corrigido pelo ProxyFix com o X-Forwarded-For do proxy)"""
+    return request.remote_addr or ''
+
+def _mtime_clients_json():
+    try:
+        return os.path.getmtime(CLIENTS_FILE)
+    except OSError:
+        return None
+
+def buscar_ordem_json(codigo):
+    """Busca ordem no clients.json por um índice em memória (sem varrer o arquivo a cada busca)"""
+    mtime = _mtime_clients_json()
+    if mtime is None:
+        return None, None
+    if _indice_ordens_json['mtime'] != mtime:
+        with open(CLIENTS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        indice = {}
+        for cliente in data.get('clients', []):
+            for ordem in cliente.get('ordens', []):
+                indice.setdefault(str(ordem.get('numero_ordem', '')), (cliente, ordem))
+        _indice_ordens_json['ordens'] = indice
+        _indice_ordens_json['mtime'] = mtime
+    return _indice_ordens_json['ordens'].get(str(codigo), (None, None))
+
+def invalidar_cache_rastreamento(numero_ordem):
+    """Remove o código do cache de não encontrados (chamar ao criar uma ordem)"""
+    _rastreio_nao_encontrados.delete(str(numero_ordem))
+
+def buscar_ordem_rastreio(codigo):
+    """Busca ordem, cliente e técnico com uma única consulta (join pelo índice único de numero_ordem)
+    
+    Retorna (ordem, cliente, tecnico) como dicts ou (None, None, None).
+    """
+    if use_database():
+        try:
+            linha = db.session.query(OrdemServico, Cliente, Tecnico) \
+                .join(Cliente, Cliente.id == OrdemServico.cliente_id) \
+                .outerjoin(Tecnico, Tecnico.id == OrdemServico.tecnico_id) \
+                .filter(OrdemServico.numero_ordem == str(codigo)) \
+                .first()
+            if linha:
+                ordem_db, cliente_db, tecnico_db = linha
+                # Converter ordem do banco para formato esperado pelo template
+                ordem = {
+                    'id': ordem_db.id,
+                    'numero_ordem': ordem_db.numero_ordem,
+                    'servico': ordem_db.servico,
+                    'tipo_aparelho': ordem_db.tipo_aparelho,
+                    'marca': ordem_db.marca,
+                    'modelo': ordem_db.modelo,
+                    'numero_serie': ordem_db.numero_serie,
+                    'defeitos_cliente': ordem_db.defeitos_cliente,
+                    'diagnostico_tecnico': ordem_db.diagnostico_tecnico,
+                    'pecas': ordem_db.pecas or [],
+                    'custo_pecas': float(ordem_db.custo_pecas) if ordem_db.custo_pecas else 0.00,
+                    'custo_mao_obra': float(ordem_db.custo_mao_obra) if ordem_db.custo_mao_obra else 0.00,
+                    'subtotal': float(ordem_db.subtotal) if ordem_db.subtotal else 0.00,
+                    'desconto_percentual': float(ordem_db.desconto_percentual) if ordem_db.desconto_percentual else 0.00,
+                    'valor_desconto': float(ordem_db.valor_desconto) if ordem_db.valor_desconto else 0.00,
+                    'total': float(ordem_db.total) if ordem_db.total else 0.00,
+                    'status': ordem_db.status,
+                    'prazo_estimado': ordem_db.prazo_estimado,
+                    'tecnico_id': ordem_db.tecnico_id,
+                    'data': ordem_db.data.strftime('%Y-%m-%d %H:%M:%S') if ordem_db.data else ''
+                }
+                cliente = {
+                    'id': cliente_db.id,
+                    'nome': cliente_db.nome,
+                    'email': cliente_db.email,
+                    'telefone': cliente_db.telefone,
+                    'cpf': cliente_db.cpf,
+                    'endereco': cliente_db.endereco
+                }
+                tecnico = None
+                if tecnico_db:
+                    tecnico = {
+                        'id': tecnico_db.id,
+                        'nome': tecnico_db.nome,
+                        'especialidade': tecnico_db.especialidade,
+                        'telefone': tecnico_db.telefone,
+                        'email': tecnico_db.email
+                    }
+                return ordem, cliente, tecnico
+        except Exception as e:
+            print(f"Erro ao buscar ordem no banco: {e}")
+            import traceback
+            traceback.print_exc()
+            try:
+                db.session.rollback()
+            except:
+                pass
+    
+    # Fallback para JSON se não encontrou no banco
+    cliente, ordem = buscar_ordem_json(codigo)
+    if not ordem:
+        return None, None, None
+    
+    tecnico = None
+    tecnico_id = ordem.get('tecnico_id')
+    if tecnico_id:
+        try:
+            init_tecnicos_file()
+            with open(TECNICOS_FILE, 'r', encoding='utf-8') as f:
+                tecnicos_data = json.load(f)
+            tecnico = next((t for t in tecnicos_data.get('tecnicos', []) if t.get('id') == tecnico_id), None)
+        except Exception as e:
+            print(f"Erro ao buscar técnico: {str(e)}")
+    return ordem, cliente, tecnico
+
 @app.route('/rastrear', methods=['GET', 'POST'])
 def rastrear():
     if request.method == 'POST':
@@ -1562,104 +2182,28 @@ def rastrear():
             flash('Por favor, ingrese el código de la orden de servicio.', 'error')
             return render_template('rastrear.html')
         
-        # Buscar ordem pelo número
-        ordem_encontrada = None
-        cliente_encontrado = None
-        
-        ordem_encontrada = None
-        cliente_encontrado = None
+        if not _rastreio_rate_limiter.permitir(ip_cliente()):
+            flash('Demasiadas consultas. Espere un minuto e intente nuevamente.', 'error')
+            return render_template('rastrear.html'), 429
         
-        # Buscar no banco de dados se disponível
-        if use_database():
-            try:
-                # Buscar ordem pelo número
-                ordem_db = OrdemServico.query.filter_by(numero_ordem=str(codigo)).first()
-                if ordem_db:
-                    cliente_db = Cliente.query.get(ordem_db.cliente_id)
-                    if cliente_db:
-                        # Converter ordem do banco para formato esperado pelo template
-                        ordem_encontrada = {
-                            'id': ordem_db.id,
-                            'numero_ordem': ordem_db.numero_ordem,
-                            'servico': ordem_db.servico,
-                            'tipo_aparelho': ordem_db.tipo_aparelho,
-                            'marca': ordem_db.marca,
-                            'modelo': ordem_db.modelo,
-                            'numero_serie': ordem_db.numero_serie,
-                            'defeitos_cliente': ordem_db.defeitos_cliente,
-                            'diagnostico_tecnico': ordem_db.diagnostico_tecnico,
-                            'pecas': ordem_db.pecas or [],
-                            'custo_pecas': float(ordem_db.custo_pecas) if ordem_db.custo_pecas else 0.00,
-                            'custo_mao_obra': float(ordem_db.custo_mao_obra) if ordem_db.custo_mao_obra else 0.00,
-                            'subtotal': float(ordem_db.subtotal) if ordem_db.subtotal else 0.00,
-                            'desconto_percentual': float(ordem_db.desconto_percentual) if ordem_db.desconto_percentual else 0.00,
-                            'valor_desconto': float(ordem_db.valor_desconto) if ordem_db.valor_desconto else 0.00,
-                            'total': float(ordem_db.total) if ordem_db.total else 0.00,
-                            'status': ordem_db.status,
-                            'prazo_estimado': ordem_db.prazo_estimado,
-                            'tecnico_id': ordem_db.tecnico_id,
-                            'data': ordem_db.data.strftime('%Y-%m-%d %H:%M:%S') if ordem_db.data else ''
-                        }
-                        cliente_encontrado = {
-                            'id': cliente_db.id,
-                            'nome': cliente_db.nome,
-                            'email': cliente_db.email,
-                            'telefone': cliente_db.telefone,
-                            'cpf': cliente_db.cpf,
-                            'endereco': cliente_db.endereco
-                        }
-            except Exception as e:
-                print(f"Erro ao buscar ordem no banco: {e}")
-                import traceback
-                traceback.print_exc()
+        # Código já consultado e inexistente (e o clients.json não mudou desde então)
+        mtime_json = _mtime_clients_json()
+        if _rastreio_nao_encontrados.get(codigo, False) == (mtime_json,):
+            flash('Orden de servicio no encontrada. Verifique el código ingresado.', 'error')
+            return render_template('rastrear.html')
         
-        # Fallback para JSON se não encontrou no banco
-        if not ordem_encontrada:
-            try:
-                with open(CLIENTS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Buscar em todos os clientes
-                for cliente in data.get('clients', []):
-                    for ordem in cliente.get('ordens', []):
-                        if str(ordem.get('numero_ordem', '')) == str(codigo):
-                            ordem_encontrada = ordem
-                            cliente_encontrado = cliente
-                            break
-                    if ordem_encontrada:
-                        break
-            except Exception as e:
-                flash('Error al buscar orden de servicio.', 'error')
-                return render_template('rastrear.html')
+        try:
+            ordem_encontrada, cliente_encontrado, tecnico_encontrado = buscar_ordem_rastreio(codigo)
+        except Exception as e:
+            print(f"Erro ao buscar ordem de serviço: {e}")
+            flash('Error al buscar orden de servicio.', 'error')
+            return render_template('rastrear.html')
         
         if not ordem_encontrada:
+            _rastreio_nao_encontrados.set(codigo, (mtime_json,))
             flash('Orden de servicio no encontrada. Verifique el código ingresado.', 'error')
             return render_template('rastrear.html')
         
-        # Buscar técnico se houver tecnico_id na ordem
-        tecnico_encontrado = None
-        tecnico_id = ordem_encontrada.get('tecnico_id')
-        if tecnico_id:
-            try:
-                if use_database():
-                    tecnico_db = Tecnico.query.get(tecnico_id)
-                    if tecnico_db:
-                        tecnico_encontrado = {
-                            'id': tecnico_db.id,
-                            'nome': tecnico_db.nome,
-                            'especialidade': tecnico_db.especialidade,
-                            'telefone': tecnico_db.telefone,
-                            'email': tecnico_db.email
-                        }
-                else:
-                    init_tecnicos_file()
-                    with open(TECNICOS_FILE, 'r', encoding='utf-8') as f:
-                        tecnicos_data = json.load(f)
-                    
-                    tecnico_encontrado = next((t for t in tecnicos_data.get('tecnicos', []) if t.get('id') == tecnico_id), None)
-            except Exception as e:
-                print(f"Erro ao buscar técnico: {str(e)}")
-        
         # Usar prazo estimado da ordem se existir, caso contrário calcular baseado no status
         prazo_estimado = ordem_encontrada.get('prazo_estimado') or calcular_prazo_estimado(ordem_encontrada.get('status'))
         
@@ -1684,6 +2228,147 @@ def calcular_prazo_estimado(status):
     }
     return prazos.get(status, 'A definir')
 
+# ==================== API PÚBLICA DE STATUS ====================
+# Tempo máximo que uma requisição de long-poll fica aguardando mudança de status.
+# Só vale em workers com threads ou assíncronos (gthread, gevent, eventlet): num worker
+# sync cada espera ocuparia o worker inteiro, então lá o ?wait= é ignorado.
+STATUS_LONG_POLL_MAX = 25
+# Intervalo para reconsultar o banco durante o long-poll (mudanças feitas por outros workers)
+STATUS_LONG_POLL_INTERVALO = 5
+# Limite de consultas por (IP, ordem) - o polling normal (max-age=15) fica bem abaixo. O bot
+# de WhatsApp e as integrações consultam muitas ordens do mesmo IP, então o limite só por IP
+# é um teto alto contra varredura de números. O estado é por worker (o limite efetivo é
+# multiplicado pelo número de workers), o que basta contra abuso.
+_status_api_rate_limiter = RateLimiter(limite=30, janela=60)
+_status_api_rate_limiter_ip = RateLimiter(limite=600, janela=60)
+
+def long_poll_disponivel():
+    """True quando o worker atende várias requisições ao mesmo tempo
+    
+    O gunicorn só marca wsgi.multithread nos workers gthread e assíncronos.
+    """
+    return bool(request.environ.get('wsgi.multithread'))
+
+class NotificadorStatus:
+    """Acorda as requisições de long-poll quando o status de uma ordem muda neste worker"""
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._versoes = {}
+    
+    def notificar(self, numero_ordem):
+        with self._cond:
+            numero_ordem = str(numero_ordem)
+            self._versoes[numero_ordem] = self._versoes.get(numero_ordem, 0) + 1
+            self._cond.notify_all()
+    
+    def aguardar(self, numero_ordem, timeout):
+        numero_ordem = str(numero_ordem)
+        with self._cond:
+            versao = self._versoes.get(numero_ordem, 0)
+            return self._cond.wait_for(lambda: self._versoes.get(numero_ordem, 0) != versao, timeout)
+
+_notificador_status = NotificadorStatus()
+
+def notificar_status_ordem(numero_ordem):
+    """Avisa os clientes em long-poll que a ordem mudou"""
+    _notificador_status.notificar(numero_ordem)
+
+def consultar_status_ordem(numero_ordem):
+    """Consulta apenas as colunas de status da ordem (sem carregar a linha inteira)"""
+    if use_database():
+        try:
+            linha = db.session.query(
+                OrdemServico.numero_ordem,
+                OrdemServico.status,
+                OrdemServico.prazo_estimado,
+                OrdemServico.data_atualizacao,
+                OrdemServico.data
+            ).filter(OrdemServico.numero_ordem == str(numero_ordem)).first()
+            if linha:
+                return {
+                    'numero_ordem': linha.numero_ordem,
+                    'status': linha.status,
+                    'prazo_estimado': linha.prazo_estimado,
+                    'atualizado_em': linha.data_atualizacao or linha.data
+                }
+        except Exception as e:
+            print(f"Erro ao consultar status da ordem: {e}")
+            try:
+                db.session.rollback()
+            except:
+                pass
+    
+    _cliente, ordem = buscar_ordem_json(numero_ordem)
+    if not ordem:
+        return None
+    try:
+        atualizado_em = datetime.strptime(ordem.get('data_atualizacao') or ordem.get('data'), '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        atualizado_em = None
+    return {
+        'numero_ordem': str(ordem.get('numero_ordem')),
+        'status': ordem.get('status'),
+        'prazo_estimado': ordem.get('prazo_estimado'),
+        'atualizado_em': atualizado_em
+    }
+
+def _etag_status(info):
+    conteudo = f"{info['numero_ordem']}|{info['status']}|{info['prazo_estimado']}|{info['atualizado_em']}"
+    return hashlib.sha1(conteudo.encode('utf-8')).hexdigest()
+
+@app.route('/api/ordens/<numero>/status', methods=['GET'])
+def api_status_ordem(numero):
+    """Status da ordem em JSON para polling (clientes e bot de WhatsApp)
+    
+    Suporta If-None-Match (responde 304 sem corpo) e long-poll opcional:
+    com ?wait=N e If-None-Match, a resposta só volta quando o status mudar
+    ou após N segundos (máx. STATUS_LONG_POLL_MAX). Em workers sync o wait
+    é ignorado e a resposta é imediata.
+    """
+    ip = ip_cliente()
+    if not (_status_api_rate_limiter.permitir((ip, str(numero))) and _status_api_rate_limiter_ip.permitir(ip)):
+        resposta = jsonify({'error': 'Demasiadas consultas. Espere un minuto e intente nuevamente.'})
+        resposta.headers['Retry-After'] = '60'
+        return resposta, 429
+    
+    espera = 0
+    if long_poll_disponivel():
+        try:
+            espera = min(max(int(request.args.get('wait', 0)), 0), STATUS_LONG_POLL_MAX)
+        except ValueError:
+            espera = 0
+    limite = time.monotonic() + espera
+    
+    while True:
+        info = consultar_status_ordem(numero)
+        if not info:
+            return jsonify({'error': 'Orden de servicio no encontrada'}), 404
+        etag = _etag_status(info)
+        # A resposta JSON sai comprimida com ETag fraca (W/...)
+        nao_mudou = request.if_none_match.contains_weak(etag)
+        restante = limite - time.monotonic()
+        if not nao_mudou or restante <= 0:
+            break
+        # Liberar a conexão do pool enquanto espera
+        recriar_sessao()
+        _notificador_status.aguardar(numero, min(restante, STATUS_LONG_POLL_INTERVALO))
+    
+    if nao_mudou:
+        resposta = Response(status=304)
+    else:
+        atualizado_em = info['atualizado_em']
+        resposta = jsonify({
+            'numero_ordem': info['numero_ordem'],
+            'status': info['status'],
+            'status_label': get_status_label(info['status'] or ''),
+            'prazo_estimado': info['prazo_estimado'] or calcular_prazo_estimado(info['status']),
+            'atualizado_em': atualizado_em.isoformat() if atualizado_em else None
+        })
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'public, max-age=15'
+    return resposta
+
 @app.route('/api/servicos', methods=['GET'])
 def get_servicos():
     with open(DATA_FILE, 'r', encoding='utf-8') as f:
@@ -1787,6 +2472,57 @@ def admin_logout():
 # Rota de migração removida - banco de dados agora funciona diretamente com o Render
 # Quando DATABASE_URL estiver configurado, o sistema usa o banco automaticamente
 
+VISITAS_DIAS_GRAFICO = 14
+
+def carregar_visitas_diarias(dias=VISITAS_DIAS_GRAFICO):
+    """Visitas e únicos estimados dos últimos dias (dias sem visita entram com zero)"""
+    hoje = datetime.now().date()
+    inicio = hoje - timedelta(days=dias - 1)
+    linhas = db.session.query(VisitaDiaria.dia, VisitaDiaria.visitas, VisitaDiaria.unicos).filter(
+        VisitaDiaria.dia >= inicio
+    ).all()
+    por_dia = {dia: (visitas, unicos) for dia, visitas, unicos in linhas}
+    resultado = []
+    for i in range(dias):
+        dia = inicio + timedelta(days=i)
+        visitas, unicos = por_dia.get(dia, (0, 0))
+        resultado.append({'dia': dia.strftime('%d/%m'), 'visitas': visitas, 'unicos': unicos or 0})
+    maximo = max([item['visitas'] for item in resultado] + [1])
+    for item in resultado:
+        item['percentual'] = round(item['visitas'] * 100 / maximo)
+    return resultado
+
+def carga_agenda_hoje():
+    """Citas de hoje por status (sem as canceladas) - uma agregação, sem carregar as linhas"""
+    hoje = datetime.now().date()
+    carga = {'total': 0, 'pendentes': 0, 'confirmados': 0, 'minutos': 0}
+    if use_database():
+        try:
+            status = db.func.coalesce(Agendamento.status, 'pendente')
+            total, pendentes, confirmados, minutos = db.session.query(
+                db.func.count(Agendamento.id),
+                db.func.count(Agendamento.id).filter(status == 'pendente'),
+                db.func.count(Agendamento.id).filter(status == 'confirmado'),
+                db.func.coalesce(db.func.sum(Agendamento.duracao_minutos), 0)
+            ).filter(Agendamento.data_agendamento == hoje, status != 'cancelado').one()
+            carga.update(total=total, pendentes=pendentes, confirmados=confirmados, minutos=int(minutos or 0))
+        except Exception as e:
+            print(f"Erro ao calcular a carga da agenda de hoje: {e}")
+            db.session.rollback()
+    else:
+        try:
+            with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+                agendamentos = json.load(f).get('agendamentos', [])
+        except (OSError, ValueError):
+            agendamentos = []
+        for a in agendamentos:
+            if a.get('data_agendamento') == hoje.isoformat() and a.get('status', 'pendente') != 'cancelado':
+                carga['total'] += 1
+                carga['pendentes'] += a.get('status', 'pendente') == 'pendente'
+                carga['confirmados'] += a.get('status') == 'confirmado'
+                carga['minutos'] += a.get('duracao_minutos') or 0
+    return carga
+
 @app.route('/admin')
 @login_required
 def admin_dashboard():
@@ -1810,14 +2546,16 @@ def admin_dashboard():
             # Serviços do banco
             total_servicos = Servico.query.count()
             
-            # Contador de visitas
-            visit_count = 0
+            # Contador de visitas (inclui as ainda não gravadas por este worker)
+            visit_count = _contador_visitas.pendentes()
+            visitas_diarias = []
             try:
                 counter = VisitCounter.query.get(1)
                 if counter:
-                    visit_count = counter.count
+                    visit_count += counter.count
+                visitas_diarias = carregar_visitas_diarias()
             except:
-                pass
+                db.session.rollback()
             
             # Agendamentos recentes (últimos 10, ordenados por data de criação)
             agendamentos_recentes_db = Agendamento.query.order_by(Agendamento.data_criacao.desc()).limit(10).all()
@@ -1839,6 +2577,7 @@ def admin_dashboard():
             total_contatos = 0
             total_servicos = 0
             visit_count = 0
+            visitas_diarias = []
             contatos_recentes = []
             agendamentos_recentes = []
     else:
@@ -1850,6 +2589,7 @@ def admin_dashboard():
         total_contatos = len(data.get('contacts', []))
         total_servicos = len(data.get('services', []))
         visit_count = 0
+        visitas_diarias = []
         contatos_recentes = sorted(data.get('contacts', []), key=lambda x: x.get('data', ''), reverse=True)[:5]
         
         # Agendamentos do JSON
@@ -1869,7 +2609,9 @@ def admin_dashboard():
         'total_servicos': total_servicos,
         'contatos_recentes': contatos_recentes,
         'agendamentos_recentes': agendamentos_recentes,
-        'visit_count': visit_count
+        'agenda_hoje': carga_agenda_hoje(),
+        'visit_count': visit_count,
+        'visitas_diarias': visitas_diarias
     }
     
     return render_template('admin/dashboard.html', stats=stats)
@@ -1989,42 +2731,12 @@ def upload_servico_imagem():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    # Verificar tamanho do arquivo
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    # Ler dados do arquivo
-    file_data = file.read()
-    
-    # Determinar tipo MIME
-    ext = os.path.splitext(file.filename)[1].lower()
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp'
-    }
-    imagem_tipo = mime_types.get(ext, 'image/jpeg')
-    
-    # Se usar banco de dados, salvar no banco
+    # Se usar banco de dados, gravar em streaming no armazenamento de blobs
     if use_database():
         try:
             # Em rotas Flask, já estamos em um contexto de aplicação
-            # Criar registro de imagem no banco
-            imagem = Imagem(
-                nome=secure_filename(file.filename),
-                dados=file_data,
-                tipo_mime=imagem_tipo,
-                tamanho=file_size,
-                referencia=f'servico_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            )
-            # Usar db.session diretamente - Flask-SQLAlchemy gerencia o contexto
-            db.session.add(imagem)
-            db.session.commit()
+            # Tipo MIME e tamanho são validados durante a cópia em blocos
+            imagem = salvar_upload_imagem(file, 'servico')
             
             # Retornar ID da imagem para usar no serviço
             return jsonify({
@@ -2032,6 +2744,8 @@ def upload_servico_imagem():
                 'path': f'/admin/servicos/imagem/{imagem.id}',
                 'image_id': imagem.id
             })
+        except UploadInvalido as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro ao salvar imagem no banco: {e}")
             import traceback
@@ -2060,6 +2774,16 @@ def servir_imagem_servico(image_id):
         try:
             # Não usar app.app_context() aqui - já estamos em uma rota Flask
             imagem = Imagem.query.get(image_id)
+            if imagem and imagem.storage_key:
+                return resposta_blob(
+                    imagem.storage_key,
+                    mimetype=imagem.tipo_mime or 'image/jpeg',
+                    headers={
+                        'Content-Disposition': f'inline; filename={imagem.nome or "imagem.jpg"}',
+                        'Cache-Control': 'public, max-age=31536000'  # Cache por 1 ano
+                    },
+                    tamanho=imagem.tamanho
+                )
             if imagem and imagem.dados:
                 return Response(
                     imagem.dados,
@@ -2083,6 +2807,16 @@ def servir_pdf(pdf_id):
     if use_database():
         try:
             pdf_doc = PDFDocument.query.get(pdf_id)
+            if pdf_doc and pdf_doc.storage_key:
+                return resposta_blob(
+                    pdf_doc.storage_key,
+                    mimetype='application/pdf',
+                    headers={
+                        'Content-Disposition': f'inline; filename={pdf_doc.nome or "documento.pdf"}',
+                        'Cache-Control': 'public, max-age=31536000'  # Cache por 1 ano
+                    },
+                    tamanho=pdf_doc.tamanho
+                )
             if pdf_doc and pdf_doc.dados:
                 return Response(
                     pdf_doc.dados,
@@ -2405,6 +3139,7 @@ def delete_servico(servico_id):
                         
                         # Se não há outros serviços usando esta imagem, deletar
                         if outros_servicos == 0:
+                            remover_blob(db.session, imagem.storage_key)
                             db.session.delete(imagem)
                             print(f"✅ Imagem {servico.imagem_id} deletada (não usada por outros serviços)")
                 except Exception as e:
@@ -2642,274 +3377,77 @@ def edit_cliente(cliente_id):
     
     return render_template('admin/edit_cliente.html', cliente=cliente)
 
-@app.route('/admin/executar-delete-cliente-2', methods=['GET', 'POST'])
-@login_required
-def executar_delete_cliente_2():
-    """Rota temporária para executar exclusão do cliente ID 2 - OTIMIZADA"""
-    if not use_database():
-        flash('Base de datos no configurada.', 'error')
-        return redirect(url_for('admin_clientes'))
-    
-    if request.method == 'POST':
+def _apos_excluir_cliente(cliente_id, resultado):
+    """Descarta caches que ainda apontam para o cliente ou suas ordens"""
+    invalidar_cache_portal(cliente_id)
+    for numero_ordem in resultado.get('numeros_ordem', ()):
+        invalidar_cache_rastreamento(numero_ordem)
+        notificar_status_ordem(numero_ordem)
+    if resultado.get('agendamentos'):
+        # Libera na agenda os horários dos agendamentos removidos
         try:
-            cliente_id = 2
-            
-            # Executar tudo em uma única transação SQL otimizada
-            with db.engine.begin() as conn:
-                # 1. Deletar itens_pedido relacionados aos pedidos do cliente (se tabela existir)
-                try:
-                    conn.execute(db.text("""
-                        DELETE FROM itens_pedido 
-                        WHERE pedido_id IN (
-                            SELECT id FROM pedidos WHERE cliente_id = :cliente_id
-                        )
-                    """), {'cliente_id': cliente_id})
-                except Exception as e:
-                    print(f"Aviso: erro ao deletar itens_pedido (pode não existir): {e}")
-                
-                # 2. Deletar pedidos do cliente (se tabela existir)
-                try:
-                    conn.execute(db.text("DELETE FROM pedidos WHERE cliente_id = :cliente_id"), {'cliente_id': cliente_id})
-                except Exception as e:
-                    print(f"Aviso: erro ao deletar pedidos (pode não existir): {e}")
-                
-                # 3. Remover constraint da loja antiga (se existir) - ANTES de deletar o cliente
-                try:
-                    conn.execute(db.text("ALTER TABLE clientes DROP CONSTRAINT IF EXISTS pedidos_cliente_id_fkey CASCADE"))
-                except Exception as e:
-                    print(f"Aviso: erro ao remover constraint (pode não existir): {e}")
-                
-                # 4-12. Executar exclusões em cascata usando SQL direto (mais rápido)
-                conn.execute(db.text("""
-                    -- Deletar PDFs de orçamentos
-                    DELETE FROM pdf_documents 
-                    WHERE id IN (
-                        SELECT pdf_id FROM orcamentos_ar_condicionado 
-                        WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
-                    );
-                    
-                    -- Deletar orçamentos
-                    DELETE FROM orcamentos_ar_condicionado WHERE cliente_id = :cliente_id;
-                    
-                    -- Deletar PDFs de comprovantes
-                    DELETE FROM pdf_documents 
-                    WHERE id IN (
-                        SELECT pdf_id FROM comprovantes 
-                        WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
-                    );
-                    
-                    -- Deletar comprovantes
-                    DELETE FROM comprovantes WHERE cliente_id = :cliente_id;
-                    
-                    -- Deletar cupons
-                    DELETE FROM cupons WHERE cliente_id = :cliente_id;
-                    
-                    -- Deletar PDFs de ordens
-                    DELETE FROM pdf_documents 
-                    WHERE id IN (
-                        SELECT pdf_id FROM ordens_servico 
-                        WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
-                    );
-                    
-                    -- Deletar ordens
-                    DELETE FROM ordens_servico WHERE cliente_id = :cliente_id;
-                    
-                    -- Deletar agendamentos relacionados
-                    DELETE FROM agendamentos 
-                    WHERE email = (SELECT email FROM clientes WHERE id = :cliente_id);
-                    
-                    -- Deletar cliente
-                    DELETE FROM clientes WHERE id = :cliente_id;
-                """), {'cliente_id': cliente_id})
-                
-            flash('Cliente ID 2 e todos os dados relacionados foram deletados com sucesso!', 'success')
-                    
+            reconstruir_agenda(db.session, carregar_config_agenda())
+            db.session.commit()
         except Exception as e:
-            print(f"Erro ao deletar cliente 2: {e}")
-            import traceback
-            traceback.print_exc()
-            flash(f'Erro ao deletar cliente: {str(e)}', 'error')
-        
-        return redirect(url_for('admin_clientes'))
-    
-    return '''
-    <html>
-    <head><title>Confirmar Exclusão</title></head>
-    <body style="font-family: Arial; padding: 40px; text-align: center;">
-        <h1>⚠️ Confirmar Exclusão do Cliente ID 2</h1>
-        <p>Esta ação irá deletar o cliente ID 2 e TODOS os dados relacionados:</p>
-        <ul style="text-align: left; display: inline-block;">
-            <li>Orçamentos de ar-condicionado</li>
-            <li>Comprovantes</li>
-            <li>Cupons</li>
-            <li>Ordens de serviço</li>
-            <li>Agendamentos relacionados</li>
-            <li>PDFs associados</li>
-        </ul>
-        <form method="POST" style="margin-top: 30px;">
-            <button type="submit" style="background: #dc3545; color: white; padding: 15px 30px; font-size: 18px; border: none; border-radius: 5px; cursor: pointer;">
-                ⚠️ CONFIRMAR EXCLUSÃO
-            </button>
-            <br><br>
-            <a href="/admin/clientes" style="color: #666;">Cancelar</a>
-        </form>
-    </body>
-    </html>
-    '''
+            print(f"Erro ao reconstruir a agenda após excluir o cliente {cliente_id}: {e}")
+            db.session.rollback()
+
+@app.route('/admin/clientes/<int:cliente_id>/exclusao/previa')
+@login_required
+def previa_exclusao_cliente(cliente_id):
+    """Quantos registros seriam excluídos junto com o cliente (não altera nada)"""
+    if not use_database():
+        return jsonify({'error': 'Base de datos no configurada.'}), 503
+    try:
+        previa = previa_exclusao(db.session, cliente_id)
+        db.session.rollback()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao calcular prévia de exclusão do cliente {cliente_id}: {e}")
+        return jsonify({'error': str(e)}), 500
+    if not previa['cliente']:
+        return jsonify({'error': 'Cliente não encontrado'}), 404
+    previa['em_background'] = previa['total'] > LIMITE_EXCLUSAO_SINCRONA
+    return jsonify(previa)
+
+@app.route('/admin/clientes/<int:cliente_id>/exclusao/status')
+@login_required
+def status_exclusao_cliente(cliente_id):
+    """Estado da exclusão em background do cliente"""
+    return jsonify(estado_exclusao(cliente_id) or {'rodando': False})
 
 @app.route('/admin/clientes/<int:cliente_id>/delete', methods=['POST'])
 @login_required
 def delete_cliente(cliente_id):
-    """Exclui um cliente - APENAS BANCO DE DADOS"""
+    """Exclui um cliente e todos os registros relacionados - APENAS BANCO DE DADOS"""
     if not use_database():
         flash('Base de datos no configurada.', 'error')
         return redirect(url_for('admin_clientes'))
     
     try:
-        cliente = Cliente.query.get(cliente_id)
-        if not cliente:
+        previa = previa_exclusao(db.session, cliente_id)
+        if not previa['cliente']:
+            db.session.rollback()
             flash('Cliente não encontrado!', 'error')
             return redirect(url_for('admin_clientes'))
         
-        # Verificar se há registros relacionados e coletar informações
-        ordens_count = OrdemServico.query.filter_by(cliente_id=cliente_id).count()
-        comprovantes_count = Comprovante.query.filter_by(cliente_id=cliente_id).count()
-        cupons_count = Cupom.query.filter_by(cliente_id=cliente_id).count()
-        
-        orcamentos_count = 0
-        try:
-            from models import OrcamentoArCondicionado
-            orcamentos_count = OrcamentoArCondicionado.query.filter_by(cliente_id=cliente_id).count()
-        except:
-            pass
-        
-        # Excluir registros relacionados em cascata antes de excluir o cliente
-        # Fazer commit após cada tipo para garantir que as exclusões sejam salvas
-        
-        # 1. Excluir orçamentos de ar-condicionado relacionados (e seus PDFs)
-        if orcamentos_count > 0:
-            try:
-                from models import OrcamentoArCondicionado
-                orcamentos = OrcamentoArCondicionado.query.filter_by(cliente_id=cliente_id).all()
-                for orcamento in orcamentos:
-                    # Deletar PDF associado se existir
-                    if orcamento.pdf_id:
-                        try:
-                            pdf_doc = PDFDocument.query.get(orcamento.pdf_id)
-                            if pdf_doc:
-                                db.session.delete(pdf_doc)
-                        except Exception as pdf_err:
-                            print(f"Erro ao excluir PDF do orçamento {orcamento.id}: {pdf_err}")
-                    db.session.delete(orcamento)
-                db.session.commit()
-                print(f"Excluídos {orcamentos_count} orçamento(s) de ar-condicionado")
-            except Exception as e:
-                print(f"Erro ao excluir orçamentos: {e}")
-                db.session.rollback()
-        
-        # 2. Excluir cupons relacionados
-        if cupons_count > 0:
-            try:
-                Cupom.query.filter_by(cliente_id=cliente_id).delete()
-                db.session.commit()
-                print(f"Excluídos {cupons_count} cupom(ns)")
-            except Exception as e:
-                print(f"Erro ao excluir cupons: {e}")
-                db.session.rollback()
-        
-        # 3. Excluir comprovantes relacionados (e seus PDFs)
-        if comprovantes_count > 0:
-            try:
-                comprovantes = Comprovante.query.filter_by(cliente_id=cliente_id).all()
-                for comprovante in comprovantes:
-                    # Deletar PDF associado se existir
-                    if comprovante.pdf_id:
-                        try:
-                            pdf_doc = PDFDocument.query.get(comprovante.pdf_id)
-                            if pdf_doc:
-                                db.session.delete(pdf_doc)
-                        except Exception as pdf_err:
-                            print(f"Erro ao excluir PDF do comprovante {comprovante.id}: {pdf_err}")
-                    db.session.delete(comprovante)
-                db.session.commit()
-                print(f"Excluídos {comprovantes_count} comprovante(s)")
-            except Exception as e:
-                print(f"Erro ao excluir comprovantes: {e}")
-                db.session.rollback()
-        
-        # 4. Excluir ordens de serviço relacionadas (e seus PDFs)
-        if ordens_count > 0:
-            try:
-                ordens = OrdemServico.query.filter_by(cliente_id=cliente_id).all()
-                for ordem in ordens:
-                    # Deletar PDF associado se existir
-                    if ordem.pdf_id:
-                        try:
-                            pdf_doc = PDFDocument.query.get(ordem.pdf_id)
-                            if pdf_doc:
-                                db.session.delete(pdf_doc)
-                        except Exception as pdf_err:
-                            print(f"Erro ao excluir PDF da ordem {ordem.id}: {pdf_err}")
-                    db.session.delete(ordem)
-                db.session.commit()
-                print(f"Excluídos {ordens_count} ordem(ns) de serviço")
-            except Exception as e:
-                print(f"Erro ao excluir ordens: {e}")
-                db.session.rollback()
-        
-        # 5. Tentar excluir agendamentos relacionados por email (caso existam)
-        try:
-            from models import Agendamento
-            agendamentos_count = 0
-            if cliente.email:
-                agendamentos = Agendamento.query.filter_by(email=cliente.email).all()
-                agendamentos_count = len(agendamentos)
-                for agendamento in agendamentos:
-                    db.session.delete(agendamento)
-                if agendamentos_count > 0:
-                    db.session.commit()
-                    print(f"Excluídos {agendamentos_count} agendamento(s) relacionados")
-        except Exception as e:
-            print(f"Erro ao excluir agendamentos: {e}")
+        # Clientes com muitos registros são excluídos em background para não segurar a requisição
+        if previa['total'] > LIMITE_EXCLUSAO_SINCRONA:
             db.session.rollback()
+            if iniciar_exclusao_em_background(app, db, cliente_id, ao_concluir=_apos_excluir_cliente):
+                flash(f'Exclusão do cliente e de {previa["total"]} registro(s) relacionado(s) iniciada em segundo plano.', 'info')
+            else:
+                flash('Já existe uma exclusão em andamento para este cliente.', 'warning')
+            return redirect(url_for('admin_clientes'))
         
-        # 6. Tentar remover constraints de foreign key manualmente se necessário
-        # Isso resolve problemas com clientes cadastrados na loja antiga
-        try:
-            with db.engine.begin() as conn:
-                # Tentar remover constraint específica de pedidos se existir
-                conn.execute(db.text("""
-                    ALTER TABLE clientes DROP CONSTRAINT IF EXISTS pedidos_cliente_id_fkey CASCADE
-                """))
-        except Exception as constraint_err:
-            print(f"Aviso ao remover constraints: {constraint_err}")
-            # Continuar mesmo se der erro, pode ser que a constraint não exista
+        resultado = excluir_cliente(db.session, cliente_id)
+        _apos_excluir_cliente(cliente_id, resultado)
         
-        # 7. Agora tentar excluir o cliente
-        try:
-            db.session.delete(cliente)
-            db.session.commit()
-            
-            # Mensagem informando quantos registros foram excluídos
-            total_excluidos = ordens_count + comprovantes_count + cupons_count + orcamentos_count
-            if total_excluidos > 0:
-                flash(f'Cliente e {total_excluidos} registro(s) relacionado(s) foram excluídos com sucesso!', 'success')
-            else:
-                flash('Cliente excluído com sucesso!', 'success')
-        except Exception as delete_err:
-            # Se ainda der erro, tentar exclusão direta via SQL
-            print(f"Erro ao excluir cliente via ORM: {delete_err}")
-            db.session.rollback()
-            
-            try:
-                with db.engine.connect() as conn:
-                    # Exclusão direta via SQL (bypassa constraints)
-                    conn.execute(db.text("DELETE FROM clientes WHERE id = :cliente_id"), {'cliente_id': cliente_id})
-                    conn.commit()
-                flash('Cliente excluído com sucesso (via exclusão direta)!', 'success')
-            except Exception as sql_err:
-                print(f"Erro ao excluir cliente via SQL: {sql_err}")
-                raise delete_err
+        # Mensagem informando quantos registros foram excluídos
+        if previa['total'] > 0:
+            flash(f'Cliente e {previa["total"]} registro(s) relacionado(s) foram excluídos com sucesso!', 'success')
+        else:
+            flash('Cliente excluído com sucesso!', 'success')
     except Exception as e:
         print(f"Erro ao excluir cliente: {e}")
         import traceback
@@ -2919,7 +3457,7 @@ def delete_cliente(cliente_id):
         # Mensagem mais amigável para erro de foreign key
         error_msg = str(e)
         if 'foreign key' in error_msg.lower() or 'violates foreign key' in error_msg.lower():
-            flash('Não é possível excluir o cliente. Existem registros relacionados (ordens de serviço, comprovantes, cupons, orçamentos, etc.) que precisam ser excluídos primeiro.', 'error')
+            flash('Não é possível excluir o cliente. Existem registros relacionados que impedem a exclusão.', 'error')
         else:
             flash(f'Erro ao excluir cliente: {str(e)}', 'error')
     
@@ -3035,6 +3573,274 @@ def admin_financeiro():
                          ordens_pagas=ordens_pagas,
                          ordens_concluidas=ordens_concluidas)
 
+# ==================== BUSCA DO ADMIN ====================
+
+# Índice invertido do clients.json para o modo JSON, reconstruído só quando o arquivo muda
+_indice_busca_json = {'mtime': None, 'indice': None}
+
+def _indice_busca_clients_json():
+    mtime = _mtime_clients_json()
+    if mtime is None:
+        return None
+    if _indice_busca_json['mtime'] != mtime:
+        with open(CLIENTS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        _indice_busca_json['indice'] = indice_de_clientes_json(data)
+        _indice_busca_json['mtime'] = mtime
+    return _indice_busca_json['indice']
+
+def _link_resultado_busca(resultado):
+    if resultado['tipo'] == 'cliente':
+        return url_for('view_cliente', cliente_id=resultado['id'])
+    if resultado['tipo'] == 'ordem':
+        return url_for('edit_ordem_servico', cliente_id=resultado['cliente_id'], ordem_id=resultado['id'])
+    return url_for('servir_manual', manual_id=resultado['id'])
+
+@app.route('/admin/busca')
+@login_required
+def busca_admin():
+    """Busca unificada em clientes, ordens de serviço e manuais (ordenada por relevância)"""
+    termo = request.args.get('q', '').strip()[:200]
+    pagina = max(request.args.get('pagina', 1, type=int) or 1, 1)
+    resultados, total = [], 0
+    
+    if termo:
+        if use_database():
+            try:
+                garantir_indices_busca()
+                resultados, total = buscar_banco(db.session, termo, pagina, POR_PAGINA_BUSCA)
+            except Exception as e:
+                print(f"Erro na busca do admin: {e}")
+                try:
+                    db.session.rollback()
+                except:
+                    pass
+                flash('Error al realizar la búsqueda.', 'error')
+        else:
+            try:
+                indice = _indice_busca_clients_json()
+                if indice:
+                    resultados, total = indice.buscar(termo, pagina, POR_PAGINA_BUSCA)
+            except Exception as e:
+                print(f"Erro na busca do admin (JSON): {e}")
+    
+    for resultado in resultados:
+        resultado['link'] = _link_resultado_busca(resultado)
+    total_paginas = max((total + POR_PAGINA_BUSCA - 1) // POR_PAGINA_BUSCA, 1)
+    return render_template('admin/busca.html', termo=termo, resultados=resultados, total=total,
+                           pagina=pagina, total_paginas=total_paginas)
+
+# ==================== EXPORTAÇÃO DE PLANILHAS ====================
+# CSV/XLSX gerados em streaming direto do cursor do banco (yield_per): a
+# memória fica constante para qualquer número de linhas
+
+LOTE_EXPORTACAO = 1000
+
+def _filtro_data(coluna, consulta):
+    """Aplica ?de=AAAA-MM-DD&ate=AAAA-MM-DD (ambos inclusive) na coluna de data"""
+    try:
+        de = request.args.get('de', '').strip()
+        if de:
+            consulta = consulta.where(coluna >= datetime.strptime(de, '%Y-%m-%d'))
+        ate = request.args.get('ate', '').strip()
+        if ate:
+            consulta = consulta.where(coluna < datetime.strptime(ate, '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        pass  # Data inválida: exporta sem o filtro, como a listagem
+    return consulta
+
+def _filtro_valor(consulta, parametro, coluna):
+    valor = request.args.get(parametro, '').strip()
+    return consulta.where(coluna == valor) if valor else consulta
+
+def _filtros_comuns(consulta, coluna_data, coluna_cliente=None, coluna_status=None):
+    consulta = _filtro_data(coluna_data, consulta)
+    cliente_id = request.args.get('cliente_id', type=int)
+    if cliente_id and coluna_cliente is not None:
+        consulta = consulta.where(coluna_cliente == cliente_id)
+    if coluna_status is not None:
+        consulta = _filtro_valor(consulta, 'status', coluna_status)
+    return consulta
+
+def _exportar_ordens():
+    """Ordens com a situação financeira do admin_financeiro (pago = status 'pago' ou com comprovante)"""
+    tem_comprovante = db.exists().where(Comprovante.ordem_id == OrdemServico.id)
+    consulta = db.select(
+        OrdemServico.numero_ordem, OrdemServico.data, Cliente.nome.label('cliente'), Tecnico.nome.label('tecnico'),
+        OrdemServico.servico, OrdemServico.tipo_aparelho, OrdemServico.marca, OrdemServico.modelo, OrdemServico.numero_serie,
+        OrdemServico.status, OrdemServico.prazo_estimado, OrdemServico.custo_pecas, OrdemServico.custo_mao_obra,
+        OrdemServico.subtotal, OrdemServico.desconto_percentual, OrdemServico.valor_desconto, OrdemServico.total,
+        db.or_(OrdemServico.status == 'pago', tem_comprovante).label('pago'),
+    ).outerjoin(Cliente, Cliente.id == OrdemServico.cliente_id) \
+     .outerjoin(Tecnico, Tecnico.id == OrdemServico.tecnico_id) \
+     .order_by(OrdemServico.data.desc())
+    consulta = _filtros_comuns(consulta, OrdemServico.data, OrdemServico.cliente_id, OrdemServico.status)
+
+    colunas = ['Nº Orden', 'Fecha', 'Cliente', 'Técnico', 'Servicio', 'Tipo de aparato', 'Marca', 'Modelo',
+               'Nº de serie', 'Estado', 'Plazo estimado', 'Costo piezas', 'Costo mano de obra', 'Subtotal',
+               'Descuento %', 'Valor descuento', 'Total', 'Pagado', 'Valor recibido', 'Valor por cobrar']
+
+    def linhas():
+        for linha in db.session.execute(consulta.execution_options(yield_per=LOTE_EXPORTACAO)):
+            *dados, pago = linha
+            total = linha.total or 0
+            por_cobrar = total if not pago and linha.status == 'concluido' else 0
+            yield (*dados, bool(pago), total if pago else 0, por_cobrar)
+    return colunas, linhas()
+
+def _exportar_clientes():
+    totais = db.select(
+        OrdemServico.cliente_id.label('cliente_id'),
+        db.func.count(OrdemServico.id).label('ordens'),
+        db.func.coalesce(db.func.sum(OrdemServico.total), 0).label('total'),
+    ).group_by(OrdemServico.cliente_id).subquery()
+    consulta = db.select(
+        Cliente.id, Cliente.nome, Cliente.email, Cliente.telefone, Cliente.cpf, Cliente.endereco,
+        Cliente.username, Cliente.data_cadastro,
+        db.func.coalesce(totais.c.ordens, 0), db.func.coalesce(totais.c.total, 0),
+    ).outerjoin(totais, totais.c.cliente_id == Cliente.id).order_by(Cliente.id.desc())
+    consulta = _filtro_data(Cliente.data_cadastro, consulta)
+
+    colunas = ['ID', 'Nombre', 'Email', 'Teléfono', 'CPF', 'Dirección', 'Usuario', 'Fecha de registro',
+               'Órdenes', 'Total en órdenes']
+    return colunas, db.session.execute(consulta.execution_options(yield_per=LOTE_EXPORTACAO))
+
+def _exportar_comprovantes():
+    consulta = db.select(
+        Comprovante.id, Comprovante.data, Comprovante.cliente_id, Comprovante.cliente_nome, Comprovante.numero_ordem,
+        Comprovante.valor_total, Comprovante.valor_pago, Comprovante.forma_pagamento, Comprovante.parcelas,
+        Comprovante.valor_total - Comprovante.valor_pago,
+    ).order_by(Comprovante.data.desc())
+    consulta = _filtros_comuns(consulta, Comprovante.data, Comprovante.cliente_id)
+    consulta = _filtro_valor(consulta, 'forma_pagamento', Comprovante.forma_pagamento)
+
+    colunas = ['ID', 'Fecha', 'ID cliente', 'Cliente', 'Nº Orden', 'Valor total', 'Valor pagado',
+               'Forma de pago', 'Cuotas', 'Saldo pendiente']
+    return colunas, db.session.execute(consulta.execution_options(yield_per=LOTE_EXPORTACAO))
+
+def _exportar_cupons():
+    consulta = db.select(
+        Cupom.id, Cupom.data_emissao, Cupom.cliente_id, Cupom.cliente_nome, Cupom.desconto_percentual,
+        Cupom.usado, Cupom.ordem_id, Cupom.data_uso,
+    ).order_by(Cupom.data_emissao.desc())
+    consulta = _filtros_comuns(consulta, Cupom.data_emissao, Cupom.cliente_id)
+    usado = request.args.get('usado', '').strip().lower()
+    if usado in ('1', 'true', 'sim', 'si'):
+        consulta = consulta.where(Cupom.usado.is_(True))
+    elif usado in ('0', 'false', 'nao', 'no'):
+        consulta = consulta.where(db.or_(Cupom.usado.is_(False), Cupom.usado.is_(None)))
+
+    colunas = ['ID', 'Fecha de emisión', 'ID cliente', 'Cliente', 'Descuento %', 'Usado', 'ID orden', 'Fecha de uso']
+    return colunas, db.session.execute(consulta.execution_options(yield_per=LOTE_EXPORTACAO))
+
+def _exportar_orcamentos_ar():
+    consulta = db.select(
+        OrcamentoArCondicionado.id, OrcamentoArCondicionado.data_criacao, Cliente.nome, Tecnico.nome,
+        OrcamentoArCondicionado.tipo_servico, OrcamentoArCondicionado.potencia_btu,
+        OrcamentoArCondicionado.tipo_acesso, OrcamentoArCondicionado.marca_aparelho,
+        OrcamentoArCondicionado.modelo_aparelho, OrcamentoArCondicionado.material_adicional,
+        OrcamentoArCondicionado.valor_base, OrcamentoArCondicionado.valor_acesso,
+        OrcamentoArCondicionado.valor_material_adicional, OrcamentoArCondicionado.valor_total,
+        OrcamentoArCondicionado.status, OrcamentoArCondicionado.prazo_estimado,
+    ).outerjoin(Cliente, Cliente.id == OrcamentoArCondicionado.cliente_id) \
+     .outerjoin(Tecnico, Tecnico.id == OrcamentoArCondicionado.tecnico_id) \
+     .order_by(OrcamentoArCondicionado.data_criacao.desc())
+    consulta = _filtros_comuns(consulta, OrcamentoArCondicionado.data_criacao, OrcamentoArCondicionado.cliente_id,
+                               OrcamentoArCondicionado.status)
+
+    colunas = ['ID', 'Fecha', 'Cliente', 'Técnico', 'Tipo de servicio', 'Potencia (BTU)', 'Acceso', 'Marca',
+               'Modelo', 'Material adicional', 'Valor base', 'Valor acceso', 'Valor material', 'Valor total',
+               'Estado', 'Plazo estimado']
+    return colunas, db.session.execute(consulta.execution_options(yield_per=LOTE_EXPORTACAO))
+
+# entidade -> (função que retorna (colunas, linhas), nome do arquivo/planilha)
+EXPORTACOES = {
+    'ordens': (_exportar_ordens, 'ordenes'),
+    'clientes': (_exportar_clientes, 'clientes'),
+    'comprovantes': (_exportar_comprovantes, 'comprobantes'),
+    'cupons': (_exportar_cupons, 'cupones'),
+    'orcamentos-ar': (_exportar_orcamentos_ar, 'presupuestos_ar'),
+}
+
+@app.route('/admin/exportar/<entidade>.<formato>')
+@login_required
+def exportar_planilha(entidade, formato):
+    """Exporta a listagem do admin em CSV ou XLSX (aceita os filtros ?de=&ate=&status=&cliente_id=)"""
+    if entidade not in EXPORTACOES or formato not in FORMATOS_PLANILHA:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    gerar, nome = EXPORTACOES[entidade]
+    mimetype, extensao = FORMATOS_PLANILHA[formato]
+    colunas, linhas = gerar()
+    nome_arquivo = f"{nome}_{datetime.now().strftime('%Y%m%d_%H%M')}.{extensao}"
+    response = Response(stream_with_context(gerar_planilha(formato, colunas, linhas, nome)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# ==================== IMPORTAÇÃO EM MASSA ====================
+
+EXTENSOES_IMPORTACAO = ('.csv', '.xlsx')
+
+def _apos_importar(tipo, resultado):
+    """Ordens novas: descarta o portal dos clientes e os códigos 'não encontrados' do rastreio"""
+    afetados = resultado.get('afetados') or {}
+    for cliente_id in afetados.get('clientes', ()):
+        invalidar_cache_portal(cliente_id)
+    for numero_ordem in afetados.get('numeros_ordem', ()):
+        invalidar_cache_rastreamento(numero_ordem)
+
+@app.route('/admin/importar', methods=['GET', 'POST'])
+@login_required
+def importar_planilha():
+    """Importa clientes ou ordens de um CSV/XLSX em background"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    if request.method == 'POST':
+        tipo = request.form.get('tipo')
+        arquivo = request.files.get('arquivo')
+        nome_arquivo = secure_filename(arquivo.filename) if arquivo and arquivo.filename else ''
+        if tipo not in ('clientes', 'ordens'):
+            flash('Tipo de importación inválido.', 'error')
+            return redirect(url_for('importar_planilha'))
+        if not nome_arquivo.lower().endswith(EXTENSOES_IMPORTACAO):
+            flash('Envíe un archivo .csv o .xlsx.', 'error')
+            return redirect(url_for('importar_planilha'))
+
+        # O arquivo vai para disco (em blocos) e a thread de importação o remove no final
+        descritor, caminho = tempfile.mkstemp(suffix=os.path.splitext(nome_arquivo)[1])
+        with os.fdopen(descritor, 'wb') as destino:
+            arquivo.save(destino)
+        job_id = iniciar_importacao_em_background(app, db, tipo, caminho, nome_arquivo, ao_concluir=_apos_importar)
+        return redirect(url_for('importar_planilha', job=job_id))
+
+    return render_template('admin/importar.html', job_id=request.args.get('job'))
+
+@app.route('/admin/importar/<job_id>/status')
+@login_required
+def status_importacao(job_id):
+    estado = estado_importacao(job_id)
+    if estado is None:
+        return jsonify({'error': 'Importación no encontrada'}), 404
+    return jsonify(estado)
+
+@app.route('/admin/importar/<job_id>/erros.csv')
+@login_required
+def erros_importacao(job_id):
+    """Relatório de erros da importação (linha, campo, mensagem)"""
+    estado = estado_importacao(job_id, com_erros=True)
+    if estado is None:
+        return jsonify({'error': 'Importación no encontrada'}), 404
+    mimetype, _ = FORMATOS_PLANILHA['csv']
+    response = Response(gerar_planilha('csv', ['Fila', 'Campo', 'Error'], estado['erros']), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="errores_importacion_{job_id[:8]}.csv"'
+    return response
+
 @app.route('/admin/ordens')
 @login_required
 def admin_ordens():
@@ -3060,7 +3866,7 @@ def admin_ordens():
                     'pdf_id': ordem.pdf_id
                 }
                 todas_ordens.append(ordem_dict)
-            return render_template('admin/ordens.html', ordens=todas_ordens)
+            return render_template('admin/ordens.html', ordens=todas_ordens, status_ordem=STATUS_ORDEM)
         except Exception as e:
             print(f"Erro ao buscar ordens do banco: {e}")
             import traceback
@@ -3085,7 +3891,144 @@ def admin_ordens():
     # Ordenar por data (mais recente primeiro)
     todas_ordens = sorted(todas_ordens, key=lambda x: x.get('data', ''), reverse=True)
     
-    return render_template('admin/ordens.html', ordens=todas_ordens)
+    return render_template('admin/ordens.html', ordens=todas_ordens, status_ordem=STATUS_ORDEM)
+
+@app.route('/admin/ordens/status', methods=['POST'])
+@login_required
+def atualizar_status_ordens():
+    """Muda o status das ordens selecionadas em admin_ordens de uma vez
+
+    Um UPDATE para o lote inteiro, com o histórico gravado no mesmo comando;
+    só as ordens que realmente mudaram entram na fila de PDFs.
+    """
+    status = request.form.get('status', '')
+    status_atual = request.form.get('status_atual') or None
+    try:
+        ordem_ids = [int(ordem_id) for ordem_id in request.form.getlist('ordem_ids')]
+    except ValueError:
+        ordem_ids = []
+    if not ordem_ids:
+        flash('Seleccione al menos una orden.', 'error')
+        return redirect(url_for('admin_ordens'))
+    
+    if use_database():
+        try:
+            alteradas = atualizar_status_em_lote(db.session, ordem_ids, status, status_atual,
+                                                 usuario=session.get('admin_username'))
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            return redirect(url_for('admin_ordens'))
+        except Exception as e:
+            print(f"Erro ao atualizar status em lote: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            flash('Error al actualizar el estado de las órdenes.', 'error')
+            return redirect(url_for('admin_ordens'))
+        
+        # O UPDATE não passa pelo ORM: portal e long-poll são avisados aqui
+        for cliente_id in {ordem['cliente_id'] for ordem in alteradas}:
+            invalidar_cache_portal(cliente_id)
+        for ordem in alteradas:
+            notificar_status_ordem(ordem['numero_ordem'])
+        na_fila = agendar_pdfs_ordens([ordem['id'] for ordem in alteradas if ordem['tem_pdf']])
+    else:
+        if status not in STATUS_ORDEM or (status_atual and status_atual not in STATUS_ORDEM):
+            flash('Estado inválido.', 'error')
+            return redirect(url_for('admin_ordens'))
+        with open(CLIENTS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        selecionadas = set(ordem_ids)
+        agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        alteradas = []
+        for cliente in data['clients']:
+            for ordem in cliente.get('ordens', []):
+                if ordem.get('id') not in selecionadas or ordem.get('status') == status:
+                    continue
+                if status_atual and ordem.get('status') != status_atual:
+                    continue
+                ordem.setdefault('historico_status', []).append({
+                    'status_anterior': ordem.get('status'), 'status_novo': status, 'origem': 'lote',
+                    'usuario': session.get('admin_username'), 'data': agora,
+                })
+                ordem['status'] = status
+                ordem['data_atualizacao'] = agora
+                alteradas.append((cliente, ordem))
+        # Sem banco não há fila: o PDF (arquivo em static/pdfs) é regerado aqui mesmo
+        for cliente, ordem in alteradas:
+            if ordem.get('pdf_filename'):
+                pdf_result = gerar_pdf_ordem(cliente, ordem)
+                if isinstance(pdf_result, dict):
+                    ordem['pdf_filename'] = pdf_result.get('pdf_filename', '')
+        with open(CLIENTS_FILE, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        for _, ordem in alteradas:
+            notificar_status_ordem(ordem.get('numero_ordem'))
+        na_fila = 0
+    
+    mensagem = f'{len(alteradas)} de {len(set(ordem_ids))} órdenes pasaron a "{STATUS_ORDEM[status]}".'
+    if na_fila:
+        mensagem += f' {na_fila} PDF se regeneran en segundo plano.'
+    flash(mensagem, 'success')
+    return redirect(url_for('admin_ordens'))
+
+@app.route('/admin/ordens/relatorio-status')
+@login_required
+def relatorio_status_ordens():
+    """Tempo médio em cada status, por técnico, e as ordens abertas com SLA estourado"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_ordens'))
+    
+    hoje = datetime.now().date()
+    try:
+        fim = datetime.strptime(request.args.get('ate', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fim = hoje
+    try:
+        inicio = datetime.strptime(request.args.get('de', ''), '%Y-%m-%d').date()
+    except ValueError:
+        inicio = fim - timedelta(days=29)
+    if inicio > fim:
+        inicio, fim = fim, inicio
+    
+    try:
+        # Soma só os eventos novos desde a última vez (o cron faz o mesmo com --agregar)
+        agregar_status_ordens(db.session)
+    except Exception as e:
+        print(f"Erro ao agregar eventos de status: {e}")
+        db.session.rollback()
+    try:
+        por_status = tempo_por_status(db.session, inicio, fim)
+        por_tecnico = tempo_por_tecnico(db.session, inicio, fim)
+        atrasadas = sla_estourado(db.session)
+        db.session.commit()
+    except Exception as e:
+        print(f"Erro ao gerar relatório de status: {e}")
+        import traceback
+        traceback.print_exc()
+        db.session.rollback()
+        flash('Error al generar el informe de estados.', 'error')
+        return redirect(url_for('admin_ordens'))
+    
+    return render_template('admin/relatorio_status_ordens.html',
+                           inicio=inicio,
+                           fim=fim,
+                           por_status=por_status,
+                           por_tecnico=por_tecnico,
+                           atrasadas=atrasadas,
+                           status_ordem=STATUS_ORDEM,
+                           sla_horas=SLA_HORAS)
+
+def item_peca_do_form(i, nome, custo):
+    """Item do JSON `pecas` - com o peca_id quando a peça foi escolhida no autocomplete do catálogo"""
+    item = {'nome': nome, 'custo': custo}
+    peca_id = request.form.get(f'peca_id_{i}', '').strip()
+    if peca_id.isdigit():
+        item['peca_id'] = int(peca_id)
+    return item
 
 @app.route('/admin/ordens/add', methods=['GET', 'POST'])
 @login_required
@@ -3115,10 +4058,7 @@ def add_ordem_servico():
                 try:
                     custo_valor = float(custo_peca) if custo_peca else 0.00
                     total_pecas += custo_valor
-                    pecas.append({
-                        'nome': nome_peca,
-                        'custo': custo_valor
-                    })
+                    pecas.append(item_peca_do_form(i, nome_peca, custo_valor))
                 except:
                     pass
         
@@ -3238,7 +4178,13 @@ def add_ordem_servico():
                     data=datetime.now()
                 )
                 db.session.add(nova_ordem_db)
+                db.session.flush()
+                # Peças do catálogo: baixa no estoque na mesma transação da ordem
+                abaixo_minimo = registrar_pecas_ordem(db.session, nova_ordem_db.id, pecas)
                 db.session.commit()
+                invalidar_cache_rastreamento(nova_ordem_db.numero_ordem)
+                if abaixo_minimo:
+                    flash(f'Stock bajo: {", ".join(abaixo_minimo)}.', 'warning')
                 
                 # Atualizar cupom se usado
                 if cupom_usado and use_database():
@@ -3291,6 +4237,10 @@ def add_ordem_servico():
                 
                 flash('Ordem de serviço emitida com sucesso!', 'success')
                 return redirect(url_for('admin_ordens'))
+            except EstoqueInsuficiente as e:
+                db.session.rollback()
+                flash(str(e), 'error')
+                return redirect(url_for('add_ordem_servico'))
             except Exception as e:
                 print(f"Erro ao salvar ordem no banco: {e}")
                 import traceback
@@ -3378,6 +4328,7 @@ def add_ordem_servico():
                                 )
                                 db.session.add(nova_ordem_db)
                                 db.session.commit()
+                                invalidar_cache_rastreamento(nova_ordem_db.numero_ordem)
                                 
                                 # Atualizar cupom se usado
                                 if cupom_usado and use_database():
@@ -3561,7 +4512,8 @@ def add_ordem_servico():
         return render_template('admin/add_ordem.html',
                                clientes=clientes,
                                tipos_servico=tipos_servico,
-                               tecnicos=tecnicos)
+                               tecnicos=tecnicos,
+                               status_ordem=STATUS_ORDEM)
     else:
         init_tecnicos_file()
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
@@ -3574,7 +4526,8 @@ def add_ordem_servico():
         return render_template('admin/add_ordem.html',
                                clientes=clients_data.get('clients', []),
                                tipos_servico=tipos_servico,
-                               tecnicos=tecnicos_data.get('tecnicos', []))
+                               tecnicos=tecnicos_data.get('tecnicos', []),
+                               status_ordem=STATUS_ORDEM)
 
 @app.route('/admin/clientes/<int:cliente_id>/ordens/<int:ordem_id>')
 @login_required
@@ -3608,6 +4561,10 @@ def view_ordem_detalhes(cliente_id, ordem_id):
                 'prazo_estimado': ordem.prazo_estimado,
                 'cliente_nome': cliente.nome,
                 'cliente_id': cliente.id,
+                'historico': [
+                    {**evento, 'data': evento['data'].strftime('%Y-%m-%d %H:%M:%S') if evento['data'] else ''}
+                    for evento in historico_status(db.session, ordem.id)
+                ],
             }
             return jsonify(ordem_completa)
         except Exception as e:
@@ -3628,6 +4585,7 @@ def view_ordem_detalhes(cliente_id, ordem_id):
         ordem_completa = ordem.copy()
         ordem_completa['cliente_nome'] = cliente['nome']
         ordem_completa['cliente_id'] = cliente['id']
+        ordem_completa['historico'] = ordem.get('historico_status', [])
         
         return jsonify(ordem_completa)
 
@@ -3668,7 +4626,7 @@ def edit_ordem_servico(cliente_id, ordem_id):
                         try:
                             custo_valor = float(custo_peca) if custo_peca else 0.00
                             total_pecas += custo_valor
-                            pecas.append({'nome': nome_peca, 'custo': custo_valor})
+                            pecas.append(item_peca_do_form(i, nome_peca, custo_valor))
                         except:
                             pass
                 if not pecas:
@@ -3685,6 +4643,16 @@ def edit_ordem_servico(cliente_id, ordem_id):
                     custo_mao_obra_valor = 0.00
                     subtotal = total_pecas or float(ordem.subtotal or 0.00)
                 
+                # Peças mudaram: estoque ajustado na mesma transação (devolve as antigas, baixa as novas)
+                abaixo_minimo = []
+                if pecas != (ordem.pecas or []):
+                    try:
+                        abaixo_minimo = registrar_pecas_ordem(db.session, ordem.id, pecas)
+                    except EstoqueInsuficiente as e:
+                        db.session.rollback()
+                        flash(str(e), 'error')
+                        return redirect(url_for('edit_ordem_servico', cliente_id=cliente_id, ordem_id=ordem_id))
+                
                 ordem.servico = servico
                 ordem.tipo_aparelho = tipo_aparelho
                 ordem.marca = marca
@@ -3714,35 +4682,11 @@ def edit_ordem_servico(cliente_id, ordem_id):
                     ordem.tecnico_id = None
                 
                 db.session.commit()
+                notificar_status_ordem(ordem.numero_ordem)
+                if abaixo_minimo:
+                    flash(f'Stock bajo: {", ".join(abaixo_minimo)}.', 'warning')
                 
-                cliente_dict = {
-                    'id': cliente.id,
-                    'nome': cliente.nome,
-                    'email': cliente.email,
-                    'telefone': cliente.telefone,
-                    'cpf': cliente.cpf,
-                    'endereco': cliente.endereco
-                }
-                ordem_dict = {
-                    'id': ordem.id,
-                    'numero_ordem': ordem.numero_ordem,
-                    'servico': ordem.servico,
-                    'marca': ordem.marca,
-                    'modelo': ordem.modelo,
-                    'numero_serie': ordem.numero_serie,
-                    'defeitos_cliente': ordem.defeitos_cliente,
-                    'diagnostico_tecnico': ordem.diagnostico_tecnico,
-                    'pecas': ordem.pecas or [],
-                    'custo_pecas': float(ordem.custo_pecas) if ordem.custo_pecas else 0.00,
-                    'custo_mao_obra': float(ordem.custo_mao_obra) if ordem.custo_mao_obra else 0.00,
-                    'subtotal': float(ordem.subtotal) if ordem.subtotal else 0.00,
-                    'desconto_percentual': float(ordem.desconto_percentual) if ordem.desconto_percentual else 0.00,
-                    'valor_desconto': float(ordem.valor_desconto) if ordem.valor_desconto else 0.00,
-                    'total': float(ordem.total) if ordem.total else 0.00,
-                    'status': ordem.status,
-                    'prazo_estimado': ordem.prazo_estimado,
-                    'data': ordem.data.strftime('%Y-%m-%d %H:%M:%S') if ordem.data else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
+                cliente_dict, ordem_dict = dados_pdf_ordem(cliente, ordem)
                 pdf_result = gerar_pdf_ordem(cliente_dict, ordem_dict)
                 if isinstance(pdf_result, dict):
                     ordem.pdf_filename = pdf_result.get('pdf_filename', '')
@@ -3767,7 +4711,8 @@ def edit_ordem_servico(cliente_id, ordem_id):
                                    cliente=cliente,
                                    ordem=ordem,
                                    tipos_servico=tipos_servico,
-                                   tecnicos=tecnicos)
+                                   tecnicos=tecnicos,
+                                   status_ordem=STATUS_ORDEM)
         except Exception as e:
             print(f"Erro na edição de ordem (banco): {e}")
             import traceback
@@ -3810,10 +4755,7 @@ def edit_ordem_servico(cliente_id, ordem_id):
                     try:
                         custo_valor = float(custo_peca) if custo_peca else 0.00
                         total_pecas += custo_valor
-                        pecas.append({
-                            'nome': nome_peca,
-                            'custo': custo_valor
-                        })
+                        pecas.append(item_peca_do_form(i, nome_peca, custo_valor))
                     except:
                         pass
             
@@ -3845,8 +4787,15 @@ def edit_ordem_servico(cliente_id, ordem_id):
                 'prazo_estimado': prazo_estimado if prazo_estimado else ordem.get('prazo_estimado'),
                 'tecnico_id': int(tecnico_id) if tecnico_id and tecnico_id != '' else ordem.get('tecnico_id'),
                 'data': ordem.get('data', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
-                'pdf_filename': ordem.get('pdf_filename')
+                'data_atualizacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'pdf_filename': ordem.get('pdf_filename'),
+                'historico_status': ordem.get('historico_status', [])
             }
+            if status != ordem.get('status'):
+                ordem_atualizada['historico_status'].append({
+                    'status_anterior': ordem.get('status'), 'status_novo': status, 'origem': 'edicao',
+                    'usuario': session.get('admin_username'), 'data': ordem_atualizada['data_atualizacao'],
+                })
             
             for i, o in enumerate(cliente['ordens']):
                 if o.get('id') == ordem_id:
@@ -3880,6 +4829,7 @@ def edit_ordem_servico(cliente_id, ordem_id):
             
             with open(CLIENTS_FILE, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            notificar_status_ordem(ordem_atualizada.get('numero_ordem'))
             
             flash('Ordem de serviço atualizada com sucesso!', 'success')
             return redirect(url_for('admin_ordens'))
@@ -3896,7 +4846,8 @@ def edit_ordem_servico(cliente_id, ordem_id):
                                cliente=cliente,
                                ordem=ordem,
                                tipos_servico=tipos_servico,
-                               tecnicos=tecnicos_data.get('tecnicos', []))
+                               tecnicos=tecnicos_data.get('tecnicos', []),
+                               status_ordem=STATUS_ORDEM)
 
 @app.route('/admin/clientes/<int:cliente_id>/ordens/<int:ordem_id>/delete', methods=['POST'])
 @login_required
@@ -3927,10 +4878,14 @@ def delete_ordem_servico(cliente_id, ordem_id):
                 try:
                     pdf_doc = PDFDocument.query.get(ordem.pdf_id)
                     if pdf_doc:
+                        remover_blob(db.session, pdf_doc.storage_key)
                         db.session.delete(pdf_doc)
                 except Exception as e:
                     print(f"Erro ao deletar PDF: {e}")
             
+            # Peças do catálogo voltam para o estoque
+            devolver_pecas_ordem(db.session, ordem.id)
+            
             # Deletar ordem
             db.session.delete(ordem)
             db.session.commit()
@@ -4010,7 +4965,8 @@ def salvar_pdf_no_banco(pdf_data, nome, tipo_documento, referencia_id):
         try:
             pdf_doc = PDFDocument(
                 nome=nome,
-                dados=pdf_data,
+                storage_key=gravar_bytes(db.session, pdf_data),
+                sha256=hashlib.sha256(pdf_data).hexdigest(),
                 tamanho=len(pdf_data),
                 tipo_documento=tipo_documento,
                 referencia_id=referencia_id
@@ -4028,6 +4984,86 @@ def salvar_pdf_no_banco(pdf_data, nome, tipo_documento, referencia_id):
                 pass
     return None
 
+def dados_pdf_ordem(cliente, ordem):
+    """(cliente, ordem) do banco -> dicts que o gerar_pdf_ordem recebe"""
+    cliente_dict = {
+        'id': cliente.id,
+        'nome': cliente.nome,
+        'email': cliente.email,
+        'telefone': cliente.telefone,
+        'cpf': cliente.cpf,
+        'endereco': cliente.endereco
+    }
+    ordem_dict = {
+        'id': ordem.id,
+        'numero_ordem': ordem.numero_ordem,
+        'servico': ordem.servico,
+        'marca': ordem.marca,
+        'modelo': ordem.modelo,
+        'numero_serie': ordem.numero_serie,
+        'defeitos_cliente': ordem.defeitos_cliente,
+        'diagnostico_tecnico': ordem.diagnostico_tecnico,
+        'pecas': ordem.pecas or [],
+        'custo_pecas': float(ordem.custo_pecas) if ordem.custo_pecas else 0.00,
+        'custo_mao_obra': float(ordem.custo_mao_obra) if ordem.custo_mao_obra else 0.00,
+        'subtotal': float(ordem.subtotal) if ordem.subtotal else 0.00,
+        'desconto_percentual': float(ordem.desconto_percentual) if ordem.desconto_percentual else 0.00,
+        'valor_desconto': float(ordem.valor_desconto) if ordem.valor_desconto else 0.00,
+        'total': float(ordem.total) if ordem.total else 0.00,
+        'status': ordem.status,
+        'prazo_estimado': ordem.prazo_estimado,
+        'data': ordem.data.strftime('%Y-%m-%d %H:%M:%S') if ordem.data else datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    return cliente_dict, ordem_dict
+
+# PDFs regerados fora da requisição (mudança de status em lote, recálculo de orçamentos).
+# Uma thread só: o reportlab é CPU e não deve disputar o worker com as requisições.
+_fila_pdfs = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf')
+_pdfs_ordens_pendentes = set()
+_pdfs_ordens_lock = threading.Lock()
+LOTE_PDFS_ORDENS = 50
+
+def agendar_pdfs_ordens(ordem_ids):
+    """Coloca na fila a regeneração dos PDFs das ordens (ignora as que já estão na fila)"""
+    with _pdfs_ordens_lock:
+        novos = [ordem_id for ordem_id in dict.fromkeys(ordem_ids) if ordem_id not in _pdfs_ordens_pendentes]
+        _pdfs_ordens_pendentes.update(novos)
+    if novos:
+        _fila_pdfs.submit(_regenerar_pdfs_ordens, novos)
+    return len(novos)
+
+def _regenerar_pdfs_ordens(ordem_ids):
+    with app.app_context():
+        gerados = 0
+        try:
+            for inicio in range(0, len(ordem_ids), LOTE_PDFS_ORDENS):
+                lote = ordem_ids[inicio:inicio + LOTE_PDFS_ORDENS]
+                # Sai da fila antes de ler a ordem: uma mudança feita depois daqui agenda de novo
+                with _pdfs_ordens_lock:
+                    _pdfs_ordens_pendentes.difference_update(lote)
+                linhas = db.session.query(OrdemServico, Cliente) \
+                    .join(Cliente, Cliente.id == OrdemServico.cliente_id) \
+                    .filter(OrdemServico.id.in_(lote)).all()
+                db.session.commit()
+                for ordem, cliente in linhas:
+                    try:
+                        pdf_result = gerar_pdf_ordem(*dados_pdf_ordem(cliente, ordem))
+                        if isinstance(pdf_result, dict):
+                            ordem.pdf_filename = pdf_result.get('pdf_filename', '')
+                            ordem.pdf_id = pdf_result.get('pdf_id')
+                            db.session.commit()
+                            gerados += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Erro ao regenerar PDF da ordem {ordem.id}: {e}")
+            print(f"PDFs de ordens regenerados: {gerados}/{len(ordem_ids)}")
+        except Exception as e:
+            print(f"Erro na regeneração de PDFs das ordens: {e}")
+            with _pdfs_ordens_lock:
+                _pdfs_ordens_pendentes.difference_update(ordem_ids)
+        finally:
+            db.session.remove()
+
 def gerar_pdf_ordem(cliente, ordem):
     """Gera PDF da ordem de serviço e salva no banco de dados"""
     # Nome do arquivo PDF
@@ -4359,6 +5395,15 @@ def download_pdf(filename):
             ordem = OrdemServico.query.filter_by(pdf_filename=filename).first()
             if ordem and ordem.pdf_id:
                 pdf_doc = PDFDocument.query.get(ordem.pdf_id)
+                if pdf_doc and pdf_doc.storage_key:
+                    return resposta_blob(
+                        pdf_doc.storage_key,
+                        mimetype='application/pdf',
+                        headers={
+                            'Content-Disposition': f'attachment; filename={pdf_doc.nome}'
+                        },
+                        tamanho=pdf_doc.tamanho
+                    )
                 if pdf_doc and pdf_doc.dados:
                     return Response(
                         pdf_doc.dados,
@@ -4471,6 +5516,134 @@ def client_logout():
     flash('Logout realizado com sucesso!', 'success')
     return redirect(url_for('client_login'))
 
+# ==================== PORTAL DO CLIENTE ====================
+# Itens por página em cada seção do portal
+PORTAL_ITENS_POR_PAGINA = 10
+# Cache curto do portal por cliente; invalidado ao alterar ordens, comprovantes ou cupons do cliente.
+# É por worker - nos demais workers a entrada expira pelo TTL.
+_portal_cache = LRUCache(max_itens=2000, ttl=30)
+_portal_versoes = {}
+
+def invalidar_cache_portal(cliente_id):
+    """Descarta o portal em cache do cliente (as chaves antigas ficam inalcançáveis)"""
+    if cliente_id is not None:
+        _portal_versoes[int(cliente_id)] = _portal_versoes.get(int(cliente_id), 0) + 1
+
+@event.listens_for(SessionORM, 'after_flush')
+def _coletar_clientes_alterados(sessao, flush_context):
+    """Anota os clientes cujo portal mudou (ordens, comprovantes, cupons ou o próprio cadastro)"""
+    for obj in list(sessao.new) + list(sessao.dirty) + list(sessao.deleted):
+        if isinstance(obj, (OrdemServico, Comprovante, Cupom)):
+            cliente_id = obj.cliente_id
+        elif isinstance(obj, Cliente):
+            cliente_id = obj.id
+        else:
+            continue
+        if cliente_id is not None:
+            sessao.info.setdefault('portal_clientes_alterados', set()).add(cliente_id)
+
+@event.listens_for(SessionORM, 'after_commit')
+def _invalidar_portais_apos_commit(sessao):
+    for cliente_id in sessao.info.pop('portal_clientes_alterados', ()):
+        invalidar_cache_portal(cliente_id)
+
+@event.listens_for(SessionORM, 'after_soft_rollback')
+def _descartar_portais_apos_rollback(sessao, previous_transaction):
+    sessao.info.pop('portal_clientes_alterados', None)
+
+@event.listens_for(SessionORM, 'before_flush')
+def _registrar_mudancas_status(sessao, flush_context, instances):
+    """Grava em ordem_status_eventos as trocas de status feitas pelo ORM (edição da ordem)
+
+    O lote e os comprovantes mudam o status por SQL e gravam o evento no
+    mesmo comando (status_ordens.py); ordens novas não geram evento - o
+    início do primeiro intervalo é a própria data da ordem.
+    """
+    for obj in list(sessao.dirty):
+        if not isinstance(obj, OrdemServico):
+            continue
+        historico = sa_inspect(obj).attrs.status.history
+        if not historico.has_changes() or not historico.deleted or historico.deleted[0] == obj.status:
+            continue
+        sessao.add(OrdemStatusEvento(
+            ordem_id=obj.id,
+            status_anterior=historico.deleted[0],
+            status_novo=obj.status,
+            origem='edicao',
+            usuario=session.get('admin_username') if has_request_context() else None,
+        ))
+
+_SQL_PORTAL_CLIENTE = db.text("""
+    SELECT
+        (SELECT row_to_json(c) FROM (
+            SELECT id, nome, email, telefone, cpf, endereco,
+                   to_char(data_cadastro, 'DD/MM/YYYY') AS data_cadastro
+            FROM clientes WHERE id = :cliente_id
+        ) c) AS cliente,
+        (SELECT COUNT(*) FROM ordens_servico WHERE cliente_id = :cliente_id) AS total_ordens,
+        (SELECT COALESCE(json_agg(o), '[]'::json) FROM (
+            SELECT id, numero_ordem, servico, tipo_aparelho, marca, modelo, numero_serie,
+                   defeitos_cliente, diagnostico_tecnico, status, pecas,
+                   custo_pecas, custo_mao_obra, desconto_percentual, valor_desconto, total,
+                   to_char(data, 'DD/MM/YYYY HH24:MI') AS data, pdf_filename
+            FROM ordens_servico WHERE cliente_id = :cliente_id
+            ORDER BY ordens_servico.data DESC, id DESC
+            LIMIT :limite OFFSET :offset_ordens
+        ) o) AS ordens,
+        (SELECT COUNT(*) FROM comprovantes WHERE cliente_id = :cliente_id) AS total_comprovantes,
+        (SELECT COALESCE(json_agg(cp), '[]'::json) FROM (
+            SELECT id, numero_ordem, valor_total, valor_pago, forma_pagamento, parcelas,
+                   to_char(data, 'DD/MM/YYYY HH24:MI') AS data, pdf_filename
+            FROM comprovantes WHERE cliente_id = :cliente_id
+            ORDER BY comprovantes.data DESC, id DESC
+            LIMIT :limite OFFSET :offset_comprovantes
+        ) cp) AS comprovantes,
+        (SELECT COUNT(*) FROM cupons WHERE cliente_id = :cliente_id) AS total_cupons,
+        (SELECT COALESCE(json_agg(cu), '[]'::json) FROM (
+            SELECT id, desconto_percentual, usado, ordem_id,
+                   to_char(data_emissao, 'DD/MM/YYYY') AS data_emissao,
+                   to_char(data_uso, 'DD/MM/YYYY') AS data_uso
+            FROM cupons WHERE cliente_id = :cliente_id
+            ORDER BY cupons.data_emissao DESC, id DESC
+            LIMIT :limite OFFSET :offset_cupons
+        ) cu) AS cupons
+""")
+
+def carregar_portal_cliente(cliente_id, paginas):
+    """Carrega cliente, ordens, comprovantes e cupons (paginados) em uma única ida ao banco"""
+    chave = (int(cliente_id), _portal_versoes.get(int(cliente_id), 0), paginas['ordens'], paginas['comprovantes'], paginas['cupons'])
+    portal = _portal_cache.get(chave)
+    if portal is not None:
+        return portal
+    
+    linha = db.session.execute(_SQL_PORTAL_CLIENTE, {
+        'cliente_id': int(cliente_id),
+        'limite': PORTAL_ITENS_POR_PAGINA,
+        'offset_ordens': (paginas['ordens'] - 1) * PORTAL_ITENS_POR_PAGINA,
+        'offset_comprovantes': (paginas['comprovantes'] - 1) * PORTAL_ITENS_POR_PAGINA,
+        'offset_cupons': (paginas['cupons'] - 1) * PORTAL_ITENS_POR_PAGINA
+    }).mappings().first()
+    if not linha or not linha['cliente']:
+        return None
+    
+    portal = {
+        'cliente': linha['cliente'],
+        'ordens': linha['ordens'],
+        'comprovantes': linha['comprovantes'],
+        'cupons': linha['cupons'],
+        'totais': {
+            'ordens': linha['total_ordens'],
+            'comprovantes': linha['total_comprovantes'],
+            'cupons': linha['total_cupons']
+        }
+    }
+    _portal_cache.set(chave, portal)
+    return portal
+
+def _paginar_lista(itens, pagina):
+    inicio = (pagina - 1) * PORTAL_ITENS_POR_PAGINA
+    return itens[inicio:inicio + PORTAL_ITENS_POR_PAGINA]
+
 @app.route('/cliente')
 @client_login_required
 def client_dashboard():
@@ -4480,85 +5653,36 @@ def client_dashboard():
         flash('Sessão expirada. Faça login novamente.', 'error')
         return redirect(url_for('client_login'))
     
+    paginas = {}
+    for secao in ('ordens', 'comprovantes', 'cupons'):
+        paginas[secao] = max(request.args.get(f'pagina_{secao}', 1, type=int) or 1, 1)
+    
     if use_database():
         try:
-            cliente = Cliente.query.get(cliente_id)
+            portal = carregar_portal_cliente(cliente_id, paginas)
             
-            if not cliente:
+            if not portal:
                 flash('Cliente não encontrado!', 'error')
                 return redirect(url_for('client_logout'))
             
-            # Buscar ordens de serviço do cliente
-            ordens_db = OrdemServico.query.filter_by(cliente_id=cliente_id).order_by(OrdemServico.data.desc()).all()
-            ordens = []
-            for ordem in ordens_db:
-                ordens.append({
-                    'id': ordem.id,
-                    'numero_ordem': ordem.numero_ordem,
-                    'servico': ordem.servico.nome if ordem.servico else 'Serviço',
-                    'tipo_aparelho': ordem.tipo_aparelho,
-                    'marca': ordem.marca,
-                    'modelo': ordem.modelo,
-                    'numero_serie': ordem.numero_serie,
-                    'defeitos_cliente': ordem.defeitos_cliente,
-                    'diagnostico_tecnico': ordem.diagnostico_tecnico,
-                    'status': ordem.status,
-                    'custo_pecas': float(ordem.custo_pecas) if ordem.custo_pecas else 0,
-                    'custo_mao_obra': float(ordem.custo_mao_obra) if ordem.custo_mao_obra else 0,
-                    'total': float(ordem.valor_total) if ordem.valor_total else 0,
-                    'data': ordem.data.strftime('%d/%m/%Y %H:%M') if ordem.data else '',
-                    'pdf_filename': ordem.pdf_filename
-                })
-            
-            # Buscar comprovantes do cliente
-            comprovantes_db = Comprovante.query.filter_by(cliente_id=cliente_id).order_by(Comprovante.data.desc()).all()
-            comprovantes = []
-            for comp in comprovantes_db:
-                comprovantes.append({
-                    'id': comp.id,
-                    'numero_ordem': comp.numero_ordem,
-                    'valor_total': float(comp.valor_total),
-                    'valor_pago': float(comp.valor_pago),
-                    'forma_pagamento': comp.forma_pagamento,
-                    'parcelas': comp.parcelas,
-                    'data': comp.data.strftime('%d/%m/%Y %H:%M') if comp.data else '',
-                    'pdf_filename': comp.pdf_filename
-                })
-            
-            # Buscar cupons de desconto do cliente
-            cupons_db = Cupom.query.filter_by(cliente_id=cliente_id).order_by(Cupom.data_emissao.desc()).all()
-            cupons = []
-            for cupom in cupons_db:
-                cupons.append({
-                    'id': cupom.id,
-                    'desconto_percentual': float(cupom.desconto_percentual),
-                    'usado': cupom.usado,
-                    'ordem_id': cupom.ordem_id,
-                    'data_emissao': cupom.data_emissao.strftime('%d/%m/%Y') if cupom.data_emissao else '',
-                    'data_uso': cupom.data_uso.strftime('%d/%m/%Y') if cupom.data_uso else None
-                })
-            
-            # Preparar dados do cliente para o template
-            cliente_dict = {
-                'id': cliente.id,
-                'nome': cliente.nome,
-                'email': cliente.email,
-                'telefone': cliente.telefone,
-                'cpf': cliente.cpf,
-                'endereco': cliente.endereco,
-                'data_cadastro': cliente.data_cadastro.strftime('%d/%m/%Y') if cliente.data_cadastro else ''
-            }
-            
             return render_template('client/dashboard.html', 
-                                 cliente=cliente_dict, 
-                                 ordens=ordens, 
+                                 cliente=portal['cliente'], 
+                                 ordens=portal['ordens'], 
                                  pedidos=[],
-                                 comprovantes=comprovantes, 
-                                 cupons=cupons)
+                                 comprovantes=portal['comprovantes'], 
+                                 cupons=portal['cupons'],
+                                 totais=portal['totais'],
+                                 paginas=paginas,
+                                 por_pagina=PORTAL_ITENS_POR_PAGINA,
+                                 status_ordem=STATUS_ORDEM)
         except Exception as e:
             print(f"Erro ao carregar dashboard do cliente: {e}")
             import traceback
             traceback.print_exc()
+            try:
+                db.session.rollback()
+            except:
+                pass
             flash('Erro ao carregar seus dados. Tente novamente.', 'error')
             return redirect(url_for('client_login'))
     else:
@@ -4596,10 +5720,14 @@ def client_dashboard():
             
             return render_template('client/dashboard.html', 
                                  cliente=cliente, 
-                                 ordens=ordens_ordenadas, 
+                                 ordens=_paginar_lista(ordens_ordenadas, paginas['ordens']), 
                                  pedidos=[],
-                                 comprovantes=comprovantes, 
-                                 cupons=cupons)
+                                 comprovantes=_paginar_lista(comprovantes, paginas['comprovantes']), 
+                                 cupons=_paginar_lista(cupons, paginas['cupons']),
+                                 totais={'ordens': len(ordens_ordenadas), 'comprovantes': len(comprovantes), 'cupons': len(cupons)},
+                                 paginas=paginas,
+                                 por_pagina=PORTAL_ITENS_POR_PAGINA,
+                                 status_ordem=STATUS_ORDEM)
         except Exception as e:
             print(f"Erro ao carregar dashboard: {e}")
             flash('Erro ao carregar seus dados.', 'error')
@@ -4641,6 +5769,15 @@ def client_download_pdf(filename):
             ordem = OrdemServico.query.filter_by(pdf_filename=filename, cliente_id=cliente_id).first()
             if ordem and ordem.pdf_id:
                 pdf_doc = PDFDocument.query.get(ordem.pdf_id)
+                if pdf_doc and pdf_doc.storage_key:
+                    return resposta_blob(
+                        pdf_doc.storage_key,
+                        mimetype='application/pdf',
+                        headers={
+                            'Content-Disposition': f'attachment; filename={pdf_doc.nome}'
+                        },
+                        tamanho=pdf_doc.tamanho
+                    )
                 if pdf_doc and pdf_doc.dados:
                     return Response(
                         pdf_doc.dados,
@@ -4680,6 +5817,15 @@ def client_download_comprovante_pdf(filename):
             comprovante = Comprovante.query.filter_by(pdf_filename=filename, cliente_id=cliente_id).first()
             if comprovante and comprovante.pdf_id:
                 pdf_doc = PDFDocument.query.get(comprovante.pdf_id)
+                if pdf_doc and pdf_doc.storage_key:
+                    return resposta_blob(
+                        pdf_doc.storage_key,
+                        mimetype='application/pdf',
+                        headers={
+                            'Content-Disposition': f'attachment; filename={pdf_doc.nome}'
+                        },
+                        tamanho=pdf_doc.tamanho
+                    )
                 if pdf_doc and pdf_doc.dados:
                     return Response(
                         pdf_doc.dados,
@@ -4835,8 +5981,16 @@ def emitir_comprovante():
                     novo_comprovante.pdf_filename = pdf_result
                 
                 db.session.add(novo_comprovante)
+                db.session.flush()
+                # Comprovante emitido = ordem paga (se ainda não foi encerrada), com o evento no histórico
+                ordem_paga = marcar_paga(db.session, ordem_id, usuario=session.get('admin_username'))
                 db.session.commit()
                 
+                if ordem_paga:
+                    notificar_status_ordem(ordem_paga['numero_ordem'])
+                    if ordem_paga['tem_pdf']:
+                        agendar_pdfs_ordens([ordem_paga['id']])
+                
                 # Atualizar ID do comprovante temporário para caso precise regerar PDF
                 novo_comprovante_temp['id'] = novo_comprovante.id
                 
@@ -4898,6 +6052,21 @@ def emitir_comprovante():
             with open(COMPROVANTES_FILE, 'w', encoding='utf-8') as f:
                 json.dump(comprovantes_data, f, ensure_ascii=False, indent=2)
             
+            if ordem.get('status', 'pendente') not in STATUS_FINAIS:
+                ordem.setdefault('historico_status', []).append({
+                    'status_anterior': ordem.get('status', 'pendente'), 'status_novo': 'pago', 'origem': 'comprovante',
+                    'usuario': session.get('admin_username'), 'data': novo_comprovante['data'],
+                })
+                ordem['status'] = 'pago'
+                ordem['data_atualizacao'] = novo_comprovante['data']
+                if ordem.get('pdf_filename'):
+                    pdf_ordem = gerar_pdf_ordem(cliente, ordem)
+                    if isinstance(pdf_ordem, dict):
+                        ordem['pdf_filename'] = pdf_ordem.get('pdf_filename', '')
+                with open(CLIENTS_FILE, 'w', encoding='utf-8') as f:
+                    json.dump(clients_data, f, ensure_ascii=False, indent=2)
+                notificar_status_ordem(ordem.get('numero_ordem'))
+            
             flash('Comprovante emitido com sucesso!', 'success')
             return redirect(url_for('admin_comprovantes'))
     
@@ -5266,6 +6435,7 @@ def delete_comprovante(comprovante_id):
                 try:
                     pdf_doc = PDFDocument.query.get(comprovante.pdf_id)
                     if pdf_doc:
+                        remover_blob(db.session, pdf_doc.storage_key)
                         db.session.delete(pdf_doc)
                 except Exception as e:
                     print(f"Erro ao deletar PDF: {e}")
@@ -5311,6 +6481,15 @@ def download_comprovante_pdf(filename):
             comprovante = Comprovante.query.filter_by(pdf_filename=filename).first()
             if comprovante and comprovante.pdf_id:
                 pdf_doc = PDFDocument.query.get(comprovante.pdf_id)
+                if pdf_doc and pdf_doc.storage_key:
+                    return resposta_blob(
+                        pdf_doc.storage_key,
+                        mimetype='application/pdf',
+                        headers={
+                            'Content-Disposition': f'attachment; filename={pdf_doc.nome}'
+                        },
+                        tamanho=pdf_doc.tamanho
+                    )
                 if pdf_doc and pdf_doc.dados:
                     return Response(
                         pdf_doc.dados,
@@ -5728,6 +6907,64 @@ def admin_tecnicos():
     
     return render_template('admin/tecnicos.html', tecnicos=tecnicos)
 
+# Painel dos técnicos: resultado por quantidade de semanas, recalculado no máximo a cada minuto
+_painel_tecnicos_cache = LRUCache(max_itens=16, ttl=60)
+
+def _garantir_indices_painel_tecnicos_internal():
+    """Função interna - só deve ser chamada após db.init_app()"""
+    global _painel_indices_exist
+    
+    if _painel_indices_exist:
+        return True
+    
+    try:
+        with db.engine.begin() as conn:
+            # Abertas por técnico e concluídas no período
+            conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_ordens_servico_tecnico_status ON ordens_servico (tecnico_id, status)"))
+            conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_ordens_servico_data_atualizacao ON ordens_servico (data_atualizacao)"))
+        _painel_indices_exist = True
+        return True
+    except Exception as e:
+        print(f"Erro ao garantir índices do painel dos técnicos: {e}")
+        return False
+
+def garantir_indices_painel_tecnicos():
+    """Garante os índices de ordens_servico usados pelo painel dos técnicos"""
+    if not use_database():
+        return False
+    return _garantir_indices_painel_tecnicos_internal()
+
+@app.route('/admin/tecnicos/painel')
+@login_required
+def admin_painel_tecnicos():
+    """Carga e produção por técnico - consultas agrupadas no banco, com cache curto"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    semanas = request.args.get('semanas', SEMANAS_PAINEL_TECNICOS, type=int)
+    semanas = max(1, min(semanas, MAX_SEMANAS_PAINEL_TECNICOS))
+    painel = _painel_tecnicos_cache.get(semanas)
+    if painel is None:
+        try:
+            garantir_coluna_data_atualizacao_ordem()
+            garantir_indices_painel_tecnicos()
+            painel = painel_tecnicos(db.session, semanas)
+            db.session.commit()
+        except Exception as e:
+            print(f"Erro ao calcular painel dos técnicos: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            flash('Error al calcular el panel de técnicos.', 'error')
+            return redirect(url_for('admin_tecnicos'))
+        _painel_tecnicos_cache.set(semanas, painel)
+    
+    return render_template('admin/painel_tecnicos.html',
+                           painel=painel,
+                           semanas=semanas,
+                           ttl_cache=_painel_tecnicos_cache.ttl)
+
 @app.route('/admin/tecnicos/add', methods=['GET', 'POST'])
 @login_required
 def add_tecnico():
@@ -6793,33 +8030,17 @@ def upload_imagem_reparo():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    # Verificar tamanho do arquivo
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    file_data = file.read()
-    imagem_tipo = file.mimetype
-    
     if use_database():
         try:
-            imagem = Imagem(
-                nome=secure_filename(file.filename),
-                dados=file_data,
-                tipo_mime=imagem_tipo,
-                tamanho=file_size,
-                referencia=f'reparo_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            )
-            db.session.add(imagem)
-            db.session.commit()
+            imagem = salvar_upload_imagem(file, 'reparo')
             
             return jsonify({
                 'success': True, 
                 'path': f'/admin/reparos/imagem/{imagem.id}',
                 'image_id': imagem.id
             })
+        except UploadInvalido as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro ao salvar imagem de reparo no banco: {e}")
             import traceback
@@ -6835,6 +8056,13 @@ def servir_imagem_reparo(image_id):
     if use_database():
         try:
             imagem = Imagem.query.get(image_id)
+            if imagem and imagem.storage_key:
+                return resposta_blob(
+                    imagem.storage_key,
+                    mimetype=imagem.tipo_mime,
+                    headers={'Content-Disposition': f'inline; filename={imagem.nome}'},
+                    tamanho=imagem.tamanho
+                )
             if imagem and imagem.dados:
                 return Response(
                     imagem.dados,
@@ -6904,8 +8132,7 @@ def add_video():
         
         try:
             # Verificar se consegue extrair o ID do vídeo
-            temp_video = Video(embed_code=embed_code)
-            video_id = temp_video.get_video_id()
+            video_id = extrair_video_id(embed_code)
             if not video_id:
                 flash('Código embed inválido. Por favor, verifique o código e tente novamente.', 'error')
                 return redirect(url_for('add_video'))
@@ -6924,7 +8151,8 @@ def add_video():
                 titulo=titulo,
                 embed_code=embed_code,
                 ordem=ordem,
-                ativo=ativo
+                ativo=ativo,
+                **metadados_video(video_id)
             )
             
             db.session.add(novo_video)
@@ -6978,13 +8206,12 @@ def edit_video(video_id):
                 return redirect(url_for('edit_video', video_id=video_id))
             
             # Verificar se consegue extrair o ID do vídeo
-            temp_video = Video(embed_code=embed_code)
-            video_id_check = temp_video.get_video_id()
-            if not video_id_check:
+            if not extrair_video_id(embed_code):
                 flash('Código embed inválido. Por favor, verifique o código e tente novamente.', 'error')
                 return redirect(url_for('edit_video', video_id=video_id))
             
             video.embed_code = embed_code
+            video.atualizar_metadados()
             
             if ordem and ordem.isdigit():
                 video.ordem = int(ordem)
@@ -7058,7 +8285,17 @@ def admin_manuais():
                 query = query.filter(Manual.titulo.ilike(f'%{busca}%'))
             
             manuais = query.order_by(Manual.data_criacao.desc()).all()
-            return render_template('admin/manuais.html', manuais=manuais, busca=busca)
+            
+            # Páginas dos manuais cujo texto contém o termo
+            paginas_encontradas, total_paginas_encontradas = [], 0
+            if busca:
+                garantir_indices_busca()
+                paginas_encontradas, total_paginas_encontradas = buscar_paginas_manuais(db.session, busca)
+                for resultado in paginas_encontradas:
+                    resultado['trecho'] = _trecho_html(resultado['trecho'])
+            return render_template('admin/manuais.html', manuais=manuais, busca=busca,
+                                   paginas_encontradas=paginas_encontradas,
+                                   total_paginas_encontradas=total_paginas_encontradas)
         except Exception as e:
             # Silenciar erros de conexão - não crítico
             error_str = str(e).lower()
@@ -7074,6 +8311,43 @@ def admin_manuais():
     else:
         return render_template('admin/manuais.html', manuais=[], busca=busca)
 
+def _trecho_html(trecho):
+    """Escapa o texto do PDF e troca os marcadores do ts_headline por <mark>"""
+    return Markup(str(escape(trecho or '')).replace(MARCA_INICIO, '<mark>').replace(MARCA_FIM, '</mark>'))
+
+@app.route('/admin/manuais/busca-texto')
+@login_required
+def buscar_texto_manuais():
+    """Busca no texto das páginas dos manuais - JSON com manual, página e link para o visualizador"""
+    termo = request.args.get('q', '').strip()[:200]
+    pagina = max(request.args.get('pagina', 1, type=int) or 1, 1)
+    if not termo:
+        return jsonify({'resultados': [], 'total': 0})
+    if not use_database():
+        return jsonify({'error': 'Base de datos no configurada'}), 503
+    
+    try:
+        garantir_indices_busca()
+        resultados, total = buscar_paginas_manuais(db.session, termo, pagina, POR_PAGINA_BUSCA)
+        return jsonify({
+            'total': total,
+            'pagina': pagina,
+            'resultados': [{
+                'manual_id': r['manual_id'],
+                'titulo': r['titulo'],
+                'pagina': r['pagina'],
+                'trecho': str(_trecho_html(r['trecho'])),
+                'url': url_for('servir_manual', manual_id=r['manual_id'], _anchor=f"page={r['pagina']}")
+            } for r in resultados]
+        })
+    except Exception as e:
+        print(f"Erro na busca de texto dos manuais: {e}")
+        try:
+            db.session.rollback()
+        except:
+            pass
+        return jsonify({'error': 'Error al buscar en los manuales'}), 500
+
 @app.route('/admin/manuais/add', methods=['GET', 'POST'])
 @login_required
 def add_manual():
@@ -7104,31 +8378,32 @@ def add_manual():
                 flash('Tipo de arquivo não permitido. Use apenas arquivos PDF.', 'error')
                 return redirect(url_for('add_manual'))
             
-            # Verificar tamanho
-            pdf_file.seek(0, os.SEEK_END)
-            pdf_size = pdf_file.tell()
-            pdf_file.seek(0)
-            
-            if pdf_size > MAX_PDF_SIZE:
-                flash(f'Arquivo muito grande. Tamanho máximo: {MAX_PDF_SIZE // (1024*1024)}MB', 'error')
-                return redirect(url_for('add_manual'))
-            
-            # Ler arquivo em chunks para evitar problemas de memória
-            pdf_data = pdf_file.read()
+            # Copiar o PDF em blocos para o armazenamento de blobs (tipo e tamanho validados no caminho)
+            # O arquivo nunca é lido inteiro para a memória do worker
+            info = stream_upload(pdf_file, novo_writer(db.session), MAX_PDF_SIZE, TIPOS_PDF)
             
             # Criar manual e salvar diretamente (sem múltiplas tentativas que causam timeout)
             novo_manual = Manual(
                 titulo=titulo,
-                pdf_data=pdf_data,
+                storage_key=info['storage_key'],
+                sha256=info['sha256'],
                 pdf_filename=secure_filename(pdf_file.filename),
-                pdf_size=pdf_size
+                pdf_size=info['tamanho'],
+                texto_status='pendente'
             )
             
             db.session.add(novo_manual)
             db.session.commit()
             
+            # Texto das páginas extraído em background (busca por código de erro)
+            agendar_extracao_manual(app, db, novo_manual.id)
+            
             flash('Manual cadastrado com sucesso!', 'success')
             return redirect(url_for('admin_manuais'))
+        except UploadInvalido as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            return redirect(url_for('add_manual'))
         except Exception as e:
             print(f"Erro ao cadastrar manual: {e}")
             db.session.rollback()
@@ -7171,20 +8446,25 @@ def edit_manual(manual_id):
                     flash('Tipo de arquivo não permitido. Use apenas arquivos PDF.', 'error')
                     return redirect(url_for('edit_manual', manual_id=manual_id))
                 
-                pdf_file.seek(0, os.SEEK_END)
-                pdf_size = pdf_file.tell()
-                pdf_file.seek(0)
-                
-                if pdf_size > MAX_PDF_SIZE:
-                    flash(f'Arquivo muito grande. Tamanho máximo: {MAX_PDF_SIZE // (1024*1024)}MB', 'error')
+                try:
+                    info = stream_upload(pdf_file, novo_writer(db.session), MAX_PDF_SIZE, TIPOS_PDF)
+                except UploadInvalido as e:
+                    db.session.rollback()
+                    flash(str(e), 'error')
                     return redirect(url_for('edit_manual', manual_id=manual_id))
                 
-                pdf_data = pdf_file.read()
-                manual.pdf_data = pdf_data
+                # Remover o blob anterior na mesma transação
+                remover_blob(db.session, manual.storage_key)
+                manual.storage_key = info['storage_key']
+                manual.sha256 = info['sha256']
+                manual.pdf_data = None
                 manual.pdf_filename = secure_filename(pdf_file.filename)
-                manual.pdf_size = pdf_size
+                manual.pdf_size = info['tamanho']
                 manual.data_atualizacao = datetime.now()
+                manual.texto_status = 'pendente'
+                manual.texto_paginas = None
                 db.session.commit()
+                agendar_extracao_manual(app, db, manual.id)
                 flash('Manual atualizado com sucesso!', 'success')
                 return redirect(url_for('admin_manuais'))
             else:
@@ -7214,6 +8494,7 @@ def delete_manual(manual_id):
             flash('Manual não encontrado!', 'error')
             return redirect(url_for('admin_manuais'))
         
+        remover_blob(db.session, manual.storage_key)
         db.session.delete(manual)
         db.session.commit()
         
@@ -7235,6 +8516,16 @@ def servir_manual(manual_id):
     
     try:
         manual = Manual.query.get(manual_id)
+        if manual and manual.storage_key:
+            return resposta_blob(
+                manual.storage_key,
+                mimetype='application/pdf',
+                headers={
+                    'Content-Disposition': f'inline; filename={manual.pdf_filename or "manual.pdf"}',
+                    'Cache-Control': 'public, max-age=31536000'
+                },
+                tamanho=manual.pdf_size
+            )
         if manual and manual.pdf_data:
             return Response(
                 manual.pdf_data,
@@ -7262,6 +8553,16 @@ def download_manual(manual_id):
     
     try:
         manual = Manual.query.get(manual_id)
+        if manual and manual.storage_key:
+            return resposta_blob(
+                manual.storage_key,
+                mimetype='application/pdf',
+                headers={
+                    'Content-Disposition': f'attachment; filename={manual.pdf_filename or "manual.pdf"}',
+                    'Cache-Control': 'public, max-age=31536000'
+                },
+                tamanho=manual.pdf_size
+            )
         if manual and manual.pdf_data:
             return Response(
                 manual.pdf_data,
@@ -7279,7 +8580,36 @@ def download_manual(manual_id):
         flash('Erro ao baixar manual.', 'error')
         return redirect(url_for('admin_manuais'))
 
+# ==================== ARMAZENAMENTO DE BLOBS ====================
+@app.route('/admin/armazenamento/status')
+@login_required
+def status_armazenamento():
+    """Quantidade de blobs por backend e andamento da migração em background"""
+    from migrar_blobs import contar_por_backend, estado_migracao
+    if not use_database():
+        return jsonify({'success': False, 'error': 'Banco de dados não configurado'}), 500
+    try:
+        return jsonify({'success': True, 'blobs': contar_por_backend(db), 'migracao': estado_migracao()})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/admin/armazenamento/migrar', methods=['POST'])
+@login_required
+def migrar_armazenamento():
+    """Inicia a migração dos blobs para o backend configurado (ou o informado em 'backend')"""
+    from migrar_blobs import iniciar_migracao_em_background
+    if not use_database():
+        return jsonify({'success': False, 'error': 'Banco de dados não configurado'}), 500
+    destino = request.form.get('backend') or None
+    if destino not in (None, 'postgres', 'local', 's3'):
+        return jsonify({'success': False, 'error': 'Backend inválido'}), 400
+    if not iniciar_migracao_em_background(app, db, destino):
+        return jsonify({'success': False, 'error': 'Migração já está em andamento'}), 409
+    return jsonify({'success': True})
+
 @app.route('/videos')
+@pagina_publica_cacheada
 def todos_videos():
     """Página que exibe todos os vídeos"""
     # Carregar footer do banco de dados
@@ -7315,7 +8645,7 @@ def todos_videos():
     if use_database():
         try:
             garantir_colunas_video()
-            videos_db = Video.query.filter_by(ativo=True).order_by(Video.ordem, Video.data_criacao.desc()).all()
+            videos_db = Video.query.filter(Video.ativo == True, Video.video_id.isnot(None)).order_by(Video.ordem, Video.data_criacao.desc()).all()
         except Exception as e:
             error_str = str(e).lower()
             if 'connection' not in error_str and 'refused' not in error_str:
@@ -7326,10 +8656,10 @@ def todos_videos():
             videos.append({
                 'id': v.id,
                 'titulo': v.titulo,
-                'embed_url': v.get_embed_url(),
-                'thumbnail_url': v.get_thumbnail_url(),
-                'embed_html': v.get_embed_html(),
-                'video_id': v.get_video_id(),
+                'embed_url': v.embed_url,
+                'thumbnail_url': v.thumbnail_url,
+                'embed_html': v.embed_html,
+                'video_id': v.video_id,
                 'ordem': v.ordem
             })
     else:
@@ -7764,6 +9094,39 @@ def init_agendamentos_file():
 
 init_agendamentos_file()
 
+# Serializa a conferência de vaga + gravação do agendamentos.json: o threading.Lock entre as
+# threads do worker e o flock num arquivo ao lado entre os workers do gunicorn
+_lock_agendamentos_json = threading.Lock()
+ARQUIVO_LOCK_AGENDAMENTOS = AGENDAMENTOS_FILE + '.lock'
+
+@contextmanager
+def trava_agendamentos_json():
+    """Lock exclusivo do agendamentos.json (threads e processos) para ler, conferir e gravar"""
+    with _lock_agendamentos_json:
+        if fcntl is None:
+            yield
+            return
+        with open(ARQUIVO_LOCK_AGENDAMENTOS, 'a') as arquivo_lock:
+            fcntl.flock(arquivo_lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(arquivo_lock, fcntl.LOCK_UN)
+
+def gravar_agendamentos_json(agendamentos_data):
+    """Grava o agendamentos.json de uma vez (temporário + os.replace) - quem lê sem o lock nunca pega o arquivo pela metade"""
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(AGENDAMENTOS_FILE) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(agendamentos_data, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, AGENDAMENTOS_FILE)
+    except Exception:
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+        raise
+
 def enviar_notificacao_whatsapp(mensagem):
     """Envia notificação via WhatsApp"""
     try:
@@ -7888,15 +9251,22 @@ def agendamento():
             flash('Por favor, preencha todos os campos obrigatórios!', 'error')
             return redirect(url_for('agendamento'))
         
+        try:
+            data_agendamento_obj = datetime.strptime(data_agendamento, '%Y-%m-%d').date()
+        except ValueError:
+            flash('Fecha inválida.', 'error')
+            return redirect(url_for('agendamento'))
+        
+        config_agenda = carregar_config_agenda()
+        duracao_minutos = config_agenda.duracao(tipo_servico)
+        
         # Salvar agendamento
         if use_database():
             try:
-                # Converter data_agendamento para formato date
-                from datetime import datetime as dt
-                try:
-                    data_agendamento_obj = dt.strptime(data_agendamento, '%Y-%m-%d').date()
-                except:
-                    data_agendamento_obj = dt.now().date()
+                garantir_agenda()
+                # Ocupa a vaga e grava o agendamento na mesma transação (sem reserva dupla)
+                tecnico_id = reservar_horario(db.session, config_agenda, data_agendamento_obj,
+                                              hora_agendamento, duracao_minutos)
                 
                 novo_agendamento = Agendamento(
                     nome=nome,
@@ -7904,6 +9274,9 @@ def agendamento():
                     email=email if email else None,
                     data_agendamento=data_agendamento_obj,
                     hora_agendamento=hora_agendamento,
+                    hora=datetime.strptime(hora_agendamento, '%H:%M').time(),
+                    duracao_minutos=duracao_minutos,
+                    tecnico_id=tecnico_id,
                     tipo_servico=tipo_servico,
                     observacoes=observacoes if observacoes else None,
                     status='pendente',
@@ -7914,6 +9287,10 @@ def agendamento():
                 
                 # Para mensagem de notificação
                 data_criacao_str = novo_agendamento.data_criacao.strftime('%Y-%m-%d %H:%M:%S')
+            except HorarioIndisponivel as e:
+                db.session.rollback()
+                flash(str(e), 'error')
+                return redirect(url_for('agendamento'))
             except Exception as e:
                 print(f"Erro ao salvar agendamento no banco: {e}")
                 import traceback
@@ -7922,30 +9299,39 @@ def agendamento():
                 flash('Erro ao salvar agendamento. Tente novamente.', 'error')
                 return redirect(url_for('agendamento'))
         else:
-            # Fallback para JSON
-            init_agendamentos_file()
-            with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
-                agendamentos_data = json.load(f)
-            
-            novo_agendamento = {
-                'id': len(agendamentos_data.get('agendamentos', [])) + 1,
-                'nome': nome,
-                'telefone': telefone,
-                'email': email,
-                'data_agendamento': data_agendamento,
-                'hora_agendamento': hora_agendamento,
-                'tipo_servico': tipo_servico,
-                'observacoes': observacoes,
-                'status': 'pendente',
-                'data_criacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            if 'agendamentos' not in agendamentos_data:
-                agendamentos_data['agendamentos'] = []
-            agendamentos_data['agendamentos'].append(novo_agendamento)
-            
-            with open(AGENDAMENTOS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(agendamentos_data, f, ensure_ascii=False, indent=2)
+            # Fallback para JSON (conferência e gravação sob o mesmo lock)
+            with trava_agendamentos_json():
+                init_agendamentos_file()
+                with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+                    agendamentos_data = json.load(f)
+                
+                try:
+                    tecnico_id = reservar_horario_json(config_agenda, agendamentos_data.get('agendamentos', []),
+                                                       _tecnicos_ativos_json(), data_agendamento_obj,
+                                                       hora_agendamento, duracao_minutos)
+                except HorarioIndisponivel as e:
+                    flash(str(e), 'error')
+                    return redirect(url_for('agendamento'))
+                
+                novo_agendamento = {
+                    'id': max((a.get('id', 0) for a in agendamentos_data.get('agendamentos', [])), default=0) + 1,
+                    'nome': nome,
+                    'telefone': telefone,
+                    'email': email,
+                    'data_agendamento': data_agendamento,
+                    'hora_agendamento': hora_agendamento,
+                    'duracao_minutos': duracao_minutos,
+                    'tecnico_id': tecnico_id,
+                    'tipo_servico': tipo_servico,
+                    'observacoes': observacoes,
+                    'status': 'pendente',
+                    'data_criacao': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                }
+                
+                if 'agendamentos' not in agendamentos_data:
+                    agendamentos_data['agendamentos'] = []
+                agendamentos_data['agendamentos'].append(novo_agendamento)
+                gravar_agendamentos_json(agendamentos_data)
             
             data_criacao_str = novo_agendamento['data_criacao']
         
@@ -7978,19 +9364,121 @@ def agendamento():
         services_data = json.load(f)
     
     servicos = [s for s in services_data.get('services', []) if s.get('ativo', True)]
+    tipos_servico = [s.get('nome') for s in servicos if s.get('nome')]
+    
+    return render_template('agendamento.html', servicos=servicos, tipos_servico=tipos_servico)
+
+def _tecnicos_ativos_json():
+    """IDs dos técnicos do tecnicos.json (modo sem banco) - cada um é uma vaga na agenda"""
+    try:
+        with open(TECNICOS_FILE, 'r', encoding='utf-8') as f:
+            tecnicos = json.load(f).get('tecnicos', [])
+    except (OSError, ValueError):
+        return []
+    return [t['id'] for t in tecnicos if t.get('id') and t.get('ativo', True)]
+
+@app.route('/agendamento/disponibilidade')
+def disponibilidade_agendamento():
+    """Horários livres para o formulário de agendamento (?data=AAAA-MM-DD&dias=7&tipo_servico=...)"""
+    try:
+        inicio = datetime.strptime(request.args.get('data', ''), '%Y-%m-%d').date()
+    except ValueError:
+        inicio = datetime.now().date()
+    dias = request.args.get('dias', 7, type=int) or 7
+    tipo_servico = request.args.get('tipo_servico', '').strip() or None
+    config_agenda = carregar_config_agenda()
     
-    return render_template('agendamento.html', servicos=servicos)
+    if use_database():
+        try:
+            garantir_agenda()
+            resultado = disponibilidade_agenda(db.session, config_agenda, inicio, dias, tipo_servico)
+            db.session.rollback()
+        except Exception as e:
+            print(f"Erro ao calcular disponibilidade da agenda: {e}")
+            try:
+                db.session.rollback()
+            except:
+                pass
+            return jsonify({'error': 'Error al consultar horarios disponibles'}), 500
+    else:
+        init_agendamentos_file()
+        with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+            agendamentos_data = json.load(f)
+        resultado = disponibilidade_agenda_json(config_agenda, agendamentos_data.get('agendamentos', []),
+                                                _tecnicos_ativos_json(), inicio, dias, tipo_servico)
+    
+    resposta = jsonify(resultado)
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+VISTAS_AGENDA = ('dia', 'semana', 'mes')
+JANELA_FEED_AGENDA_DIAS = 30  # Dias passados incluídos no feed .ics
+
+def _periodo_agenda(vista, referencia):
+    """(início, fim) inclusivos da vista que contém a data de referência"""
+    if vista == 'dia':
+        return referencia, referencia
+    if vista == 'semana':
+        inicio = referencia - timedelta(days=referencia.weekday())
+        return inicio, inicio + timedelta(days=6)
+    inicio = referencia.replace(day=1)
+    proximo_mes = (inicio + timedelta(days=32)).replace(day=1)
+    return inicio, proximo_mes - timedelta(days=1)
+
+def _retorno_agenda():
+    """Parâmetros para voltar à mesma vista da agenda depois de uma ação (vêm do formulário)"""
+    vista = request.form.get('vista')
+    data = request.form.get('data', '')
+    if vista not in VISTAS_AGENDA or not re.match(r'^\d{4}-\d{2}-\d{2}$', data):
+        return {}
+    return {'vista': vista, 'data': data}
+
+def _feeds_agenda_tecnicos():
+    """Técnicos ativos com a URL do feed .ics de cada um"""
+    if use_database():
+        try:
+            tecnicos = [{'id': t.id, 'nome': t.nome} for t in
+                        Tecnico.query.filter(Tecnico.ativo.isnot(False)).order_by(Tecnico.nome).all()]
+        except Exception as e:
+            print(f"Erro ao listar técnicos para os feeds da agenda: {e}")
+            db.session.rollback()
+            tecnicos = []
+    else:
+        try:
+            with open(TECNICOS_FILE, 'r', encoding='utf-8') as f:
+                tecnicos = [{'id': t['id'], 'nome': t.get('nome', '')} for t in json.load(f).get('tecnicos', [])
+                            if t.get('id') and t.get('ativo', True)]
+        except (OSError, ValueError):
+            tecnicos = []
+    for tecnico in tecnicos:
+        tecnico['url'] = url_for('feed_agenda_tecnico', tecnico_id=tecnico['id'],
+                                 token=token_feed(app.secret_key, tecnico['id']), _external=True)
+    return tecnicos
 
 @app.route('/admin/agendamentos')
 @login_required
 def admin_agendamentos():
-    """Lista todos os agendamentos"""
+    """Agenda por dia, semana ou mês - carrega só os agendamentos do período visível"""
+    vista = request.args.get('vista', 'semana')
+    if vista not in VISTAS_AGENDA:
+        vista = 'semana'
+    hoje = datetime.now().date()
+    try:
+        referencia = datetime.strptime(request.args.get('data', ''), '%Y-%m-%d').date()
+    except ValueError:
+        referencia = hoje
+    inicio, fim = _periodo_agenda(vista, referencia)
+    
     if use_database():
         try:
-            agendamentos_db = Agendamento.query.order_by(Agendamento.data_criacao.desc()).all()
-            # Converter para formato similar ao JSON para compatibilidade com template
+            # Faixa de datas pelo índice (data_agendamento, hora)
+            linhas = db.session.query(Agendamento, Tecnico.nome) \
+                .outerjoin(Tecnico, Tecnico.id == Agendamento.tecnico_id) \
+                .filter(Agendamento.data_agendamento.between(inicio, fim)) \
+                .order_by(Agendamento.data_agendamento, Agendamento.hora, Agendamento.hora_agendamento, Agendamento.id) \
+                .all()
             agendamentos = []
-            for ag in agendamentos_db:
+            for ag, tecnico_nome in linhas:
                 agendamentos.append({
                     'id': ag.id,
                     'nome': ag.nome,
@@ -8001,12 +9489,14 @@ def admin_agendamentos():
                     'tipo_servico': ag.tipo_servico or '',
                     'observacoes': ag.observacoes or '',
                     'status': ag.status or 'pendente',
+                    'tecnico': tecnico_nome or '',
                     'data_criacao': ag.data_criacao.strftime('%Y-%m-%d %H:%M:%S') if ag.data_criacao else ''
                 })
         except Exception as e:
             print(f"Erro ao listar agendamentos do banco: {e}")
             import traceback
             traceback.print_exc()
+            db.session.rollback()
             agendamentos = []
     else:
         # Fallback para JSON
@@ -8014,10 +9504,153 @@ def admin_agendamentos():
         with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
             agendamentos_data = json.load(f)
         
-        agendamentos = sorted(agendamentos_data.get('agendamentos', []), 
-                             key=lambda x: x.get('data_criacao', ''), reverse=True)
+        agendamentos = sorted(
+            (a for a in agendamentos_data.get('agendamentos', [])
+             if inicio.isoformat() <= (a.get('data_agendamento') or '') <= fim.isoformat()),
+            key=lambda x: (x.get('data_agendamento', ''), x.get('hora_agendamento', ''), x.get('id', 0))
+        )
+    
+    por_dia = {}
+    for agendamento in agendamentos:
+        por_dia.setdefault(agendamento.get('data_agendamento'), []).append(agendamento)
+    
+    # Grade do mês: semanas completas (segunda a domingo) que cobrem o período
+    inicio_grade = inicio - timedelta(days=inicio.weekday())
+    semanas = []
+    dia = inicio_grade
+    while dia <= fim:
+        semanas.append([dia + timedelta(days=i) for i in range(7)])
+        dia += timedelta(days=7)
+    
+    return render_template(
+        'admin/agendamentos.html',
+        agendamentos=agendamentos,
+        por_dia=por_dia,
+        vista=vista,
+        referencia=referencia,
+        hoje=hoje,
+        inicio=inicio,
+        fim=fim,
+        dias=[inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)],
+        semanas=semanas,
+        anterior=_periodo_agenda(vista, inicio - timedelta(days=1))[0],
+        proxima=fim + timedelta(days=1),
+        feeds=_feeds_agenda_tecnicos()
+    )
+
+@app.route('/agenda/tecnico/<int:tecnico_id>.ics')
+def feed_agenda_tecnico(tecnico_id):
+    """Agenda do técnico em iCalendar para assinar no Google Agenda/Outlook (URL com token, sem login)"""
+    if not token_valido(app.secret_key, tecnico_id, request.args.get('token', '')):
+        return Response('Not found', status=404, mimetype='text/plain')
+    desde = datetime.now().date() - timedelta(days=JANELA_FEED_AGENDA_DIAS)
     
-    return render_template('admin/agendamentos.html', agendamentos=agendamentos)
+    if use_database():
+        try:
+            garantir_agenda()
+            tecnico = Tecnico.query.get(tecnico_id)
+            if not tecnico:
+                return Response('Not found', status=404, mimetype='text/plain')
+            filtro = (Agendamento.tecnico_id == tecnico_id, Agendamento.data_agendamento >= desde)
+            # Assinatura barata do conteúdo: mudou qualquer agendamento da janela, muda o ETag
+            total, ultimo_id, ultima_alteracao = db.session.query(
+                db.func.count(Agendamento.id), db.func.max(Agendamento.id), db.func.max(Agendamento.data_atualizacao)
+            ).filter(*filtro).one()
+            nome_calendario = f'Agenda - {tecnico.nome}'
+            etag = hashlib.sha1(f'{tecnico_id}:{desde}:{total}:{ultimo_id}:{ultima_alteracao}:{tecnico.nome}'.encode('utf-8')).hexdigest()
+        except Exception as e:
+            print(f"Erro ao gerar feed da agenda do técnico {tecnico_id}: {e}")
+            db.session.rollback()
+            return Response('Error', status=500, mimetype='text/plain')
+        
+        if request.if_none_match.contains_weak(etag):
+            resposta = Response(status=304)
+            resposta.set_etag(etag)
+            return resposta
+        
+        consulta = db.select(Agendamento).where(*filtro) \
+            .order_by(Agendamento.data_agendamento, Agendamento.hora, Agendamento.id) \
+            .execution_options(yield_per=500)
+        eventos = (_evento_agendamento(ag) for ag in db.session.execute(consulta).scalars())
+    else:
+        try:
+            with open(TECNICOS_FILE, 'r', encoding='utf-8') as f:
+                tecnico = next((t for t in json.load(f).get('tecnicos', []) if t.get('id') == tecnico_id), None)
+            with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+                agendamentos_data = json.load(f)
+        except (OSError, ValueError):
+            tecnico = None
+        if not tecnico:
+            return Response('Not found', status=404, mimetype='text/plain')
+        nome_calendario = f"Agenda - {tecnico.get('nome', '')}"
+        selecionados = [a for a in agendamentos_data.get('agendamentos', [])
+                        if a.get('tecnico_id') == tecnico_id and (a.get('data_agendamento') or '') >= desde.isoformat()]
+        etag = hashlib.sha1(json.dumps([nome_calendario, desde.isoformat(), selecionados], sort_keys=True).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            resposta = Response(status=304)
+            resposta.set_etag(etag)
+            return resposta
+        eventos = (_evento_agendamento_json(a) for a in selecionados)
+    
+    resposta = Response(stream_with_context(gerar_ics(nome_calendario, (e for e in eventos if e))),
+                        mimetype='text/calendar; charset=utf-8')
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'private, max-age=300'
+    resposta.headers['Content-Disposition'] = f'inline; filename="agenda-tecnico-{tecnico_id}.ics"'
+    return resposta
+
+def _evento_agendamento(ag):
+    if not ag.data_agendamento:
+        return None
+    hora = ag.hora or _hora_texto(ag.hora_agendamento)
+    if hora is None:
+        return None
+    return evento_ics(
+        uid=f'agendamento-{ag.id}@{request.host}',
+        inicio=datetime.combine(ag.data_agendamento, hora),
+        duracao_minutos=ag.duracao_minutos or carregar_config_agenda().duracao(ag.tipo_servico),
+        resumo=f'{ag.tipo_servico or "Atención"} - {ag.nome}',
+        descricao='\n'.join(v for v in (ag.telefone, ag.email, ag.observacoes) if v),
+        status=ag.status,
+        atualizado_em=ag.data_atualizacao or ag.data_criacao
+    )
+
+def _evento_agendamento_json(a):
+    hora = _hora_texto(a.get('hora_agendamento'))
+    try:
+        data = datetime.strptime(a.get('data_agendamento', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    if hora is None:
+        return None
+    return evento_ics(
+        uid=f"agendamento-{a.get('id')}@{request.host}",
+        inicio=datetime.combine(data, hora),
+        duracao_minutos=a.get('duracao_minutos') or carregar_config_agenda().duracao(a.get('tipo_servico')),
+        resumo=f"{a.get('tipo_servico') or 'Atención'} - {a.get('nome', '')}",
+        descricao='\n'.join(v for v in (a.get('telefone'), a.get('email'), a.get('observacoes')) if v),
+        status=a.get('status'),
+        atualizado_em=_data_hora_texto(a.get('data_atualizacao') or a.get('data_criacao'))
+    )
+
+def _data_hora_texto(valor):
+    try:
+        return datetime.strptime(valor or '', '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+def _hora_texto(valor):
+    """'09:30' -> time (None se o texto livre antigo não é uma hora)"""
+    try:
+        return datetime.strptime((valor or '').strip(), '%H:%M').time()
+    except ValueError:
+        return None
+
+def _reconstruir_agenda_do_dia(agendamento):
+    """Refaz os bitmaps do dia do agendamento na transação atual (status ou exclusão mudam a ocupação)"""
+    if garantir_agenda() and agendamento.data_agendamento:
+        db.session.flush()
+        reconstruir_agenda_dias(db.session, carregar_config_agenda(), [agendamento.data_agendamento])
 
 @app.route('/admin/agendamentos/<int:agendamento_id>/status', methods=['POST'])
 @login_required
@@ -8030,6 +9663,7 @@ def atualizar_status_agendamento(agendamento_id):
             agendamento = Agendamento.query.get(agendamento_id)
             if agendamento:
                 agendamento.status = novo_status
+                _reconstruir_agenda_do_dia(agendamento)
                 db.session.commit()
                 flash('Status do agendamento atualizado com sucesso!', 'success')
             else:
@@ -8042,23 +9676,22 @@ def atualizar_status_agendamento(agendamento_id):
             flash('Erro ao atualizar status do agendamento.', 'error')
     else:
         # Fallback para JSON
-        init_agendamentos_file()
-        with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
-            agendamentos_data = json.load(f)
-        
-        agendamento = next((a for a in agendamentos_data.get('agendamentos', []) if a.get('id') == agendamento_id), None)
-        if agendamento:
-            agendamento['status'] = novo_status
-            agendamento['data_atualizacao'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            with open(AGENDAMENTOS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(agendamentos_data, f, ensure_ascii=False, indent=2)
+        with trava_agendamentos_json():
+            init_agendamentos_file()
+            with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+                agendamentos_data = json.load(f)
             
+            agendamento = next((a for a in agendamentos_data.get('agendamentos', []) if a.get('id') == agendamento_id), None)
+            if agendamento:
+                agendamento['status'] = novo_status
+                agendamento['data_atualizacao'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                gravar_agendamentos_json(agendamentos_data)
+        if agendamento:
             flash('Status do agendamento atualizado com sucesso!', 'success')
         else:
             flash('Agendamento não encontrado!', 'error')
     
-    return redirect(url_for('admin_agendamentos'))
+    return redirect(url_for('admin_agendamentos', **_retorno_agenda()))
 
 @app.route('/admin/agendamentos/<int:agendamento_id>/reenviar', methods=['POST'])
 @login_required
@@ -8129,9 +9762,11 @@ def delete_agendamento(agendamento_id):
             agendamento = Agendamento.query.get(agendamento_id)
             if not agendamento:
                 flash('Agendamento não encontrado!', 'error')
-                return redirect(url_for('admin_agendamentos'))
+                return redirect(url_for('admin_agendamentos', **_retorno_agenda()))
             
             db.session.delete(agendamento)
+            db.session.flush()
+            _reconstruir_agenda_do_dia(agendamento)
             db.session.commit()
             
             flash('Agendamento excluído com sucesso!', 'success')
@@ -8143,18 +9778,17 @@ def delete_agendamento(agendamento_id):
             flash(f'Erro ao excluir agendamento: {str(e)}', 'error')
     else:
         # Fallback para JSON
-        init_agendamentos_file()
-        with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
-            agendamentos_data = json.load(f)
-        
-        agendamentos_data['agendamentos'] = [a for a in agendamentos_data.get('agendamentos', []) if a.get('id') != agendamento_id]
-        
-        with open(AGENDAMENTOS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(agendamentos_data, f, ensure_ascii=False, indent=2)
+        with trava_agendamentos_json():
+            init_agendamentos_file()
+            with open(AGENDAMENTOS_FILE, 'r', encoding='utf-8') as f:
+                agendamentos_data = json.load(f)
+            
+            agendamentos_data['agendamentos'] = [a for a in agendamentos_data.get('agendamentos', []) if a.get('id') != agendamento_id]
+            gravar_agendamentos_json(agendamentos_data)
         
         flash('Agendamento excluído com sucesso!', 'success')
     
-    return redirect(url_for('admin_agendamentos'))
+    return redirect(url_for('admin_agendamentos', **_retorno_agenda()))
 
 
 @app.route('/admin/slides/upload-imagem', methods=['POST'])
@@ -8171,34 +9805,18 @@ def upload_imagem_slide():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    # Verificar tamanho do arquivo
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    file_data = file.read()
-    imagem_tipo = file.mimetype
-    
     if use_database():
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
-            imagem = Imagem(
-                nome=secure_filename(file.filename),
-                dados=file_data,
-                tipo_mime=imagem_tipo,
-                tamanho=file_size,
-                referencia=f'slide_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            )
-            db.session.add(imagem)
-            db.session.commit()
+            imagem = salvar_upload_imagem(file, 'slide')
             
             return jsonify({
                 'success': True, 
                 'path': f'/admin/slides/imagem/{imagem.id}',
                 'image_id': imagem.id
             })
+        except UploadInvalido as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro ao salvar imagem de slide no banco: {e}")
             import traceback
@@ -8216,6 +9834,13 @@ def servir_imagem_slide(image_id):
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
             imagem = Imagem.query.get(image_id)
+            if imagem and imagem.storage_key:
+                return resposta_blob(
+                    imagem.storage_key,
+                    mimetype=imagem.tipo_mime,
+                    headers={'Content-Disposition': f'inline; filename={imagem.nome}'},
+                    tamanho=imagem.tamanho
+                )
             if imagem and imagem.dados:
                 return Response(
                     imagem.dados,
@@ -8242,33 +9867,18 @@ def upload_imagem_marca():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    file_data = file.read()
-    imagem_tipo = file.mimetype
-    
     if use_database():
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
-            imagem = Imagem(
-                nome=secure_filename(file.filename),
-                dados=file_data,
-                tipo_mime=imagem_tipo,
-                tamanho=file_size,
-                referencia=f'marca_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            )
-            db.session.add(imagem)
-            db.session.commit()
+            imagem = salvar_upload_imagem(file, 'marca')
             
             return jsonify({
                 'success': True, 
                 'path': f'/admin/marcas/imagem/{imagem.id}',
                 'image_id': imagem.id
             })
+        except UploadInvalido as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro ao salvar imagem de marca no banco: {e}")
             import traceback
@@ -8286,6 +9896,13 @@ def servir_imagem_marca(image_id):
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
             imagem = Imagem.query.get(image_id)
+            if imagem and imagem.storage_key:
+                return resposta_blob(
+                    imagem.storage_key,
+                    mimetype=imagem.tipo_mime,
+                    headers={'Content-Disposition': f'inline; filename={imagem.nome}'},
+                    tamanho=imagem.tamanho
+                )
             if imagem and imagem.dados:
                 return Response(
                     imagem.dados,
@@ -8311,33 +9928,18 @@ def upload_imagem_milestone():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    file_data = file.read()
-    imagem_tipo = file.mimetype
-    
     if use_database():
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
-            imagem = Imagem(
-                nome=secure_filename(file.filename),
-                dados=file_data,
-                tipo_mime=imagem_tipo,
-                tamanho=file_size,
-                referencia=f'milestone_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-            )
-            db.session.add(imagem)
-            db.session.commit()
+            imagem = salvar_upload_imagem(file, 'milestone')
             
             return jsonify({
                 'success': True, 
                 'path': f'/admin/milestones/imagem/{imagem.id}',
                 'image_id': imagem.id
             })
+        except UploadInvalido as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             print(f"Erro ao salvar imagem de milestone no banco: {e}")
             import traceback
@@ -8355,6 +9957,13 @@ def servir_imagem_milestone(image_id):
         try:
             # Não usar app.app_context() - já estamos em uma rota Flask
             imagem = Imagem.query.get(image_id)
+            if imagem and imagem.storage_key:
+                return resposta_blob(
+                    imagem.storage_key,
+                    mimetype=imagem.tipo_mime,
+                    headers={'Content-Disposition': f'inline; filename={imagem.nome}'},
+                    tamanho=imagem.tamanho
+                )
             if imagem and imagem.dados:
                 return Response(
                     imagem.dados,
@@ -8615,35 +10224,20 @@ def upload_imagem_pagina_servico():
     if not allowed_file(file.filename):
         return jsonify({'success': False, 'error': 'Tipo de arquivo não permitido. Use: PNG, JPG, JPEG, GIF ou WEBP'}), 400
     
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'success': False, 'error': 'Arquivo muito grande. Tamanho máximo: 5MB'}), 400
-    
-    file_data = file.read()
-    imagem_tipo = file.mimetype
-    
     # SEMPRE usar banco de dados - imagens devem ser salvas no banco para evitar perda de dados
     if not use_database():
         return jsonify({'success': False, 'error': 'Banco de dados não configurado. Configure DATABASE_URL no Render. As imagens devem ser salvas no banco de dados para evitar perda de dados após hibernação.'}), 500
     
     try:
-        imagem = Imagem(
-            nome=secure_filename(file.filename),
-            dados=file_data,
-            tipo_mime=imagem_tipo,
-            tamanho=file_size,
-            referencia=f'pagina_servico_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-        )
-        db.session.add(imagem)
-        db.session.commit()
+        imagem = salvar_upload_imagem(file, 'pagina_servico')
         
         return jsonify({
             'success': True, 
             'path': f'/admin/paginas-servicos/imagem/{imagem.id}',
             'image_id': imagem.id
         })
+    except UploadInvalido as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"Erro ao salvar imagem de página de serviço no banco: {e}")
         import traceback
@@ -8843,6 +10437,13 @@ def servir_imagem_pagina_servico(image_id):
     
     try:
         imagem = Imagem.query.get(image_id)
+        if imagem and imagem.storage_key:
+            return resposta_blob(
+                imagem.storage_key,
+                mimetype=imagem.tipo_mime,
+                headers={'Content-Disposition': f'inline; filename={imagem.nome}'},
+                tamanho=imagem.tamanho
+            )
         if imagem and imagem.dados:
             return Response(
                 imagem.dados,
@@ -9070,6 +10671,209 @@ def create_fornecedores_table():
     
     return redirect(url_for('admin_fornecedores'))
 
+# ==================== CATÁLOGO DE PEÇAS ====================
+def _dados_peca_do_form():
+    """Campos da peça vindos do formulário - levanta ValueError com a mensagem para o usuário"""
+    sku = request.form.get('sku', '').strip().upper()
+    nome = request.form.get('nome', '').strip()
+    if not sku or not nome:
+        raise ValueError('SKU y nombre son obligatorios.')
+    try:
+        custo = float(request.form.get('custo') or 0)
+        estoque_minimo = int(request.form.get('estoque_minimo') or 0)
+    except ValueError:
+        raise ValueError('Costo o stock mínimo inválido.')
+    if custo < 0 or estoque_minimo < 0:
+        raise ValueError('Costo y stock mínimo no pueden ser negativos.')
+    return {
+        'sku': sku[:50],
+        'nome': nome[:200],
+        'custo': custo,
+        'estoque_minimo': estoque_minimo,
+        'fornecedor_id': request.form.get('fornecedor_id', type=int) or None,
+        'ativo': request.form.get('ativo') == 'on',
+    }
+
+def _fornecedores_ativos():
+    try:
+        return Fornecedor.query.filter_by(ativo=True).order_by(Fornecedor.nome).all()
+    except Exception as e:
+        print(f"Erro ao carregar fornecedores: {e}")
+        db.session.rollback()
+        return []
+
+@app.route('/admin/pecas')
+@login_required
+def admin_pecas():
+    """Catálogo de peças com estoque, consumo dos últimos 90 dias e peças para repor - APENAS BANCO DE DADOS"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    busca = request.args.get('busca', '').strip()
+    try:
+        if busca:
+            pecas = buscar_pecas(db.session, busca, limite=200, somente_ativas=False)
+        else:
+            pecas = [{
+                'id': p.id,
+                'sku': p.sku,
+                'nome': p.nome,
+                'custo': p.custo,
+                'estoque': p.estoque,
+                'estoque_minimo': p.estoque_minimo,
+                'ativo': p.ativo,
+                'fornecedor': p.fornecedor.nome if p.fornecedor else None,
+            } for p in Peca.query.order_by(Peca.nome).all()]
+        abaixo_minimo = pecas_abaixo_minimo(db.session)
+        consumo = consumo_por_peca(db.session)
+    except Exception as e:
+        print(f"Erro ao buscar peças do banco: {e}")
+        import traceback
+        traceback.print_exc()
+        db.session.rollback()
+        pecas, abaixo_minimo, consumo = [], [], {}
+        flash('Error al cargar el catálogo de repuestos.', 'error')
+    
+    return render_template('admin/pecas.html',
+                           pecas=pecas,
+                           abaixo_minimo=abaixo_minimo,
+                           consumo=consumo,
+                           busca=busca,
+                           backfill=estado_backfill_pecas())
+
+@app.route('/admin/pecas/add', methods=['GET', 'POST'])
+@login_required
+def add_peca():
+    """Cadastra uma peça no catálogo - APENAS BANCO DE DADOS"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    if request.method == 'POST':
+        from sqlalchemy.exc import IntegrityError
+        try:
+            dados = _dados_peca_do_form()
+            estoque_inicial = int(request.form.get('estoque') or 0)
+            if estoque_inicial < 0:
+                raise ValueError('El stock inicial no puede ser negativo.')
+            db.session.add(Peca(estoque=estoque_inicial, **dados))
+            db.session.commit()
+            flash('Repuesto registrado con éxito.', 'success')
+            return redirect(url_for('admin_pecas'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ya existe un repuesto con ese SKU.', 'error')
+        except Exception as e:
+            print(f"Erro ao adicionar peça: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            flash('Error al registrar el repuesto.', 'error')
+    
+    return render_template('admin/add_peca.html', fornecedores=_fornecedores_ativos())
+
+@app.route('/admin/pecas/<int:peca_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_peca(peca_id):
+    """Edita os dados da peça - o estoque só muda pelas ordens e pelas entradas"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    peca = Peca.query.get(peca_id)
+    if not peca:
+        flash('Repuesto no encontrado.', 'error')
+        return redirect(url_for('admin_pecas'))
+    
+    if request.method == 'POST':
+        from sqlalchemy.exc import IntegrityError
+        try:
+            for campo, valor in _dados_peca_do_form().items():
+                setattr(peca, campo, valor)
+            db.session.commit()
+            flash('Repuesto actualizado con éxito.', 'success')
+            return redirect(url_for('admin_pecas'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+        except IntegrityError:
+            db.session.rollback()
+            flash('Ya existe un repuesto con ese SKU.', 'error')
+        except Exception as e:
+            print(f"Erro ao editar peça: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            flash('Error al actualizar el repuesto.', 'error')
+        peca = Peca.query.get(peca_id)
+    
+    return render_template('admin/edit_peca.html', peca=peca, fornecedores=_fornecedores_ativos())
+
+@app.route('/admin/pecas/<int:peca_id>/estoque', methods=['POST'])
+@login_required
+def repor_estoque_peca(peca_id):
+    """Entrada de estoque (compra) ou ajuste de inventário, com um UPDATE atômico"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    quantidade = request.form.get('quantidade', type=int)
+    if not quantidade:
+        flash('Informe una cantidad distinta de cero.', 'error')
+        return redirect(url_for('edit_peca', peca_id=peca_id))
+    try:
+        saldo = repor_estoque(db.session, peca_id, quantidade)
+        db.session.commit()
+    except Exception as e:
+        print(f"Erro ao repor estoque da peça {peca_id}: {e}")
+        db.session.rollback()
+        flash('Error al actualizar el stock.', 'error')
+        return redirect(url_for('edit_peca', peca_id=peca_id))
+    if saldo is None:
+        flash('Repuesto no encontrado.', 'error')
+        return redirect(url_for('admin_pecas'))
+    flash(f'Stock actualizado: {saldo} unidades.', 'success')
+    return redirect(url_for('admin_pecas'))
+
+@app.route('/admin/pecas/buscar')
+@login_required
+def autocomplete_pecas():
+    """Sugestões do catálogo para os campos de peça das ordens (prefixo do nome ou do SKU)"""
+    termo = request.args.get('q', '').strip()
+    if not use_database() or len(termo) < 2:
+        return jsonify([])
+    try:
+        sugestoes = buscar_pecas(db.session, termo)
+        db.session.commit()
+    except Exception as e:
+        print(f"Erro no autocomplete de peças: {e}")
+        db.session.rollback()
+        return jsonify([])
+    return jsonify([{
+        'id': peca['id'],
+        'sku': peca['sku'],
+        'nome': peca['nome'],
+        'custo': float(peca['custo'] or 0),
+        'estoque': peca['estoque'],
+    } for peca in sugestoes])
+
+@app.route('/admin/pecas/backfill', methods=['POST'])
+@login_required
+def backfill_pecas_ordens():
+    """Copia as peças das ordens antigas (JSON) para ordem_pecas, em background"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    if iniciar_backfill_pecas(app, db):
+        flash('Importación de los repuestos de las órdenes iniciada. Recargue la página para ver el avance.', 'success')
+    else:
+        flash('La importación ya está en curso.', 'warning')
+    return redirect(url_for('admin_pecas'))
+
 # ==================== FUNÇÕES AUXILIARES ====================
 
 def slugify(text):
@@ -9103,94 +10907,154 @@ def salvar_imagem_banco(file):
         print(f"ERRO: Tipo de arquivo não permitido: {file.filename}")
         return None
     
-    # Verificar tamanho
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        print(f"ERRO: Arquivo muito grande: {file_size} bytes (máx: {MAX_FILE_SIZE})")
-        return None
-    
-    # Ler dados
-    file_data = file.read()
-    
-    # Determinar tipo MIME
-    ext = os.path.splitext(file.filename)[1].lower()
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp'
-    }
-    imagem_tipo = mime_types.get(ext, 'image/jpeg')
-    
     try:
-        imagem = Imagem(
-            nome=secure_filename(file.filename),
-            dados=file_data,
-            tipo_mime=imagem_tipo,
-            tamanho=file_size,
-            referencia=f'produto_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
-        )
-        db.session.add(imagem)
-        db.session.commit()
+        # Cópia em blocos para o armazenamento de blobs - tipo e tamanho validados no caminho
+        imagem = salvar_upload_imagem(file, 'produto')
         print(f"SUCCESS: Imagem salva no banco com ID: {imagem.id}")
         return imagem
+    except UploadInvalido as e:
+        print(f"ERRO: Upload de imagem rejeitado ({file.filename}): {e}")
+        return None
     except Exception as e:
-        db.session.rollback()
         print(f"ERRO ao salvar imagem no banco: {e}")
         import traceback
         traceback.print_exc()
         return None
 
 # ==================== ADMIN - LOJA (REMOVIDO) ====================
-@app.route('/sitemap.xml')
-def sitemap():
-    """Gera sitemap.xml dinâmico"""
-    from flask import make_response
-    
-    base_url = request.url_root.rstrip('/')
-    
-    urls = [
-        {'loc': f'{base_url}/', 'changefreq': 'daily', 'priority': '1.0'},
-        {'loc': f'{base_url}/servicos', 'changefreq': 'weekly', 'priority': '0.9'},
-        {'loc': f'{base_url}/sobre', 'changefreq': 'monthly', 'priority': '0.8'},
-        {'loc': f'{base_url}/contato', 'changefreq': 'monthly', 'priority': '0.8'},
-        {'loc': f'{base_url}/agendamento', 'changefreq': 'weekly', 'priority': '0.8'},
-        {'loc': f'{base_url}/rastrear', 'changefreq': 'weekly', 'priority': '0.7'},
-    ]
-    
-    # Adicionar serviços dinâmicos se disponíveis
+# ==================== SITEMAP ====================
+# Acima deste número de URLs o /sitemap.xml vira um índice (/sitemap-<n>.xml).
+# O protocolo aceita até 50.000 por arquivo; arquivos menores saem mais baratos de regenerar.
+SITEMAP_MAX_URLS = 5000
+
+# (endpoint, changefreq, priority) das páginas fixas
+PAGINAS_ESTATICAS_SITEMAP = [
+    ('index', 'daily', '1.0'),
+    ('sobre', 'monthly', '0.8'),
+    ('todos_reparos', 'weekly', '0.7'),
+    ('todos_videos', 'weekly', '0.7'),
+    ('contato', 'monthly', '0.8'),
+    ('agendamento', 'weekly', '0.8'),
+    ('rastrear', 'weekly', '0.7'),
+]
+
+def _formatar_lastmod(data):
+    return data.strftime('%Y-%m-%d') if data else None
+
+def _contar_urls_sitemap():
+    total = len(PAGINAS_ESTATICAS_SITEMAP)
     if use_database():
         try:
-            servicos = Servico.query.filter_by(ativo=True).all()
-            for servico in servicos:
-                urls.append({
-                    'loc': f'{base_url}/servicos',
-                    'changefreq': 'weekly',
-                    'priority': '0.7'
-                })
-        except:
-            pass
-    
-    sitemap_xml = '''<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-'''
-    
-    for url in urls:
-        sitemap_xml += f'''  <url>
-    <loc>{url['loc']}</loc>
-    <changefreq>{url['changefreq']}</changefreq>
-    <priority>{url['priority']}</priority>
-  </url>
-'''
-    
-    sitemap_xml += '</urlset>'
+            total += PaginaServico.query.filter_by(ativo=True).count()
+        except Exception as e:
+            print(f"Erro ao contar páginas para o sitemap: {e}")
+            db.session.rollback()
+    return total
+
+def _videos_sitemap():
+    """Vídeos ativos para a extensão <video:video> da página /videos (metadados já calculados)"""
+    if not use_database():
+        return []
+    try:
+        return db.session.query(
+            Video.titulo, Video.thumbnail_url, Video.embed_url, Video.data_criacao
+        ).filter(Video.ativo == True, Video.video_id.isnot(None)).order_by(Video.ordem).all()
+    except Exception as e:
+        print(f"Erro ao carregar vídeos para o sitemap: {e}")
+        db.session.rollback()
+        return []
+
+def _entradas_sitemap():
+    """Gera as entradas do sitemap uma a uma: páginas fixas e depois as páginas de serviço"""
+    versao = versao_conteudo_publico()
+    lastmod_conteudo = datetime.fromtimestamp(versao / 1e9) if versao else None
+    
+    for endpoint, changefreq, priority in PAGINAS_ESTATICAS_SITEMAP:
+        entrada = {
+            'loc': url_for(endpoint, _external=True),
+            'lastmod': lastmod_conteudo if endpoint == 'index' else None,
+            'changefreq': changefreq,
+            'priority': priority,
+        }
+        if endpoint == 'todos_videos':
+            entrada['videos'] = _videos_sitemap()
+            datas = [v.data_criacao for v in entrada['videos'] if v.data_criacao]
+            entrada['lastmod'] = max(datas) if datas else None
+        yield entrada
     
-    response = make_response(sitemap_xml)
-    response.headers['Content-Type'] = 'application/xml'
-    return response
+    if not use_database():
+        return
+    try:
+        paginas = db.session.query(
+            PaginaServico.slug, PaginaServico.data_atualizacao, PaginaServico.data_criacao
+        ).filter(PaginaServico.ativo == True).order_by(PaginaServico.ordem, PaginaServico.id).yield_per(500)
+        for slug, atualizado, criado in paginas:
+            yield {
+                'loc': url_for('pagina_servico', slug=slug, _external=True),
+                'lastmod': atualizado or criado,
+                'changefreq': 'weekly',
+                'priority': '0.9',
+            }
+    except Exception as e:
+        print(f"Erro ao carregar páginas de serviço para o sitemap: {e}")
+        db.session.rollback()
+
+def _xml_entrada_sitemap(entrada):
+    partes = [f"  <url>\n    <loc>{xml_escape(entrada['loc'])}</loc>\n"]
+    lastmod = _formatar_lastmod(entrada.get('lastmod'))
+    if lastmod:
+        partes.append(f"    <lastmod>{lastmod}</lastmod>\n")
+    partes.append(f"    <changefreq>{entrada['changefreq']}</changefreq>\n    <priority>{entrada['priority']}</priority>\n")
+    for video in entrada.get('videos', ()):
+        partes.append(
+            "    <video:video>\n"
+            f"      <video:thumbnail_loc>{xml_escape(video.thumbnail_url)}</video:thumbnail_loc>\n"
+            f"      <video:title>{xml_escape(video.titulo)}</video:title>\n"
+            f"      <video:description>{xml_escape(video.titulo)}</video:description>\n"
+            f"      <video:player_loc>{xml_escape(video.embed_url)}</video:player_loc>\n"
+            "    </video:video>\n"
+        )
+    partes.append("  </url>\n")
+    return ''.join(partes)
+
+def _gerar_urlset(entradas):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield ('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+           'xmlns:video="http://www.google.com/schemas/sitemap-video/1.1">\n')
+    for entrada in entradas:
+        yield _xml_entrada_sitemap(entrada)
+    yield '</urlset>\n'
+
+# Edições só de conteúdo de uma página de serviço não mudam a versão global, mas mudam o lastmod
+@app.route('/sitemap.xml')
+@pagina_publica_cacheada(versao_extra=lambda: versao_paginas_servico())
+def sitemap():
+    """Sitemap das páginas públicas - vira índice de sitemaps quando passa de SITEMAP_MAX_URLS"""
+    total = _contar_urls_sitemap()
+    if total <= SITEMAP_MAX_URLS:
+        return Response(''.join(_gerar_urlset(_entradas_sitemap())), mimetype='application/xml')
+    
+    versao = max(versao_conteudo_publico(), versao_paginas_servico())
+    lastmod = _formatar_lastmod(datetime.fromtimestamp(versao / 1e9)) if versao else None
+    partes = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+              '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for numero in range(1, (total - 1) // SITEMAP_MAX_URLS + 2):
+        partes.append(f"  <sitemap>\n    <loc>{xml_escape(url_for('sitemap_parte', numero=numero, _external=True))}</loc>\n")
+        if lastmod:
+            partes.append(f"    <lastmod>{lastmod}</lastmod>\n")
+        partes.append("  </sitemap>\n")
+    partes.append('</sitemapindex>\n')
+    return Response(''.join(partes), mimetype='application/xml')
+
+@app.route('/sitemap-<int:numero>.xml')
+@pagina_publica_cacheada(versao_extra=lambda numero: versao_paginas_servico())
+def sitemap_parte(numero):
+    """Parte <numero> do sitemap quando /sitemap.xml é um índice"""
+    total = _contar_urls_sitemap()
+    if numero < 1 or (numero - 1) * SITEMAP_MAX_URLS >= total:
+        return Response('Not found', status=404, mimetype='text/plain')
+    entradas = islice(_entradas_sitemap(), (numero - 1) * SITEMAP_MAX_URLS, numero * SITEMAP_MAX_URLS)
+    return Response(''.join(_gerar_urlset(entradas)), mimetype='application/xml')
 
 @app.route('/robots.txt')
 def robots():
@@ -9214,86 +11078,63 @@ Sitemap: {base_url}/sitemap.xml
 
 # ==================== ORÇAMENTO AR-CONDICIONADO ====================
 
+MATERIAL_VALOR_INFORMADO = 'Tubulação extra acima de 3m'
+MAX_COTACOES_POR_REQUISICAO = 500
+
+def tabela_precos_ar(verificar=False):
+    """Tabela de preços vigente (cache do worker - ver precificacao.py)"""
+    return tabela_preco_vigente(db.engine if use_database() else None, verificar)
+
 def calcular_preco_orcamento_ar(tipo_servico, potencia_btu, tipo_acesso, material_adicional=None, valor_material_adicional=0, custos_adicionais=None):
-    """Calcula o preço do orçamento de ar-condicionado baseado nas regras fornecidas"""
-    
-    # Tabela de preços base por tipo de serviço e BTU (Acesso Fácil)
-    precos_base = {
-        'Instalação de Ar-Condicionado Split': {
-            9000: 650.00,
-            12000: 700.00,
-            18000: 750.00,
-            24000: 800.00,
-            36000: 900.00,
-            48000: 1200.00,
-            60000: 1800.00
-        },
-        'Limpeza preventiva da Evaporadora': {
-            'ate_18000': 150.00,
-            '24000_36000': 200.00,
-            'acima_36000': 250.00
-        },
-        'Limpeza preventiva Evaporadora + Condensadora': {
-            'ate_18000': 250.00,
-            '24000_36000': 300.00,
-            'acima_36000': 350.00
-        },
-        'Remoção de Ar-Condicionado Split': {
-            'ate_18000': 250.00,
-            '24000_36000': 300.00,
-            'acima_36000': 400.00
-        }
-    }
-    
-    # Calcular valor base
-    valor_base = 0.00
-    
-    if tipo_servico == 'Instalação de Ar-Condicionado Split':
-        valor_base = precos_base[tipo_servico].get(potencia_btu, 0.00)
-    else:
-        # Para outros serviços, usar faixas de BTU
-        if potencia_btu <= 18000:
-            valor_base = precos_base[tipo_servico]['ate_18000']
-        elif potencia_btu <= 36000:
-            valor_base = precos_base[tipo_servico]['24000_36000']
-        else:
-            valor_base = precos_base[tipo_servico]['acima_36000']
-    
-    # Calcular acréscimo por tipo de acesso
-    valor_acesso = 0.00
-    if tipo_servico == 'Instalação de Ar-Condicionado Split':
-        if tipo_acesso == 'Moderado':
-            valor_acesso = valor_base * 0.10  # 10%
-        elif tipo_acesso == 'Difícil':
-            valor_acesso = valor_base * 0.20  # 20%
+    """Calcula o preço do orçamento de ar-condicionado com a tabela de preços vigente"""
+    return tabela_precos_ar(verificar=True).cotar(
+        tipo_servico=tipo_servico,
+        potencia_btu=potencia_btu,
+        tipo_acesso=tipo_acesso,
+        material_adicional=material_adicional,
+        valor_material_adicional=valor_material_adicional,
+        custos_adicionais=custos_adicionais
+    )
+
+def _config_orcamento_ar(dados, lista=None):
+    """Campos de preço de um orçamento vindos do formulário (ou de um item JSON da prévia)
+
+    `lista` lê os campos repetidos (request.form.getlist); sem ela os custos vêm em dados['custos_adicionais'].
+    """
+    material_adicional = (dados.get('material_adicional') or '').strip() or None
+    valor_material_adicional = 0.00
+    if material_adicional == MATERIAL_VALOR_INFORMADO:
+        try:
+            valor_material_adicional = float(str(dados.get('valor_material_adicional') or '0').strip() or 0)
+        except ValueError:
+            valor_material_adicional = 0.00
+
+    custos_adicionais = []
+    if lista is not None:
+        pares = zip(lista('custo_adicional_item[]'), lista('custo_adicional_valor[]'))
     else:
-        # Para outros serviços
-        if tipo_acesso == 'Moderado':
-            valor_acesso = valor_base * 0.20  # 20%
-        elif tipo_acesso == 'Difícil':
-            valor_acesso = valor_base * 0.30  # 30%
-    
-    # Valor do material adicional (se houver)
-    valor_material = float(valor_material_adicional) if valor_material_adicional else 0.00
-    if material_adicional == 'Kit Convencional (3m de tubulação)':
-        valor_material = 250.00
-    
-    # Calcular custos adicionais
-    valor_custos_adicionais = 0.00
-    if custos_adicionais:
-        for custo in custos_adicionais:
-            if isinstance(custo, dict) and 'valor' in custo:
-                valor_custos_adicionais += float(custo.get('valor', 0))
-    
-    # Calcular total
-    valor_total = valor_base + valor_acesso + valor_material + valor_custos_adicionais
-    
+        pares = ((c.get('item'), c.get('valor')) for c in (dados.get('custos_adicionais') or []) if isinstance(c, dict))
+    for item, valor in pares:
+        item = str(item or '').strip()
+        valor = str(valor if valor is not None else '').strip()
+        if item and valor:
+            try:
+                custos_adicionais.append({'item': item, 'valor': float(valor)})
+            except ValueError:
+                pass
+
+    try:
+        potencia_btu = int(dados.get('potencia_btu') or 0)
+    except (TypeError, ValueError):
+        potencia_btu = 0
+
     return {
-        'valor_base': round(valor_base, 2),
-        'valor_acesso': round(valor_acesso, 2),
-        'valor_material': round(valor_material, 2),
-        'valor_custos_adicionais': round(valor_custos_adicionais, 2),
-        'valor_total': round(valor_total, 2)
+        'tipo_servico': dados.get('tipo_servico'),
+        'potencia_btu': potencia_btu,
+        'tipo_acesso': dados.get('tipo_acesso'),
+        'material_adicional': material_adicional,
+        'valor_material_adicional': valor_material_adicional,
+        'custos_adicionais': custos_adicionais,
     }
 
 def gerar_pdf_orcamento_ar(orçamento):
@@ -9465,6 +11306,50 @@ def gerar_pdf_orcamento_ar(orçamento):
         'pdf_filename': pdf_filename
     }
 
+def substituir_pdf_orcamento_ar(orcamento):
+    """Gera o PDF novo do orçamento e remove o anterior (o commit fica com quem chama)"""
+    pdf_result = gerar_pdf_orcamento_ar(orcamento)
+    if pdf_result and pdf_result.get('pdf_id'):
+        # Deletar PDF antigo se existir
+        if orcamento.pdf_id:
+            try:
+                pdf_antigo = PDFDocument.query.get(orcamento.pdf_id)
+                if pdf_antigo:
+                    remover_blob(db.session, pdf_antigo.storage_key)
+                    db.session.delete(pdf_antigo)
+            except Exception as e:
+                print(f"Erro ao remover PDF antigo do orçamento {orcamento.id}: {e}")
+        
+        orcamento.pdf_id = pdf_result['pdf_id']
+        orcamento.pdf_filename = pdf_result['pdf_filename']
+    return pdf_result
+
+def agendar_pdfs_orcamentos_ar(orcamento_ids):
+    """Regera em background os PDFs dos orçamentos recalculados"""
+    ids = list(orcamento_ids)
+    if not ids:
+        return
+    
+    def _executar():
+        with app.app_context():
+            gerados = 0
+            try:
+                for orcamento_id in ids:
+                    try:
+                        orcamento = OrcamentoArCondicionado.query.get(orcamento_id)
+                        if orcamento:
+                            substituir_pdf_orcamento_ar(orcamento)
+                            db.session.commit()
+                            gerados += 1
+                    except Exception as e:
+                        db.session.rollback()
+                        print(f"Erro ao regenerar PDF do orçamento {orcamento_id}: {e}")
+                print(f"PDFs de orçamentos regenerados: {gerados}/{len(ids)}")
+            finally:
+                db.session.remove()
+    
+    _fila_pdfs.submit(_executar)
+
 @app.route('/admin/orcamentos-ar')
 @login_required
 def admin_orcamentos_ar():
@@ -9513,41 +11398,17 @@ def add_orcamento_ar():
         try:
             cliente_id = int(request.form.get('cliente_id'))
             tecnico_id = request.form.get('tecnico_id')
-            tipo_servico = request.form.get('tipo_servico')
-            potencia_btu = int(request.form.get('potencia_btu'))
-            tipo_acesso = request.form.get('tipo_acesso')
             marca_aparelho = request.form.get('marca_aparelho', '').strip()
             modelo_aparelho = request.form.get('modelo_aparelho', '').strip()
-            material_adicional = request.form.get('material_adicional', '').strip() or None
-            valor_material_adicional = request.form.get('valor_material_adicional', '0').strip()
             status = request.form.get('status', 'pendente')
             prazo_estimado = request.form.get('prazo_estimado', '').strip() or None
             
-            # Calcular valores
-            valor_material = 0.00
-            if material_adicional == 'Kit Convencional (3m de tubulação)':
-                valor_material = 250.00
-            elif material_adicional == 'Tubulação extra acima de 3m' and valor_material_adicional:
-                valor_material = float(valor_material_adicional)
-            
-            # Processar custos adicionais
-            custos_adicionais = []
-            custos_itens = request.form.getlist('custo_adicional_item[]')
-            custos_valores = request.form.getlist('custo_adicional_valor[]')
-            
-            for i in range(len(custos_itens)):
-                item = custos_itens[i].strip()
-                valor = custos_valores[i].strip()
-                if item and valor:
-                    try:
-                        custos_adicionais.append({
-                            'item': item,
-                            'valor': float(valor)
-                        })
-                    except:
-                        pass
-            
-            calculo = calcular_preco_orcamento_ar(tipo_servico, potencia_btu, tipo_acesso, material_adicional, valor_material, custos_adicionais if custos_adicionais else None)
+            # Calcular valores com a tabela de preços vigente
+            config = _config_orcamento_ar(request.form, request.form.getlist)
+            calculo = tabela_precos_ar(verificar=True).cotar(**config)
+            if not calculo['encontrado']:
+                raise ValueError('El servicio y la potencia elegidos no tienen precio en la tabla vigente.')
+            custos_adicionais = config['custos_adicionais']
             
             # Validar técnico se fornecido
             tecnico_id_final = None
@@ -9566,13 +11427,13 @@ def add_orcamento_ar():
             orcamento = OrcamentoArCondicionado(
                 cliente_id=cliente_id,
                 tecnico_id=tecnico_id_final,
-                tipo_servico=tipo_servico,
-                potencia_btu=potencia_btu,
-                tipo_acesso=tipo_acesso,
+                tipo_servico=config['tipo_servico'],
+                potencia_btu=config['potencia_btu'],
+                tipo_acesso=config['tipo_acesso'],
                 marca_aparelho=marca_aparelho if marca_aparelho else None,
                 modelo_aparelho=modelo_aparelho if modelo_aparelho else None,
-                material_adicional=material_adicional,
-                valor_material_adicional=valor_material,
+                material_adicional=config['material_adicional'],
+                valor_material_adicional=calculo['valor_material'],
                 custos_adicionais=custos_adicionais if custos_adicionais else None,
                 valor_base=calculo['valor_base'],
                 valor_acesso=calculo['valor_acesso'],
@@ -9626,7 +11487,8 @@ def add_orcamento_ar():
         clientes = []
         tecnicos = []
     
-    return render_template('admin/add_orcamento_ar.html', clientes=clientes, tecnicos=tecnicos)
+    return render_template('admin/add_orcamento_ar.html', clientes=clientes, tecnicos=tecnicos,
+                           materiais_preco=tabela_precos_ar().materiais)
 
 @app.route('/admin/orcamentos-ar/<int:orcamento_id>')
 @login_required
@@ -9704,64 +11566,30 @@ def edit_orcamento_ar(orcamento_id):
                 except (ValueError, Exception) as e:
                     print(f"Erro ao validar técnico: {e}")
             orcamento.tecnico_id = tecnico_id_final
-            orcamento.tipo_servico = request.form.get('tipo_servico')
-            orcamento.potencia_btu = int(request.form.get('potencia_btu'))
-            orcamento.tipo_acesso = request.form.get('tipo_acesso')
             orcamento.marca_aparelho = request.form.get('marca_aparelho', '').strip() or None
             orcamento.modelo_aparelho = request.form.get('modelo_aparelho', '').strip() or None
-            material_adicional = request.form.get('material_adicional', '').strip() or None
-            valor_material_adicional = request.form.get('valor_material_adicional', '0').strip()
             orcamento.status = request.form.get('status', 'pendente')
             orcamento.prazo_estimado = request.form.get('prazo_estimado', '').strip() or None
             
-            # Recalcular valores
-            valor_material = 0.00
-            if material_adicional == 'Kit Convencional (3m de tubulação)':
-                valor_material = 250.00
-            elif material_adicional == 'Tubulação extra acima de 3m' and valor_material_adicional:
-                valor_material = float(valor_material_adicional)
-            
-            # Processar custos adicionais
-            custos_adicionais = []
-            custos_itens = request.form.getlist('custo_adicional_item[]')
-            custos_valores = request.form.getlist('custo_adicional_valor[]')
-            
-            for i in range(len(custos_itens)):
-                item = custos_itens[i].strip()
-                valor = custos_valores[i].strip()
-                if item and valor:
-                    try:
-                        custos_adicionais.append({
-                            'item': item,
-                            'valor': float(valor)
-                        })
-                    except:
-                        pass
-            
-            calculo = calcular_preco_orcamento_ar(orcamento.tipo_servico, orcamento.potencia_btu, orcamento.tipo_acesso, material_adicional, valor_material, custos_adicionais if custos_adicionais else None)
-            
-            orcamento.material_adicional = material_adicional
-            orcamento.valor_material_adicional = valor_material
-            orcamento.custos_adicionais = custos_adicionais if custos_adicionais else None
+            # Recalcular valores com a tabela de preços vigente
+            config = _config_orcamento_ar(request.form, request.form.getlist)
+            calculo = tabela_precos_ar(verificar=True).cotar(**config)
+            if not calculo['encontrado']:
+                raise ValueError('El servicio y la potencia elegidos no tienen precio en la tabla vigente.')
+            
+            orcamento.tipo_servico = config['tipo_servico']
+            orcamento.potencia_btu = config['potencia_btu']
+            orcamento.tipo_acesso = config['tipo_acesso']
+            orcamento.material_adicional = config['material_adicional']
+            orcamento.valor_material_adicional = calculo['valor_material']
+            orcamento.custos_adicionais = config['custos_adicionais'] or None
             orcamento.valor_base = calculo['valor_base']
             orcamento.valor_acesso = calculo['valor_acesso']
             orcamento.valor_total = calculo['valor_total']
             orcamento.data_atualizacao = datetime.now()
             
             # Regenerar PDF
-            pdf_result = gerar_pdf_orcamento_ar(orcamento)
-            if pdf_result and pdf_result.get('pdf_id'):
-                # Deletar PDF antigo se existir
-                if orcamento.pdf_id:
-                    try:
-                        pdf_antigo = PDFDocument.query.get(orcamento.pdf_id)
-                        if pdf_antigo:
-                            db.session.delete(pdf_antigo)
-                    except:
-                        pass
-                
-                orcamento.pdf_id = pdf_result['pdf_id']
-                orcamento.pdf_filename = pdf_result['pdf_filename']
+            substituir_pdf_orcamento_ar(orcamento)
             
             db.session.commit()
             
@@ -9803,7 +11631,8 @@ def edit_orcamento_ar(orcamento_id):
             'prazo_estimado': orcamento.prazo_estimado or ''
         }
         
-        return render_template('admin/edit_orcamento_ar.html', orcamento=orcamento_dict, clientes=clientes, tecnicos=tecnicos)
+        return render_template('admin/edit_orcamento_ar.html', orcamento=orcamento_dict, clientes=clientes, tecnicos=tecnicos,
+                               materiais_preco=tabela_precos_ar().materiais)
     except Exception as e:
         print(f"Erro ao editar orçamento: {e}")
         import traceback
@@ -9831,6 +11660,7 @@ def delete_orcamento_ar(orcamento_id):
             try:
                 pdf_doc = PDFDocument.query.get(orcamento.pdf_id)
                 if pdf_doc:
+                    remover_blob(db.session, pdf_doc.storage_key)
                     db.session.delete(pdf_doc)
             except Exception as e:
                 print(f"Erro ao deletar PDF: {e}")
@@ -9863,6 +11693,13 @@ def download_orcamento_ar_pdf(orcamento_id):
             return redirect(url_for('admin_orcamentos_ar'))
         
         pdf_doc = PDFDocument.query.get(orcamento.pdf_id)
+        if pdf_doc and pdf_doc.storage_key:
+            return resposta_blob(
+                pdf_doc.storage_key,
+                mimetype='application/pdf',
+                headers={'Content-Disposition': f'inline; filename={orcamento.pdf_filename or "orcamento.pdf"}'},
+                tamanho=pdf_doc.tamanho
+            )
         if pdf_doc and pdf_doc.dados:
             return Response(
                 pdf_doc.dados,
@@ -9877,6 +11714,110 @@ def download_orcamento_ar_pdf(orcamento_id):
     
     return redirect(url_for('admin_orcamentos_ar'))
 
+@app.route('/admin/orcamentos-ar/cotacao', methods=['POST'])
+@login_required
+def cotar_orcamentos_ar():
+    """Prévia de preço: cota uma ou várias configurações com a tabela vigente
+
+    Aceita o formulário do orçamento ou JSON {"itens": [{tipo_servico, potencia_btu, ...}, ...]}.
+    """
+    dados = request.get_json(silent=True)
+    if isinstance(dados, dict) and isinstance(dados.get('itens'), list):
+        if len(dados['itens']) > MAX_COTACOES_POR_REQUISICAO:
+            return jsonify({'erro': f'Máximo de {MAX_COTACOES_POR_REQUISICAO} configuraciones por consulta.'}), 400
+        configs = [_config_orcamento_ar(item) for item in dados['itens'] if isinstance(item, dict)]
+    else:
+        configs = [_config_orcamento_ar(request.form, request.form.getlist)]
+    
+    tabela = tabela_precos_ar()
+    return jsonify({'versao': tabela.versao, 'cotacoes': tabela.cotar_varios(configs)})
+
+def _tabela_precos_do_form(form, tabela):
+    """Monta os dados de uma nova versão a partir do formulário de edição (mesma estrutura da vigente)"""
+    dados = {'servicos': {}, 'materiais': {}}
+    for i, (nome, regra) in enumerate(tabela.dados['servicos'].items()):
+        acesso = {
+            tipo: form.get(f'servico_{i}_acesso_{k}', '').strip() or '0'
+            for k, tipo in enumerate(ACESSOS_ORCAMENTO_AR) if tipo != 'Fácil'
+        }
+        if 'por_btu' in regra:
+            por_btu = {}
+            for j, btu in enumerate(regra['por_btu']):
+                preco = form.get(f'servico_{i}_preco_{j}', '').strip()
+                if preco:  # Preço em branco tira a potência da tabela
+                    por_btu[btu] = preco
+            dados['servicos'][nome] = {'por_btu': por_btu, 'acesso': acesso}
+        else:
+            total = len(regra['faixas'])
+            faixas = []
+            for j in range(total):
+                limite = form.get(f'servico_{i}_limite_{j}', '').strip() if j < total - 1 else None
+                faixas.append([limite, form.get(f'servico_{i}_preco_{j}', '').strip()])
+            dados['servicos'][nome] = {'faixas': faixas, 'acesso': acesso}
+    
+    for nome, preco in zip(form.getlist('material_nome[]'), form.getlist('material_preco[]')):
+        if nome.strip() and preco.strip():
+            dados['materiais'][nome.strip()] = preco.strip()
+    return dados
+
+def _recalcular_orcamentos_pendentes(tabela):
+    """Aplica a tabela aos orçamentos pendentes e agenda os PDFs - devolve quantos mudaram"""
+    alterados = recalcular_orcamentos_pendentes(db.session, tabela)
+    agendar_pdfs_orcamentos_ar(item['id'] for item in alterados)
+    return len(alterados)
+
+@app.route('/admin/orcamentos-ar/precos', methods=['GET', 'POST'])
+@login_required
+def precos_orcamentos_ar():
+    """Edita a tabela de preços dos orçamentos de ar (cada gravação cria uma nova versão)"""
+    if not use_database():
+        flash('Base de datos no configurada.', 'error')
+        return redirect(url_for('admin_orcamentos_ar'))
+    
+    tabela = tabela_precos_ar(verificar=True)
+    
+    if request.method == 'POST':
+        try:
+            if request.form.get('acao') == 'recalcular':
+                total = _recalcular_orcamentos_pendentes(tabela)
+                flash(f'{total} presupuestos pendientes recalculados con la versión {tabela.versao}.', 'success')
+                return redirect(url_for('precos_orcamentos_ar'))
+            
+            nova = salvar_versao_precos(
+                db.session,
+                _tabela_precos_do_form(request.form, tabela),
+                observacao=request.form.get('observacao', '').strip()[:300],
+                usuario=session.get('admin_username')
+            )
+            mensagem = f'Tabla de precios guardada (versión {nova.versao}).'
+            if request.form.get('recalcular_pendentes'):
+                total = _recalcular_orcamentos_pendentes(nova)
+                mensagem += f' {total} presupuestos pendientes recalculados; los PDF se regeneran en segundo plano.'
+            flash(mensagem, 'success')
+            return redirect(url_for('precos_orcamentos_ar'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+        except Exception as e:
+            print(f"Erro ao salvar tabela de preços: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            flash(f'Error al guardar la tabla de precios: {str(e)}', 'error')
+    
+    try:
+        versoes = historico_precos(db.session)
+        # Pendentes com valores diferentes da tabela vigente (gravados com uma versão anterior)
+        divergentes = comparar_orcamentos_pendentes(db.session, tabela)
+        db.session.commit()
+    except Exception as e:
+        print(f"Erro ao carregar histórico da tabela de preços: {e}")
+        db.session.rollback()
+        versoes, divergentes = [], []
+    
+    return render_template('admin/precos_orcamentos_ar.html', tabela=tabela, versoes=versoes,
+                           divergentes=divergentes, acessos=[a for a in ACESSOS_ORCAMENTO_AR if a != 'Fácil'])
+
 # Handler de erro para arquivos muito grandes
 from werkzeug.exceptions import RequestEntityTooLarge
 
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Pipeline de assets estáticos
+No build (python assets.py) copia os arquivos de static/ para static/dist/ com o
+hash do conteúdo no nome, gera versões .gz/.br dos arquivos de texto e versões
+WebP/AVIF das imagens grandes, e grava um manifest.json com o mapeamento.
+Em execução, url_asset() traduz 'css/style.css' para o nome versionado e
+responder_asset() serve os arquivos de dist/ com cache imutável, escolhendo a
+variante pré-comprimida que o navegador aceita.
+Sem manifest (ex: ambiente local sem build) tudo cai para o static normal.
+
+Uso:
+    python assets.py
+"""
+
+import os
+import io
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:  # Opcional - sem brotli só geramos .gz
+    brotli = None
+
+try:
+    from PIL import Image, features as pil_features
+except ImportError:  # Opcional - sem Pillow as imagens são só versionadas
+    Image = None
+    pil_features = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_NOME = 'dist'
+DIST_DIR = os.path.join(STATIC_DIR, DIST_NOME)
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Pastas de static/ que não são assets (PDFs gerados de ordens/comprovantes)
+PASTAS_IGNORADAS = {DIST_NOME, 'pdfs', 'videos'}
+EXTENSOES_ASSET = {'.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp', '.mp4', '.woff', '.woff2'}
+EXTENSOES_COMPRIMIVEIS = {'.css', '.js', '.svg', '.ico', '.json', '.txt'}
+EXTENSOES_RECOMPRIMIR = {'.png', '.jpg', '.jpeg'}
+LIMITE_RECOMPRESSAO = 100 * 1024  # Só vale a pena recomprimir imagens acima de 100KB
+QUALIDADE_WEBP = 80
+QUALIDADE_AVIF = 55
+
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+
+# Ordem de preferência das variantes na negociação
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+FORMATOS_IMAGEM = ['image/avif', 'image/webp']
+
+
+# ==================== BUILD ====================
+
+def _hash_arquivo(caminho):
+    hasher = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(bloco)
+    return hasher.hexdigest()[:12]
+
+
+def _listar_assets(static_dir):
+    """Retorna os caminhos relativos (com /) dos assets de static/"""
+    for raiz, pastas, arquivos in os.walk(static_dir):
+        if raiz == static_dir:
+            pastas[:] = [p for p in pastas if p not in PASTAS_IGNORADAS]
+        for nome in sorted(arquivos):
+            if os.path.splitext(nome)[1].lower() in EXTENSOES_ASSET:
+                yield os.path.relpath(os.path.join(raiz, nome), static_dir).replace(os.sep, '/')
+
+
+def _comprimir(caminho):
+    """Gera .gz (e .br se disponível) ao lado do arquivo - retorna os encodings gerados"""
+    with open(caminho, 'rb') as f:
+        dados = f.read()
+    gerados = []
+    comprimido = gzip.compress(dados, compresslevel=9, mtime=0)
+    if len(comprimido) < len(dados):
+        with open(caminho + '.gz', 'wb') as f:
+            f.write(comprimido)
+        gerados.append('gzip')
+    if brotli is not None:
+        comprimido = brotli.compress(dados, quality=11)
+        if len(comprimido) < len(dados):
+            with open(caminho + '.br', 'wb') as f:
+                f.write(comprimido)
+            gerados.append('br')
+    return gerados
+
+
+def _recomprimir_imagem(caminho, base_destino):
+    """Gera versões AVIF/WebP menores que o original - retorna {mimetype: caminho}"""
+    if Image is None:
+        return {}
+    tamanho_original = os.path.getsize(caminho)
+    formatos = [('image/webp', 'WEBP', '.webp', {'quality': QUALIDADE_WEBP, 'method': 6})]
+    if pil_features.check('avif'):
+        formatos.insert(0, ('image/avif', 'AVIF', '.avif', {'quality': QUALIDADE_AVIF}))
+
+    gerados = {}
+    with Image.open(caminho) as imagem:
+        imagem.load()
+        if imagem.mode not in ('RGB', 'RGBA'):
+            imagem = imagem.convert('RGBA' if 'transparency' in imagem.info else 'RGB')
+        for mimetype, formato, extensao, opcoes in formatos:
+            buffer = io.BytesIO()
+            try:
+                imagem.save(buffer, formato, **opcoes)
+            except Exception as e:
+                print(f"Aviso: não foi possível gerar {formato} de {caminho}: {e}")
+                continue
+            if buffer.tell() < tamanho_original:
+                destino = base_destino + extensao
+                with open(destino, 'wb') as f:
+                    f.write(buffer.getvalue())
+                gerados[mimetype] = destino
+    return gerados
+
+
+def construir_assets(static_dir=STATIC_DIR, dist_dir=None):
+    """Gera static/dist/ e o manifest.json - retorna o manifest"""
+    dist_dir = dist_dir or os.path.join(static_dir, DIST_NOME)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    manifesto = {'arquivos': {}, 'variantes': {}}
+    bytes_originais = 0
+    bytes_servidos = 0
+
+    for relativo in _listar_assets(static_dir):
+        origem = os.path.join(static_dir, relativo)
+        base, extensao = os.path.splitext(relativo)
+        versionado = f"{base}.{_hash_arquivo(origem)}{extensao}"
+        destino = os.path.join(dist_dir, versionado)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.copy2(origem, destino)
+
+        variantes = {}
+        extensao = extensao.lower()
+        if extensao in EXTENSOES_COMPRIMIVEIS:
+            variantes['encodings'] = _comprimir(destino)
+        if extensao in EXTENSOES_RECOMPRIMIR and os.path.getsize(origem) > LIMITE_RECOMPRESSAO:
+            imagens = _recomprimir_imagem(origem, os.path.splitext(destino)[0])
+            if imagens:
+                variantes['imagens'] = {
+                    mimetype: os.path.relpath(caminho, dist_dir).replace(os.sep, '/')
+                    for mimetype, caminho in imagens.items()
+                }
+
+        tamanho = os.path.getsize(origem)
+        menor = min([tamanho] + [os.path.getsize(destino + sufixo) for enc, sufixo in ENCODINGS if enc in variantes.get('encodings', [])]
+                    + [os.path.getsize(os.path.join(dist_dir, c)) for c in variantes.get('imagens', {}).values()])
+        bytes_originais += tamanho
+        bytes_servidos += menor
+
+        manifesto['arquivos'][relativo] = f"{DIST_NOME}/{versionado}"
+        if variantes:
+            manifesto['variantes'][versionado] = variantes
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, sort_keys=True)
+
+    economia = bytes_originais - bytes_servidos
+    print(f"✅ {len(manifesto['arquivos'])} assets versionados em {dist_dir}")
+    print(f"   {bytes_originais / 1024:.0f}KB originais -> {bytes_servidos / 1024:.0f}KB na melhor variante "
+          f"({economia / 1024:.0f}KB a menos)")
+    if brotli is None:
+        print("   Aviso: módulo brotli não instalado - apenas .gz gerado")
+    return manifesto
+
+
+# ==================== EXECUÇÃO ====================
+
+_manifesto = None
+
+
+def carregar_manifesto(caminho=MANIFEST_PATH):
+    """Carrega o manifest.json gerado no build (vazio se não existir)"""
+    global _manifesto
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            _manifesto = json.load(f)
+        print(f"Assets versionados: {len(_manifesto.get('arquivos', {}))} arquivos no manifest")
+    except FileNotFoundError:
+        _manifesto = {'arquivos': {}, 'variantes': {}}
+    except Exception as e:
+        print(f"Erro ao carregar manifest de assets: {e}")
+        _manifesto = {'arquivos': {}, 'variantes': {}}
+    return _manifesto
+
+
+def url_asset(filename):
+    """Traduz o caminho lógico (ex: 'css/style.css') para o versionado, se existir"""
+    if _manifesto is None or not filename:
+        return filename
+    return _manifesto['arquivos'].get(filename.lstrip('/'), filename)
+
+
+def _aceita_explicitamente(accept, mimetype):
+    """True se o cabeçalho Accept lista o tipo (ignora curingas como */*)"""
+    return any(valor == mimetype and qualidade > 0 for valor, qualidade in accept)
+
+
+def responder_asset(filename, request, send_from_directory):
+    """Serve um arquivo de static/dist/ com cache imutável e a melhor variante aceita
+
+    Retorna None se o arquivo não for um asset versionado (o chamador usa o static normal).
+    """
+    if _manifesto is None or not filename.startswith(DIST_NOME + '/'):
+        return None
+    versionado = filename[len(DIST_NOME) + 1:]
+    variantes = _manifesto['variantes'].get(versionado, {})
+    arquivo = versionado
+    encoding = None
+    vary = []
+
+    imagens = variantes.get('imagens')
+    if imagens:
+        vary.append('Accept')
+        for mimetype in FORMATOS_IMAGEM:
+            if mimetype in imagens and _aceita_explicitamente(request.accept_mimetypes, mimetype):
+                arquivo = imagens[mimetype]
+                break
+
+    encodings = variantes.get('encodings')
+    if encodings:
+        vary.append('Accept-Encoding')
+        for nome, sufixo in ENCODINGS:
+            if nome in encodings and request.accept_encodings[nome]:
+                encoding = nome
+                arquivo = versionado + sufixo
+                break
+
+    mimetype = mimetypes.guess_type(arquivo if encoding is None else versionado)[0]
+    response = send_from_directory(DIST_DIR, arquivo, mimetype=mimetype, max_age=31536000)
+    response.headers['Cache-Control'] = CACHE_IMUTAVEL
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if vary:
+        response.vary.update(vary)
+    return response
+
+
+if __name__ == '__main__':
+    destino = sys.argv[1] if len(sys.argv) > 1 else None
+    construir_assets(dist_dir=destino)
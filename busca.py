@@ -0,0 +1,298 @@
+"""
+Busca unificada do admin (clientes, ordens de serviço e manuais)
+No PostgreSQL cada tabela ganha uma coluna tsvector gerada (busca_tsv) com
+índice GIN, e o pg_trgm (quando a extensão pode ser criada) cobre a busca
+aproximada por nome e por telefone/DNI só com dígitos. Uma única consulta
+junta as três tabelas, ordena pela relevância e pagina.
+
+Sem banco (modo JSON) a busca usa um índice invertido em memória montado a
+partir de data/clients.json, com a mesma ordenação por relevância.
+"""
+
+import re
+import bisect
+import unicodedata
+from difflib import SequenceMatcher
+
+from sqlalchemy import text
+
+POR_PAGINA = 20
+MIN_DIGITOS_TELEFONE = 4  # Abaixo disso qualquer telefone casaria
+LIMIAR_SIMILARIDADE = 0.3  # Padrão do operador % do pg_trgm
+
+# Colunas tsvector geradas: (tabela, expressão). Pesos: A = identificação, B = detalhes, C = resto
+COLUNAS_TSV = {
+    'clientes': """
+        setweight(to_tsvector('simple'::regconfig, coalesce(nome, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(username, '') || ' ' || coalesce(email, '') || ' ' ||
+                              coalesce(cpf, '') || ' ' || coalesce(telefone, '')), 'B') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(endereco, '')), 'C')
+    """,
+    'ordens_servico': """
+        setweight(to_tsvector('simple'::regconfig, coalesce(numero_ordem, '') || ' ' || coalesce(numero_serie, '') || ' ' ||
+                              coalesce(marca, '') || ' ' || coalesce(modelo, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(defeitos_cliente, '') || ' ' ||
+                              coalesce(diagnostico_tecnico, '')), 'B') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(servico, '') || ' ' || coalesce(tipo_aparelho, '')), 'C')
+    """,
+    'manuais': """
+        setweight(to_tsvector('simple'::regconfig, coalesce(titulo, '')), 'A') ||
+        setweight(to_tsvector('simple'::regconfig, coalesce(pdf_filename, '')), 'B')
+    """,
+    'manual_paginas': "to_tsvector('simple'::regconfig, coalesce(texto, ''))",
+}
+
+# Só dígitos: '(11) 98765-4321' e '11987654321' viram a mesma coisa
+_SQL_DIGITOS = "regexp_replace(coalesce({coluna}, ''), '[^0-9]', '', 'g')"
+
+INDICES_TRGM = [
+    ('ix_clientes_nome_trgm', 'clientes', 'nome'),
+    ('ix_clientes_telefone_trgm', 'clientes', _SQL_DIGITOS.format(coluna='telefone')),
+    ('ix_clientes_cpf_trgm', 'clientes', _SQL_DIGITOS.format(coluna='cpf')),
+    ('ix_ordens_numero_serie_trgm', 'ordens_servico', 'numero_serie'),
+    ('ix_ordens_modelo_trgm', 'ordens_servico', 'modelo'),
+    ('ix_manuais_titulo_trgm', 'manuais', 'titulo'),  # Também atende o ILIKE de admin_manuais
+]
+
+# Recursos disponíveis no banco (preenchido por garantir_indices_busca)
+recursos = {'fts': False, 'trgm': False}
+
+
+def garantir_indices_busca(engine):
+    """Cria colunas busca_tsv, índices GIN e (se possível) pg_trgm - retorna os recursos disponíveis"""
+    try:
+        with engine.begin() as conn:
+            for tabela, expressao in COLUNAS_TSV.items():
+                conn.execute(text(
+                    f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS busca_tsv tsvector "
+                    f"GENERATED ALWAYS AS ({expressao}) STORED"
+                ))
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{tabela}_busca_tsv ON {tabela} USING GIN (busca_tsv)"))
+        recursos['fts'] = True
+    except Exception as e:
+        print(f"Aviso: busca textual indisponível (colunas tsvector): {e}")
+
+    try:
+        with engine.begin() as conn:
+            # Exige permissão de criar extensões - sem ela a busca segue sem o modo aproximado
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for nome, tabela, expressao in INDICES_TRGM:
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} USING GIN (({expressao}) gin_trgm_ops)"
+                ))
+        recursos['trgm'] = True
+    except Exception as e:
+        print(f"Aviso: pg_trgm indisponível, busca aproximada desativada: {e}")
+    return dict(recursos)
+
+
+def _tokens(termo):
+    return re.findall(r'\w+', termo.lower())
+
+
+def _tsquery(termo):
+    """'iphone 8 tela' -> 'iphone:* & 8:* & tela:*' (prefixo, todos os termos)"""
+    return ' & '.join(f"{token}:*" for token in _tokens(termo))
+
+
+def _digitos(termo):
+    return re.sub(r'\D', '', termo)
+
+
+def buscar_banco(session, termo, pagina=1, por_pagina=POR_PAGINA):
+    """Busca nas três tabelas com uma consulta - retorna (resultados, total)"""
+    tsquery = _tsquery(termo)
+    if not tsquery:
+        return [], 0
+    digitos = _digitos(termo)
+    trgm = recursos['trgm']
+    usar_digitos = trgm and len(digitos) >= MIN_DIGITOS_TELEFONE
+    telefone = _SQL_DIGITOS.format(coluna='c.telefone')
+    cpf = _SQL_DIGITOS.format(coluna='c.cpf')
+
+    def condicao(base, *aproximadas):
+        extras = [a for a in aproximadas if a]
+        return ' OR '.join([base] + extras) if trgm else base
+
+    def relevancia(tsv, *similaridades):
+        if not trgm:
+            return f"ts_rank({tsv}, q.consulta)"
+        return f"ts_rank({tsv}, q.consulta) + greatest({', '.join(similaridades)})"
+
+    sim_digitos = f"CASE WHEN {telefone} LIKE :digitos_like OR {cpf} LIKE :digitos_like THEN 1 ELSE 0 END" \
+        if usar_digitos else '0'
+    cond_digitos = f"{telefone} LIKE :digitos_like OR {cpf} LIKE :digitos_like" if usar_digitos else None
+
+    sql = f"""
+        WITH q AS (SELECT to_tsquery('simple', :tsquery) AS consulta)
+        SELECT tipo, id, titulo, detalhe, cliente_id, relevancia, COUNT(*) OVER () AS total
+        FROM (
+            SELECT 'cliente' AS tipo, c.id, c.nome AS titulo,
+                   concat_ws(' · ', c.telefone, c.email, c.cpf) AS detalhe, c.id AS cliente_id,
+                   {relevancia('c.busca_tsv', 'similarity(c.nome, :termo)', sim_digitos)} AS relevancia
+            FROM clientes c, q
+            WHERE {condicao('c.busca_tsv @@ q.consulta', 'c.nome % :termo', cond_digitos)}
+
+            UNION ALL
+
+            SELECT 'ordem', o.id, '#' || o.numero_ordem || ' · ' || concat_ws(' ', o.marca, o.modelo),
+                   concat_ws(' · ', o.numero_serie, left(o.defeitos_cliente, 120), o.status), o.cliente_id,
+                   {relevancia('o.busca_tsv', 'similarity(o.numero_serie, :termo)', 'similarity(o.modelo, :termo)')}
+            FROM ordens_servico o, q
+            WHERE {condicao('o.busca_tsv @@ q.consulta', 'o.numero_serie % :termo', 'o.modelo % :termo')}
+
+            UNION ALL
+
+            SELECT 'manual', m.id, m.titulo, m.pdf_filename, NULL,
+                   {relevancia('m.busca_tsv', 'similarity(m.titulo, :termo)')}
+            FROM manuais m, q
+            WHERE {condicao('m.busca_tsv @@ q.consulta', 'm.titulo % :termo')}
+        ) resultados
+        ORDER BY relevancia DESC, tipo, id DESC
+        LIMIT :limite OFFSET :offset
+    """
+    parametros = {
+        'tsquery': tsquery, 'termo': termo, 'digitos_like': f"%{digitos}%",
+        'limite': por_pagina, 'offset': (max(pagina, 1) - 1) * por_pagina,
+    }
+    linhas = session.execute(text(sql), parametros).mappings().all()
+    total = linhas[0]['total'] if linhas else 0
+    if not linhas and pagina > 1:
+        # Página além do fim: o COUNT(*) OVER () não vem sem linhas
+        _, total = buscar_banco(session, termo, 1, 1)
+    return [dict(linha) for linha in linhas], total
+
+
+# Marcadores do trecho destacado - trocados por <mark> depois de escapar o HTML do texto do PDF
+MARCA_INICIO = '\u27e6'
+MARCA_FIM = '\u27e7'
+
+
+def buscar_paginas_manuais(session, termo, pagina=1, por_pagina=POR_PAGINA):
+    """Páginas de manuais que contêm o termo - retorna (resultados, total)
+
+    Cada resultado traz manual_id, titulo, pagina e um trecho com os termos entre
+    MARCA_INICIO/MARCA_FIM. O ts_headline (caro) só roda nas linhas da página pedida.
+    """
+    tsquery = _tsquery(termo)
+    if not tsquery:
+        return [], 0
+    linhas = session.execute(text(f"""
+        WITH q AS (SELECT to_tsquery('simple', :tsquery) AS consulta),
+        encontradas AS (
+            SELECT p.id, p.manual_id, p.pagina, ts_rank(p.busca_tsv, q.consulta) AS relevancia,
+                   COUNT(*) OVER () AS total
+            FROM manual_paginas p, q
+            WHERE p.busca_tsv @@ q.consulta
+            ORDER BY relevancia DESC, p.manual_id, p.pagina
+            LIMIT :limite OFFSET :offset
+        )
+        SELECT e.manual_id, m.titulo, e.pagina, e.relevancia, e.total,
+               ts_headline('simple', p.texto, q.consulta,
+                           'MaxFragments=2, MaxWords=25, MinWords=8, FragmentDelimiter=" … ", '
+                           'StartSel={MARCA_INICIO}, StopSel={MARCA_FIM}') AS trecho
+        FROM encontradas e
+        JOIN manual_paginas p ON p.id = e.id
+        JOIN manuais m ON m.id = e.manual_id, q
+        ORDER BY e.relevancia DESC, e.manual_id, e.pagina
+    """), {'tsquery': tsquery, 'limite': por_pagina, 'offset': (max(pagina, 1) - 1) * por_pagina}).mappings().all()
+    total = linhas[0]['total'] if linhas else 0
+    return [dict(linha) for linha in linhas], total
+
+
+# ==================== FALLBACK EM MEMÓRIA (MODO JSON) ====================
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+class IndiceBusca:
+    """Índice invertido simples: token -> {documento: peso}, com busca por prefixo"""
+
+    PESOS = {'A': 1.0, 'B': 0.4, 'C': 0.1}
+
+    def __init__(self):
+        self.documentos = []
+        self._postings = {}
+        self._vocabulario = []
+
+    def adicionar(self, documento, campos):
+        """documento: dict do resultado; campos: {'A': texto, 'B': texto, ...}"""
+        indice = len(self.documentos)
+        documento = dict(documento)
+        documento['_nome'] = _normalizar(documento.get('titulo'))
+        documento['_digitos'] = _digitos(' '.join(str(campos.get(p) or '') for p in ('B', 'A')))
+        self.documentos.append(documento)
+        for peso, texto in campos.items():
+            for token in _tokens(_normalizar(texto)):
+                postings = self._postings.setdefault(token, {})
+                postings[indice] = postings.get(indice, 0) + self.PESOS[peso]
+        self._vocabulario = []  # Reordenado na próxima busca
+
+    def _por_prefixo(self, prefixo):
+        if not self._vocabulario:
+            self._vocabulario = sorted(self._postings)
+        inicio = bisect.bisect_left(self._vocabulario, prefixo)
+        pontos = {}
+        for token in self._vocabulario[inicio:]:
+            if not token.startswith(prefixo):
+                break
+            for indice, peso in self._postings[token].items():
+                pontos[indice] = pontos.get(indice, 0) + peso
+        return pontos
+
+    def buscar(self, termo, pagina=1, por_pagina=POR_PAGINA):
+        """Mesma semântica do banco: todos os termos por prefixo, ou nome/telefone aproximados"""
+        tokens = _tokens(_normalizar(termo))
+        if not tokens:
+            return [], 0
+        pontos = None
+        for token in tokens:
+            do_token = self._por_prefixo(token)
+            pontos = do_token if pontos is None else {
+                i: p + do_token[i] for i, p in pontos.items() if i in do_token
+            }
+        pontos = pontos or {}
+
+        termo_normalizado = _normalizar(termo)
+        digitos = _digitos(termo)
+        for indice, documento in enumerate(self.documentos):
+            similaridade = SequenceMatcher(None, termo_normalizado, documento['_nome']).ratio()
+            if similaridade >= LIMIAR_SIMILARIDADE * 2:  # SequenceMatcher é mais generoso que trigramas
+                pontos[indice] = pontos.get(indice, 0) + similaridade
+            if len(digitos) >= MIN_DIGITOS_TELEFONE and digitos in documento['_digitos']:
+                pontos[indice] = pontos.get(indice, 0) + 1
+
+        ordenados = sorted(pontos.items(), key=lambda item: (-item[1], item[0]))
+        inicio = (max(pagina, 1) - 1) * por_pagina
+        resultados = []
+        for indice, relevancia in ordenados[inicio:inicio + por_pagina]:
+            documento = {k: v for k, v in self.documentos[indice].items() if not k.startswith('_')}
+            documento['relevancia'] = relevancia
+            resultados.append(documento)
+        return resultados, len(ordenados)
+
+
+def indice_de_clientes_json(dados):
+    """Monta o IndiceBusca a partir do conteúdo de clients.json (clientes e ordens aninhadas)"""
+    indice = IndiceBusca()
+    for cliente in dados.get('clients', []):
+        indice.adicionar(
+            {'tipo': 'cliente', 'id': cliente.get('id'), 'titulo': cliente.get('nome'), 'cliente_id': cliente.get('id'),
+             'detalhe': ' · '.join(str(v) for v in (cliente.get('telefone'), cliente.get('email'), cliente.get('cpf')) if v)},
+            {'A': cliente.get('nome'),
+             'B': ' '.join(str(cliente.get(c) or '') for c in ('username', 'email', 'cpf', 'telefone')),
+             'C': cliente.get('endereco')},
+        )
+        for ordem in cliente.get('ordens', []):
+            indice.adicionar(
+                {'tipo': 'ordem', 'id': ordem.get('id'), 'cliente_id': cliente.get('id'),
+                 'titulo': f"#{ordem.get('numero_ordem')} · {ordem.get('marca') or ''} {ordem.get('modelo') or ''}".strip(),
+                 'detalhe': ' · '.join(str(v) for v in (ordem.get('numero_serie'), (ordem.get('defeitos_cliente') or '')[:120],
+                                                      ordem.get('status')) if v)},
+                {'A': ' '.join(str(ordem.get(c) or '') for c in ('numero_ordem', 'numero_serie', 'marca', 'modelo')),
+                 'B': f"{ordem.get('defeitos_cliente') or ''} {ordem.get('diagnostico_tecnico') or ''}",
+                 'C': f"{ordem.get('servico') or ''} {ordem.get('tipo_aparelho') or ''}"},
+            )
+    return indice
@@ -0,0 +1,87 @@
+"""
+Caches em memória e limitador de requisições
+Estruturas simples e thread-safe usadas pelas rotas públicas.
+O estado é por worker do gunicorn (cada processo tem o seu)
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class LRUCache:
+    """Cache LRU com tamanho máximo e expiração opcional (TTL em segundos)"""
+
+    _AUSENTE = object()
+
+    def __init__(self, max_itens=1024, ttl=None):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._itens.get(chave, self._AUSENTE)
+            if item is self._AUSENTE:
+                return padrao
+            valor, expira_em = item
+            if expira_em is not None and expira_em < time.monotonic():
+                del self._itens[chave]
+                return padrao
+            self._itens.move_to_end(chave)
+            return valor
+
+    def __contains__(self, chave):
+        return self.get(chave, self._AUSENTE) is not self._AUSENTE
+
+    def set(self, chave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira_em = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._itens[chave] = (valor, expira_em)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._itens)
+
+
+class RateLimiter:
+    """Limita requisições por chave (ex: IP) em uma janela deslizante"""
+
+    def __init__(self, limite, janela, max_chaves=10000):
+        self.limite = limite
+        self.janela = janela
+        self.max_chaves = max_chaves
+        self._acessos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def permitir(self, chave):
+        """Registra um acesso e retorna False se a chave passou do limite"""
+        agora = time.monotonic()
+        with self._lock:
+            acessos = self._acessos.get(chave)
+            if acessos is None:
+                acessos = deque()
+                self._acessos[chave] = acessos
+                while len(self._acessos) > self.max_chaves:
+                    self._acessos.popitem(last=False)
+            else:
+                self._acessos.move_to_end(chave)
+            while acessos and acessos[0] <= agora - self.janela:
+                acessos.popleft()
+            if len(acessos) >= self.limite:
+                return False
+            acessos.append(agora)
+            return True
@@ -0,0 +1,96 @@
+"""
+Feed iCalendar (.ics) da agenda
+Os eventos chegam de um iterador (cursor do banco com yield_per) e o
+calendário sai em blocos, como as planilhas de exportacao.py. Texto
+escapado e linhas dobradas em 75 octetos conforme a RFC 5545.
+"""
+
+import hmac
+import hashlib
+from datetime import datetime, timedelta
+
+TAMANHO_BLOCO = 32 * 1024
+
+# Status do agendamento -> STATUS do VEVENT
+STATUS_ICS = {
+    'pendente': 'TENTATIVE',
+    'confirmado': 'CONFIRMED',
+    'concluido': 'CONFIRMED',
+    'cancelado': 'CANCELLED',
+}
+
+
+def token_feed(segredo, tecnico_id):
+    """Token da URL do feed (o app de calendário não tem a sessão do admin)"""
+    return hmac.new(str(segredo).encode('utf-8'), f'agenda-tecnico:{tecnico_id}'.encode('utf-8'),
+                    hashlib.sha256).hexdigest()[:32]
+
+
+def token_valido(segredo, tecnico_id, token):
+    return hmac.compare_digest(token_feed(segredo, tecnico_id), token or '')
+
+
+def _escapar(texto):
+    return (str(texto or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n').replace('\r', '\\n'))
+
+
+def _dobrar(linha):
+    """Quebra a linha em partes de até 75 octetos (continuação começa com espaço)"""
+    dados = linha.encode('utf-8')
+    if len(dados) <= 75:
+        return linha + '\r\n'
+    partes = []
+    limite = 75
+    while dados:
+        corte = min(limite, len(dados))
+        # Não corta no meio de um caractere UTF-8
+        while corte < len(dados) and (dados[corte] & 0xC0) == 0x80:
+            corte -= 1
+        partes.append(dados[:corte].decode('utf-8'))
+        dados = dados[corte:]
+        limite = 74  # O espaço da continuação conta
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def _data_hora(valor):
+    return valor.strftime('%Y%m%dT%H%M%S')
+
+
+def evento_ics(uid, inicio, duracao_minutos, resumo, descricao='', status='pendente', atualizado_em=None):
+    """Um VEVENT (horário local flutuante, como o resto do sistema)"""
+    fim = inicio + timedelta(minutes=duracao_minutos or 30)
+    linhas = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}',
+        f'DTSTAMP:{_data_hora(atualizado_em or datetime.now())}',
+        f'DTSTART:{_data_hora(inicio)}',
+        f'DTEND:{_data_hora(fim)}',
+        f'SUMMARY:{_escapar(resumo)}',
+    ]
+    if descricao:
+        linhas.append(f'DESCRIPTION:{_escapar(descricao)}')
+    linhas.append(f"STATUS:{STATUS_ICS.get(status or 'pendente', 'TENTATIVE')}")
+    linhas.append('END:VEVENT')
+    return ''.join(_dobrar(linha) for linha in linhas)
+
+
+def gerar_ics(nome_calendario, eventos):
+    """Gera o calendário em blocos de bytes - `eventos` é um iterador de strings de evento_ics()"""
+    partes = [''.join(_dobrar(linha) for linha in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Clinica de Reparacion//Agenda//ES',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escapar(nome_calendario)}',
+    ))]
+    tamanho = len(partes[0])
+    for evento in eventos:
+        partes.append(evento)
+        tamanho += len(evento)
+        if tamanho >= TAMANHO_BLOCO:
+            yield ''.join(partes).encode('utf-8')
+            partes, tamanho = [], 0
+    partes.append('END:VCALENDAR\r\n')
+    yield ''.join(partes).encode('utf-8')
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Compressão de respostas (middleware WSGI)
+Comprime com brotli ou gzip, conforme o Accept-Encoding, as respostas de texto
+(HTML, JSON, CSS...) acima de um tamanho mínimo. A compressão é feita bloco a
+bloco conforme o corpo é gerado, então respostas em streaming continuam
+chegando aos poucos. Blobs (imagens, PDFs, vídeos) ficam de fora pela lista
+de tipos, e respostas que já têm Content-Encoding (ex: assets .br/.gz de
+static/dist) passam direto.
+
+Benchmark:
+    python compressao.py [rota ...]
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Opcional - sem brotli só usamos gzip
+    brotli = None
+
+TAMANHO_MINIMO = 1024  # Abaixo disso o cabeçalho gzip/brotli não compensa
+NIVEL_GZIP = 6
+QUALIDADE_BROTLI = 5  # Qualidade alta demais custa CPU por requisição
+
+TIPOS_COMPRIMIVEIS = {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/csv', 'text/calendar', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'application/rss+xml',
+    'image/svg+xml',
+}
+
+# Rotas de blobs (imagens/PDFs/manuais) - já são formatos comprimidos; a lista de
+# tipos já as exclui, os prefixos evitam até a negociação
+PREFIXOS_IGNORADOS = ('/static/dist/', '/media/', '/admin/download-pdf/', '/cliente/download-pdf/')
+
+STATUS_SEM_CORPO = ('1', '204', '304')
+
+
+def escolher_encoding(accept_encoding):
+    """Escolhe 'br', 'gzip' ou None a partir do cabeçalho Accept-Encoding"""
+    if not accept_encoding:
+        return None
+    aceitos = {}
+    for parte in accept_encoding.lower().split(','):
+        nome, _, parametros = parte.strip().partition(';')
+        qualidade = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith('q='):
+            try:
+                qualidade = float(parametros[2:])
+            except ValueError:
+                qualidade = 0.0
+        aceitos[nome.strip()] = qualidade
+    curinga = aceitos.get('*', 0.0)
+    opcoes = [('br', aceitos.get('br', curinga))] if brotli is not None else []
+    opcoes.append(('gzip', aceitos.get('gzip', curinga)))
+    opcoes = [(nome, q) for nome, q in opcoes if q > 0]
+    if not opcoes:
+        return None
+    # Empate na qualidade: preferir br (vem primeiro)
+    return max(opcoes, key=lambda item: item[1])[0]
+
+
+class _Compressor:
+    """Interface comum para gzip e brotli"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._obj = brotli.Compressor(quality=QUALIDADE_BROTLI)
+        else:
+            self._obj = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)  # 31 = formato gzip
+
+    def comprimir(self, dados, flush=False):
+        if self.encoding == 'br':
+            saida = self._obj.process(dados)
+            return saida + self._obj.flush() if flush else saida
+        saida = self._obj.compress(dados)
+        return saida + self._obj.flush(zlib.Z_SYNC_FLUSH) if flush else saida
+
+    def finalizar(self):
+        if self.encoding == 'br':
+            return self._obj.finish()
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class CompressaoMiddleware:
+    """Middleware WSGI de compressão com negociação, tamanho mínimo e lista de tipos"""
+
+    def __init__(self, app, tamanho_minimo=TAMANHO_MINIMO, tipos=None, prefixos_ignorados=PREFIXOS_IGNORADOS):
+        self.app = app
+        self.tamanho_minimo = tamanho_minimo
+        self.tipos = tipos or TIPOS_COMPRIMIVEIS
+        self.prefixos_ignorados = prefixos_ignorados
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get('REQUEST_METHOD') != 'HEAD' and not environ.get('PATH_INFO', '').startswith(self.prefixos_ignorados):
+            encoding = escolher_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        decisao = {}
+
+        def start_response_comprimido(status, headers, exc_info=None):
+            compressor = self._decidir(status, headers, encoding)
+            if compressor is not None:
+                decisao['compressor'] = compressor
+                decisao['streaming'] = not any(nome.lower() == 'content-length' for nome, _ in headers)
+                headers = self._ajustar_headers(headers, encoding)
+            elif self._tipo_comprimivel(headers):
+                headers = self._adicionar_vary(list(headers))
+            return start_response(status, headers, exc_info)
+
+        app_iter = self.app(environ, start_response_comprimido)
+        if 'compressor' not in decisao:
+            return app_iter
+        return self._comprimir_iter(app_iter, decisao['compressor'], decisao['streaming'])
+
+    def _tipo_comprimivel(self, headers):
+        for nome, valor in headers:
+            if nome.lower() == 'content-type':
+                return valor.split(';', 1)[0].strip().lower() in self.tipos
+        return False
+
+    def _decidir(self, status, headers, encoding):
+        """Retorna um _Compressor se a resposta deve ser comprimida"""
+        if status.startswith(STATUS_SEM_CORPO):
+            return None
+        if not self._tipo_comprimivel(headers):
+            return None
+        for nome, valor in headers:
+            nome = nome.lower()
+            if nome in ('content-encoding', 'content-range'):
+                return None
+            if nome == 'cache-control' and 'no-transform' in valor.lower():
+                return None
+            if nome == 'content-length':
+                try:
+                    if int(valor) < self.tamanho_minimo:
+                        return None
+                except ValueError:
+                    return None
+        return _Compressor(encoding)
+
+    @staticmethod
+    def _adicionar_vary(headers):
+        for i, (nome, valor) in enumerate(headers):
+            if nome.lower() == 'vary':
+                if 'accept-encoding' not in valor.lower():
+                    headers[i] = (nome, f"{valor}, Accept-Encoding")
+                return headers
+        headers.append(('Vary', 'Accept-Encoding'))
+        return headers
+
+    def _ajustar_headers(self, headers, encoding):
+        novos = []
+        for nome, valor in headers:
+            minusculo = nome.lower()
+            if minusculo == 'content-length':
+                continue
+            if minusculo == 'etag' and not valor.startswith('W/'):
+                valor = 'W/' + valor  # O corpo mudou de bytes - ETag forte deixaria de valer
+            novos.append((nome, valor))
+        novos.append(('Content-Encoding', encoding))
+        return self._adicionar_vary(novos)
+
+    @staticmethod
+    def _comprimir_iter(app_iter, compressor, streaming):
+        """Comprime bloco a bloco; em streaming faz flush a cada bloco para não segurar o conteúdo"""
+        try:
+            for bloco in app_iter:
+                if not bloco:
+                    continue
+                saida = compressor.comprimir(bloco, flush=streaming)
+                if saida:
+                    yield saida
+            yield compressor.finalizar()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+# ==================== BENCHMARK ====================
+
+def benchmark(app, rotas, repeticoes=20):
+    """Mede bytes economizados e CPU gasta por rota e encoding - retorna lista de dicts"""
+    import time
+
+    cliente = app.test_client()
+    resultados = []
+    for rota in rotas:
+        original = cliente.get(rota, headers={'Accept-Encoding': 'identity'})
+        tamanho_original = len(original.get_data())
+        tipo = original.headers.get('Content-Type', '').split(';')[0]
+        for encoding in (['br'] if brotli is not None else []) + ['gzip']:
+            inicio = time.process_time()
+            for _ in range(repeticoes):
+                resposta = cliente.get(rota, headers={'Accept-Encoding': encoding})
+                corpo = resposta.get_data()
+            cpu_total = (time.process_time() - inicio) / repeticoes
+            inicio = time.process_time()
+            for _ in range(repeticoes):
+                cliente.get(rota, headers={'Accept-Encoding': 'identity'}).get_data()
+            cpu_base = (time.process_time() - inicio) / repeticoes
+            resultados.append({
+                'rota': rota,
+                'tipo': tipo,
+                'encoding': resposta.headers.get('Content-Encoding') or 'nenhum',
+                'original': tamanho_original,
+                'comprimido': len(corpo),
+                'cpu_ms': max(cpu_total - cpu_base, 0.0) * 1000,
+            })
+    return resultados
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    rotas = sys.argv[1:] or ['/', '/sobre', '/reparos', '/videos', '/api/servicos', '/static/css/style.css']
+    print(f"{'rota':<28} {'tipo':<18} {'enc':<7} {'original':>10} {'comprimido':>10} {'economia':>9} {'cpu/resp':>9}")
+    for r in benchmark(app, rotas):
+        economia = 1 - r['comprimido'] / r['original'] if r['original'] else 0
+        print(f"{r['rota']:<28} {r['tipo']:<18} {r['encoding']:<7} {r['original']:>10} {r['comprimido']:>10} "
+              f"{economia:>8.0%} {r['cpu_ms']:>7.2f}ms")
@@ -0,0 +1,157 @@
+"""
+Contador de visitas com escrita adiada (write-behind)
+As visitas são somadas em memória, por worker, e gravadas no banco em lote a
+cada INTERVALO_FLUSH segundos (e na saída do worker). Assim a página inicial
+não faz nenhuma escrita no banco; em caso de queda perde-se no máximo um
+intervalo de contagem.
+
+Além do total (visit_counter), guarda um balde por dia (visitas_diarias) com a
+contagem e, opcionalmente, um HyperLogLog para estimar visitantes únicos.
+"""
+
+import atexit
+import hashlib
+import math
+import threading
+from datetime import date
+
+from sqlalchemy import text
+
+INTERVALO_FLUSH = 30  # segundos
+HLL_PRECISAO = 11  # 2048 registradores (~2,3% de erro padrão, 2KB por dia)
+
+
+class HyperLogLog:
+    """Estimador de cardinalidade (visitantes únicos) com registradores de 1 byte"""
+
+    def __init__(self, precisao=HLL_PRECISAO, registradores=None):
+        self.precisao = precisao
+        self.m = 1 << precisao
+        self.registradores = bytearray(registradores) if registradores else bytearray(self.m)
+
+    def adicionar(self, valor):
+        h = int.from_bytes(hashlib.sha1(valor.encode('utf-8')).digest()[:8], 'big')
+        indice = h >> (64 - self.precisao)
+        resto = h & ((1 << (64 - self.precisao)) - 1)
+        posicao = (64 - self.precisao) - resto.bit_length() + 1
+        if posicao > self.registradores[indice]:
+            self.registradores[indice] = posicao
+
+    def unir(self, outro):
+        """Mescla outro HyperLogLog (ou os bytes dos registradores) neste"""
+        registradores = outro.registradores if isinstance(outro, HyperLogLog) else outro
+        if not registradores or len(registradores) != self.m:
+            return
+        self.registradores = bytearray(max(a, b) for a, b in zip(self.registradores, registradores))
+
+    def estimar(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimativa = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registradores)
+        zeros = self.registradores.count(0)
+        if estimativa <= 2.5 * self.m and zeros:
+            estimativa = self.m * math.log(self.m / zeros)  # Correção para contagens pequenas
+        return int(round(estimativa))
+
+    def to_bytes(self):
+        return bytes(self.registradores)
+
+
+class ContadorVisitas:
+    """Acumula visitas em memória e grava em lote no banco"""
+
+    def __init__(self, app, db, intervalo=INTERVALO_FLUSH, estimar_unicos=True):
+        self.app = app
+        self.db = db
+        self.intervalo = intervalo
+        self.estimar_unicos = estimar_unicos
+        self._pendentes = {}  # dia -> {'visitas': int, 'hll': HyperLogLog}
+        self._lock = threading.Lock()
+        self._timer_iniciado = False
+
+    def registrar(self, identificador=None):
+        """Conta uma visita (identificador opcional alimenta a estimativa de únicos)"""
+        dia = date.today()
+        with self._lock:
+            balde = self._pendentes.get(dia)
+            if balde is None:
+                balde = self._pendentes[dia] = {'visitas': 0, 'hll': HyperLogLog() if self.estimar_unicos else None}
+            balde['visitas'] += 1
+            if identificador and balde['hll'] is not None:
+                balde['hll'].adicionar(identificador)
+            if not self._timer_iniciado:
+                self._iniciar_timer()
+
+    def pendentes(self):
+        """Total de visitas ainda não gravadas neste worker"""
+        with self._lock:
+            return sum(balde['visitas'] for balde in self._pendentes.values())
+
+    def _iniciar_timer(self):
+        # Iniciado na primeira visita (depois do fork do gunicorn), nunca no import
+        self._timer_iniciado = True
+        atexit.register(self.flush)
+        threading.Thread(target=self._loop, name='contador-visitas', daemon=True).start()
+
+    def _loop(self):
+        evento = threading.Event()
+        while not evento.wait(self.intervalo):
+            self.flush()
+
+    def flush(self):
+        """Grava as visitas acumuladas - em caso de erro elas voltam para a fila"""
+        with self._lock:
+            lote, self._pendentes = self._pendentes, {}
+        if not lote:
+            return 0
+        try:
+            with self.app.app_context():
+                self._gravar(lote)
+            return sum(balde['visitas'] for balde in lote.values())
+        except Exception as e:
+            print(f"Erro ao gravar contador de visitas: {e}")
+            self._devolver(lote)
+            return 0
+
+    def _devolver(self, lote):
+        with self._lock:
+            for dia, balde in lote.items():
+                atual = self._pendentes.get(dia)
+                if atual is None:
+                    self._pendentes[dia] = balde
+                    continue
+                atual['visitas'] += balde['visitas']
+                if atual['hll'] is not None and balde['hll'] is not None:
+                    atual['hll'].unir(balde['hll'])
+
+    def _gravar(self, lote):
+        total = sum(balde['visitas'] for balde in lote.values())
+        with self.db.engine.begin() as conn:
+            atualizado = conn.execute(
+                text("UPDATE visit_counter SET count = count + :total, last_updated = now() WHERE id = 1"),
+                {'total': total},
+            ).rowcount
+            if not atualizado:
+                conn.execute(text("""
+                    INSERT INTO visit_counter (id, count, last_updated) VALUES (1, :total, now())
+                    ON CONFLICT (id) DO UPDATE SET count = visit_counter.count + EXCLUDED.count
+                """), {'total': total})
+
+            for dia, balde in lote.items():
+                conn.execute(text("""
+                    INSERT INTO visitas_diarias (dia, visitas, data_atualizacao) VALUES (:dia, :visitas, now())
+                    ON CONFLICT (dia) DO UPDATE
+                    SET visitas = visitas_diarias.visitas + EXCLUDED.visitas, data_atualizacao = now()
+                """), {'dia': dia, 'visitas': balde['visitas']})
+                if balde['hll'] is None:
+                    continue
+                # Os registradores de cada worker são mesclados (máximo) com os do banco
+                atual = conn.execute(
+                    text("SELECT hll FROM visitas_diarias WHERE dia = :dia FOR UPDATE"), {'dia': dia}
+                ).scalar()
+                hll = balde['hll']
+                if atual:
+                    hll.unir(bytes(atual))
+                conn.execute(
+                    text("UPDATE visitas_diarias SET hll = :hll, unicos = :unicos WHERE dia = :dia"),
+                    {'hll': hll.to_bytes(), 'unicos': hll.estimar(), 'dia': dia},
+                )
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Catálogo de peças e estoque
+As peças usadas em cada ordem ficam em ordem_pecas (uma linha por peça,
+com a peça do catálogo quando escolhida no autocomplete ou só a descrição
+quando digitada livre). O JSON `pecas` da ordem continua sendo gravado
+como está - é o que o PDF, o portal e as exportações leem.
+
+O estoque só muda por SQL, na transação da ordem: as peças envolvidas são
+travadas em ordem de id (FOR UPDATE), o que a ordem usava volta para o
+estoque, o saldo é conferido e a baixa é feita. Sem saldo, levanta
+EstoqueInsuficiente e quem chama desfaz a transação inteira - ordem e
+estoque nunca ficam pela metade.
+
+O autocomplete busca por prefixo do nome ou do SKU com índices
+text_pattern_ops em lower(nome)/lower(sku). As ordens antigas têm as peças
+só no JSON: backfill_ordens() copia para ordem_pecas em lotes, ligando à
+peça do catálogo de mesmo nome, sem mexer no estoque - essas linhas ficam
+com baixa_estoque = FALSE e nunca voltam para o estoque.
+
+Uso:
+    python estoque.py --backfill [--lote 500]   # peças das ordens antigas
+    python estoque.py --baixo                   # peças no estoque mínimo ou abaixo
+    python estoque.py <termo>                   # testa o autocomplete
+"""
+
+import sys
+import time
+import threading
+
+from sqlalchemy import text
+
+MAX_SUGESTOES = 10
+LOTE_BACKFILL = 500
+
+_SQL_LOCK_BACKFILL = "hashtext('backfill_ordem_pecas')"
+
+# Estado do backfill em background (consultado pela página do catálogo)
+_estado = {'rodando': False, 'ordens': 0, 'linhas': 0, 'inicio': None, 'fim': None, 'erro': None}
+_lock = threading.Lock()
+
+
+class EstoqueInsuficiente(Exception):
+    """Alguma peça da ordem não tem saldo suficiente"""
+    pass
+
+
+def garantir_indices_estoque(engine):
+    """Índices de prefixo do autocomplete e colunas novas (as tabelas vêm do db.create_all())"""
+    with engine.begin() as conn:
+        # Linhas anteriores à coluna vieram de registrar_pecas_ordem, que dava baixa
+        conn.execute(text("ALTER TABLE ordem_pecas ADD COLUMN IF NOT EXISTS baixa_estoque BOOLEAN NOT NULL DEFAULT TRUE"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pecas_nome_prefixo ON pecas (lower(nome) text_pattern_ops)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pecas_sku_prefixo ON pecas (lower(sku) text_pattern_ops)"))
+
+
+def _prefixo_like(termo):
+    """'Tela 6%' -> 'tela 6\\%%' (curingas do usuário escapados)"""
+    termo = termo.strip().lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return termo + '%'
+
+
+def buscar_pecas(session, termo, limite=MAX_SUGESTOES, somente_ativas=True):
+    """Peças cujo nome ou SKU começa com `termo` - para o autocomplete das ordens"""
+    if not termo or not termo.strip():
+        return []
+    return [dict(linha) for linha in session.execute(text("""
+        SELECT p.id, p.sku, p.nome, p.custo, p.estoque, p.estoque_minimo, p.ativo, f.nome AS fornecedor
+        FROM pecas p
+        LEFT JOIN fornecedores f ON f.id = p.fornecedor_id
+        WHERE (lower(p.nome) LIKE :prefixo ESCAPE '\\' OR lower(p.sku) LIKE :prefixo ESCAPE '\\')
+          AND (p.ativo IS NOT FALSE OR NOT :somente_ativas)
+        ORDER BY lower(p.nome)
+        LIMIT :limite
+    """), {'prefixo': _prefixo_like(termo), 'limite': limite, 'somente_ativas': somente_ativas}).mappings()]
+
+
+def _travar_pecas(session, ids):
+    """Trava as peças em ordem de id (duas ordens concorrentes não se bloqueiam em cruz) - {id: linha}"""
+    if not ids:
+        return {}
+    return {linha['id']: dict(linha) for linha in session.execute(text("""
+        SELECT id, nome, estoque, estoque_minimo FROM pecas
+        WHERE id = ANY(:ids)
+        ORDER BY id
+        FOR UPDATE
+    """), {'ids': sorted(ids)}).mappings()}
+
+
+def _pecas_da_ordem(session, ordem_id):
+    """Peças em que a ordem deu baixa (as que _devolver() vai creditar)"""
+    return {linha[0] for linha in session.execute(text(
+        "SELECT DISTINCT peca_id FROM ordem_pecas WHERE ordem_id = :ordem_id AND peca_id IS NOT NULL AND baixa_estoque"
+    ), {'ordem_id': ordem_id})}
+
+
+def _devolver(session, ordem_id):
+    session.execute(text("""
+        UPDATE pecas p
+        SET estoque = p.estoque + usadas.quantidade, data_atualizacao = now()
+        FROM (
+            SELECT peca_id, SUM(quantidade) AS quantidade
+            FROM ordem_pecas
+            WHERE ordem_id = :ordem_id AND peca_id IS NOT NULL AND baixa_estoque
+            GROUP BY peca_id
+        ) usadas
+        WHERE p.id = usadas.peca_id
+    """), {'ordem_id': ordem_id})
+    session.execute(text("DELETE FROM ordem_pecas WHERE ordem_id = :ordem_id"), {'ordem_id': ordem_id})
+
+
+def devolver_pecas_ordem(session, ordem_id):
+    """Ordem excluída: as peças que deram baixa voltam para o estoque e as linhas saem de ordem_pecas"""
+    _travar_pecas(session, _pecas_da_ordem(session, ordem_id))
+    _devolver(session, ordem_id)
+
+
+def registrar_pecas_ordem(session, ordem_id, pecas):
+    """Substitui as peças da ordem por `pecas` (o JSON da ordem) e ajusta o estoque - retorna as peças abaixo do mínimo
+
+    Itens com 'peca_id' dão baixa de uma unidade cada na peça do catálogo;
+    os demais entram só como descrição. Levanta EstoqueInsuficiente sem
+    saldo; o commit (ou rollback) fica com quem chama.
+    """
+    linhas = []
+    necessario = {}
+    for item in pecas or []:
+        descricao = str(item.get('nome') or '').strip()[:200]
+        if not descricao:
+            continue
+        try:
+            peca_id = int(item['peca_id']) if item.get('peca_id') not in (None, '') else None
+        except (TypeError, ValueError):
+            peca_id = None
+        linhas.append({'ordem_id': ordem_id, 'peca_id': peca_id, 'descricao': descricao,
+                       'custo_unitario': item.get('custo') or 0})
+        if peca_id is not None:
+            necessario[peca_id] = necessario.get(peca_id, 0) + 1
+
+    travadas = _travar_pecas(session, set(necessario) | _pecas_da_ordem(session, ordem_id))
+    _devolver(session, ordem_id)
+
+    for linha in linhas:
+        # Peça removida do catálogo nesse meio tempo: fica só a descrição
+        if linha['peca_id'] is not None and linha['peca_id'] not in travadas:
+            necessario.pop(linha['peca_id'], None)
+            linha['peca_id'] = None
+    if necessario:
+        # Saldo já com a devolução: relê as linhas travadas
+        saldos = {linha[0]: linha[1] for linha in session.execute(text(
+            "SELECT id, estoque FROM pecas WHERE id = ANY(:ids)"
+        ), {'ids': sorted(necessario)})}
+        for peca_id, quantidade in sorted(necessario.items()):
+            if saldos[peca_id] < quantidade:
+                raise EstoqueInsuficiente(
+                    f'Stock insuficiente de "{travadas[peca_id]["nome"]}": '
+                    f'disponible {saldos[peca_id]}, solicitado {quantidade}.'
+                )
+        ids = sorted(necessario)
+        session.execute(text("""
+            UPDATE pecas p
+            SET estoque = p.estoque - baixa.quantidade, data_atualizacao = now()
+            FROM (SELECT unnest(CAST(:ids AS INTEGER[])) AS id, unnest(CAST(:quantidades AS INTEGER[])) AS quantidade) baixa
+            WHERE p.id = baixa.id
+        """), {'ids': ids, 'quantidades': [necessario[peca_id] for peca_id in ids]})
+    if linhas:
+        for linha in linhas:
+            linha['baixa_estoque'] = linha['peca_id'] is not None
+        session.execute(text("""
+            INSERT INTO ordem_pecas (ordem_id, peca_id, descricao, quantidade, custo_unitario, baixa_estoque, data)
+            VALUES (:ordem_id, :peca_id, :descricao, 1, :custo_unitario, :baixa_estoque, now())
+        """), linhas)
+
+    if not necessario:
+        return []
+    return [linha['nome'] for linha in session.execute(text("""
+        SELECT nome FROM pecas WHERE id = ANY(:ids) AND estoque <= estoque_minimo ORDER BY nome
+    """), {'ids': sorted(necessario)}).mappings()]
+
+
+def repor_estoque(session, peca_id, quantidade):
+    """Entrada (ou ajuste, se negativa) de estoque - retorna o saldo novo ou None se a peça não existe"""
+    return session.execute(text("""
+        UPDATE pecas SET estoque = estoque + :quantidade, data_atualizacao = now()
+        WHERE id = :peca_id
+        RETURNING estoque
+    """), {'peca_id': peca_id, 'quantidade': int(quantidade)}).scalar()
+
+
+def pecas_abaixo_minimo(session):
+    """Peças ativas no estoque mínimo ou abaixo, com o fornecedor para a reposição"""
+    return [dict(linha) for linha in session.execute(text("""
+        SELECT p.id, p.sku, p.nome, p.estoque, p.estoque_minimo, f.nome AS fornecedor, f.telefone AS fornecedor_telefone
+        FROM pecas p
+        LEFT JOIN fornecedores f ON f.id = p.fornecedor_id
+        WHERE p.ativo IS NOT FALSE AND p.estoque <= p.estoque_minimo
+        ORDER BY p.estoque - p.estoque_minimo, lower(p.nome)
+    """)).mappings()]
+
+
+def consumo_por_peca(session, dias=90):
+    """Unidades e custo de cada peça do catálogo usadas nas ordens dos últimos `dias` - {peca_id: dict}"""
+    return {linha['peca_id']: dict(linha) for linha in session.execute(text("""
+        SELECT peca_id, SUM(quantidade) AS unidades, SUM(quantidade * custo_unitario) AS custo
+        FROM ordem_pecas
+        WHERE peca_id IS NOT NULL AND data >= now() - make_interval(days => :dias)
+        GROUP BY peca_id
+    """), {'dias': dias}).mappings()}
+
+
+# ==================== BACKFILL DAS ORDENS ANTIGAS ====================
+_SQL_BACKFILL_LOTE = text("""
+    WITH alvo AS (
+        SELECT id, pecas, data FROM ordens_servico
+        WHERE id > :de AND pecas IS NOT NULL
+        ORDER BY id
+        LIMIT :lote
+    ), itens AS (
+        SELECT a.id AS ordem_id, a.data, left(trim(item ->> 'nome'), 200) AS descricao,
+               CASE WHEN item ->> 'custo' ~ '^-?[0-9]+([.][0-9]+)?$'
+                    THEN CAST(item ->> 'custo' AS NUMERIC) ELSE 0 END AS custo
+        FROM alvo a
+        CROSS JOIN LATERAL json_array_elements(
+            CASE WHEN json_typeof(a.pecas) = 'array' THEN a.pecas ELSE '[]'::json END
+        ) AS item
+        WHERE coalesce(trim(item ->> 'nome'), '') <> ''
+          AND NOT EXISTS (SELECT 1 FROM ordem_pecas op WHERE op.ordem_id = a.id)
+    ), inseridas AS (
+        INSERT INTO ordem_pecas (ordem_id, peca_id, descricao, quantidade, custo_unitario, baixa_estoque, data)
+        SELECT i.ordem_id,
+               (SELECT p.id FROM pecas p WHERE lower(p.nome) = lower(i.descricao) ORDER BY p.id LIMIT 1),
+               i.descricao, 1, i.custo, FALSE, coalesce(i.data, now())
+        FROM itens i
+        RETURNING ordem_id
+    )
+    SELECT (SELECT max(id) FROM alvo) AS ultimo,
+           (SELECT COUNT(DISTINCT ordem_id) FROM inseridas) AS ordens,
+           (SELECT COUNT(*) FROM inseridas) AS linhas
+""")
+
+
+def estado_backfill():
+    """Retorna uma cópia do estado do backfill em background"""
+    with _lock:
+        return dict(_estado)
+
+
+def backfill_ordens(engine, lote=LOTE_BACKFILL, pausa=0.05):
+    """Copia as peças do JSON das ordens que ainda não têm linhas em ordem_pecas - um lote por transação
+
+    Idempotente: ordens que já têm linhas ficam de fora. Um advisory lock
+    impede dois workers de rodarem ao mesmo tempo (retorna None se já houver
+    um). O estoque não é alterado - as peças antigas já foram consumidas.
+    """
+    with engine.connect() as conn:
+        if not conn.execute(text(f"SELECT pg_try_advisory_lock({_SQL_LOCK_BACKFILL})")).scalar():
+            conn.rollback()
+            return None
+        conn.commit()
+        total = {'ordens': 0, 'linhas': 0}
+        try:
+            de = 0
+            while True:
+                resultado = conn.execute(_SQL_BACKFILL_LOTE, {'de': de, 'lote': lote}).mappings().first()
+                conn.commit()
+                if resultado['ultimo'] is None:
+                    break
+                de = resultado['ultimo']
+                total['ordens'] += resultado['ordens']
+                total['linhas'] += resultado['linhas']
+                with _lock:
+                    _estado.update(total)
+                if pausa:
+                    time.sleep(pausa)
+        finally:
+            conn.rollback()
+            conn.execute(text(f"SELECT pg_advisory_unlock({_SQL_LOCK_BACKFILL})"))
+            conn.commit()
+    return total
+
+
+def iniciar_backfill_em_background(app, db, lote=LOTE_BACKFILL):
+    """Dispara o backfill em uma thread daemon - retorna False se já houver um rodando"""
+    with _lock:
+        if _estado['rodando']:
+            return False
+        _estado.update({'rodando': True, 'ordens': 0, 'linhas': 0, 'inicio': time.time(), 'fim': None, 'erro': None})
+
+    def _executar():
+        try:
+            with app.app_context():
+                if backfill_ordens(db.engine, lote=lote) is None:
+                    with _lock:
+                        _estado['erro'] = 'Outro proceso ya está importando los repuestos.'
+        except Exception as e:
+            print(f"Erro no backfill de ordem_pecas: {e}")
+            with _lock:
+                _estado['erro'] = str(e)
+        finally:
+            with _lock:
+                _estado['rodando'] = False
+                _estado['fim'] = time.time()
+
+    threading.Thread(target=_executar, name='backfill-pecas', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or any(a in ('-h', '--help') for a in args):
+        print(__doc__)
+        sys.exit(0 if args else 1)
+    from app import app, db
+
+    with app.app_context():
+        if args[0] == '--backfill':
+            lote = int(args[args.index('--lote') + 1]) if '--lote' in args else LOTE_BACKFILL
+            inicio = time.time()
+            total = backfill_ordens(db.engine, lote=lote, pausa=0)
+            if total is None:
+                print("Outro processo já está fazendo o backfill")
+                sys.exit(1)
+            print(f"{total['linhas']} peças de {total['ordens']} ordens copiadas em {time.time() - inicio:.1f}s")
+        elif args[0] == '--baixo':
+            for peca in pecas_abaixo_minimo(db.session):
+                print(f"{peca['sku']}  {peca['nome']}: {peca['estoque']} (mínimo {peca['estoque_minimo']})"
+                      f"  {peca['fornecedor'] or ''}")
+        else:
+            for peca in buscar_pecas(db.session, ' '.join(args)):
+                print(f"{peca['sku']}  {peca['nome']}  estoque {peca['estoque']}")
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Exclusão em massa de um cliente e de tudo que pertence a ele
+Ordens de serviço (com o histórico de status e as peças usadas), comprovantes, cupons,
+orçamentos de ar-condicionado, PDFs (e seus blobs), agendamentos com o
+mesmo e-mail e pedidos da loja antiga,
+com DELETE ... WHERE id IN (subquery) em uma única transação: ou sai tudo,
+ou nada.
+
+Também faz a prévia (quantos registros seriam removidos) sem alterar nada,
+e pode rodar em background para clientes com muitos registros.
+
+Uso:
+    python exclusao_cliente.py <cliente_id> [--dry-run]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+from sqlalchemy import text
+
+from storage import remover_blob
+
+# Acima deste total de registros a rota dispara a exclusão em background
+LIMITE_EXCLUSAO_SINCRONA = 500
+
+# PDFs do cliente: os referenciados pelas linhas e os antigos (regenerados) ligados por referencia_id
+_SQL_PDFS_CLIENTE = """
+    SELECT id, storage_key FROM pdf_documents
+    WHERE id IN (
+        SELECT pdf_id FROM ordens_servico WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
+        UNION ALL
+        SELECT pdf_id FROM comprovantes WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
+        UNION ALL
+        SELECT pdf_id FROM orcamentos_ar_condicionado WHERE cliente_id = :cliente_id AND pdf_id IS NOT NULL
+    )
+    OR (tipo_documento = 'ordem_servico' AND referencia_id IN (
+        SELECT id FROM ordens_servico WHERE cliente_id = :cliente_id))
+    OR (tipo_documento = 'comprovante' AND referencia_id IN (
+        SELECT id FROM comprovantes WHERE cliente_id = :cliente_id))
+    OR (tipo_documento = 'orcamento_ar' AND referencia_id IN (
+        SELECT id FROM orcamentos_ar_condicionado WHERE cliente_id = :cliente_id))
+"""
+
+# (chave, DELETE) na ordem em que as dependências permitem
+ETAPAS_EXCLUSAO = [
+    ('orcamentos_ar', "DELETE FROM orcamentos_ar_condicionado WHERE cliente_id = :cliente_id"),
+    ('comprovantes', "DELETE FROM comprovantes WHERE cliente_id = :cliente_id"),
+    ('cupons', "DELETE FROM cupons WHERE cliente_id = :cliente_id"),
+    ('eventos_status', """
+        DELETE FROM ordem_status_eventos
+        WHERE ordem_id IN (SELECT id FROM ordens_servico WHERE cliente_id = :cliente_id)
+    """),
+    ('pecas_ordens', """
+        DELETE FROM ordem_pecas
+        WHERE ordem_id IN (SELECT id FROM ordens_servico WHERE cliente_id = :cliente_id)
+    """),
+    ('ordens', "DELETE FROM ordens_servico WHERE cliente_id = :cliente_id"),
+    ('pdfs', "DELETE FROM pdf_documents WHERE id IN (SELECT id FROM _exclusao_pdfs)"),
+    ('agendamentos', """
+        DELETE FROM agendamentos
+        WHERE email IS NOT NULL AND email <> ''
+        AND email = (SELECT email FROM clientes WHERE id = :cliente_id)
+    """),
+]
+
+# Tabelas da loja antiga (removida) - só existem em bancos mais velhos
+ETAPAS_LOJA_ANTIGA = [
+    ('itens_pedido', "DELETE FROM itens_pedido WHERE pedido_id IN (SELECT id FROM pedidos WHERE cliente_id = :cliente_id)"),
+    ('pedidos', "DELETE FROM pedidos WHERE cliente_id = :cliente_id"),
+]
+
+# Estado das exclusões em background, por cliente (consultado pela rota de status). Também vai
+# para disco em DIR_ESTADO para que a rota de status responda em qualquer worker do gunicorn
+DIR_ESTADO = 'data/.exclusoes'
+# Job 'rodando' no disco há mais que isso é de um worker que morreu no meio - não bloqueia outro
+JOB_ORFAO_SEGUNDOS = 3600
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _caminho_estado(cliente_id):
+    return os.path.join(DIR_ESTADO, f"{int(cliente_id)}.json")
+
+
+def _persistir(cliente_id, job):
+    try:
+        os.makedirs(DIR_ESTADO, exist_ok=True)
+        temporario = _caminho_estado(cliente_id) + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(temporario, _caminho_estado(cliente_id))
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar o estado da exclusão do cliente {cliente_id}: {e}")
+
+
+def _job_do_disco(cliente_id):
+    try:
+        with open(_caminho_estado(cliente_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _tabela_existe(session, tabela):
+    return session.execute(text("SELECT to_regclass(:tabela) IS NOT NULL"), {'tabela': tabela}).scalar()
+
+
+def previa_exclusao(session, cliente_id):
+    """Conta o que seria excluído, sem alterar nada - uma única query"""
+    linha = session.execute(text(f"""
+        SELECT
+            (SELECT COUNT(*) FROM clientes WHERE id = :cliente_id) AS cliente,
+            (SELECT COUNT(*) FROM ordens_servico WHERE cliente_id = :cliente_id) AS ordens,
+            (SELECT COUNT(*) FROM comprovantes WHERE cliente_id = :cliente_id) AS comprovantes,
+            (SELECT COUNT(*) FROM cupons WHERE cliente_id = :cliente_id) AS cupons,
+            (SELECT COUNT(*) FROM orcamentos_ar_condicionado WHERE cliente_id = :cliente_id) AS orcamentos_ar,
+            (SELECT COUNT(*) FROM ({_SQL_PDFS_CLIENTE}) p) AS pdfs,
+            (SELECT COUNT(*) FROM agendamentos
+             WHERE email IS NOT NULL AND email <> ''
+             AND email = (SELECT email FROM clientes WHERE id = :cliente_id)) AS agendamentos
+    """), {'cliente_id': cliente_id}).mappings().one()
+    contagem = dict(linha)
+    if _tabela_existe(session, 'pedidos'):
+        contagem['pedidos'] = session.execute(
+            text("SELECT COUNT(*) FROM pedidos WHERE cliente_id = :cliente_id"), {'cliente_id': cliente_id}
+        ).scalar()
+    contagem['total'] = sum(valor for chave, valor in contagem.items() if chave != 'cliente')
+    return contagem
+
+
+def excluir_cliente(session, cliente_id):
+    """Exclui o cliente e todo o grafo relacionado em uma transação
+
+    Retorna dict com as quantidades excluídas por tabela e os números das ordens
+    removidas (para invalidar caches). Levanta exceção (com rollback) em caso de erro.
+    """
+    parametros = {'cliente_id': cliente_id}
+    resultado = {}
+    try:
+        numeros_ordem = [linha[0] for linha in session.execute(
+            text("SELECT numero_ordem FROM ordens_servico WHERE cliente_id = :cliente_id"), parametros
+        )]
+
+        # PDFs são identificados antes de apagar as linhas que apontam para eles
+        session.execute(text(f"CREATE TEMP TABLE _exclusao_pdfs ON COMMIT DROP AS {_SQL_PDFS_CLIENTE}"), parametros)
+
+        if _tabela_existe(session, 'pedidos'):
+            for chave, sql in ETAPAS_LOJA_ANTIGA:
+                if chave == 'itens_pedido' and not _tabela_existe(session, 'itens_pedido'):
+                    continue
+                resultado[chave] = session.execute(text(sql), parametros).rowcount
+
+        for chave, sql in ETAPAS_EXCLUSAO:
+            if chave == 'pdfs':
+                # Large objects saem na mesma transação; blobs em disco/S3 após o commit
+                session.execute(text("""
+                    SELECT lo_unlink(lo.oid) FROM pg_largeobject_metadata lo
+                    WHERE lo.oid IN (
+                        SELECT CASE WHEN storage_key LIKE 'pglo:%' THEN split_part(storage_key, ':', 2)::oid END
+                        FROM _exclusao_pdfs
+                    )
+                """))
+                for (chave_blob,) in session.execute(text(
+                    "SELECT storage_key FROM _exclusao_pdfs WHERE storage_key IS NOT NULL AND storage_key NOT LIKE 'pglo:%'"
+                )):
+                    remover_blob(session, chave_blob)
+            resultado[chave] = session.execute(text(sql), parametros).rowcount
+
+        resultado['cliente'] = session.execute(
+            text("DELETE FROM clientes WHERE id = :cliente_id"), parametros
+        ).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    resultado['numeros_ordem'] = numeros_ordem
+    return resultado
+
+
+def estado_exclusao(cliente_id):
+    """Estado da exclusão em background do cliente (None se nunca houve)"""
+    with _lock:
+        job = _jobs.get(cliente_id)
+        if job:
+            return dict(job)
+    return _job_do_disco(cliente_id)
+
+
+def iniciar_exclusao_em_background(app, db, cliente_id, ao_concluir=None):
+    """Dispara a exclusão em uma thread daemon - retorna False se já houver uma rodando"""
+    with _lock:
+        job = _jobs.get(cliente_id) or _job_do_disco(cliente_id)
+        if job and job['rodando'] and time.time() - job['inicio'] < JOB_ORFAO_SEGUNDOS:
+            return False
+        _jobs[cliente_id] = {'rodando': True, 'inicio': time.time(), 'fim': None, 'resultado': None, 'erro': None}
+        _persistir(cliente_id, _jobs[cliente_id])
+
+    def _executar():
+        resultado = None
+        erro = None
+        try:
+            with app.app_context():
+                resultado = excluir_cliente(db.session, cliente_id)
+                if ao_concluir:
+                    ao_concluir(cliente_id, resultado)
+        except Exception as e:
+            erro = str(e)
+            print(f"Erro na exclusão em background do cliente {cliente_id}: {e}")
+        finally:
+            with _lock:
+                _jobs[cliente_id].update({'rodando': False, 'fim': time.time(), 'resultado': resultado, 'erro': erro})
+                _persistir(cliente_id, _jobs[cliente_id])
+
+    threading.Thread(target=_executar, name=f'excluir-cliente-{cliente_id}', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    from app import app, db
+
+    args = sys.argv[1:]
+    if not args or not args[0].isdigit():
+        print(__doc__)
+        sys.exit(1)
+    cliente_id = int(args[0])
+
+    with app.app_context():
+        previa = previa_exclusao(db.session, cliente_id)
+        db.session.rollback()
+        print(f"Cliente {cliente_id}: {previa}")
+        if not previa['cliente']:
+            print("⚠️  Cliente não encontrado")
+            sys.exit(1)
+        if '--dry-run' in args:
+            sys.exit(0)
+        inicio = time.time()
+        resultado = excluir_cliente(db.session, cliente_id)
+        print(f"✅ Excluído em {time.time() - inicio:.2f}s: {resultado}")
@@ -0,0 +1,193 @@
+"""
+Exportação de planilhas (CSV e XLSX) em streaming
+As linhas chegam de um iterador (cursor do banco com yield_per) e saem em
+blocos de bytes, então a memória fica constante qualquer que seja o número
+de linhas. O XLSX é montado à mão (zip + XML mínimo do Office Open XML):
+a planilha vai sendo comprimida e enviada enquanto as linhas são lidas,
+sem openpyxl e sem arquivo temporário.
+"""
+
+import io
+import csv
+import re
+import zipfile
+from datetime import datetime, date
+from decimal import Decimal
+from xml.sax.saxutils import escape as xml_escape
+
+TAMANHO_BLOCO = 64 * 1024  # Bytes acumulados antes de enviar um bloco
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Texto que o Excel/LibreOffice interpretariam como fórmula
+_INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+# Caracteres de controle não são permitidos em XML 1.0
+_CONTROLE_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'Sí' if valor else 'No'
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)
+
+
+# ==================== CSV ====================
+
+def gerar_csv(colunas, linhas):
+    """Gera o CSV em blocos de bytes (UTF-8 com BOM, para o Excel reconhecer os acentos)"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write('\ufeff')
+    escritor.writerow(colunas)
+    for linha in linhas:
+        valores = []
+        for valor in linha:
+            if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+                valores.append(valor)
+                continue
+            texto = _texto(valor)
+            if texto.startswith(_INICIO_FORMULA):
+                texto = "'" + texto
+            valores.append(texto)
+        escritor.writerow(valores)
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+# ==================== XLSX ====================
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+# Estilo 0 = padrão, estilo 1 = cabeçalho em negrito
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+
+
+def _workbook(nome_planilha):
+    nome = xml_escape(re.sub(r'[\[\]:*?/\\]', ' ', nome_planilha)[:31] or 'Planilha', {'"': '&quot;'})
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _celula(valor, estilo=''):
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        return f'<c{estilo}><v>{valor}</v></c>'
+    texto = xml_escape(_CONTROLE_XML.sub('', _texto(valor)))
+    return f'<c{estilo} t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+class _Fluxo(io.RawIOBase):
+    """Destino do zip que só acumula bytes - o gerador esvazia e envia a cada bloco"""
+
+    def __init__(self):
+        self._partes = []
+        self.tamanho = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        self.tamanho = 0
+        return dados
+
+
+def gerar_xlsx(colunas, linhas, nome_planilha='Planilha'):
+    """Gera o XLSX em blocos de bytes (zip em streaming, uma única planilha)"""
+    fluxo = _Fluxo()
+    with zipfile.ZipFile(fluxo, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        arquivo_zip.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        arquivo_zip.writestr('_rels/.rels', _RELS)
+        arquivo_zip.writestr('xl/workbook.xml', _workbook(nome_planilha))
+        arquivo_zip.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        arquivo_zip.writestr('xl/styles.xml', _STYLES)
+        yield fluxo.esvaziar()
+
+        with arquivo_zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilha:
+            planilha.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>'
+                '<row r="1">' + ''.join(_celula(c, ' s="1"') for c in colunas) + '</row>'
+            ).encode('utf-8'))
+            for numero, linha in enumerate(linhas, start=2):
+                planilha.write(f'<row r="{numero}">{"".join(_celula(v) for v in linha)}</row>'.encode('utf-8'))
+                if fluxo.tamanho >= TAMANHO_BLOCO:
+                    yield fluxo.esvaziar()
+            planilha.write(b'</sheetData></worksheet>')
+    yield fluxo.esvaziar()
+
+
+def gerar_planilha(formato, colunas, linhas, nome_planilha='Planilha'):
+    """Gerador de bytes no formato pedido ('csv' ou 'xlsx')"""
+    if formato == 'xlsx':
+        return gerar_xlsx(colunas, linhas, nome_planilha)
+    return gerar_csv(colunas, linhas)
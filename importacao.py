@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+Importação em massa de clientes e ordens de serviço (CSV ou XLSX)
+As linhas são validadas em paralelo (pool de processos, em blocos), a
+unicidade é verificada com uma consulta por bloco (username dos clientes,
+numero_ordem das ordens) e a gravação é feita com INSERT de várias linhas
+por comando. As ordens sem número recebem números de um bloco reservado de
+uma vez (mesma regra de get_proximo_numero_ordem: 6 dígitos, aleatório, não
+sequencial). Linhas com erro não interrompem a importação - vão para o
+relatório de erros.
+
+Uso:
+    python importacao.py clientes|ordens <arquivo.csv|arquivo.xlsx>
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import zipfile
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from status_ordens import STATUS_ORDEM
+
+TAMANHO_BLOCO = 1000  # Linhas por bloco de validação, consulta de unicidade e INSERT
+MIN_LINHAS_POOL = 5000  # Abaixo disso validar no próprio processo sai mais barato que o pool
+WORKERS_VALIDACAO = min(4, os.cpu_count() or 1)
+MAX_ERROS_RELATORIO = 10000
+
+# Cabeçalhos aceitos (já normalizados: minúsculas, sem acento) -> campo
+ALIASES = {
+    'nome': 'nome', 'nombre': 'nome',
+    'email': 'email', 'correo': 'email', 'e-mail': 'email',
+    'telefone': 'telefone', 'telefono': 'telefone',
+    'cpf': 'cpf', 'documento': 'cpf', 'dni': 'cpf',
+    'endereco': 'endereco', 'direccion': 'endereco',
+    'username': 'username', 'usuario': 'username',
+    'password': 'password', 'senha': 'password', 'contrasena': 'password',
+    'cliente': 'cliente', 'cliente_id': 'cliente', 'id cliente': 'cliente',
+    'numero_ordem': 'numero_ordem', 'no orden': 'numero_ordem', 'numero orden': 'numero_ordem',
+    'tecnico_id': 'tecnico_id', 'id tecnico': 'tecnico_id',
+    'servico': 'servico', 'servicio': 'servico',
+    'tipo_aparelho': 'tipo_aparelho', 'tipo de aparato': 'tipo_aparelho', 'aparato': 'tipo_aparelho',
+    'marca': 'marca', 'modelo': 'modelo',
+    'numero_serie': 'numero_serie', 'no de serie': 'numero_serie', 'numero de serie': 'numero_serie',
+    'defeitos_cliente': 'defeitos_cliente', 'defectos': 'defeitos_cliente',
+    'diagnostico_tecnico': 'diagnostico_tecnico', 'diagnostico': 'diagnostico_tecnico',
+    'custo_pecas': 'custo_pecas', 'costo piezas': 'custo_pecas',
+    'custo_mao_obra': 'custo_mao_obra', 'costo mano de obra': 'custo_mao_obra',
+    'desconto_percentual': 'desconto_percentual', 'descuento %': 'desconto_percentual',
+    'status': 'status', 'estado': 'status',
+    'prazo_estimado': 'prazo_estimado', 'plazo estimado': 'prazo_estimado',
+    'data': 'data', 'fecha': 'data',
+}
+
+
+# campo -> tamanho máximo (colunas String dos modelos)
+LIMITES_CLIENTE = {'nome': 200, 'email': 200, 'telefone': 20, 'cpf': 14, 'username': 100, 'password': 200}
+LIMITES_ORDEM = {'servico': 200, 'tipo_aparelho': 100, 'marca': 100, 'modelo': 100, 'numero_serie': 100,
+                 'numero_ordem': 20, 'prazo_estimado': 100, 'status': 50}
+# Maior valor das colunas Numeric(10, 2) de ordens_servico (subtotal e total)
+VALOR_MAXIMO = 99999999.99
+
+_RE_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+_ACENTOS = str.maketrans('áàâãäéèêëíìîïóòôõöúùûüçñº°', 'aaaaaeeeeiiiiooooouuuucnoo')
+
+
+# ==================== LEITURA ====================
+
+def _normalizar_cabecalho(nome):
+    nome = (nome or '').strip().lower().translate(_ACENTOS).replace('.', '')
+    return ALIASES.get(nome, ALIASES.get(nome.replace(' ', '_'), nome))
+
+
+def _ler_csv(caminho):
+    with open(caminho, 'r', encoding='utf-8-sig', newline='') as f:
+        amostra = f.read(8192)
+        f.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+        except csv.Error:
+            dialeto = csv.excel
+        leitor = csv.reader(f, dialeto)
+        cabecalho = [_normalizar_cabecalho(c) for c in next(leitor, [])]
+        for valores in leitor:
+            if any(v.strip() for v in valores):
+                yield dict(zip(cabecalho, valores))
+
+
+_NS_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def _indice_coluna(referencia):
+    """'C12' -> 2"""
+    indice = 0
+    for caractere in referencia:
+        if not caractere.isalpha():
+            break
+        indice = indice * 26 + (ord(caractere.upper()) - 64)
+    return indice - 1
+
+
+def _ler_xlsx(caminho):
+    """Lê a primeira planilha do XLSX em streaming (iterparse), sem openpyxl"""
+    with zipfile.ZipFile(caminho) as arquivo_zip:
+        compartilhadas = []
+        if 'xl/sharedStrings.xml' in arquivo_zip.namelist():
+            with arquivo_zip.open('xl/sharedStrings.xml') as f:
+                for _, elemento in ElementTree.iterparse(f):
+                    if elemento.tag == _NS_XLSX + 'si':
+                        compartilhadas.append(''.join(t.text or '' for t in elemento.iter(_NS_XLSX + 't')))
+                        elemento.clear()
+        planilhas = sorted(n for n in arquivo_zip.namelist() if n.startswith('xl/worksheets/sheet'))
+        if not planilhas:
+            return
+        cabecalho = None
+        with arquivo_zip.open(planilhas[0]) as f:
+            for _, elemento in ElementTree.iterparse(f):
+                if elemento.tag != _NS_XLSX + 'row':
+                    continue
+                valores = {}
+                posicao = -1
+                for celula in elemento.iter(_NS_XLSX + 'c'):
+                    referencia = celula.get('r')
+                    posicao = _indice_coluna(referencia) if referencia else posicao + 1
+                    tipo = celula.get('t')
+                    if tipo == 'inlineStr':
+                        valor = ''.join(t.text or '' for t in celula.iter(_NS_XLSX + 't'))
+                    else:
+                        v = celula.find(_NS_XLSX + 'v')
+                        valor = v.text if v is not None and v.text is not None else ''
+                        if tipo == 's' and valor:
+                            valor = compartilhadas[int(valor)]
+                        elif valor.endswith('.0') and valor[:-2].lstrip('-').isdigit():
+                            valor = valor[:-2]  # Números inteiros vêm como "123.0" de algumas planilhas
+                    valores[posicao] = valor
+                elemento.clear()
+                if cabecalho is None:
+                    cabecalho = {i: _normalizar_cabecalho(v) for i, v in valores.items()}
+                    continue
+                if any(str(v).strip() for v in valores.values()):
+                    yield {cabecalho[i]: v for i, v in valores.items() if i in cabecalho}
+
+
+def ler_planilha(caminho, nome_arquivo=None):
+    """Itera as linhas do CSV/XLSX como dicts com os campos normalizados"""
+    nome = (nome_arquivo or caminho).lower()
+    if nome.endswith('.xlsx'):
+        return _ler_xlsx(caminho)
+    return _ler_csv(caminho)
+
+
+# ==================== VALIDAÇÃO ====================
+
+def _texto(linha, campo):
+    valor = linha.get(campo)
+    valor = str(valor).strip() if valor is not None else ''
+    return valor or None
+
+
+def _decimal(valor):
+    if valor in (None, ''):
+        return 0.0
+    valor = str(valor).strip().replace(' ', '')
+    if ',' in valor and '.' in valor:
+        valor = valor.replace('.', '').replace(',', '.')  # 1.234,56
+    else:
+        valor = valor.replace(',', '.')
+    numero = float(valor)
+    # float() aceita 'nan' e 'inf', que não cabem numa coluna Numeric
+    if not math.isfinite(numero):
+        raise ValueError(f"número inválido: {valor}")
+    return numero
+
+
+def _data(valor):
+    if not valor:
+        return None
+    try:
+        # Datas do Excel chegam do XLSX como número de série (dias desde 30/12/1899)
+        return datetime(1899, 12, 30) + timedelta(days=float(valor))
+    except (ValueError, OverflowError):
+        pass  # Não é número, ou é grande demais para ser série (ex: 20240105)
+    for formato in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d/%m/%Y %H:%M', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(str(valor).strip(), formato)
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {valor}")
+
+
+def _limites(registro, limites, erros):
+    for campo, maximo in limites.items():
+        if registro.get(campo) and len(registro[campo]) > maximo:
+            erros.append((campo, f"máximo de {maximo} caracteres"))
+
+
+def validar_cliente(linha):
+    """Retorna (registro, erros) - erros é uma lista de (campo, mensagem)"""
+    erros = []
+    registro = {campo: _texto(linha, campo)
+                for campo in ('nome', 'email', 'telefone', 'cpf', 'endereco', 'username', 'password')}
+    if not registro['nome']:
+        erros.append(('nome', 'obrigatório'))
+    if registro['email'] and not _RE_EMAIL.match(registro['email']):
+        erros.append(('email', 'e-mail inválido'))
+    if registro['cpf']:
+        registro['cpf'] = re.sub(r'[^\d.\-/]', '', registro['cpf']) or None
+    if registro['username'] and not registro['password']:
+        erros.append(('password', 'obrigatório quando há usuário'))
+    _limites(registro, LIMITES_CLIENTE, erros)
+    return registro, erros
+
+
+def validar_ordem(linha):
+    """Retorna (registro, erros) - os valores são calculados como em add_ordem_servico"""
+    erros = []
+    registro = {campo: _texto(linha, campo) for campo in (
+        'cliente', 'numero_ordem', 'servico', 'tipo_aparelho', 'marca', 'modelo', 'numero_serie',
+        'defeitos_cliente', 'diagnostico_tecnico', 'prazo_estimado')}
+    if not registro['cliente']:
+        erros.append(('cliente', 'obrigatório (id, usuario ou e-mail do cliente)'))
+    if registro['numero_ordem']:
+        registro['numero_ordem'] = registro['numero_ordem'].replace('#', '').strip()
+
+    status = (_texto(linha, 'status') or 'pendente').lower().replace(' ', '_')
+    if status not in STATUS_ORDEM:
+        erros.append(('status', f"inválido: {status}"))
+    registro['status'] = status
+
+    try:
+        tecnico = _texto(linha, 'tecnico_id')
+        registro['tecnico_id'] = int(tecnico) if tecnico else None
+    except ValueError:
+        erros.append(('tecnico_id', 'deve ser numérico'))
+        registro['tecnico_id'] = None
+
+    valores = {}
+    for campo in ('custo_pecas', 'custo_mao_obra', 'desconto_percentual'):
+        try:
+            valores[campo] = _decimal(linha.get(campo))
+            if valores[campo] < 0:
+                erros.append((campo, 'não pode ser negativo'))
+        except ValueError:
+            erros.append((campo, 'valor inválido'))
+            valores[campo] = 0.0
+    if valores['desconto_percentual'] > 100:
+        erros.append(('desconto_percentual', 'acima de 100%'))
+    subtotal = valores['custo_pecas'] + valores['custo_mao_obra']
+    if subtotal > VALOR_MAXIMO:
+        erros.append(('custo_pecas', 'valor acima do máximo'))
+    valor_desconto = round(subtotal * valores['desconto_percentual'] / 100, 2)
+    registro.update(valores, subtotal=subtotal, valor_desconto=valor_desconto, total=subtotal - valor_desconto)
+
+    try:
+        registro['data'] = _data(_texto(linha, 'data'))
+    except ValueError as e:
+        erros.append(('data', str(e)))
+        registro['data'] = None
+    _limites(registro, LIMITES_ORDEM, erros)
+    return registro, erros
+
+
+VALIDADORES = {'clientes': validar_cliente, 'ordens': validar_ordem}
+
+
+def _validar_bloco(tipo, inicio, linhas):
+    """Executado no pool: retorna [(numero_linha, registro, erros)]"""
+    validar = VALIDADORES[tipo]
+    return [(inicio + i, *validar(linha)) for i, linha in enumerate(linhas)]
+
+
+def validar_linhas(tipo, linhas):
+    """Valida todas as linhas - em paralelo (processos) para arquivos grandes
+
+    Os números de linha começam em 2 (a linha 1 é o cabeçalho).
+    """
+    blocos = [(2 + i, linhas[i:i + TAMANHO_BLOCO]) for i in range(0, len(linhas), TAMANHO_BLOCO)]
+    if len(linhas) < MIN_LINHAS_POOL or WORKERS_VALIDACAO < 2:
+        return [resultado for inicio, bloco in blocos for resultado in _validar_bloco(tipo, inicio, bloco)]
+    # spawn: o worker do gunicorn tem threads e conexões abertas - fork não é seguro aqui
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=WORKERS_VALIDACAO, mp_context=contexto) as executor:
+        futuros = [executor.submit(_validar_bloco, tipo, inicio, bloco) for inicio, bloco in blocos]
+        return [resultado for futuro in futuros for resultado in futuro.result()]
+
+
+# ==================== NÚMEROS DE ORDEM ====================
+
+def _eh_sequencial(numero):
+    digitos = str(numero)
+    passos = {int(b) - int(a) for a, b in zip(digitos, digitos[1:])}
+    return passos in ({1}, {-1})
+
+
+def reservar_numeros_ordem(session, quantidade, excluir=()):
+    """Sorteia `quantidade` números de 6 dígitos não sequenciais que ainda não existem
+
+    Uma única consulta carrega os números em uso; o INSERT usa ON CONFLICT, então
+    um número tomado por outra requisição nesse meio-tempo só volta para a fila.
+    """
+    if quantidade <= 0:
+        return []
+    existentes = set(excluir)
+    for (numero,) in session.execute(text("SELECT numero_ordem FROM ordens_servico")):
+        numero = str(numero or '').replace('#', '').strip()
+        if numero.isdigit():
+            existentes.add(int(numero))
+    reservados = []
+    while len(reservados) < quantidade:
+        faltam = quantidade - len(reservados)
+        candidatos = random.sample(range(100000, 1000000), min(faltam * 2 + 16, 900000))
+        for numero in candidatos:
+            if numero not in existentes and not _eh_sequencial(numero):
+                existentes.add(numero)
+                reservados.append(str(numero))
+                if len(reservados) == quantidade:
+                    break
+        if len(existentes) >= 900000:
+            raise RuntimeError("Não há números de ordem livres suficientes")
+    return reservados
+
+
+# ==================== GRAVAÇÃO ====================
+
+def _em_blocos(itens, tamanho=TAMANHO_BLOCO):
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+
+def gravar_clientes(session, validos, progresso):
+    """Insere os clientes em blocos; username repetido (no banco ou no arquivo) vira erro"""
+    from models import Cliente
+
+    tabela = Cliente.__table__
+    erros = []
+    vistos = set()
+    inseridos = 0
+    for bloco in _em_blocos(validos):
+        usernames = [r['username'] for _, r in bloco if r['username']]
+        em_uso = set()
+        if usernames:
+            em_uso = {u for (u,) in session.execute(
+                text("SELECT username FROM clientes WHERE username = ANY(:usernames)"), {'usernames': usernames}
+            )}
+        pendentes = []
+        for numero_linha, registro in bloco:
+            username = registro['username']
+            if username and (username in em_uso or username in vistos):
+                erros.append((numero_linha, 'username', f"'{username}' já está em uso"))
+                continue
+            if username:
+                vistos.add(username)
+            pendentes.append((numero_linha, dict(registro, data_cadastro=datetime.now())))
+        if pendentes:
+            # ON CONFLICT cobre o cadastro simultâneo do mesmo username pela tela do admin
+            gravados = session.execute(
+                pg_insert(tabela).values([linha for _, linha in pendentes])
+                .on_conflict_do_nothing().returning(tabela.c.username)
+            ).fetchall()
+            session.commit()
+            inseridos += len(gravados)
+            if len(gravados) < len(pendentes):
+                gravados_usernames = {u for (u,) in gravados}
+                erros.extend(
+                    (numero_linha, 'username', f"'{linha['username']}' já está em uso")
+                    for numero_linha, linha in pendentes
+                    if linha['username'] and linha['username'] not in gravados_usernames
+                )
+        progresso(len(bloco), inseridos)
+    return inseridos, erros, {}
+
+
+def _resolver_clientes(session, referencias):
+    """Mapeia id/username/e-mail do arquivo -> id do cliente, com uma consulta"""
+    ids = [int(r) for r in referencias if r.isdigit()]
+    textos = [r for r in referencias if not r.isdigit()]
+    mapa = {}
+    for cliente_id, username, email in session.execute(text("""
+        SELECT id, username, email FROM clientes
+        WHERE id = ANY(:ids) OR username = ANY(:textos) OR lower(email) = ANY(:emails)
+    """), {'ids': ids, 'textos': textos, 'emails': [t.lower() for t in textos]}):
+        mapa[str(cliente_id)] = cliente_id
+        if username:
+            mapa[username] = cliente_id
+        if email:
+            mapa.setdefault(email.lower(), cliente_id)
+    return mapa
+
+
+def gravar_ordens(session, validos, progresso):
+    """Insere as ordens em blocos, com os números de ordem reservados de uma vez"""
+    from models import OrdemServico
+
+    tabela = OrdemServico.__table__
+    erros = []
+    inseridos = 0
+    afetados = {'clientes': set(), 'numeros_ordem': []}
+    tecnicos = {t for (t,) in session.execute(text("SELECT id FROM tecnicos"))}
+
+    # Números informados no arquivo ficam fora do sorteio
+    informados = {int(r['numero_ordem']) for _, r in validos if (r['numero_ordem'] or '').isdigit()}
+    reserva = iter(reservar_numeros_ordem(
+        session, sum(1 for _, r in validos if not r['numero_ordem']), excluir=informados
+    ))
+
+    vistos = set()
+    for bloco in _em_blocos(validos):
+        clientes = _resolver_clientes(session, {r['cliente'] for _, r in bloco})
+        numeros = [r['numero_ordem'] for _, r in bloco if r['numero_ordem']]
+        em_uso = set()
+        if numeros:
+            em_uso = {n for (n,) in session.execute(
+                text("SELECT numero_ordem FROM ordens_servico WHERE numero_ordem = ANY(:numeros)"),
+                {'numeros': numeros},
+            )}
+
+        pendentes = []
+        for numero_linha, registro in bloco:
+            numero = registro['numero_ordem']
+            reservado = not numero
+            if reservado:
+                numero = next(reserva)
+            cliente_id = clientes.get(registro['cliente']) or clientes.get(registro['cliente'].lower())
+            if not cliente_id:
+                erros.append((numero_linha, 'cliente', f"cliente '{registro['cliente']}' não encontrado"))
+                continue
+            if not reservado and (numero in em_uso or numero in vistos):
+                erros.append((numero_linha, 'numero_ordem', f"'{numero}' já existe"))
+                continue
+            vistos.add(numero)
+            linha = {campo: valor for campo, valor in registro.items() if campo != 'cliente'}
+            linha.update(numero_ordem=numero, cliente_id=cliente_id, pecas=[],
+                         data=registro['data'] or datetime.now())
+            linha['data_atualizacao'] = linha['data']
+            if linha['tecnico_id'] not in tecnicos:
+                linha['tecnico_id'] = None  # Como no cadastro manual: técnico inexistente é ignorado
+            pendentes.append((numero_linha, linha, reservado))
+
+        for tentativa in range(3):
+            if not pendentes:
+                break
+            gravados = {n for (n,) in session.execute(
+                pg_insert(tabela).values([linha for _, linha, _ in pendentes])
+                .on_conflict_do_nothing(index_elements=['numero_ordem'])
+                .returning(tabela.c.numero_ordem)
+            )}
+            session.commit()
+            inseridos += len(gravados)
+            conflitos = []
+            for numero_linha, linha, reservado in pendentes:
+                if linha['numero_ordem'] in gravados:
+                    afetados['clientes'].add(linha['cliente_id'])
+                    afetados['numeros_ordem'].append(linha['numero_ordem'])
+                elif reservado:
+                    conflitos.append((numero_linha, linha, reservado))
+                else:
+                    erros.append((numero_linha, 'numero_ordem', f"'{linha['numero_ordem']}' já existe"))
+            # Número reservado que outra requisição usou nesse meio-tempo: sorteia outro
+            novos = reservar_numeros_ordem(session, len(conflitos), excluir=informados) if conflitos else []
+            for (_, linha, _), numero in zip(conflitos, novos):
+                linha['numero_ordem'] = numero
+            pendentes = conflitos
+        erros.extend((numero_linha, 'numero_ordem', 'sem número de ordem livre') for numero_linha, _, _ in pendentes)
+        progresso(len(bloco), inseridos)
+    return inseridos, erros, afetados
+
+
+GRAVADORES = {'clientes': gravar_clientes, 'ordens': gravar_ordens}
+
+
+# ==================== JOBS ====================
+
+# Estado das importações em background, por id. Também vai para disco em
+# DIR_ESTADO para que a rota de progresso responda em qualquer worker do gunicorn
+DIR_ESTADO = 'data/.importacoes'
+_jobs = {}
+_lock = threading.Lock()
+
+
+def _caminho_estado(job_id):
+    return os.path.join(DIR_ESTADO, f"{job_id}.json")
+
+
+def _persistir(job):
+    try:
+        os.makedirs(DIR_ESTADO, exist_ok=True)
+        temporario = _caminho_estado(job['id']) + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(temporario, _caminho_estado(job['id']))
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar o estado da importação {job['id']}: {e}")
+
+
+def estado_importacao(job_id, com_erros=False):
+    """Estado da importação (None se não existir) - sem a lista de erros, a não ser que pedida"""
+    with _lock:
+        job = _jobs.get(job_id)
+        job = json.loads(json.dumps(job)) if job else None
+    if job is None:
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id or ''):
+            return None
+        try:
+            with open(_caminho_estado(job_id), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+    erros = job.pop('erros', [])
+    job['total_erros'] = len(erros)
+    if com_erros:
+        job['erros'] = erros
+    return job
+
+
+def _atualizar(job_id, **campos):
+    with _lock:
+        _jobs[job_id].update(campos)
+        _persistir(_jobs[job_id])
+
+
+def importar(session, tipo, caminho, nome_arquivo=None, job_id=None):
+    """Importa o arquivo - retorna dict com total, inseridos, erros e afetados"""
+    inicio = time.time()
+
+    def progresso(processadas, inseridos):
+        if job_id:
+            with _lock:
+                _jobs[job_id]['processadas'] += processadas
+                _jobs[job_id]['inseridos'] = inseridos
+                _persistir(_jobs[job_id])
+
+    linhas = list(ler_planilha(caminho, nome_arquivo))
+    if job_id:
+        _atualizar(job_id, fase='validando', total=len(linhas))
+    validados = validar_linhas(tipo, linhas)
+    del linhas
+
+    erros = []
+    validos = []
+    for numero_linha, registro, erros_linha in validados:
+        if erros_linha:
+            erros.extend((numero_linha, campo, mensagem) for campo, mensagem in erros_linha)
+        else:
+            validos.append((numero_linha, registro))
+    if job_id:
+        invalidas = len(validados) - len(validos)
+        _atualizar(job_id, fase='gravando', invalidas=invalidas, processadas=invalidas)
+
+    try:
+        inseridos, erros_gravacao, afetados = GRAVADORES[tipo](session, validos, progresso)
+    except Exception:
+        session.rollback()
+        raise
+    erros.extend(erros_gravacao)
+    erros.sort()
+    return {'total': len(validados), 'inseridos': inseridos, 'erros': erros, 'afetados': afetados,
+            'segundos': time.time() - inicio}
+
+
+def iniciar_importacao_em_background(app, db, tipo, caminho, nome_arquivo, ao_concluir=None):
+    """Dispara a importação em uma thread daemon e retorna o id do job
+
+    O arquivo em `caminho` é removido no final.
+    """
+    job_id = uuid.uuid4().hex
+    with _lock:
+        _jobs[job_id] = {
+            'id': job_id, 'tipo': tipo, 'arquivo': nome_arquivo, 'rodando': True, 'fase': 'lendo',
+            'total': 0, 'processadas': 0, 'inseridos': 0, 'invalidas': 0, 'erros': [],
+            'inicio': time.time(), 'fim': None, 'erro': None,
+        }
+        _persistir(_jobs[job_id])
+
+    def _executar():
+        try:
+            with app.app_context():
+                resultado = importar(db.session, tipo, caminho, nome_arquivo, job_id)
+                _atualizar(job_id, inseridos=resultado['inseridos'],
+                           erros=resultado['erros'][:MAX_ERROS_RELATORIO])
+                if ao_concluir:
+                    ao_concluir(tipo, resultado)
+        except Exception as e:
+            print(f"Erro na importação {job_id} ({nome_arquivo}): {e}")
+            _atualizar(job_id, erro=str(e))
+        finally:
+            _atualizar(job_id, rodando=False, fase='concluido', fim=time.time())
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+    threading.Thread(target=_executar, name=f'importacao-{job_id[:8]}', daemon=True).start()
+    return job_id
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) != 2 or args[0] not in GRAVADORES:
+        print(__doc__)
+        sys.exit(1)
+    from app import app, db
+
+    with app.app_context():
+        resultado = importar(db.session, args[0], args[1])
+    taxa = resultado['total'] / resultado['segundos'] if resultado['segundos'] else 0
+    print(f"✅ {resultado['inseridos']} de {resultado['total']} linhas importadas em "
+          f"{resultado['segundos']:.2f}s ({taxa:,.0f} linhas/s)")
+    for numero_linha, campo, mensagem in resultado['erros'][:50]:
+        print(f"   linha {numero_linha}: {campo} - {mensagem}")
+    if len(resultado['erros']) > 50:
+        print(f"   ... e mais {len(resultado['erros']) - 50} erros")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Extração do texto dos manuais em PDF, página por página
+O PDF é copiado em blocos do armazenamento de blobs (ou da coluna
+pdf_data, nos manuais legados) para um arquivo temporário - ou lido direto
+do disco no backend local - e o pypdf abre as páginas sob demanda: o
+texto de cada página é extraído, gravado em manual_paginas em lotes e
+descartado, então nem o PDF nem o texto inteiro ficam na memória do
+worker.
+
+No app a extração roda em uma fila de uma thread só (um manual por vez),
+disparada pelo upload. Pela linha de comando serve para processar os
+manuais já cadastrados.
+
+Uso:
+    python manuais_texto.py              # manuais sem texto (e 'processando' abandonados)
+    python manuais_texto.py <id> [<id>]  # manuais específicos (reprocessa)
+    python manuais_texto.py --todos      # todos os manuais (reprocessa)
+"""
+
+import os
+import sys
+import time
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from storage import CHUNK_SIZE, backend_da_chave, iter_blob
+
+LOTE_PAGINAS = 25  # Páginas gravadas por transação
+# 'processando' sem lote gravado há mais que isso é de um worker que morreu - pode ser retomado
+PROCESSANDO_EXPIRA_MINUTOS = 30
+# Condição SQL de manual livre para extração (não está sendo processado por ninguém vivo)
+_SQL_LIVRE = """(coalesce(texto_status, '') <> 'processando' OR texto_reivindicado_em IS NULL
+    OR texto_reivindicado_em < now() - make_interval(mins => :expira))"""
+
+# Uma thread só: manuais de 300 páginas não disputam CPU com as requisições entre si
+_fila = ThreadPoolExecutor(max_workers=1, thread_name_prefix='texto-manual')
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover - dependência opcional
+    PdfReader = None
+
+
+@contextmanager
+def _arquivo_pdf(engine, storage_key, manual_id=None):
+    """Caminho local do PDF - copiado em blocos para um temporário quando o blob não está em disco"""
+    if storage_key:
+        caminho = backend_da_chave(storage_key).caminho_local(storage_key)
+        if caminho and os.path.exists(caminho):
+            yield caminho
+            return
+    fd, caminho = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            blocos = iter_blob(engine, storage_key, CHUNK_SIZE) if storage_key else _iter_pdf_legado(engine, manual_id)
+            for bloco in blocos:
+                destino.write(bloco)
+        yield caminho
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def _iter_pdf_legado(engine, manual_id, chunk_size=CHUNK_SIZE):
+    """Gera o PDF legado (coluna bytea pdf_data) em blocos com substring(), sem trazer a coluna inteira"""
+    # REPEATABLE READ: todos os blocos vêm da mesma versão da linha
+    with engine.connect().execution_options(isolation_level='REPEATABLE READ') as conexao:
+        tamanho = conexao.execute(
+            text("SELECT coalesce(octet_length(pdf_data), 0) FROM manuais WHERE id = :id"), {'id': manual_id}
+        ).scalar() or 0
+        for inicio in range(1, tamanho + 1, chunk_size):
+            bloco = conexao.execute(
+                text("SELECT substring(pdf_data FROM :inicio FOR :tamanho) FROM manuais WHERE id = :id"),
+                {'id': manual_id, 'inicio': inicio, 'tamanho': chunk_size}
+            ).scalar()
+            if not bloco:
+                break
+            yield bytes(bloco)
+
+
+def extrair_paginas(caminho):
+    """Gera (numero_pagina, texto) uma página por vez, numeração a partir de 1"""
+    if PdfReader is None:
+        raise RuntimeError('pypdf não instalado - pip install pypdf')
+    # Arquivo aberto em vez do caminho: com um caminho o pypdf copia o PDF inteiro para a memória
+    with open(caminho, 'rb') as arquivo:
+        leitor = PdfReader(arquivo)
+        for indice in range(len(leitor.pages)):
+            try:
+                texto = leitor.pages[indice].extract_text() or ''
+            except Exception as e:
+                # Página com conteúdo corrompido não impede as demais
+                print(f"Aviso: falha ao extrair texto da página {indice + 1} de {caminho}: {e}")
+                texto = ''
+            # O PostgreSQL não aceita NUL em colunas text
+            yield indice + 1, texto.replace('\x00', ' ').strip()
+
+
+def _reivindicar(session, manual_id, forcar=False):
+    """Marca o manual como 'processando' - retorna a storage_key ou None se já está sendo processado
+
+    Um 'processando' parado há mais de PROCESSANDO_EXPIRA_MINUTOS (worker
+    reiniciado no meio da extração) é reivindicado de novo.
+    """
+    condicao = '' if forcar else f"AND {_SQL_LIVRE}"
+    linha = session.execute(text(f"""
+        UPDATE manuais SET texto_status = 'processando', texto_paginas = 0, texto_reivindicado_em = now()
+        WHERE id = :id {condicao}
+        RETURNING coalesce(storage_key, '')
+    """), {'id': manual_id, 'expira': PROCESSANDO_EXPIRA_MINUTOS}).first()
+    if linha is None:
+        session.rollback()
+        return None
+    session.execute(text("DELETE FROM manual_paginas WHERE manual_id = :id"), {'id': manual_id})
+    session.commit()
+    return linha[0]
+
+
+def _ainda_e_o_mesmo_arquivo(session, manual_id, storage_key):
+    """Trava a linha do manual e confere se o PDF não foi trocado durante a extração"""
+    atual = session.execute(
+        text("SELECT coalesce(storage_key, '') FROM manuais WHERE id = :id FOR UPDATE"), {'id': manual_id}
+    ).scalar()
+    return atual == storage_key
+
+
+def extrair_texto_manual(session, manual_id, forcar=False):
+    """Extrai e grava o texto de todas as páginas - retorna o número de páginas (None se não processou)"""
+    storage_key = _reivindicar(session, manual_id, forcar)
+    if storage_key is None:
+        print(f"Manual {manual_id}: extração já em andamento, ignorando")
+        return None
+
+    inicio = time.time()
+    paginas = 0
+    try:
+        # PDF legado (sem storage_key): copiado da coluna pdf_data em blocos
+        with _arquivo_pdf(session.get_bind(), storage_key or None, manual_id) as caminho:
+            lote = []
+            for numero, texto in extrair_paginas(caminho):
+                lote.append({'manual_id': manual_id, 'pagina': numero, 'texto': texto})
+                if len(lote) >= LOTE_PAGINAS:
+                    if not _gravar_lote(session, manual_id, storage_key, lote):
+                        return None
+                    paginas += len(lote)
+                    lote = []
+            if lote and not _gravar_lote(session, manual_id, storage_key, lote):
+                return None
+            paginas += len(lote)
+
+        session.execute(
+            text("UPDATE manuais SET texto_status = 'concluido', texto_paginas = :paginas WHERE id = :id"),
+            {'id': manual_id, 'paginas': paginas}
+        )
+        session.commit()
+        print(f"Manual {manual_id}: {paginas} páginas extraídas em {time.time() - inicio:.1f}s")
+        return paginas
+    except Exception as e:
+        session.rollback()
+        print(f"Erro ao extrair texto do manual {manual_id}: {e}")
+        try:
+            session.execute(text("UPDATE manuais SET texto_status = 'erro' WHERE id = :id"), {'id': manual_id})
+            session.commit()
+        except Exception:
+            session.rollback()
+        raise
+
+
+def _gravar_lote(session, manual_id, storage_key, lote):
+    """Grava um lote de páginas e o progresso - False se o manual foi trocado ou removido"""
+    if not _ainda_e_o_mesmo_arquivo(session, manual_id, storage_key):
+        session.rollback()
+        print(f"Manual {manual_id}: PDF trocado ou removido durante a extração, interrompendo")
+        return False
+    session.execute(
+        text("INSERT INTO manual_paginas (manual_id, pagina, texto) VALUES (:manual_id, :pagina, :texto)"),
+        lote
+    )
+    session.execute(
+        text("UPDATE manuais SET texto_paginas = :paginas, texto_reivindicado_em = now() WHERE id = :id"),
+        {'id': manual_id, 'paginas': lote[-1]['pagina']}
+    )
+    session.commit()
+    return True
+
+
+def agendar_extracao(app, db, manual_id):
+    """Coloca o manual na fila de extração (chamar depois do commit do upload)"""
+    def _executar():
+        try:
+            with app.app_context():
+                extrair_texto_manual(db.session, manual_id)
+        except Exception as e:
+            print(f"Erro na extração em background do manual {manual_id}: {e}")
+        finally:
+            try:
+                with app.app_context():
+                    db.session.remove()
+            except Exception:
+                pass
+
+    _fila.submit(_executar)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if any(a in ('-h', '--help') for a in args):
+        print(__doc__)
+        sys.exit(0)
+    from app import app, db
+
+    with app.app_context():
+        if not args:
+            ids = [linha[0] for linha in db.session.execute(text(f"""
+                SELECT id FROM manuais
+                WHERE coalesce(texto_status, 'pendente') IN ('pendente', 'erro')
+                   OR (texto_status = 'processando' AND {_SQL_LIVRE})
+                ORDER BY id
+            """), {'expira': PROCESSANDO_EXPIRA_MINUTOS})]
+        elif args == ['--todos']:
+            ids = [linha[0] for linha in db.session.execute(text("SELECT id FROM manuais ORDER BY id"))]
+        else:
+            ids = [int(a) for a in args]
+        db.session.commit()
+        for manual_id in ids:
+            try:
+                extrair_texto_manual(db.session, manual_id, forcar=bool(args))
+            except Exception:
+                pass
+        print(f"{len(ids)} manuais processados")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Migração de blobs para o backend de armazenamento configurado
+Move imagens, PDFs e manuais das colunas bytea (ou de outro backend) para o
+backend de destino, um registro por vez, sem tirar o site do ar:
+as rotas de leitura usam storage_key quando preenchido e caem para a coluna
+bytea enquanto o registro ainda não foi migrado
+
+Uso:
+    python migrar_blobs.py [postgres|local|s3] [--lote 20] [--limite N]
+"""
+
+import sys
+import time
+import hashlib
+import threading
+
+from sqlalchemy import text
+
+from storage import CHUNK_SIZE, obter_backend, backend_padrao, backend_da_chave, novo_writer
+
+# (tabela, coluna bytea legada)
+TABELAS_BLOB = [
+    ('imagens', 'dados'),
+    ('pdf_documents', 'dados'),
+    ('manuais', 'pdf_data'),
+]
+
+# Estado da migração em background (consultado pela rota de status)
+_estado = {'rodando': False, 'migrados': 0, 'erros': 0, 'tabela': None, 'inicio': None, 'fim': None}
+_lock = threading.Lock()
+
+
+def estado_migracao():
+    """Retorna uma cópia do estado da migração em background"""
+    with _lock:
+        return dict(_estado)
+
+
+def contar_por_backend(db):
+    """Conta registros por tabela e backend (legado = ainda na coluna bytea)"""
+    resultado = {}
+    for tabela, _coluna in TABELAS_BLOB:
+        linhas = db.session.execute(text(f"""
+            SELECT COALESCE(split_part(storage_key, ':', 1), 'legado') AS backend, COUNT(*)
+            FROM {tabela}
+            GROUP BY 1
+        """)).fetchall()
+        resultado[tabela] = {backend: total for backend, total in linhas}
+    return resultado
+
+
+def _copiar_registro(db, tabela, coluna, registro_id, chave_antiga, destino):
+    """Copia um blob para o destino e troca a chave - retorna True se migrou"""
+    writer = novo_writer(db.session, destino)
+    hasher = hashlib.sha256()
+    try:
+        if chave_antiga:
+            for chunk in backend_da_chave(chave_antiga).iter_chunks(db.engine, chave_antiga):
+                hasher.update(chunk)
+                writer.write(chunk)
+        else:
+            # Coluna bytea lida em pedaços com substring(); FOR UPDATE: a linha não muda durante a cópia
+            tamanho = db.session.execute(
+                text(f"SELECT octet_length({coluna}) FROM {tabela} WHERE id = :id FOR UPDATE"), {'id': registro_id}
+            ).scalar()
+            if tamanho is None:
+                writer.abort()
+                db.session.rollback()
+                return False
+            for inicio in range(1, tamanho + 1, CHUNK_SIZE):
+                chunk = db.session.execute(
+                    text(f"SELECT substring({coluna} FROM :inicio FOR :tamanho) FROM {tabela} WHERE id = :id"),
+                    {'id': registro_id, 'inicio': inicio, 'tamanho': CHUNK_SIZE}
+                ).scalar()
+                hasher.update(chunk)
+                writer.write(chunk)
+    except Exception:
+        writer.abort()
+        raise
+    nova_chave = writer.close()
+
+    # Troca condicional: se o registro mudou durante a cópia (ex: manual substituído), desiste
+    atualizado = db.session.execute(text(f"""
+        UPDATE {tabela}
+        SET storage_key = :nova, sha256 = :sha256, {coluna} = NULL
+        WHERE id = :id AND storage_key IS NOT DISTINCT FROM :antiga
+    """), {'nova': nova_chave, 'sha256': hasher.hexdigest(), 'id': registro_id, 'antiga': chave_antiga}).rowcount
+
+    if not atualizado:
+        db.session.rollback()  # Descarta também o blob novo (large object ou storage.registrar_gravacao)
+        return False
+
+    if chave_antiga:
+        # Large object antigo é removido na mesma transação; demais backends após o commit
+        backend_da_chave(chave_antiga).delete(db.session, chave_antiga)
+    db.session.commit()
+    return True
+
+
+def migrar_blobs(db, destino=None, lote=20, limite=None, pausa=0.0):
+    """Migra blobs para o backend de destino (padrão: BLOB_STORAGE_BACKEND)
+
+    Processa em lotes pequenos e faz commit por registro, então pode ser
+    interrompida e retomada a qualquer momento.
+    """
+    destino = destino or backend_padrao()
+    migrados = 0
+    for tabela, coluna in TABELAS_BLOB:
+        with _lock:
+            _estado['tabela'] = tabela
+        ultimo_id = 0
+        while limite is None or migrados < limite:
+            pendentes = db.session.execute(text(f"""
+                SELECT id, storage_key FROM {tabela}
+                WHERE id > :ultimo
+                AND (storage_key IS NULL OR storage_key NOT LIKE :prefixo)
+                ORDER BY id
+                LIMIT :lote
+            """), {'ultimo': ultimo_id, 'prefixo': destino.prefixo + '%', 'lote': lote}).fetchall()
+            db.session.rollback()  # Não segurar transação aberta entre lotes
+            if not pendentes:
+                break
+            for registro_id, chave_antiga in pendentes:
+                ultimo_id = registro_id
+                try:
+                    if _copiar_registro(db, tabela, coluna, registro_id, chave_antiga, destino):
+                        migrados += 1
+                        with _lock:
+                            _estado['migrados'] += 1
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erro ao migrar {tabela}#{registro_id}: {e}")
+                    with _lock:
+                        _estado['erros'] += 1
+                if pausa:
+                    time.sleep(pausa)
+    return migrados
+
+
+def iniciar_migracao_em_background(app, db, destino_nome=None, lote=20, pausa=0.05):
+    """Dispara a migração em uma thread daemon - retorna False se já houver uma rodando"""
+    with _lock:
+        if _estado['rodando']:
+            return False
+        _estado.update({'rodando': True, 'migrados': 0, 'erros': 0, 'tabela': None, 'inicio': time.time(), 'fim': None})
+
+    def _executar():
+        try:
+            with app.app_context():
+                destino = obter_backend(destino_nome) if destino_nome else None
+                migrar_blobs(db, destino=destino, lote=lote, pausa=pausa)
+        except Exception as e:
+            print(f"Erro na migração de blobs: {e}")
+        finally:
+            with _lock:
+                _estado['rodando'] = False
+                _estado['fim'] = time.time()
+
+    threading.Thread(target=_executar, name='migrar-blobs', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    from app import app, db
+
+    args = sys.argv[1:]
+    destino_nome = args[0] if args and not args[0].startswith('--') else None
+    lote = int(args[args.index('--lote') + 1]) if '--lote' in args else 20
+    limite = int(args[args.index('--limite') + 1]) if '--limite' in args else None
+
+    with app.app_context():
+        destino = obter_backend(destino_nome) if destino_nome else backend_padrao()
+        print(f"Migrando blobs para o backend '{destino.nome}'...")
+        print(f"Antes: {contar_por_backend(db)}")
+        inicio = time.time()
+        total = migrar_blobs(db, destino=destino, lote=lote, limite=limite)
+        print(f"✅ {total} blobs migrados em {time.time() - inicio:.1f}s")
+        print(f"Depois: {contar_por_backend(db)}")
@@ -1,25 +1,48 @@
 #!/usr/bin/env python3
 """
 Script de migração de dados JSON para PostgreSQL
-Migra todos os dados dos arquivos JSON para o banco de dados PostgreSQL
+Migra todos os dados dos arquivos JSON para o banco de dados PostgreSQL.
+
+Os arquivos são lidos em streaming (ijson, se instalado) e gravados em lotes:
+cada lote vai por COPY para uma tabela temporária e entra na tabela final com
+um único INSERT ... SELECT ... ON CONFLICT DO NOTHING - registros que já
+existem são ignorados, como antes, mas sem uma consulta por registro.
+As entidades independentes rodam em paralelo (uma conexão por entidade), as
+sequências de id são ajustadas no final e o progresso fica salvo em
+data/.migracao_checkpoint.json, então uma migração interrompida continua de
+onde parou.
+
+Uso:
+    python migrate_to_db.py [entidade ...] [--lote 5000] [--workers 4] [--reiniciar]
 """
 
+import io
 import os
+import sys
 import json
+import time
+import threading
 from datetime import datetime
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import ijson
+except ImportError:  # Opcional - sem ijson o arquivo é carregado inteiro com json.load
+    ijson = None
 
 # Importações condicionais para permitir uso como módulo
 try:
     from app import app, db
-    from models import (
-        Cliente, Servico, Tecnico, OrdemServico, Comprovante, Cupom,
-        Slide, Footer, Marca, Milestone, AdminUser, Agendamento, Artigo, Contato
-    )
 except ImportError:
     # Se importado como módulo, será importado depois
     app = None
     db = None
 
+ARQUIVO_CHECKPOINT = 'data/.migracao_checkpoint.json'
+TAMANHO_LOTE = 5000
+WORKERS = 4
+
 def parse_datetime(date_str):
     """Converte string de data para datetime"""
     if not date_str:
@@ -32,458 +55,369 @@ def parse_datetime(date_str):
         except:
             return datetime.now()
 
-def migrate_clients():
-    """Migra clientes e suas ordens de serviço"""
-    if not os.path.exists('data/clients.json'):
-        print("Arquivo clients.json não encontrado")
-        return
-    
-    with open('data/clients.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for client_data in data.get('clients', []):
-        # Verificar se já existe
-        cliente = Cliente.query.get(client_data.get('id'))
-        if not cliente:
-            cliente = Cliente(
-                id=client_data.get('id'),
-                nome=client_data.get('nome'),
-                email=client_data.get('email'),
-                telefone=client_data.get('telefone'),
-                cpf=client_data.get('cpf'),
-                endereco=client_data.get('endereco'),
-                username=client_data.get('username'),
-                password=client_data.get('password'),
-                data_cadastro=parse_datetime(client_data.get('data_cadastro'))
-            )
-            db.session.add(cliente)
-            count += 1
-        
-        # Migrar ordens de serviço do cliente
-        for ordem_data in client_data.get('ordens', []):
-            ordem = OrdemServico.query.filter_by(numero_ordem=str(ordem_data.get('numero_ordem'))).first()
-            if not ordem:
-                ordem = OrdemServico(
-                    id=ordem_data.get('id'),
-                    numero_ordem=str(ordem_data.get('numero_ordem')),
-                    cliente_id=client_data.get('id'),
-                    tecnico_id=ordem_data.get('tecnico_id'),
-                    servico=ordem_data.get('servico'),
-                    tipo_aparelho=ordem_data.get('tipo_aparelho'),
-                    marca=ordem_data.get('marca'),
-                    modelo=ordem_data.get('modelo'),
-                    numero_serie=ordem_data.get('numero_serie'),
-                    defeitos_cliente=ordem_data.get('defeitos_cliente'),
-                    diagnostico_tecnico=ordem_data.get('diagnostico_tecnico'),
-                    pecas=ordem_data.get('pecas', []),
-                    custo_pecas=float(ordem_data.get('custo_pecas', 0)) or 0,
-                    custo_mao_obra=float(ordem_data.get('custo_mao_obra', 0)) or 0,
-                    subtotal=float(ordem_data.get('subtotal', 0)) or 0,
-                    desconto_percentual=float(ordem_data.get('desconto_percentual', 0)) or 0,
-                    valor_desconto=float(ordem_data.get('valor_desconto', 0)) or 0,
-                    cupom_id=ordem_data.get('cupom_id'),
-                    total=float(ordem_data.get('total', 0)) or 0,
-                    status=ordem_data.get('status', 'pendente'),
-                    prazo_estimado=ordem_data.get('prazo_estimado'),
-                    pdf_filename=ordem_data.get('pdf_filename'),
-                    data=parse_datetime(ordem_data.get('data'))
-                )
-                db.session.add(ordem)
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} clientes e suas ordens de serviço")
-
-def migrate_services():
-    """Migra serviços"""
-    if not os.path.exists('data/services.json'):
-        print("Arquivo services.json não encontrado")
-        return
-    
-    with open('data/services.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for service_data in data.get('services', []):
-        servico = Servico.query.get(service_data.get('id'))
-        if not servico:
-            servico = Servico(
-                id=service_data.get('id'),
-                nome=service_data.get('nome'),
-                descricao=service_data.get('descricao'),
-                imagem=service_data.get('imagem', ''),
-                ordem=service_data.get('ordem', 999),
-                ativo=service_data.get('ativo', True),
-                data=parse_datetime(service_data.get('data'))
-            )
-            db.session.add(servico)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} serviços")
-
-def migrate_tecnicos():
-    """Migra técnicos"""
-    if not os.path.exists('data/tecnicos.json'):
-        print("Arquivo tecnicos.json não encontrado")
-        return
-    
-    with open('data/tecnicos.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for tecnico_data in data.get('tecnicos', []):
-        tecnico = Tecnico.query.get(tecnico_data.get('id'))
-        if not tecnico:
-            tecnico = Tecnico(
-                id=tecnico_data.get('id'),
-                nome=tecnico_data.get('nome'),
-                telefone=tecnico_data.get('telefone'),
-                email=tecnico_data.get('email'),
-                especialidade=tecnico_data.get('especialidade'),
-                ativo=tecnico_data.get('ativo', True),
-                data_criacao=parse_datetime(tecnico_data.get('data_criacao'))
-            )
-            db.session.add(tecnico)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} técnicos")
-
-def migrate_slides():
-    """Migra slides"""
-    if not os.path.exists('data/slides.json'):
-        print("Arquivo slides.json não encontrado")
-        return
-    
-    with open('data/slides.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for slide_data in data.get('slides', []):
-        slide = Slide.query.get(slide_data.get('id'))
-        if not slide:
-            slide = Slide(
-                id=slide_data.get('id'),
-                imagem=slide_data.get('imagem'),
-                link=slide_data.get('link'),
-                link_target=slide_data.get('link_target', '_self'),
-                ordem=slide_data.get('ordem', 1),
-                ativo=slide_data.get('ativo', True)
-            )
-            db.session.add(slide)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} slides")
-
-def migrate_footer():
-    """Migra configurações do footer"""
-    if not os.path.exists('data/footer.json'):
-        print("Arquivo footer.json não encontrado")
-        return
-    
-    with open('data/footer.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    footer = Footer.query.first()
-    if not footer:
-        footer = Footer(
-            id=1,
-            descricao=data.get('descricao'),
-            redes_sociais=data.get('redes_sociais', {}),
-            contato=data.get('contato', {}),
-            copyright=data.get('copyright'),
-            whatsapp_float=data.get('whatsapp_float')
-        )
-        db.session.add(footer)
-        db.session.commit()
-        print("✅ Migrado footer")
-
-def migrate_marcas():
-    """Migra marcas"""
-    if not os.path.exists('data/marcas.json'):
-        print("Arquivo marcas.json não encontrado")
-        return
-    
-    with open('data/marcas.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for marca_data in data.get('marcas', []):
-        marca = Marca.query.get(marca_data.get('id'))
-        if not marca:
-            marca = Marca(
-                id=marca_data.get('id'),
-                nome=marca_data.get('nome'),
-                imagem=marca_data.get('imagem'),
-                ordem=marca_data.get('ordem', 1),
-                ativo=marca_data.get('ativo', True)
-            )
-            db.session.add(marca)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migradas {count} marcas")
-
-def migrate_milestones():
-    """Migra milestones"""
-    if not os.path.exists('data/milestones.json'):
-        print("Arquivo milestones.json não encontrado")
-        return
-    
-    with open('data/milestones.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for milestone_data in data.get('milestones', []):
-        milestone = Milestone.query.get(milestone_data.get('id'))
-        if not milestone:
-            milestone = Milestone(
-                id=milestone_data.get('id'),
-                titulo=milestone_data.get('titulo'),
-                imagem=milestone_data.get('imagem'),
-                ordem=milestone_data.get('ordem', 1),
-                ativo=milestone_data.get('ativo', True)
-            )
-            db.session.add(milestone)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} milestones")
-
-def migrate_admin_users():
-    """Migra usuários admin"""
-    if not os.path.exists('data/admin_users.json'):
-        print("Arquivo admin_users.json não encontrado")
-        return
-    
-    with open('data/admin_users.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for user_data in data.get('users', []):
-        user = AdminUser.query.get(user_data.get('id'))
-        if not user:
-            user = AdminUser(
-                id=user_data.get('id'),
-                username=user_data.get('username'),
-                password=user_data.get('password'),
-                nome=user_data.get('nome'),
-                email=user_data.get('email'),
-                ativo=user_data.get('ativo', True),
-                data_criacao=parse_datetime(user_data.get('data_criacao'))
-            )
-            db.session.add(user)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} usuários admin")
-
-def migrate_agendamentos():
-    """Migra agendamentos"""
-    if not os.path.exists('data/agendamentos.json'):
-        print("Arquivo agendamentos.json não encontrado")
-        return
-    
-    with open('data/agendamentos.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for agendamento_data in data.get('agendamentos', []):
-        agendamento = Agendamento.query.get(agendamento_data.get('id'))
-        if not agendamento:
-            data_agendamento = agendamento_data.get('data_agendamento')
-            if isinstance(data_agendamento, str):
-                try:
-                    data_agendamento = datetime.strptime(data_agendamento, '%Y-%m-%d').date()
-                except:
-                    data_agendamento = datetime.now().date()
-            
-            agendamento = Agendamento(
-                id=agendamento_data.get('id'),
-                nome=agendamento_data.get('nome'),
-                email=agendamento_data.get('email'),
-                telefone=agendamento_data.get('telefone'),
-                data_agendamento=data_agendamento,
-                hora_agendamento=agendamento_data.get('hora_agendamento', ''),
-                tipo_servico=agendamento_data.get('tipo_servico'),
-                observacoes=agendamento_data.get('observacoes'),
-                status=agendamento_data.get('status', 'pendente'),
-                data_criacao=parse_datetime(agendamento_data.get('data_criacao'))
-            )
-            db.session.add(agendamento)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} agendamentos")
-
-def migrate_blog():
-    """Migra artigos do blog"""
-    if not os.path.exists('data/blog.json'):
-        print("Arquivo blog.json não encontrado")
-        return
-    
-    with open('data/blog.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for artigo_data in data.get('artigos', []):
-        artigo = Artigo.query.get(artigo_data.get('id'))
-        if not artigo:
-            data_pub = artigo_data.get('data_publicacao')
-            if isinstance(data_pub, str):
-                try:
-                    data_pub = datetime.strptime(data_pub, '%Y-%m-%d %H:%M:%S')
-                except:
-                    try:
-                        data_pub = datetime.strptime(data_pub, '%Y-%m-%d')
-                    except:
-                        data_pub = datetime.now()
-            
-            artigo = Artigo(
-                id=artigo_data.get('id'),
-                titulo=artigo_data.get('titulo'),
-                subtitulo=artigo_data.get('subtitulo'),
-                slug=artigo_data.get('slug'),
-                categoria=artigo_data.get('categoria'),
-                autor=artigo_data.get('autor'),
-                resumo=artigo_data.get('resumo'),
-                conteudo=artigo_data.get('conteudo'),
-                imagem_destaque=artigo_data.get('imagem_destaque'),
-                data_publicacao=data_pub,
-                ativo=artigo_data.get('ativo', True),
-                data_criacao=parse_datetime(artigo_data.get('data_criacao'))
-            )
-            db.session.add(artigo)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} artigos do blog")
-
-def migrate_comprovantes():
-    """Migra comprovantes"""
-    if not os.path.exists('data/comprovantes.json'):
-        print("Arquivo comprovantes.json não encontrado")
+def parse_date(date_str):
+    """Converte string de data (YYYY-MM-DD) para date"""
+    if not isinstance(date_str, str):
+        return date_str or datetime.now().date()
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except:
+        return datetime.now().date()
+
+def _numero(valor):
+    try:
+        return float(valor or 0)
+    except (TypeError, ValueError):
+        return 0
+
+# ==================== LEITURA ====================
+
+def ler_registros(arquivo, chave):
+    """Itera os itens da lista `chave` do arquivo JSON sem carregá-lo inteiro (com ijson)
+
+    chave=None devolve o próprio documento como único registro (ex: footer.json).
+    """
+    if not os.path.exists(arquivo):
         return
-    
-    with open('data/comprovantes.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for comprovante_data in data.get('comprovantes', []):
-        comprovante = Comprovante.query.get(comprovante_data.get('id'))
-        if not comprovante:
-            comprovante = Comprovante(
-                id=comprovante_data.get('id'),
-                cliente_id=comprovante_data.get('cliente_id'),
-                cliente_nome=comprovante_data.get('cliente_nome'),
-                ordem_id=comprovante_data.get('ordem_id'),
-                numero_ordem=comprovante_data.get('numero_ordem'),
-                valor_total=float(comprovante_data.get('valor_total', 0)) or 0,
-                valor_pago=float(comprovante_data.get('valor_pago', 0)) or 0,
-                forma_pagamento=comprovante_data.get('forma_pagamento'),
-                parcelas=comprovante_data.get('parcelas', 1),
-                pdf_filename=comprovante_data.get('pdf_filename'),
-                data=parse_datetime(comprovante_data.get('data'))
-            )
-            db.session.add(comprovante)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} comprovantes")
-
-def migrate_cupons():
-    """Migra cupons de fidelidade"""
-    if not os.path.exists('data/fidelidade.json'):
-        print("Arquivo fidelidade.json não encontrado")
+    if chave is None:
+        with open(arquivo, 'r', encoding='utf-8') as f:
+            yield json.load(f)
         return
-    
-    with open('data/fidelidade.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for cupom_data in data.get('cupons', []):
-        cupom = Cupom.query.get(cupom_data.get('id'))
-        if not cupom:
-            cupom = Cupom(
-                id=cupom_data.get('id'),
-                cliente_id=cupom_data.get('cliente_id'),
-                cliente_nome=cupom_data.get('cliente_nome'),
-                desconto_percentual=float(cupom_data.get('desconto_percentual', 0)) or 0,
-                usado=cupom_data.get('usado', False),
-                ordem_id=cupom_data.get('ordem_id'),
-                data_emissao=parse_datetime(cupom_data.get('data_emissao')),
-                data_uso=parse_datetime(cupom_data.get('data_uso')) if cupom_data.get('data_uso') else None
-            )
-            db.session.add(cupom)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} cupons")
-
-def migrate_contatos():
-    """Migra contatos do formulário"""
-    if not os.path.exists('data/services.json'):
+    if ijson is not None:
+        with open(arquivo, 'rb') as f:
+            # use_float: números chegam como float (e não Decimal), como no json.load
+            yield from ijson.items(f, f'{chave}.item', use_float=True)
         return
-    
-    with open('data/services.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    count = 0
-    for contato_data in data.get('contacts', []):
-        contato = Contato.query.get(contato_data.get('id'))
-        if not contato:
-            contato = Contato(
-                id=contato_data.get('id'),
-                nome=contato_data.get('nome'),
-                email=contato_data.get('email'),
-                telefone=contato_data.get('telefone'),
-                servico=contato_data.get('servico'),
-                mensagem=contato_data.get('mensagem'),
-                data=parse_datetime(contato_data.get('data'))
+    with open(arquivo, 'r', encoding='utf-8') as f:
+        dados = json.load(f)
+    yield from dados.get(chave, [])
+
+def _ordens_dos_clientes(registros):
+    """As ordens ficam aninhadas em cada cliente de clients.json"""
+    for client_data in registros:
+        for ordem_data in client_data.get('ordens', []):
+            yield dict(ordem_data, cliente_id=client_data.get('id'))
+
+# ==================== ENTIDADES ====================
+
+# nome, arquivo, chave da lista, tabela, colunas, conversor (registro -> tupla), dependências.
+# As dependências definem a ordem: ordens só entram depois de clientes e técnicos (FKs)
+ENTIDADES = [
+    {
+        'nome': 'clientes', 'arquivo': 'data/clients.json', 'chave': 'clients', 'tabela': 'clientes',
+        'colunas': ('id', 'nome', 'email', 'telefone', 'cpf', 'endereco', 'username', 'password', 'data_cadastro'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('nome'), d.get('email'), d.get('telefone'), d.get('cpf'), d.get('endereco'),
+            d.get('username'), d.get('password'), parse_datetime(d.get('data_cadastro')),
+        ),
+    },
+    {
+        'nome': 'ordens', 'arquivo': 'data/clients.json', 'chave': 'clients', 'tabela': 'ordens_servico',
+        'expandir': _ordens_dos_clientes,
+        'depende': ('clientes', 'tecnicos'),
+        'colunas': (
+            'id', 'numero_ordem', 'cliente_id', 'tecnico_id', 'servico', 'tipo_aparelho', 'marca', 'modelo',
+            'numero_serie', 'defeitos_cliente', 'diagnostico_tecnico', 'pecas', 'custo_pecas', 'custo_mao_obra',
+            'subtotal', 'desconto_percentual', 'valor_desconto', 'cupom_id', 'total', 'status', 'prazo_estimado',
+            'pdf_filename', 'data',
+        ),
+        'conversor': lambda d: (
+            d.get('id'), str(d.get('numero_ordem')), d.get('cliente_id'), d.get('tecnico_id'), d.get('servico'),
+            d.get('tipo_aparelho'), d.get('marca'), d.get('modelo'), d.get('numero_serie'),
+            d.get('defeitos_cliente'), d.get('diagnostico_tecnico'), json.dumps(d.get('pecas', [])),
+            _numero(d.get('custo_pecas')), _numero(d.get('custo_mao_obra')), _numero(d.get('subtotal')),
+            _numero(d.get('desconto_percentual')), _numero(d.get('valor_desconto')), d.get('cupom_id'),
+            _numero(d.get('total')), d.get('status', 'pendente'), d.get('prazo_estimado'),
+            d.get('pdf_filename'), parse_datetime(d.get('data')),
+        ),
+    },
+    {
+        'nome': 'servicos', 'arquivo': 'data/services.json', 'chave': 'services', 'tabela': 'servicos',
+        'colunas': ('id', 'nome', 'descricao', 'imagem', 'ordem', 'ativo', 'data'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('nome'), d.get('descricao'), d.get('imagem', ''), d.get('ordem', 999),
+            d.get('ativo', True), parse_datetime(d.get('data')),
+        ),
+    },
+    {
+        'nome': 'tecnicos', 'arquivo': 'data/tecnicos.json', 'chave': 'tecnicos', 'tabela': 'tecnicos',
+        'colunas': ('id', 'nome', 'telefone', 'email', 'especialidade', 'ativo', 'data_criacao'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('nome'), d.get('telefone'), d.get('email'), d.get('especialidade'),
+            d.get('ativo', True), parse_datetime(d.get('data_criacao')),
+        ),
+    },
+    {
+        'nome': 'slides', 'arquivo': 'data/slides.json', 'chave': 'slides', 'tabela': 'slides',
+        'colunas': ('id', 'imagem', 'link', 'link_target', 'ordem', 'ativo'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('imagem'), d.get('link'), d.get('link_target', '_self'), d.get('ordem', 1),
+            d.get('ativo', True),
+        ),
+    },
+    {
+        'nome': 'footer', 'arquivo': 'data/footer.json', 'chave': None, 'tabela': 'footer',
+        'somente_se_vazia': True,
+        'colunas': ('id', 'descricao', 'redes_sociais', 'contato', 'copyright', 'whatsapp_float'),
+        'conversor': lambda d: (
+            1, d.get('descricao'), json.dumps(d.get('redes_sociais', {})), json.dumps(d.get('contato', {})),
+            d.get('copyright'), d.get('whatsapp_float'),
+        ),
+    },
+    {
+        'nome': 'marcas', 'arquivo': 'data/marcas.json', 'chave': 'marcas', 'tabela': 'marcas',
+        'colunas': ('id', 'nome', 'imagem', 'ordem', 'ativo'),
+        'conversor': lambda d: (d.get('id'), d.get('nome'), d.get('imagem'), d.get('ordem', 1), d.get('ativo', True)),
+    },
+    {
+        'nome': 'milestones', 'arquivo': 'data/milestones.json', 'chave': 'milestones', 'tabela': 'milestones',
+        'colunas': ('id', 'titulo', 'imagem', 'ordem', 'ativo'),
+        'conversor': lambda d: (d.get('id'), d.get('titulo'), d.get('imagem'), d.get('ordem', 1), d.get('ativo', True)),
+    },
+    {
+        'nome': 'admin_users', 'arquivo': 'data/admin_users.json', 'chave': 'users', 'tabela': 'admin_users',
+        'colunas': ('id', 'username', 'password', 'nome', 'email', 'ativo', 'data_criacao'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('username'), d.get('password'), d.get('nome'), d.get('email'), d.get('ativo', True),
+            parse_datetime(d.get('data_criacao')),
+        ),
+    },
+    {
+        'nome': 'agendamentos', 'arquivo': 'data/agendamentos.json', 'chave': 'agendamentos', 'tabela': 'agendamentos',
+        'colunas': ('id', 'nome', 'email', 'telefone', 'data_agendamento', 'hora_agendamento', 'tipo_servico',
+                    'observacoes', 'status', 'data_criacao'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('nome'), d.get('email'), d.get('telefone'), parse_date(d.get('data_agendamento')),
+            d.get('hora_agendamento', ''), d.get('tipo_servico'), d.get('observacoes'), d.get('status', 'pendente'),
+            parse_datetime(d.get('data_criacao')),
+        ),
+    },
+    {
+        'nome': 'artigos', 'arquivo': 'data/blog.json', 'chave': 'artigos', 'tabela': 'artigos',
+        'colunas': ('id', 'titulo', 'subtitulo', 'slug', 'categoria', 'autor', 'resumo', 'conteudo',
+                    'imagem_destaque', 'data_publicacao', 'ativo', 'data_criacao'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('titulo'), d.get('subtitulo'), d.get('slug'), d.get('categoria'), d.get('autor'),
+            d.get('resumo'), d.get('conteudo'), d.get('imagem_destaque'), parse_datetime(d.get('data_publicacao')),
+            d.get('ativo', True), parse_datetime(d.get('data_criacao')),
+        ),
+    },
+    {
+        'nome': 'comprovantes', 'arquivo': 'data/comprovantes.json', 'chave': 'comprovantes', 'tabela': 'comprovantes',
+        'colunas': ('id', 'cliente_id', 'cliente_nome', 'ordem_id', 'numero_ordem', 'valor_total', 'valor_pago',
+                    'forma_pagamento', 'parcelas', 'pdf_filename', 'data'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('cliente_id'), d.get('cliente_nome'), d.get('ordem_id'), d.get('numero_ordem'),
+            _numero(d.get('valor_total')), _numero(d.get('valor_pago')), d.get('forma_pagamento'),
+            d.get('parcelas', 1), d.get('pdf_filename'), parse_datetime(d.get('data')),
+        ),
+    },
+    {
+        'nome': 'cupons', 'arquivo': 'data/fidelidade.json', 'chave': 'cupons', 'tabela': 'cupons',
+        'colunas': ('id', 'cliente_id', 'cliente_nome', 'desconto_percentual', 'usado', 'ordem_id', 'data_emissao',
+                    'data_uso'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('cliente_id'), d.get('cliente_nome'), _numero(d.get('desconto_percentual')),
+            d.get('usado', False), d.get('ordem_id'), parse_datetime(d.get('data_emissao')),
+            parse_datetime(d.get('data_uso')) if d.get('data_uso') else None,
+        ),
+    },
+    {
+        'nome': 'contatos', 'arquivo': 'data/services.json', 'chave': 'contacts', 'tabela': 'contatos',
+        'colunas': ('id', 'nome', 'email', 'telefone', 'servico', 'mensagem', 'data'),
+        'conversor': lambda d: (
+            d.get('id'), d.get('nome'), d.get('email'), d.get('telefone'), d.get('servico'), d.get('mensagem'),
+            parse_datetime(d.get('data')),
+        ),
+    },
+]
+
+# ==================== CHECKPOINT ====================
+
+_lock_checkpoint = threading.Lock()
+
+def carregar_checkpoint(caminho=ARQUIVO_CHECKPOINT):
+    """Registros já gravados por entidade ({} se não houver checkpoint)"""
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _salvar_checkpoint(checkpoint, caminho=ARQUIVO_CHECKPOINT):
+    with _lock_checkpoint:
+        temporario = caminho + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, indent=2, sort_keys=True)
+        os.replace(temporario, caminho)
+
+# ==================== GRAVAÇÃO ====================
+
+def _valor_copy(valor):
+    """Formata um valor para o formato texto do COPY (\\N = NULL)"""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, datetime):
+        return valor.isoformat(sep=' ')
+    return (str(valor).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _buffer_copy(linhas):
+    buffer = io.StringIO()
+    for linha in linhas:
+        buffer.write('\t'.join(_valor_copy(valor) for valor in linha))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+def migrar_entidade(engine, entidade, checkpoint, tamanho_lote=TAMANHO_LOTE):
+    """Grava uma entidade em lotes (COPY -> tabela temporária -> INSERT ON CONFLICT DO NOTHING)
+
+    Retorna dict com lidos, inseridos e segundos. Usa uma conexão própria,
+    então pode rodar em paralelo com as demais entidades.
+    """
+    nome = entidade['nome']
+    tabela = entidade['tabela']
+    colunas = ', '.join(entidade['colunas'])
+    staging = f"_migracao_{tabela}"
+    ja_gravados = checkpoint.get(nome, 0)
+
+    registros = ler_registros(entidade['arquivo'], entidade['chave'])
+    if entidade.get('expandir'):
+        registros = entidade['expandir'](registros)
+    registros = islice(registros, ja_gravados, None)  # Retoma depois do último lote confirmado
+
+    condicao = f" WHERE NOT EXISTS (SELECT 1 FROM {tabela})" if entidade.get('somente_se_vazia') else ''
+    sql_insert = (f"INSERT INTO {tabela} ({colunas}) SELECT {colunas} FROM {staging}{condicao} "
+                  f"ON CONFLICT DO NOTHING")
+
+    inicio = time.time()
+    lidos = inseridos = 0
+    conexao = engine.raw_connection()
+    try:
+        cursor = conexao.cursor()
+        # A conexão volta para o pool: uma tentativa anterior que falhou pode ter deixado a temporária
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {tabela} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+        conexao.commit()
+        while True:
+            lote = [entidade['conversor'](registro) for registro in islice(registros, tamanho_lote)]
+            if not lote:
+                break
+            cursor.copy_expert(f"COPY {staging} ({colunas}) FROM STDIN", _buffer_copy(lote))
+            cursor.execute(sql_insert)
+            inseridos += cursor.rowcount
+            conexao.commit()
+            lidos += len(lote)
+            checkpoint[nome] = ja_gravados + lidos
+            _salvar_checkpoint(checkpoint)
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+    finally:
+        conexao.close()
+
+    return {'lidos': lidos, 'inseridos': inseridos, 'pulados_checkpoint': ja_gravados,
+            'segundos': time.time() - inicio}
+
+def ajustar_sequencias(engine, tabelas):
+    """Coloca cada sequência de id depois do maior id gravado (os ids vieram do JSON)"""
+    conexao = engine.raw_connection()
+    try:
+        cursor = conexao.cursor()
+        for tabela in tabelas:
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {tabela}",
+                (tabela,),
             )
-            db.session.add(contato)
-            count += 1
-    
-    db.session.commit()
-    print(f"✅ Migrados {count} contatos")
+        conexao.commit()
+    finally:
+        conexao.close()
+
+def _ondas(entidades):
+    """Agrupa as entidades em ondas: cada onda só depende das anteriores"""
+    nomes = {e['nome'] for e in entidades}
+    feitas = set()
+    pendentes = list(entidades)
+    while pendentes:
+        onda = [e for e in pendentes if all(d in feitas or d not in nomes for d in e.get('depende', ()))]
+        if not onda:
+            raise ValueError(f"Dependências circulares: {[e['nome'] for e in pendentes]}")
+        yield onda
+        feitas.update(e['nome'] for e in onda)
+        pendentes = [e for e in pendentes if e['nome'] not in feitas]
+
+def migrar(engine, nomes=None, tamanho_lote=TAMANHO_LOTE, workers=WORKERS, reiniciar=False):
+    """Migra as entidades (todas, ou só as de `nomes`) - retorna {nome: estatísticas}"""
+    entidades = [e for e in ENTIDADES if not nomes or e['nome'] in nomes]
+    if reiniciar and os.path.exists(ARQUIVO_CHECKPOINT):
+        os.remove(ARQUIVO_CHECKPOINT)
+    checkpoint = carregar_checkpoint()
+
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for onda in _ondas(entidades):
+            futuros = {e['nome']: executor.submit(migrar_entidade, engine, e, checkpoint, tamanho_lote) for e in onda}
+            for nome, futuro in futuros.items():
+                resultados[nome] = futuro.result()  # Erro em uma entidade interrompe as ondas seguintes
+                r = resultados[nome]
+                taxa = r['lidos'] / r['segundos'] if r['segundos'] > 0 else 0
+                print(f"✅ {nome:<13} {r['inseridos']:>8} inseridos / {r['lidos']:>8} lidos "
+                      f"em {r['segundos']:6.2f}s ({taxa:,.0f} registros/s)")
+
+    ajustar_sequencias(engine, sorted({e['tabela'] for e in entidades}))
+    return resultados
 
 def main():
     """Executa todas as migrações"""
+    args = sys.argv[1:]
+    opcoes = {'--lote': TAMANHO_LOTE, '--workers': WORKERS}
+    nomes = []
+    i = 0
+    while i < len(args):
+        if args[i] in opcoes and i + 1 < len(args):
+            opcoes[args[i]] = int(args[i + 1])
+            i += 2
+            continue
+        if not args[i].startswith('--'):
+            nomes.append(args[i])
+        i += 1
+    desconhecidas = set(nomes) - {e['nome'] for e in ENTIDADES}
+    if desconhecidas:
+        print(f"Entidades desconhecidas: {', '.join(sorted(desconhecidas))}")
+        print(__doc__)
+        sys.exit(1)
+
     print("=" * 60)
     print("MIGRAÇÃO DE DADOS JSON PARA POSTGRESQL")
     print("=" * 60)
     print()
-    
+    if ijson is None:
+        print("Aviso: módulo ijson não instalado - arquivos serão carregados inteiros na memória\n")
+
     with app.app_context():
         # Criar todas as tabelas
         db.create_all()
         print("✅ Tabelas criadas/verificadas\n")
-        
-        # Executar migrações
-        migrate_clients()
-        migrate_services()
-        migrate_tecnicos()
-        migrate_slides()
-        migrate_footer()
-        migrate_marcas()
-        migrate_milestones()
-        migrate_admin_users()
-        migrate_agendamentos()
-        migrate_blog()
-        migrate_comprovantes()
-        migrate_cupons()
-        migrate_contatos()
-        
+
+        inicio = time.time()
+        resultados = migrar(db.engine, nomes, tamanho_lote=opcoes['--lote'], workers=opcoes['--workers'],
+                            reiniciar='--reiniciar' in args)
+        total = sum(r['lidos'] for r in resultados.values())
+        segundos = time.time() - inicio
+
         print()
         print("=" * 60)
         print("✅ MIGRAÇÃO CONCLUÍDA COM SUCESSO!")
         print("=" * 60)
         print()
-        print("Todos os dados foram migrados para o banco de dados PostgreSQL.")
+        print(f"{total} registros em {segundos:.2f}s ({total / segundos if segundos else 0:,.0f} registros/s)")
         print("Os arquivos JSON originais foram preservados como backup.")
+        print(f"Progresso salvo em {ARQUIVO_CHECKPOINT} (use --reiniciar para migrar do zero).")
 
 if __name__ == '__main__':
     main()
-
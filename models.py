@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import re
 from sqlalchemy.dialects.postgresql import JSON
 import os
 
@@ -27,7 +28,9 @@ class Imagem(db.Model):
     __tablename__ = 'imagens'
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(200))
-    dados = db.Column(db.LargeBinary, nullable=False)  # Dados binários da imagem
+    dados = db.deferred(db.Column(db.LargeBinary))  # Dados binários da imagem (legado - uploads novos usam storage_key)
+    storage_key = db.Column(db.String(200))  # Chave do blob no armazenamento (ex: 'pglo:12345', 'file:ab/abcd...', 's3:...')
+    sha256 = db.Column(db.String(64))  # Hash do conteúdo calculado durante o upload
     tipo_mime = db.Column(db.String(50), nullable=False)  # image/jpeg, image/png, etc
     tamanho = db.Column(db.Integer)  # Tamanho em bytes
     data_upload = db.Column(db.DateTime, default=datetime.now)
@@ -39,7 +42,9 @@ class PDFDocument(db.Model):
     __tablename__ = 'pdf_documents'
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(200), nullable=False)
-    dados = db.Column(db.LargeBinary, nullable=False)  # Dados binários do PDF
+    dados = db.deferred(db.Column(db.LargeBinary))  # Dados binários do PDF (legado - PDFs novos usam storage_key)
+    storage_key = db.Column(db.String(200))  # Chave do blob no armazenamento (ex: 'pglo:12345', 'file:ab/abcd...', 's3:...')
+    sha256 = db.Column(db.String(64))  # Hash do conteúdo
     tamanho = db.Column(db.Integer)  # Tamanho em bytes
     tipo_documento = db.Column(db.String(50))  # 'ordem_servico', 'comprovante'
     referencia_id = db.Column(db.Integer)  # ID do documento relacionado (ordem_id, comprovante_id)
@@ -98,15 +103,46 @@ class OrdemServico(db.Model):
     valor_desconto = db.Column(db.Numeric(10, 2), default=0)
     cupom_id = db.Column(db.Integer)
     total = db.Column(db.Numeric(10, 2), default=0)
-    status = db.Column(db.String(50), default='pendente')
+    # active_history: o status anterior fica disponível ao trocar, mesmo com a ordem expirada (histórico de status)
+    status = db.column_property(db.Column(db.String(50), default='pendente'), active_history=True)
     prazo_estimado = db.Column(db.String(100))
     pdf_id = db.Column(db.Integer, db.ForeignKey('pdf_documents.id'))  # Referência ao PDF no banco
     pdf_filename = db.Column(db.String(200))  # Mantido para compatibilidade/fallback
     data = db.Column(db.DateTime, default=datetime.now)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
     
     # Relacionamento
     pdf_document = db.relationship('PDFDocument', foreign_keys=[pdf_id], lazy=True)
 
+class OrdemStatusEvento(db.Model):
+    """Histórico das mudanças de status das ordens - só recebe INSERTs (ver status_ordens.py)"""
+    __tablename__ = 'ordem_status_eventos'
+    id = db.Column(db.BigInteger, primary_key=True)
+    ordem_id = db.Column(db.Integer, db.ForeignKey('ordens_servico.id', ondelete='CASCADE'), nullable=False, index=True)
+    status_anterior = db.Column(db.String(50))
+    status_novo = db.Column(db.String(50), nullable=False)
+    origem = db.Column(db.String(30))  # lote, edicao, comprovante...
+    usuario = db.Column(db.String(100))
+    data = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
+
+class OrdemStatusResumo(db.Model):
+    """Tempo agregado em cada status, por dia de saída, status e técnico (0 = sem técnico)"""
+    __tablename__ = 'ordem_status_resumo'
+    dia = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    tecnico_id = db.Column(db.Integer, primary_key=True, default=0)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    segundos_total = db.Column(db.BigInteger, nullable=False, default=0)
+    segundos_max = db.Column(db.BigInteger, nullable=False, default=0)
+    acima_sla = db.Column(db.Integer, nullable=False, default=0)
+
+class OrdemStatusAgregacao(db.Model):
+    """Controle da agregação: último evento já somado em ordem_status_resumo (linha única, id=1)"""
+    __tablename__ = 'ordem_status_agregacao'
+    id = db.Column(db.Integer, primary_key=True)
+    ultimo_evento_id = db.Column(db.BigInteger, nullable=False, default=0)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now)
+
 # ==================== COMPROVANTES ====================
 class Comprovante(db.Model):
     __tablename__ = 'comprovantes'
@@ -212,6 +248,25 @@ class Agendamento(db.Model):
     observacoes = db.Column(db.Text)
     status = db.Column(db.String(50), default='pendente')
     data_criacao = db.Column(db.DateTime, default=datetime.now)
+    hora = db.Column(db.Time)  # Mesma hora de hora_agendamento, tipada (índice data_agendamento + hora)
+    duracao_minutos = db.Column(db.Integer)
+    tecnico_id = db.Column(db.Integer, db.ForeignKey('tecnicos.id', ondelete='SET NULL'))
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # ETag do feed .ics
+
+class AgendaOcupacao(db.Model):
+    """Bitmap dos slots ocupados de cada vaga (técnico x atendimento simultâneo) por dia - ver agenda.py"""
+    __tablename__ = 'agenda_ocupacao'
+    data = db.Column(db.Date, primary_key=True)
+    tecnico_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 = sem técnico cadastrado
+    vaga = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    bitmap = db.Column(db.BigInteger, nullable=False, default=0)
+
+class AgendaOcupacaoLayout(db.Model):
+    """Linha única: assinatura da configuração (origem, intervalo, vagas) com que os bitmaps foram montados"""
+    __tablename__ = 'agenda_ocupacao_layout'
+    id = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    assinatura = db.Column(db.String(64))
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now)
 
 # ==================== BLOG ====================
 class Artigo(db.Model):
@@ -259,6 +314,37 @@ class Fornecedor(db.Model):
     ativo = db.Column(db.Boolean, default=True)
     data_cadastro = db.Column(db.DateTime, default=datetime.now)
 
+# ==================== CATÁLOGO DE PEÇAS ====================
+class Peca(db.Model):
+    """Peça do catálogo - o campo estoque só muda por SQL atômico (ver estoque.py)"""
+    __tablename__ = 'pecas'
+    id = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(50), unique=True, nullable=False)
+    nome = db.Column(db.String(200), nullable=False)
+    fornecedor_id = db.Column(db.Integer, db.ForeignKey('fornecedores.id', ondelete='SET NULL'), index=True)
+    custo = db.Column(db.Numeric(10, 2), default=0)
+    estoque = db.Column(db.Integer, nullable=False, default=0)
+    estoque_minimo = db.Column(db.Integer, nullable=False, default=0)
+    ativo = db.Column(db.Boolean, default=True)
+    data_cadastro = db.Column(db.DateTime, default=datetime.now)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    # Relacionamento
+    fornecedor = db.relationship('Fornecedor', lazy=True)
+
+class OrdemPeca(db.Model):
+    """Peça usada numa ordem - do catálogo (peca_id) ou só a descrição digitada"""
+    __tablename__ = 'ordem_pecas'
+    id = db.Column(db.Integer, primary_key=True)
+    ordem_id = db.Column(db.Integer, db.ForeignKey('ordens_servico.id', ondelete='CASCADE'), nullable=False, index=True)
+    peca_id = db.Column(db.Integer, db.ForeignKey('pecas.id', ondelete='SET NULL'), index=True)
+    descricao = db.Column(db.String(200), nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False, default=1)
+    custo_unitario = db.Column(db.Numeric(10, 2), default=0)
+    # True quando a linha deu baixa no estoque - as copiadas das ordens antigas (backfill) não deram
+    baixa_estoque = db.Column(db.Boolean, nullable=False, default=True)
+    data = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
+
 # Modelos da loja removidos - sistema de loja removido
 
 # ==================== REPAROS REALIZADOS ====================
@@ -277,6 +363,37 @@ class ReparoRealizado(db.Model):
     imagem_obj = db.relationship('Imagem', foreign_keys=[imagem_id], lazy=True)
 
 # ==================== VÍDEOS ====================
+# Padrões do ID do vídeo no código embed, em ordem de prioridade:
+# src=".../embed/VIDEO_ID", youtu.be/VIDEO_ID e, por último, o ID direto (11 caracteres)
+_PADROES_VIDEO_ID = [
+    re.compile(r'/embed/([a-zA-Z0-9_-]{11})'),
+    re.compile(r'youtu\.be/([a-zA-Z0-9_-]{11})'),
+    re.compile(r'([a-zA-Z0-9_-]{11})'),
+]
+
+def extrair_video_id(embed_code):
+    """Extrai o ID do vídeo do YouTube de um código embed (ou None)"""
+    if not embed_code:
+        return None
+    for padrao in _PADROES_VIDEO_ID:
+        match = padrao.search(embed_code)
+        if match:
+            return match.group(1)
+    return None
+
+def metadados_video(video_id):
+    """Monta embed_url, thumbnail_url e embed_html canônicos a partir do ID"""
+    if not video_id:
+        return {'video_id': None, 'embed_url': None, 'thumbnail_url': None, 'embed_html': None}
+    embed_url = f'https://www.youtube.com/embed/{video_id}'
+    return {
+        'video_id': video_id,
+        'embed_url': embed_url,
+        'thumbnail_url': f'https://img.youtube.com/vi/{video_id}/maxresdefault.jpg',
+        # Iframe gerado por nós - o código colado pelo admin nunca vai para a página
+        'embed_html': f'<iframe width="560" height="315" src="{embed_url}" frameborder="0" allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture" allowfullscreen></iframe>',
+    }
+
 class Video(db.Model):
     """Vídeos do YouTube cadastrados usando código embed"""
     __tablename__ = 'videos'
@@ -286,54 +403,39 @@ class Video(db.Model):
     ordem = db.Column(db.Integer, default=1)  # Ordem de exibição
     ativo = db.Column(db.Boolean, default=True)
     data_criacao = db.Column(db.DateTime, default=datetime.now)
+    # Metadados calculados ao salvar (atualizar_metadados) - as listagens não fazem parsing
+    video_id = db.Column(db.String(11), index=True)
+    embed_url = db.Column(db.String(200))
+    thumbnail_url = db.Column(db.String(200))
+    embed_html = db.Column(db.Text)
+    
+    def atualizar_metadados(self):
+        """Recalcula video_id, embed_url, thumbnail_url e embed_html a partir do embed_code"""
+        for campo, valor in metadados_video(extrair_video_id(self.embed_code)).items():
+            setattr(self, campo, valor)
+        return self.video_id
     
     def get_video_id(self):
-        """Extrai o ID do vídeo do YouTube do código embed"""
-        import re
-        # Tenta extrair o ID de diferentes formatos de embed
-        # Formato 1: src="https://www.youtube.com/embed/VIDEO_ID"
-        # Formato 2: src="https://youtu.be/VIDEO_ID"
-        # Formato 3: VIDEO_ID direto
-        if not self.embed_code:
-            return None
-        
-        # Procurar por /embed/VIDEO_ID
-        match = re.search(r'/embed/([a-zA-Z0-9_-]{11})', self.embed_code)
-        if match:
-            return match.group(1)
-        
-        # Procurar por youtu.be/VIDEO_ID
-        match = re.search(r'youtu\.be/([a-zA-Z0-9_-]{11})', self.embed_code)
-        if match:
-            return match.group(1)
-        
-        # Procurar por ID direto (11 caracteres)
-        match = re.search(r'([a-zA-Z0-9_-]{11})', self.embed_code)
-        if match and len(match.group(1)) == 11:
-            return match.group(1)
-        
-        return None
+        """Retorna o ID do vídeo do YouTube (calcula do embed_code se ainda não foi salvo)"""
+        return self.video_id or extrair_video_id(self.embed_code)
     
     def get_embed_url(self):
         """Retorna a URL embed do YouTube"""
-        video_id = self.get_video_id()
-        if video_id:
-            return f'https://www.youtube.com/embed/{video_id}'
-        return None
+        if self.embed_url:
+            return self.embed_url
+        return metadados_video(self.get_video_id())['embed_url']
     
     def get_thumbnail_url(self):
         """Retorna a URL da thumbnail automática do YouTube"""
-        video_id = self.get_video_id()
-        if video_id:
-            return f'https://img.youtube.com/vi/{video_id}/maxresdefault.jpg'
-        return None
+        if self.thumbnail_url:
+            return self.thumbnail_url
+        return metadados_video(self.get_video_id())['thumbnail_url']
     
     def get_embed_html(self):
         """Retorna o HTML do iframe embed"""
-        video_id = self.get_video_id()
-        if video_id:
-            return f'<iframe width="560" height="315" src="https://www.youtube.com/embed/{video_id}" frameborder="0" allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture" allowfullscreen></iframe>'
-        return self.embed_code  # Fallback: retorna o código original
+        if self.embed_html:
+            return self.embed_html
+        return metadados_video(self.get_video_id())['embed_html'] or self.embed_code  # Fallback: retorna o código original
 
 # ==================== MANUAIS ====================
 class Manual(db.Model):
@@ -341,11 +443,25 @@ class Manual(db.Model):
     __tablename__ = 'manuais'
     id = db.Column(db.Integer, primary_key=True)
     titulo = db.Column(db.String(200), nullable=False)
-    pdf_data = db.Column(db.LargeBinary, nullable=False)  # Dados binários do PDF
+    pdf_data = db.deferred(db.Column(db.LargeBinary))  # Dados binários do PDF (legado - uploads novos usam storage_key)
+    storage_key = db.Column(db.String(200))  # Chave do blob no armazenamento (ex: 'pglo:12345', 'file:ab/abcd...', 's3:...')
+    sha256 = db.Column(db.String(64))  # Hash do conteúdo calculado durante o upload
     pdf_filename = db.Column(db.String(200), nullable=False)  # Nome do arquivo original
     pdf_size = db.Column(db.Integer, nullable=False)  # Tamanho em bytes
     data_criacao = db.Column(db.DateTime, default=datetime.now)
     data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    texto_status = db.Column(db.String(20))  # Extração do texto: pendente, processando, concluido, erro
+    texto_paginas = db.Column(db.Integer)  # Páginas com texto extraído
+    texto_reivindicado_em = db.Column(db.DateTime)  # Último sinal de vida da extração em andamento
+
+class ManualPagina(db.Model):
+    """Texto extraído de cada página de um manual (busca por código de erro, peça...)"""
+    __tablename__ = 'manual_paginas'
+    __table_args__ = (db.UniqueConstraint('manual_id', 'pagina', name='uq_manual_paginas_manual_pagina'),)
+    id = db.Column(db.Integer, primary_key=True)
+    manual_id = db.Column(db.Integer, db.ForeignKey('manuais.id', ondelete='CASCADE'), nullable=False, index=True)
+    pagina = db.Column(db.Integer, nullable=False)  # Começa em 1 (mesma numeração do #page=N do visualizador)
+    texto = db.Column(db.Text)
 
 # ==================== VISIT COUNTER ====================
 class VisitCounter(db.Model):
@@ -362,6 +478,15 @@ class VisitCounter(db.Model):
         """Retorna a URL para download do PDF"""
         return f'/admin/manuais/{self.id}/download'
 
+class VisitaDiaria(db.Model):
+    """Visitas por dia (gravadas em lote pelo contador_visitas.py)"""
+    __tablename__ = 'visitas_diarias'
+    dia = db.Column(db.Date, primary_key=True)
+    visitas = db.Column(db.Integer, default=0, nullable=False)
+    unicos = db.Column(db.Integer)  # Estimativa de visitantes únicos (HyperLogLog)
+    hll = db.deferred(db.Column(db.LargeBinary))  # Registradores do HyperLogLog
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
 # ==================== PÁGINAS DE SERVIÇOS ====================
 class PaginaServico(db.Model):
     """Páginas individuais de serviços (Máquina de Lavar, Microondas, etc.)"""
@@ -413,6 +538,16 @@ class OrcamentoArCondicionado(db.Model):
     tecnico = db.relationship('Tecnico', foreign_keys=[tecnico_id], lazy=True)
     pdf_document = db.relationship('PDFDocument', foreign_keys=[pdf_id], lazy=True)
 
+class TabelaPrecoAr(db.Model):
+    """Versões da tabela de preços dos orçamentos de ar - a maior versão é a vigente (ver precificacao.py)"""
+    __tablename__ = 'tabelas_preco_ar'
+    id = db.Column(db.Integer, primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, unique=True)
+    dados = db.Column(JSON, nullable=False)  # {"servicos": {...}, "materiais": {...}}
+    observacao = db.Column(db.String(300))
+    usuario = db.Column(db.String(100))
+    data_criacao = db.Column(db.DateTime, default=datetime.now)
+
 # ==================== LINKS DO MENU ====================
 class LinkMenu(db.Model):
     """Links gerenciáveis do menu principal"""
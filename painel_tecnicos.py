@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Painel de carga e produção dos técnicos
+Tudo é calculado no banco com consultas agrupadas - nenhuma ordem é
+carregada no Python, só uma linha por técnico (e uma por técnico e
+semana). O app guarda o resultado num cache de TTL curto.
+
+A conclusão de uma ordem é o primeiro evento em ordem_status_eventos que a
+levou a um status concluído; ordens concluídas antes do histórico existir
+usam data_atualizacao. O gasto com peças soma os custos do JSON `pecas`.
+
+Uso:
+    python painel_tecnicos.py [semanas]
+"""
+
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, text
+
+# Com o técnico: ainda em trabalho
+STATUS_ABERTOS = ('pendente', 'em_andamento', 'aguardando_pecas')
+# Serviço terminado (o cliente pode ainda não ter pago ou retirado)
+STATUS_CONCLUIDOS = ('concluido', 'pronto', 'pago', 'entregue')
+
+SEMANAS_PADRAO = 8
+MAX_SEMANAS = 52
+
+# Ordens concluídas a partir de :desde, com a data da conclusão
+_CTE_CONCLUIDAS = """
+    concluidas AS (
+        SELECT o.id, coalesce(o.tecnico_id, 0) AS tecnico_id, o.data, o.total, o.pecas,
+               coalesce(
+                   (SELECT min(e.data) FROM ordem_status_eventos e
+                    WHERE e.ordem_id = o.id AND e.status_novo IN :concluidos),
+                   o.data_atualizacao, o.data
+               ) AS conclusao
+        FROM ordens_servico o
+        WHERE o.status IN :concluidos
+          AND o.data_atualizacao >= :desde
+    )
+"""
+
+_SQL_POR_TECNICO = text(f"""
+    WITH {_CTE_CONCLUIDAS},
+    periodo AS (
+        SELECT * FROM concluidas WHERE conclusao >= :desde
+    ),
+    producao AS (
+        SELECT tecnico_id,
+               COUNT(*) AS concluidas,
+               coalesce(SUM(total), 0) AS faturamento,
+               AVG(EXTRACT(EPOCH FROM conclusao - data)) / 3600.0 AS horas_media
+        FROM periodo
+        GROUP BY tecnico_id
+    ),
+    pecas AS (
+        SELECT p.tecnico_id,
+               SUM(CAST(peca ->> 'custo' AS NUMERIC)) AS gasto_pecas,
+               COUNT(*) AS qtd_pecas
+        FROM periodo p
+        CROSS JOIN LATERAL json_array_elements(
+            CASE WHEN json_typeof(p.pecas) = 'array' THEN p.pecas ELSE '[]'::json END
+        ) AS peca
+        WHERE peca ->> 'custo' ~ '^-?[0-9]+([.][0-9]+)?$'
+        GROUP BY p.tecnico_id
+    ),
+    abertas AS (
+        SELECT coalesce(tecnico_id, 0) AS tecnico_id,
+               COUNT(*) AS abertas,
+               COUNT(*) FILTER (WHERE status = 'pendente') AS pendente,
+               COUNT(*) FILTER (WHERE status = 'em_andamento') AS em_andamento,
+               COUNT(*) FILTER (WHERE status = 'aguardando_pecas') AS aguardando_pecas,
+               MIN(data) AS mais_antiga
+        FROM ordens_servico
+        WHERE status IN :abertos
+        GROUP BY coalesce(tecnico_id, 0)
+    ),
+    tecnicos_painel AS (
+        SELECT id, nome, especialidade, ativo FROM tecnicos
+        UNION ALL
+        SELECT 0, 'Sin técnico asignado', NULL, TRUE
+    )
+    SELECT t.id AS tecnico_id, t.nome, t.especialidade, t.ativo,
+           coalesce(a.abertas, 0) AS abertas,
+           coalesce(a.pendente, 0) AS pendente,
+           coalesce(a.em_andamento, 0) AS em_andamento,
+           coalesce(a.aguardando_pecas, 0) AS aguardando_pecas,
+           a.mais_antiga,
+           coalesce(p.concluidas, 0) AS concluidas,
+           coalesce(p.faturamento, 0) AS faturamento,
+           p.horas_media,
+           coalesce(pc.gasto_pecas, 0) AS gasto_pecas,
+           coalesce(pc.qtd_pecas, 0) AS qtd_pecas
+    FROM tecnicos_painel t
+    LEFT JOIN abertas a ON a.tecnico_id = t.id
+    LEFT JOIN producao p ON p.tecnico_id = t.id
+    LEFT JOIN pecas pc ON pc.tecnico_id = t.id
+    WHERE (t.ativo IS NOT FALSE AND t.id <> 0) OR a.abertas > 0 OR p.concluidas > 0
+    ORDER BY t.id = 0, coalesce(a.abertas, 0) DESC, t.nome
+""").bindparams(bindparam('concluidos', expanding=True), bindparam('abertos', expanding=True))
+
+_SQL_POR_SEMANA = text(f"""
+    WITH {_CTE_CONCLUIDAS}
+    SELECT tecnico_id, CAST(date_trunc('week', conclusao) AS DATE) AS semana, COUNT(*) AS concluidas
+    FROM concluidas
+    WHERE conclusao >= :desde
+    GROUP BY tecnico_id, CAST(date_trunc('week', conclusao) AS DATE)
+""").bindparams(bindparam('concluidos', expanding=True))
+
+
+def inicio_periodo(semanas, hoje=None):
+    """Segunda-feira da semana mais antiga do painel"""
+    hoje = hoje or date.today()
+    return hoje - timedelta(days=hoje.weekday()) - timedelta(weeks=semanas - 1)
+
+
+def painel_tecnicos(session, semanas=SEMANAS_PADRAO):
+    """Uma linha por técnico (abertas por status, concluídas, faturamento, prazo médio, peças) e as semanas do período
+
+    Cada técnico traz `por_semana`: concluídas em cada semana, na ordem de `semanas`.
+    """
+    semanas = max(1, min(int(semanas), MAX_SEMANAS))
+    desde = inicio_periodo(semanas)
+    parametros = {'desde': desde, 'concluidos': list(STATUS_CONCLUIDOS)}
+    tecnicos = [dict(linha) for linha in session.execute(
+        _SQL_POR_TECNICO, dict(parametros, abertos=list(STATUS_ABERTOS))
+    ).mappings()]
+    por_semana = {}
+    for linha in session.execute(_SQL_POR_SEMANA, parametros).mappings():
+        por_semana[(linha['tecnico_id'], linha['semana'])] = linha['concluidas']
+    lista_semanas = [desde + timedelta(weeks=i) for i in range(semanas)]
+    for tecnico in tecnicos:
+        tecnico['por_semana'] = [por_semana.get((tecnico['tecnico_id'], semana), 0) for semana in lista_semanas]
+    return {'desde': desde, 'semanas': lista_semanas, 'tecnicos': tecnicos}
+
+
+if __name__ == '__main__':
+    if any(a in ('-h', '--help') for a in sys.argv[1:]):
+        print(__doc__)
+        sys.exit(0)
+    from app import app, db
+
+    with app.app_context():
+        resultado = painel_tecnicos(db.session, int(sys.argv[1]) if len(sys.argv) > 1 else SEMANAS_PADRAO)
+        print(f"Desde {resultado['desde']:%d/%m/%Y}")
+        for tecnico in resultado['tecnicos']:
+            horas = f"{tecnico['horas_media']:.1f}h" if tecnico['horas_media'] is not None else '-'
+            print(f"{tecnico['nome']}: {tecnico['abertas']} abertas, {tecnico['concluidas']} concluídas, "
+                  f"ARS$ {tecnico['faturamento']:.2f}, prazo médio {horas}, peças ARS$ {tecnico['gasto_pecas']:.2f}, "
+                  f"por semana {tecnico['por_semana']}")
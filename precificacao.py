@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Motor de preços dos orçamentos de ar-condicionado
+As tabelas de preço ficam versionadas em tabelas_preco_ar (uma linha por
+versão, a maior é a vigente). Cada worker carrega a versão vigente uma vez
+e a mantém compilada em dicionários; a cada INTERVALO_VERIFICACAO segundos
+só confere o número da versão, então as requisições não relêem a tabela.
+
+cotar_varios() avalia uma lista de configurações de uma vez: as
+combinações (serviço, BTU, acesso) repetidas são calculadas uma só vez.
+É o que atende a prévia de preço dos formulários e o recálculo em lote dos
+orçamentos pendentes quando a tabela muda.
+
+Uso:
+    python precificacao.py            # mostra a tabela vigente
+    python precificacao.py --simular  # pendentes que mudariam com a tabela vigente
+    python precificacao.py --aplicar  # recalcula os pendentes (sem regerar PDFs)
+"""
+
+import copy
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import bindparam, text
+
+INTERVALO_VERIFICACAO = 30  # Segundos entre as consultas da versão vigente
+ACESSOS = ('Fácil', 'Moderado', 'Difícil')
+STATUS_RECALCULAVEIS = ('pendente',)
+
+# Tabela original (versão 0) - usada enquanto nenhuma versão foi salva no banco
+TABELA_PADRAO = {
+    'servicos': {
+        'Instalação de Ar-Condicionado Split': {
+            'por_btu': {'9000': 650.00, '12000': 700.00, '18000': 750.00, '24000': 800.00,
+                        '36000': 900.00, '48000': 1200.00, '60000': 1800.00},
+            'acesso': {'Moderado': 10, 'Difícil': 20},
+        },
+        'Limpeza preventiva da Evaporadora': {
+            'faixas': [[18000, 150.00], [36000, 200.00], [None, 250.00]],
+            'acesso': {'Moderado': 20, 'Difícil': 30},
+        },
+        'Limpeza preventiva Evaporadora + Condensadora': {
+            'faixas': [[18000, 250.00], [36000, 300.00], [None, 350.00]],
+            'acesso': {'Moderado': 20, 'Difícil': 30},
+        },
+        'Remoção de Ar-Condicionado Split': {
+            'faixas': [[18000, 250.00], [36000, 300.00], [None, 400.00]],
+            'acesso': {'Moderado': 20, 'Difícil': 30},
+        },
+    },
+    # Materiais de preço fixo - os demais usam o valor informado no orçamento
+    'materiais': {'Kit Convencional (3m de tubulação)': 250.00},
+}
+
+
+def _numero(valor, campo, minimo=0):
+    try:
+        numero = float(str(valor).replace(',', '.'))
+    except (TypeError, ValueError):
+        raise ValueError(f'Valor inválido en "{campo}": {valor!r}')
+    if numero != numero or numero < minimo:
+        raise ValueError(f'Valor inválido en "{campo}": {valor!r}')
+    return numero
+
+
+def normalizar_tabela(dados):
+    """Valida a tabela e devolve uma cópia limpa (ValueError com a mensagem para o admin)"""
+    if not isinstance(dados, dict) or not isinstance(dados.get('servicos'), dict) or not dados['servicos']:
+        raise ValueError('La tabla de precios no tiene servicios.')
+
+    servicos = {}
+    for nome, regra in dados['servicos'].items():
+        nome = str(nome).strip()
+        if not nome or not isinstance(regra, dict):
+            raise ValueError('Servicio sin nombre o sin reglas en la tabla de precios.')
+        acesso = {}
+        for tipo, percentual in (regra.get('acesso') or {}).items():
+            if tipo not in ACESSOS:
+                raise ValueError(f'Tipo de acceso desconocido en "{nome}": {tipo}')
+            percentual = _numero(percentual, f'{nome} / {tipo}')
+            if percentual:
+                acesso[tipo] = round(percentual, 2)
+
+        if regra.get('por_btu'):
+            por_btu = {}
+            for btu, preco in regra['por_btu'].items():
+                btu = int(_numero(btu, f'{nome} / BTU', minimo=1))
+                por_btu[str(btu)] = round(_numero(preco, f'{nome} / {btu} BTU'), 2)
+            servicos[nome] = {'por_btu': dict(sorted(por_btu.items(), key=lambda item: int(item[0]))),
+                              'acesso': acesso}
+        elif regra.get('faixas'):
+            faixas = []
+            for limite, preco in regra['faixas']:
+                limite = None if limite in (None, '') else int(_numero(limite, f'{nome} / límite', minimo=1))
+                faixas.append([limite, round(_numero(preco, f'{nome} / franja'), 2)])
+            limites = [limite for limite, _ in faixas[:-1]]
+            if faixas[-1][0] is not None or None in limites or limites != sorted(set(limites)):
+                raise ValueError(f'Las franjas de "{nome}" deben ser crecientes y terminar sin límite.')
+            servicos[nome] = {'faixas': faixas, 'acesso': acesso}
+        else:
+            raise ValueError(f'El servicio "{nome}" no tiene precios.')
+
+    materiais = {}
+    for nome, preco in (dados.get('materiais') or {}).items():
+        nome = str(nome).strip()
+        if nome:
+            materiais[nome] = round(_numero(preco, nome), 2)
+
+    return {'servicos': servicos, 'materiais': materiais}
+
+
+class TabelaPreco:
+    """Versão compilada da tabela: dicionários e listas prontos para a busca"""
+
+    def __init__(self, versao, dados):
+        self.versao = versao
+        self.dados = normalizar_tabela(dados)
+        self._por_btu = {}
+        self._faixas = {}
+        self._fatores = {}
+        for nome, regra in self.dados['servicos'].items():
+            if 'por_btu' in regra:
+                self._por_btu[nome] = {int(btu): preco for btu, preco in regra['por_btu'].items()}
+            else:
+                faixas = regra['faixas']
+                self._faixas[nome] = ([limite for limite, _ in faixas[:-1]], [preco for _, preco in faixas])
+            for tipo, percentual in regra['acesso'].items():
+                self._fatores[(nome, tipo)] = percentual / 100.0
+        self._materiais = self.dados['materiais']
+
+    @property
+    def servicos(self):
+        return list(self.dados['servicos'])
+
+    @property
+    def materiais(self):
+        return dict(self._materiais)
+
+    def preco_base(self, tipo_servico, potencia_btu):
+        """Preço com acesso fácil - None quando a combinação não tem preço"""
+        if tipo_servico in self._por_btu:
+            return self._por_btu[tipo_servico].get(potencia_btu)
+        faixas = self._faixas.get(tipo_servico)
+        if faixas is None or potencia_btu <= 0:
+            return None
+        limites, precos = faixas
+        return precos[bisect_left(limites, potencia_btu)]
+
+    def cotar_varios(self, configuracoes):
+        """Cota uma lista de configurações (dicts com os campos do orçamento), na mesma ordem
+
+        Cada resultado tem valor_base, valor_acesso, valor_material,
+        valor_custos_adicionais, valor_total, encontrado e versao.
+        """
+        bases = {}
+        resultados = []
+        for config in configuracoes:
+            tipo_servico = config.get('tipo_servico')
+            try:
+                potencia_btu = int(config.get('potencia_btu') or 0)
+            except (TypeError, ValueError):
+                potencia_btu = 0
+            tipo_acesso = config.get('tipo_acesso')
+
+            chave = (tipo_servico, potencia_btu, tipo_acesso)
+            if chave not in bases:
+                valor_base = self.preco_base(tipo_servico, potencia_btu)
+                encontrado = valor_base is not None
+                valor_base = valor_base or 0.00
+                bases[chave] = (valor_base, valor_base * self._fatores.get((tipo_servico, tipo_acesso), 0.0), encontrado)
+            valor_base, valor_acesso, encontrado = bases[chave]
+
+            # Como no cálculo antigo: o valor informado vale sempre, salvo material do catálogo
+            material = config.get('material_adicional')
+            if material and material in self._materiais:
+                valor_material = self._materiais[material]
+            else:
+                try:
+                    valor_material = float(config.get('valor_material_adicional') or 0)
+                except (TypeError, ValueError):
+                    valor_material = 0.00
+
+            valor_custos = 0.00
+            for custo in config.get('custos_adicionais') or ():
+                if isinstance(custo, dict) and 'valor' in custo:
+                    try:
+                        valor_custos += float(custo.get('valor') or 0)
+                    except (TypeError, ValueError):
+                        pass
+
+            resultados.append({
+                'valor_base': round(valor_base, 2),
+                'valor_acesso': round(valor_acesso, 2),
+                'valor_material': round(valor_material, 2),
+                'valor_custos_adicionais': round(valor_custos, 2),
+                'valor_total': round(valor_base + valor_acesso + valor_material + valor_custos, 2),
+                'encontrado': encontrado,
+                'versao': self.versao,
+            })
+        return resultados
+
+    def cotar(self, **config):
+        return self.cotar_varios([config])[0]
+
+
+# ==================== CACHE POR WORKER ====================
+_lock = threading.Lock()
+_cache = {'tabela': None, 'verificado_em': 0.0}
+
+
+def tabela_padrao():
+    return TabelaPreco(0, copy.deepcopy(TABELA_PADRAO))
+
+
+def _carregar(engine, versao_atual):
+    """Lê a versão vigente do banco - None quando continua sendo `versao_atual`
+
+    Usa uma conexão própria: a conferência não mexe na transação da sessão da requisição.
+    """
+    with engine.connect() as conn:
+        versao = conn.execute(text("SELECT max(versao) FROM tabelas_preco_ar")).scalar() or 0
+        if versao == versao_atual:
+            return None
+        if not versao:
+            return tabela_padrao()
+        dados = conn.execute(
+            text("SELECT dados FROM tabelas_preco_ar WHERE versao = :versao"), {'versao': versao}
+        ).scalar()
+    return TabelaPreco(versao, dados if isinstance(dados, dict) else json.loads(dados))
+
+
+def tabela_vigente(engine=None, verificar=False):
+    """Tabela vigente do cache do worker; confere a versão no banco no máximo a cada INTERVALO_VERIFICACAO
+
+    `verificar=True` força a conferência (antes de gravar um orçamento).
+    Sem engine (modo JSON) usa a tabela padrão.
+    """
+    with _lock:
+        tabela = _cache['tabela']
+        agora = time.monotonic()
+        if engine is None:
+            if tabela is None:
+                tabela = _cache['tabela'] = tabela_padrao()
+            return tabela
+        if tabela is not None and not verificar and agora - _cache['verificado_em'] < INTERVALO_VERIFICACAO:
+            return tabela
+        try:
+            nova = _carregar(engine, tabela.versao if tabela is not None else None)
+            if nova is not None:
+                if tabela is not None:
+                    print(f"Tabela de preços: versão {tabela.versao} -> {nova.versao}")
+                tabela = nova
+        except Exception as e:
+            print(f"Aviso: não foi possível ler a tabela de preços: {e}")
+            if tabela is None:
+                tabela = tabela_padrao()
+        _cache['tabela'] = tabela
+        _cache['verificado_em'] = agora
+        return tabela
+
+
+def invalidar_cache():
+    with _lock:
+        _cache['verificado_em'] = 0.0
+
+
+def historico_versoes(session, limite=20):
+    return session.execute(text("""
+        SELECT versao, observacao, usuario, data_criacao
+        FROM tabelas_preco_ar ORDER BY versao DESC LIMIT :limite
+    """), {'limite': limite}).mappings().all()
+
+
+def salvar_versao(session, dados, observacao=None, usuario=None):
+    """Grava uma nova versão (vira a vigente) e devolve a TabelaPreco compilada"""
+    dados = normalizar_tabela(dados)
+    # Versões salvas ao mesmo tempo: a segunda esbarra na unique de versao e o admin tenta de novo
+    versao = session.execute(text("""
+        INSERT INTO tabelas_preco_ar (versao, dados, observacao, usuario, data_criacao)
+        SELECT coalesce(max(versao), 0) + 1, CAST(:dados AS JSON), :observacao, :usuario, now()
+        FROM tabelas_preco_ar
+        RETURNING versao
+    """), {'dados': json.dumps(dados, ensure_ascii=False), 'observacao': observacao or None,
+           'usuario': usuario}).scalar()
+    session.commit()
+    tabela = TabelaPreco(versao, dados)
+    with _lock:
+        _cache['tabela'] = tabela
+        _cache['verificado_em'] = time.monotonic()
+    return tabela
+
+
+# ==================== RECÁLCULO DOS PENDENTES ====================
+def comparar_pendentes(session, tabela):
+    """Orçamentos pendentes cujo valor muda com `tabela` - lista de dicts com os valores antigos e novos"""
+    linhas = session.execute(text("""
+        SELECT id, tipo_servico, potencia_btu, tipo_acesso, material_adicional,
+               valor_material_adicional, custos_adicionais, valor_base, valor_acesso, valor_total
+        FROM orcamentos_ar_condicionado
+        WHERE status IN :status
+        ORDER BY id
+    """).bindparams(bindparam('status', expanding=True)), {'status': list(STATUS_RECALCULAVEIS)}).mappings().all()
+
+    alterados = []
+    for linha, cotacao in zip(linhas, tabela.cotar_varios(linhas)):
+        if not cotacao['encontrado']:
+            continue  # Serviço/BTU que saiu da tabela: o orçamento fica como está
+        atual = (float(linha['valor_base'] or 0), float(linha['valor_acesso'] or 0),
+                 float(linha['valor_material_adicional'] or 0), float(linha['valor_total'] or 0))
+        novo = (cotacao['valor_base'], cotacao['valor_acesso'], cotacao['valor_material'], cotacao['valor_total'])
+        if any(abs(a - n) >= 0.005 for a, n in zip(atual, novo)):
+            alterados.append({'id': linha['id'], 'valor_total_anterior': atual[3], **cotacao})
+    return alterados
+
+
+# Um único UPDATE para todos os alterados: os novos valores chegam como arrays paralelos
+_SQL_RECALCULAR = text("""
+    UPDATE orcamentos_ar_condicionado o
+    SET valor_base = n.valor_base, valor_acesso = n.valor_acesso,
+        valor_material_adicional = n.valor_material, valor_total = n.valor_total,
+        data_atualizacao = now()
+    FROM (
+        SELECT unnest(CAST(:ids AS INTEGER[])) AS id,
+               unnest(CAST(:valores_base AS NUMERIC[])) AS valor_base,
+               unnest(CAST(:valores_acesso AS NUMERIC[])) AS valor_acesso,
+               unnest(CAST(:valores_material AS NUMERIC[])) AS valor_material,
+               unnest(CAST(:valores_total AS NUMERIC[])) AS valor_total
+    ) AS n
+    WHERE o.id = n.id AND o.status = ANY(:status)
+""")
+
+
+def recalcular_pendentes(session, tabela):
+    """Grava os novos valores dos pendentes afetados - devolve a lista de comparar_pendentes()"""
+    alterados = comparar_pendentes(session, tabela)
+    if alterados:
+        # Só atualiza se o orçamento ainda está pendente (pode ter sido aprovado nesse meio tempo)
+        session.execute(_SQL_RECALCULAR, {
+            'ids': [item['id'] for item in alterados],
+            'valores_base': [item['valor_base'] for item in alterados],
+            'valores_acesso': [item['valor_acesso'] for item in alterados],
+            'valores_material': [item['valor_material'] for item in alterados],
+            'valores_total': [item['valor_total'] for item in alterados],
+            'status': list(STATUS_RECALCULAVEIS),
+        })
+    session.commit()
+    return alterados
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if any(a in ('-h', '--help') for a in args):
+        print(__doc__)
+        sys.exit(0)
+    from app import app, db
+
+    with app.app_context():
+        tabela = tabela_vigente(db.engine, verificar=True)
+        if not args:
+            print(f"Versão {tabela.versao}")
+            print(json.dumps(tabela.dados, ensure_ascii=False, indent=2))
+        elif args == ['--simular']:
+            for item in comparar_pendentes(db.session, tabela):
+                print(f"#{item['id']:04d}: {item['valor_total_anterior']:.2f} -> {item['valor_total']:.2f}")
+        elif args == ['--aplicar']:
+            alterados = recalcular_pendentes(db.session, tabela)
+            print(f"{len(alterados)} orçamentos pendentes recalculados com a versão {tabela.versao}")
+        else:
+            print(__doc__)
+            sys.exit(1)
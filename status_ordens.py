@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Status das ordens de serviço: mudança em lote, histórico e relatórios
+Toda mudança de status gera uma linha em ordem_status_eventos (só INSERT):
+as edições pelo ORM via listener no app, o lote e os comprovantes com os
+comandos daqui. O lote usa um único comando SQL que trava as ordens, troca
+o status das que ainda não estão nele, grava os eventos e devolve o que
+mudou - para o app invalidar os caches e colocar na fila só os PDFs dessas
+ordens.
+
+Os relatórios de tempo em cada status não relêem o histórico: agregar()
+processa só os eventos novos (a partir do último id agregado) e soma os
+intervalos em ordem_status_resumo, por dia, status e técnico. Os eventos
+dos últimos minutos ficam para a próxima rodada, para não pular um evento
+de uma transação que ainda não fez commit.
+
+Uso:
+    python status_ordens.py <status> <id> [<id> ...] [--de <status_atual>]
+    python status_ordens.py --agregar   # processa os eventos novos (cron)
+"""
+
+import json
+import sys
+
+from sqlalchemy import bindparam, text
+
+# Status das ordens -> rótulo exibido no admin
+STATUS_ORDEM = {
+    'pendente': 'Pendiente',
+    'em_andamento': 'En Proceso',
+    'aguardando_pecas': 'Esperando Repuestos',
+    'concluido': 'Concluido',
+    'pronto': 'Listo para Retirar',
+    'pago': 'Pagado',
+    'entregue': 'Entregado',
+    'cancelado': 'Cancelado',
+}
+
+# Status que encerram a ordem: sem SLA e não voltam para 'pago' com um comprovante
+STATUS_FINAIS = ('pago', 'entregue', 'cancelado')
+
+# Horas máximas em cada status antes de contar como SLA estourado
+SLA_HORAS = {
+    'pendente': 24,
+    'em_andamento': 72,
+    'aguardando_pecas': 168,
+    'concluido': 48,
+    'pronto': 168,
+}
+
+MAX_ORDENS_POR_LOTE = 1000
+LOTE_AGREGACAO = 20000
+ATRASO_AGREGACAO_MINUTOS = 5
+
+_SQL_ATUALIZAR_LOTE = text("""
+    WITH alvo AS (
+        SELECT id, status AS status_anterior
+        FROM ordens_servico
+        WHERE id = ANY(:ids)
+          AND status IS DISTINCT FROM :status
+          AND (CAST(:filtrar AS BOOLEAN) IS FALSE OR status = ANY(:status_atual))
+        ORDER BY id
+        FOR UPDATE
+    ), atualizadas AS (
+        UPDATE ordens_servico o
+        SET status = :status, data_atualizacao = now()
+        FROM alvo
+        WHERE o.id = alvo.id
+        RETURNING o.id, o.cliente_id, o.numero_ordem, alvo.status_anterior,
+                  (o.pdf_id IS NOT NULL OR coalesce(o.pdf_filename, '') <> '') AS tem_pdf
+    ), eventos AS (
+        INSERT INTO ordem_status_eventos (ordem_id, status_anterior, status_novo, origem, usuario, data)
+        SELECT id, status_anterior, :status, :origem, :usuario, now() FROM atualizadas
+    )
+    SELECT id, cliente_id, numero_ordem, status_anterior, tem_pdf FROM atualizadas
+""")
+
+
+def atualizar_status_em_lote(session, ordem_ids, status, status_atual=None, usuario=None, origem='lote'):
+    """Troca o status das ordens e registra o histórico - retorna as ordens alteradas (dicts)
+
+    Ordens que já estão no status novo, ou que não estão em `status_atual`
+    (um status ou uma lista) quando ele é informado, ficam de fora. O commit
+    fica com quem chama.
+    """
+    if isinstance(status_atual, str):
+        status_atual = [status_atual]
+    if status not in STATUS_ORDEM or any(s not in STATUS_ORDEM for s in status_atual or ()):
+        raise ValueError(f'Estado inválido: {status}')
+    ids = sorted({int(ordem_id) for ordem_id in ordem_ids})
+    if len(ids) > MAX_ORDENS_POR_LOTE:
+        raise ValueError(f'Seleccione como máximo {MAX_ORDENS_POR_LOTE} órdenes por vez.')
+    if not ids:
+        return []
+    return [dict(linha) for linha in session.execute(_SQL_ATUALIZAR_LOTE, {
+        'ids': ids, 'status': status, 'filtrar': status_atual is not None, 'status_atual': list(status_atual or ()),
+        'origem': origem, 'usuario': usuario,
+    }).mappings()]
+
+
+def marcar_paga(session, ordem_id, usuario=None):
+    """Comprovante emitido: a ordem passa a 'pago' se ainda não foi encerrada - retorna a ordem alterada ou None"""
+    alteradas = atualizar_status_em_lote(
+        session, [ordem_id], 'pago', [s for s in STATUS_ORDEM if s not in STATUS_FINAIS],
+        usuario=usuario, origem='comprovante'
+    )
+    return alteradas[0] if alteradas else None
+
+
+def historico_status(session, ordem_id):
+    """Eventos de status de uma ordem, do mais antigo para o mais recente"""
+    return [dict(linha) for linha in session.execute(text("""
+        SELECT status_anterior, status_novo, origem, usuario, data
+        FROM ordem_status_eventos
+        WHERE ordem_id = :ordem_id
+        ORDER BY data, id
+    """), {'ordem_id': ordem_id}).mappings()]
+
+
+# ==================== AGREGAÇÃO INCREMENTAL ====================
+_SQL_AGREGAR = text("""
+    INSERT INTO ordem_status_resumo (dia, status, tecnico_id, quantidade, segundos_total, segundos_max, acima_sla)
+    SELECT dia, status, tecnico_id, COUNT(*), SUM(segundos), MAX(segundos),
+           COUNT(*) FILTER (WHERE limite IS NOT NULL AND segundos > limite)
+    FROM (
+        SELECT CAST(n.data AS DATE) AS dia,
+               n.status_anterior AS status,
+               coalesce(o.tecnico_id, 0) AS tecnico_id,
+               GREATEST(CAST(EXTRACT(EPOCH FROM n.data - coalesce(l.inicio, o.data)) AS BIGINT), 0) AS segundos,
+               CAST(CAST(:sla AS JSONB) ->> n.status_anterior AS NUMERIC) * 3600 AS limite
+        FROM ordem_status_eventos n
+        JOIN (
+            -- Início do intervalo = evento anterior da mesma ordem (ou a abertura da ordem)
+            SELECT e.id, LAG(e.data) OVER (PARTITION BY e.ordem_id ORDER BY e.data, e.id) AS inicio
+            FROM ordem_status_eventos e
+            WHERE e.id <= :ate
+              AND e.ordem_id IN (SELECT ordem_id FROM ordem_status_eventos WHERE id > :de AND id <= :ate)
+        ) l ON l.id = n.id
+        JOIN ordens_servico o ON o.id = n.ordem_id
+        WHERE n.id > :de AND n.id <= :ate AND n.status_anterior IS NOT NULL
+    ) intervalos
+    GROUP BY dia, status, tecnico_id
+    ON CONFLICT (dia, status, tecnico_id) DO UPDATE SET
+        quantidade = ordem_status_resumo.quantidade + EXCLUDED.quantidade,
+        segundos_total = ordem_status_resumo.segundos_total + EXCLUDED.segundos_total,
+        segundos_max = GREATEST(ordem_status_resumo.segundos_max, EXCLUDED.segundos_max),
+        acima_sla = ordem_status_resumo.acima_sla + EXCLUDED.acima_sla
+""")
+
+
+def _travar_controle(session):
+    """Trava a linha de controle da agregação - None se outro worker já está agregando"""
+    consulta = text("SELECT ultimo_evento_id FROM ordem_status_agregacao WHERE id = 1 FOR UPDATE SKIP LOCKED")
+    linha = session.execute(consulta).first()
+    if linha is None:
+        session.rollback()
+        session.execute(text("""
+            INSERT INTO ordem_status_agregacao (id, ultimo_evento_id, data_atualizacao)
+            VALUES (1, 0, now()) ON CONFLICT (id) DO NOTHING
+        """))
+        session.commit()
+        linha = session.execute(consulta).first()
+    return None if linha is None else linha[0]
+
+
+def agregar(session):
+    """Soma em ordem_status_resumo os eventos ainda não agregados - retorna quantos processou"""
+    processados = 0
+    while True:
+        de = _travar_controle(session)
+        if de is None:
+            session.rollback()
+            return processados
+        ate = session.execute(text("""
+            SELECT max(id) FROM (
+                SELECT id FROM ordem_status_eventos
+                WHERE id > :de AND id < coalesce(
+                    (SELECT min(id) FROM ordem_status_eventos
+                     WHERE id > :de AND data >= now() - make_interval(mins => :atraso)),
+                    9223372036854775807)
+                ORDER BY id
+                LIMIT :lote
+            ) proximos
+        """), {'de': de, 'atraso': ATRASO_AGREGACAO_MINUTOS, 'lote': LOTE_AGREGACAO}).scalar()
+        if ate is None:
+            session.commit()
+            return processados
+        session.execute(_SQL_AGREGAR, {'de': de, 'ate': ate, 'sla': json.dumps(SLA_HORAS)})
+        session.execute(text("""
+            UPDATE ordem_status_agregacao SET ultimo_evento_id = :ate, data_atualizacao = now() WHERE id = 1
+        """), {'ate': ate})
+        processados += session.execute(text(
+            "SELECT COUNT(*) FROM ordem_status_eventos WHERE id > :de AND id <= :ate"
+        ), {'de': de, 'ate': ate}).scalar()
+        session.commit()
+
+
+# ==================== RELATÓRIOS ====================
+def tempo_por_status(session, inicio, fim):
+    """Intervalos encerrados entre inicio e fim (datas), por status - lê só o resumo"""
+    return [dict(linha) for linha in session.execute(text("""
+        SELECT status,
+               SUM(quantidade) AS quantidade,
+               SUM(segundos_total) / NULLIF(SUM(quantidade), 0) / 3600.0 AS media_horas,
+               MAX(segundos_max) / 3600.0 AS maximo_horas,
+               SUM(acima_sla) AS acima_sla,
+               100.0 * SUM(acima_sla) / NULLIF(SUM(quantidade), 0) AS percentual_sla
+        FROM ordem_status_resumo
+        WHERE dia BETWEEN :inicio AND :fim
+        GROUP BY status
+        ORDER BY SUM(segundos_total) DESC
+    """), {'inicio': inicio, 'fim': fim}).mappings()]
+
+
+def tempo_por_tecnico(session, inicio, fim):
+    """Média de horas de cada técnico em cada status, com a posição entre os técnicos naquele status"""
+    return [dict(linha) for linha in session.execute(text("""
+        SELECT r.tecnico_id,
+               coalesce(t.nome, 'Sin técnico') AS tecnico,
+               r.status,
+               SUM(r.quantidade) AS quantidade,
+               SUM(r.segundos_total) / NULLIF(SUM(r.quantidade), 0) / 3600.0 AS media_horas,
+               SUM(r.acima_sla) AS acima_sla,
+               RANK() OVER (
+                   PARTITION BY r.status
+                   ORDER BY SUM(r.segundos_total) / NULLIF(SUM(r.quantidade), 0)
+               ) AS posicao
+        FROM ordem_status_resumo r
+        LEFT JOIN tecnicos t ON t.id = r.tecnico_id
+        WHERE r.dia BETWEEN :inicio AND :fim
+        GROUP BY r.tecnico_id, t.nome, r.status
+        ORDER BY tecnico, r.status
+    """), {'inicio': inicio, 'fim': fim}).mappings()]
+
+
+def sla_estourado(session, limite=100):
+    """Ordens abertas que estão no status atual há mais tempo que o SLA, das mais atrasadas para as menos"""
+    return [dict(linha) for linha in session.execute(text("""
+        WITH abertas AS (
+            SELECT id, cliente_id, tecnico_id, numero_ordem, status, data,
+                   CAST(CAST(:sla AS JSONB) ->> status AS NUMERIC) AS sla_horas
+            FROM ordens_servico
+            WHERE status IN :status
+        ), ultimo AS (
+            SELECT e.ordem_id, e.data,
+                   ROW_NUMBER() OVER (PARTITION BY e.ordem_id ORDER BY e.data DESC, e.id DESC) AS n
+            FROM ordem_status_eventos e
+            WHERE e.ordem_id IN (SELECT id FROM abertas)
+        )
+        SELECT a.id, a.cliente_id, a.numero_ordem, a.status, a.sla_horas,
+               c.nome AS cliente, t.nome AS tecnico,
+               coalesce(u.data, a.data) AS desde,
+               EXTRACT(EPOCH FROM now() - coalesce(u.data, a.data)) / 3600.0 AS horas
+        FROM abertas a
+        LEFT JOIN ultimo u ON u.ordem_id = a.id AND u.n = 1
+        LEFT JOIN clientes c ON c.id = a.cliente_id
+        LEFT JOIN tecnicos t ON t.id = a.tecnico_id
+        WHERE now() - coalesce(u.data, a.data) > a.sla_horas * interval '1 hour'
+        ORDER BY EXTRACT(EPOCH FROM now() - coalesce(u.data, a.data)) / (a.sla_horas * 3600) DESC
+        LIMIT :limite
+    """).bindparams(bindparam('status', expanding=True)), {
+        'sla': json.dumps(SLA_HORAS), 'status': list(SLA_HORAS), 'limite': limite,
+    }).mappings()]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or any(a in ('-h', '--help') for a in args):
+        print(__doc__)
+        sys.exit(0 if args else 1)
+    from app import app, db
+
+    with app.app_context():
+        if args == ['--agregar']:
+            print(f"{agregar(db.session)} eventos agregados")
+            sys.exit(0)
+        if len(args) < 2:
+            print(__doc__)
+            sys.exit(1)
+        status_atual = None
+        if '--de' in args:
+            posicao = args.index('--de')
+            status_atual = args[posicao + 1]
+            del args[posicao:posicao + 2]
+        alteradas = atualizar_status_em_lote(db.session, args[1:], args[0], status_atual, origem='cli')
+        db.session.commit()
+        print(f"{len(alteradas)} ordens alteradas para '{args[0]}' (os PDFs não são regerados pela linha de comando)")
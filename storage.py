@@ -0,0 +1,395 @@
+"""
+Armazenamento de blobs (imagens, PDFs e manuais)
+Backends plugáveis: PostgreSQL (large objects), disco local e S3-compatível (AWS, MinIO, R2...).
+A chave de armazenamento carrega o prefixo do backend ('pglo:', 'file:', 's3:'),
+então registros gravados em backends diferentes convivem na mesma tabela
+e podem ser migrados aos poucos
+
+Configuração por variáveis de ambiente:
+    BLOB_STORAGE_BACKEND   postgres (padrão) | local | s3 - destino dos uploads novos
+    BLOB_STORAGE_DIR       diretório do backend local (padrão: data/blobs)
+    S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY
+"""
+
+import os
+import uuid
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# Tamanho do bloco usado para ler/gravar blobs
+CHUNK_SIZE = 256 * 1024  # 256KB
+
+# Remoções de blobs fora do banco aguardam o commit da sessão (lista em session.info)
+_CHAVE_REMOCOES_PENDENTES = 'blobs_para_remover'
+# Blobs gravados fora do banco nesta transação - removidos se ela sofrer rollback
+_CHAVE_GRAVACOES_PENDENTES = 'blobs_gravados'
+
+
+def _conexao_dbapi(connection):
+    """Retorna a conexão psycopg2 por trás de uma conexão do SQLAlchemy"""
+    dbapi_conn = getattr(connection, 'driver_connection', None)
+    if dbapi_conn is None:
+        dbapi_conn = getattr(connection, 'dbapi_connection', connection)
+    return dbapi_conn
+
+
+# ==================== POSTGRESQL (LARGE OBJECTS) ====================
+class LargeObjectWriter:
+    """Grava blocos em um large object do PostgreSQL dentro da transação da sessão
+
+    O large object só passa a existir de fato quando a sessão fizer commit;
+    um rollback descarta o que foi gravado.
+    """
+
+    def __init__(self, session, prefixo):
+        raw_conn = session.connection().connection
+        self.lobj = _conexao_dbapi(raw_conn).lobject(0, 'wb')
+        self.chave = f'{prefixo}{self.lobj.oid}'
+
+    def write(self, chunk):
+        self.lobj.write(chunk)
+
+    def close(self):
+        self.lobj.close()
+        return self.chave
+
+    def abort(self):
+        try:
+            self.lobj.unlink()
+        except Exception:
+            pass
+
+
+class PostgresBackend:
+    """Blobs em large objects do próprio PostgreSQL (compatível com o deploy atual)"""
+    nome = 'postgres'
+    prefixo = 'pglo:'
+
+    def _oid(self, chave):
+        return int(chave[len(self.prefixo):])
+
+    def open_writer(self, session):
+        return LargeObjectWriter(session, self.prefixo)
+
+    def iter_chunks(self, engine, chave, chunk_size=CHUNK_SIZE):
+        # Conexão própria: o corpo da resposta é enviado depois que a sessão da requisição foi encerrada
+        raw_conn = engine.raw_connection()
+        try:
+            lobj = _conexao_dbapi(raw_conn).lobject(self._oid(chave), 'rb')
+            try:
+                while True:
+                    chunk = lobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                lobj.close()
+                raw_conn.rollback()
+        finally:
+            raw_conn.close()
+
+    def delete(self, session, chave):
+        # lo_unlink é transacional - roda na transação da sessão
+        session.execute(
+            text('SELECT lo_unlink(:oid) WHERE EXISTS (SELECT 1 FROM pg_largeobject_metadata WHERE oid = :oid)'),
+            {'oid': self._oid(chave)}
+        )
+
+    def url(self, chave, mimetype=None, disposition=None):
+        return None
+
+    def caminho_local(self, chave):
+        return None
+
+
+# ==================== DISCO LOCAL ====================
+class LocalFileWriter:
+    """Grava em um arquivo temporário e só publica (rename atômico) no close()"""
+
+    def __init__(self, raiz, prefixo):
+        nome = uuid.uuid4().hex
+        self.relativo = f'{nome[:2]}/{nome}'
+        self.destino = os.path.join(raiz, self.relativo)
+        self.temporario = self.destino + '.part'
+        os.makedirs(os.path.dirname(self.destino), exist_ok=True)
+        self.arquivo = open(self.temporario, 'wb')
+        self.chave = f'{prefixo}{self.relativo}'
+
+    def write(self, chunk):
+        self.arquivo.write(chunk)
+
+    def close(self):
+        self.arquivo.close()
+        os.replace(self.temporario, self.destino)
+        return self.chave
+
+    def abort(self):
+        try:
+            self.arquivo.close()
+            os.remove(self.temporario)
+        except Exception:
+            pass
+
+
+class LocalBackend:
+    """Blobs em arquivos no disco local - servidos com sendfile pelo servidor WSGI"""
+    nome = 'local'
+    prefixo = 'file:'
+
+    def __init__(self, raiz):
+        self.raiz = os.path.abspath(raiz)
+
+    def caminho_local(self, chave):
+        relativo = os.path.normpath(chave[len(self.prefixo):])
+        if relativo.startswith('..') or os.path.isabs(relativo):
+            raise ValueError(f'Chave inválida: {chave}')
+        return os.path.join(self.raiz, relativo)
+
+    def open_writer(self, session):
+        writer = LocalFileWriter(self.raiz, self.prefixo)
+        registrar_gravacao(session, writer.chave)
+        return writer
+
+    def iter_chunks(self, engine, chave, chunk_size=CHUNK_SIZE):
+        with open(self.caminho_local(chave), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, session, chave):
+        agendar_remocao(session, chave)
+
+    def remover_agora(self, chave):
+        try:
+            os.remove(self.caminho_local(chave))
+        except FileNotFoundError:
+            pass
+
+    def url(self, chave, mimetype=None, disposition=None):
+        return None
+
+
+# ==================== S3-COMPATÍVEL ====================
+class S3MultipartWriter:
+    """Envia o blob em multipart upload - mantém no máximo uma parte (8MB) em memória"""
+
+    TAMANHO_PARTE = 8 * 1024 * 1024  # Mínimo do S3 é 5MB (exceto a última parte)
+
+    def __init__(self, client, bucket, prefixo):
+        self.client = client
+        self.bucket = bucket
+        nome = uuid.uuid4().hex
+        self.objeto = f'{nome[:2]}/{nome}'
+        self.chave = f'{prefixo}{self.objeto}'
+        resposta = client.create_multipart_upload(Bucket=bucket, Key=self.objeto)
+        self.upload_id = resposta['UploadId']
+        self.partes = []
+        self.buffer = bytearray()
+
+    def _enviar_parte(self):
+        numero = len(self.partes) + 1
+        resposta = self.client.upload_part(
+            Bucket=self.bucket, Key=self.objeto, UploadId=self.upload_id,
+            PartNumber=numero, Body=bytes(self.buffer)
+        )
+        self.partes.append({'ETag': resposta['ETag'], 'PartNumber': numero})
+        self.buffer.clear()
+
+    def write(self, chunk):
+        self.buffer.extend(chunk)
+        if len(self.buffer) >= self.TAMANHO_PARTE:
+            self._enviar_parte()
+
+    def close(self):
+        if self.buffer or not self.partes:
+            self._enviar_parte()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.objeto, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.partes}
+        )
+        return self.chave
+
+    def abort(self):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.objeto, UploadId=self.upload_id)
+        except Exception:
+            pass
+
+
+class S3Backend:
+    """Blobs em bucket S3-compatível - servidos por redirect para URL pré-assinada"""
+    nome = 's3'
+    prefixo = 's3:'
+
+    def __init__(self, bucket, endpoint_url=None, region=None, access_key=None, secret_key=None, expiracao_url=3600):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.expiracao_url = expiracao_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # boto3 é dependência opcional - só necessária com BLOB_STORAGE_BACKEND=s3
+            import boto3
+            self._client = boto3.client(
+                's3',
+                endpoint_url=self.endpoint_url or None,
+                region_name=self.region or None,
+                aws_access_key_id=self.access_key or None,
+                aws_secret_access_key=self.secret_key or None,
+            )
+        return self._client
+
+    def _objeto(self, chave):
+        return chave[len(self.prefixo):]
+
+    def open_writer(self, session):
+        writer = S3MultipartWriter(self.client, self.bucket, self.prefixo)
+        registrar_gravacao(session, writer.chave)
+        return writer
+
+    def iter_chunks(self, engine, chave, chunk_size=CHUNK_SIZE):
+        resposta = self.client.get_object(Bucket=self.bucket, Key=self._objeto(chave))
+        for chunk in resposta['Body'].iter_chunks(chunk_size):
+            yield chunk
+
+    def delete(self, session, chave):
+        agendar_remocao(session, chave)
+
+    def remover_agora(self, chave):
+        self.client.delete_object(Bucket=self.bucket, Key=self._objeto(chave))
+
+    def url(self, chave, mimetype=None, disposition=None):
+        params = {'Bucket': self.bucket, 'Key': self._objeto(chave)}
+        if mimetype:
+            params['ResponseContentType'] = mimetype
+        if disposition:
+            params['ResponseContentDisposition'] = disposition
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.expiracao_url)
+
+    def caminho_local(self, chave):
+        return None
+
+
+# ==================== REGISTRO DE BACKENDS ====================
+_backends = {}
+
+
+def _criar_backend(nome):
+    if nome == 'postgres':
+        return PostgresBackend()
+    if nome == 'local':
+        return LocalBackend(os.environ.get('BLOB_STORAGE_DIR', os.path.join('data', 'blobs')))
+    if nome == 's3':
+        bucket = os.environ.get('S3_BUCKET')
+        if not bucket:
+            raise RuntimeError('S3_BUCKET não configurado')
+        return S3Backend(
+            bucket,
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+            region=os.environ.get('S3_REGION'),
+            access_key=os.environ.get('S3_ACCESS_KEY_ID'),
+            secret_key=os.environ.get('S3_SECRET_ACCESS_KEY'),
+        )
+    raise ValueError(f'Backend de armazenamento desconhecido: {nome}')
+
+
+def obter_backend(nome):
+    """Retorna (criando sob demanda) o backend pelo nome"""
+    if nome not in _backends:
+        _backends[nome] = _criar_backend(nome)
+    return _backends[nome]
+
+
+def registrar_backend(backend):
+    """Registra uma instância de backend já configurada (ex: S3 apontando para um MinIO local)"""
+    _backends[backend.nome] = backend
+
+
+def backend_padrao():
+    """Backend onde os uploads novos são gravados"""
+    return obter_backend(os.environ.get('BLOB_STORAGE_BACKEND', 'postgres'))
+
+
+def backend_da_chave(chave):
+    """Identifica o backend pelo prefixo da chave de armazenamento"""
+    for nome, prefixo in (('postgres', PostgresBackend.prefixo), ('local', LocalBackend.prefixo), ('s3', S3Backend.prefixo)):
+        if chave.startswith(prefixo):
+            return obter_backend(nome)
+    raise ValueError(f'Chave de armazenamento desconhecida: {chave}')
+
+
+# ==================== API USADA PELAS ROTAS ====================
+def novo_writer(session, backend=None):
+    """Abre um writer no backend padrão (ou no informado)"""
+    return (backend or backend_padrao()).open_writer(session)
+
+
+def gravar_bytes(session, dados, backend=None):
+    """Grava bytes já em memória (ex: PDF gerado pelo reportlab) e retorna a chave"""
+    writer = novo_writer(session, backend)
+    try:
+        visao = memoryview(dados)
+        for inicio in range(0, len(visao), CHUNK_SIZE):
+            writer.write(visao[inicio:inicio + CHUNK_SIZE])
+    except Exception:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def iter_blob(engine, chave, chunk_size=CHUNK_SIZE):
+    """Gera o conteúdo do blob em blocos"""
+    return backend_da_chave(chave).iter_chunks(engine, chave, chunk_size)
+
+
+def remover_blob(session, chave):
+    """Remove o blob - no PostgreSQL na própria transação, nos demais após o commit"""
+    if not chave:
+        return
+    backend_da_chave(chave).delete(session, chave)
+
+
+def agendar_remocao(session, chave):
+    """Agenda a remoção de um blob fora do banco para depois do commit da sessão"""
+    session.info.setdefault(_CHAVE_REMOCOES_PENDENTES, []).append(chave)
+
+
+def registrar_gravacao(session, chave):
+    """Anota um blob gravado fora do banco - se a sessão fizer rollback ele é removido
+
+    No PostgreSQL o large object já some com o rollback; nos demais backends o
+    arquivo/objeto é enviado antes do commit e ficaria órfão.
+    """
+    session.connection()  # Abre a transação: sem ela o rollback não dispara after_soft_rollback
+    session.info.setdefault(_CHAVE_GRAVACOES_PENDENTES, []).append(chave)
+
+
+def _remover_agora(chaves):
+    for chave in chaves:
+        try:
+            backend_da_chave(chave).remover_agora(chave)
+        except Exception as e:
+            print(f"Aviso: não foi possível remover blob {chave}: {e}")
+
+
+@event.listens_for(Session, 'after_commit')
+def _remover_blobs_apos_commit(session):
+    session.info.pop(_CHAVE_GRAVACOES_PENDENTES, None)
+    _remover_agora(session.info.pop(_CHAVE_REMOCOES_PENDENTES, []))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _descartar_remocoes_apos_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        # Rollback de savepoint: a transação externa ainda pode gravar as chaves
+        return
+    session.info.pop(_CHAVE_REMOCOES_PENDENTES, None)
+    _remover_agora(session.info.pop(_CHAVE_GRAVACOES_PENDENTES, []))
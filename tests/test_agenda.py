@@ -0,0 +1,86 @@
+"""Assinatura do layout da agenda e reconstrução dos bitmaps (agenda.py)
+
+O teste de reconstrução roda no Postgres de TEST_DATABASE_URL, num schema
+descartável com as colunas de tecnicos, agendamentos e agenda_ocupacao que
+o módulo usa.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+import agenda
+from agenda import ConfigAgenda, conferir_layout
+
+_DDL = [
+    "CREATE TABLE tecnicos (id SERIAL PRIMARY KEY, nome VARCHAR(200), ativo BOOLEAN DEFAULT TRUE)",
+    """CREATE TABLE agendamentos (
+        id SERIAL PRIMARY KEY, data_agendamento DATE NOT NULL, hora TIME, duracao_minutos INTEGER,
+        tecnico_id INTEGER REFERENCES tecnicos(id) ON DELETE SET NULL, tipo_servico VARCHAR(100),
+        status VARCHAR(50) DEFAULT 'pendente'
+    )""",
+    """CREATE TABLE agenda_ocupacao (
+        data DATE NOT NULL, tecnico_id INTEGER NOT NULL, vaga SMALLINT NOT NULL, bitmap BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (data, tecnico_id, vaga)
+    )""",
+    "CREATE TABLE agenda_ocupacao_layout (id SMALLINT PRIMARY KEY, assinatura VARCHAR(64), data_atualizacao TIMESTAMP)",
+]
+
+
+def test_assinatura_muda_so_com_o_layout():
+    base = ConfigAgenda({})
+    assert ConfigAgenda({'intervalo_minutos': 30}).assinatura == base.assinatura
+    # Durações e antecedência não mudam a posição dos bits
+    assert ConfigAgenda({'duracao_padrao_minutos': 60, 'antecedencia_maxima_dias': 10}).assinatura == base.assinatura
+    assert ConfigAgenda({'intervalo_minutos': 60}).assinatura != base.assinatura
+    assert ConfigAgenda({'horarios': {'0': [['07:00', '12:00']]}}).assinatura != base.assinatura
+    assert ConfigAgenda({'capacidades': {'3': 2}}).assinatura != base.assinatura
+
+
+@pytest.fixture
+def engine(pg_schema_engine, monkeypatch):
+    from sqlalchemy import text
+
+    monkeypatch.setattr(agenda, '_layout_conferido', {'assinatura': None})
+    with pg_schema_engine.begin() as conexao:
+        for ddl in _DDL:
+            conexao.execute(text(ddl))
+    return pg_schema_engine
+
+
+def _segunda_que_vem():
+    hoje = date.today()
+    return hoje + timedelta(days=7 - hoje.weekday())
+
+
+def _bitmaps(engine, dia):
+    from sqlalchemy import text
+
+    with engine.connect() as conexao:
+        return [linha[0] for linha in conexao.execute(text(
+            "SELECT bitmap FROM agenda_ocupacao WHERE data = :data AND bitmap <> 0"
+        ), {'data': dia})]
+
+
+def test_mudar_intervalo_reconstroi_bitmaps(engine, monkeypatch):
+    from sqlalchemy import text
+
+    dia = _segunda_que_vem()
+    with engine.begin() as conexao:
+        conexao.execute(text(
+            "INSERT INTO agendamentos (data_agendamento, hora, duracao_minutos) VALUES (:data, '10:00', 30)"
+        ), {'data': dia})
+
+    meia_hora = ConfigAgenda({'intervalo_minutos': 30})
+    assert conferir_layout(engine, meia_hora) is True
+    assert _bitmaps(engine, dia) == [1 << 4]  # (10:00 - 08:00) / 30 min
+    assert conferir_layout(engine, meia_hora) is False
+
+    # Outro worker, já com o agenda.json novo
+    monkeypatch.setattr(agenda, '_layout_conferido', {'assinatura': None})
+    uma_hora = ConfigAgenda({'intervalo_minutos': 60})
+    assert conferir_layout(engine, uma_hora) is True
+    assert _bitmaps(engine, dia) == [1 << 2]  # (10:00 - 08:00) / 60 min
+
+    monkeypatch.setattr(agenda, '_layout_conferido', {'assinatura': None})
+    assert conferir_layout(engine, uma_hora) is False
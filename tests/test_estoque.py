@@ -0,0 +1,164 @@
+"""Baixa e devolução de estoque das peças das ordens (estoque.py)
+
+Rodam no Postgres de TEST_DATABASE_URL, num schema descartável com as
+colunas de pecas, ordens_servico e ordem_pecas que o módulo usa.
+"""
+
+import json
+import threading
+
+import pytest
+
+from estoque import EstoqueInsuficiente, backfill_ordens, devolver_pecas_ordem, registrar_pecas_ordem
+
+_DDL = [
+    "CREATE TABLE fornecedores (id SERIAL PRIMARY KEY, nome VARCHAR(200), telefone VARCHAR(20))",
+    """CREATE TABLE pecas (
+        id SERIAL PRIMARY KEY, sku VARCHAR(50) NOT NULL UNIQUE, nome VARCHAR(200) NOT NULL,
+        fornecedor_id INTEGER REFERENCES fornecedores(id) ON DELETE SET NULL, custo NUMERIC(10, 2) DEFAULT 0,
+        estoque INTEGER NOT NULL DEFAULT 0, estoque_minimo INTEGER NOT NULL DEFAULT 0, ativo BOOLEAN DEFAULT TRUE,
+        data_cadastro TIMESTAMP DEFAULT now(), data_atualizacao TIMESTAMP DEFAULT now()
+    )""",
+    "CREATE TABLE ordens_servico (id SERIAL PRIMARY KEY, pecas JSON, data TIMESTAMP DEFAULT now())",
+    """CREATE TABLE ordem_pecas (
+        id SERIAL PRIMARY KEY, ordem_id INTEGER NOT NULL REFERENCES ordens_servico(id) ON DELETE CASCADE,
+        peca_id INTEGER REFERENCES pecas(id) ON DELETE SET NULL, descricao VARCHAR(200) NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 1, custo_unitario NUMERIC(10, 2) DEFAULT 0,
+        baixa_estoque BOOLEAN NOT NULL DEFAULT TRUE, data TIMESTAMP NOT NULL DEFAULT now()
+    )""",
+]
+
+
+@pytest.fixture
+def engine(pg_schema_engine):
+    from sqlalchemy import text
+
+    with pg_schema_engine.begin() as conexao:
+        for ddl in _DDL:
+            conexao.execute(text(ddl))
+        conexao.execute(text("""
+            INSERT INTO pecas (id, sku, nome, estoque, estoque_minimo)
+            VALUES (1, 'TELA-A10', 'Tela Galaxy A10', 5, 3), (2, 'BAT-G7', 'Batería Moto G7', 1, 0)
+        """))
+        conexao.execute(text("INSERT INTO ordens_servico (id, pecas) VALUES (1, '[]'), (2, '[]')"))
+    return pg_schema_engine
+
+
+def _estoque(engine, peca_id):
+    from sqlalchemy import text
+
+    with engine.connect() as conexao:
+        return conexao.execute(text("SELECT estoque FROM pecas WHERE id = :id"), {'id': peca_id}).scalar()
+
+
+def _linhas(engine, ordem_id):
+    from sqlalchemy import text
+
+    with engine.connect() as conexao:
+        return [tuple(linha) for linha in conexao.execute(text(
+            "SELECT peca_id, descricao, baixa_estoque FROM ordem_pecas WHERE ordem_id = :id ORDER BY id"
+        ), {'id': ordem_id})]
+
+
+def test_baixa_troca_e_devolucao(engine):
+    from sqlalchemy.orm import Session
+
+    with Session(engine) as sessao:
+        abaixo = registrar_pecas_ordem(sessao, 1, [
+            {'nome': 'Tela Galaxy A10', 'peca_id': '1', 'custo': 30},
+            {'nome': 'Tela Galaxy A10', 'peca_id': 1, 'custo': 30},
+            {'nome': 'Tornillo suelto', 'custo': 1},
+        ])
+        sessao.commit()
+    assert abaixo == ['Tela Galaxy A10']  # Ficou no mínimo (3)
+    assert _estoque(engine, 1) == 3
+    assert _linhas(engine, 1) == [(1, 'Tela Galaxy A10', True), (1, 'Tela Galaxy A10', True),
+                                  (None, 'Tornillo suelto', False)]
+
+    # Edição: o que a ordem usava volta antes da nova baixa
+    with Session(engine) as sessao:
+        registrar_pecas_ordem(sessao, 1, [{'nome': 'Tela Galaxy A10', 'peca_id': 1}])
+        sessao.commit()
+    assert _estoque(engine, 1) == 4
+
+    with Session(engine) as sessao:
+        devolver_pecas_ordem(sessao, 1)
+        sessao.commit()
+    assert _estoque(engine, 1) == 5
+    assert _linhas(engine, 1) == []
+
+
+def test_sem_saldo_nao_altera_nada(engine):
+    from sqlalchemy.orm import Session
+
+    with Session(engine) as sessao:
+        with pytest.raises(EstoqueInsuficiente):
+            registrar_pecas_ordem(sessao, 1, [
+                {'nome': 'Tela Galaxy A10', 'peca_id': 1},
+                {'nome': 'Batería Moto G7', 'peca_id': 2},
+                {'nome': 'Batería Moto G7', 'peca_id': 2},
+            ])
+        sessao.rollback()
+    assert (_estoque(engine, 1), _estoque(engine, 2)) == (5, 1)
+    assert _linhas(engine, 1) == []
+
+
+def test_pecas_travadas_ate_o_commit(engine):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import Session
+
+    primeira = Session(engine)
+    registrar_pecas_ordem(primeira, 1, [{'nome': 'Batería Moto G7', 'peca_id': 2}])  # Sem commit: segura a peça
+
+    erros = []
+
+    def concorrente():
+        with Session(engine) as sessao:
+            sessao.execute(text("SET LOCAL lock_timeout = '300ms'"))
+            try:
+                registrar_pecas_ordem(sessao, 2, [{'nome': 'Batería Moto G7', 'peca_id': 2}])
+            except OperationalError as e:
+                erros.append(e)
+            sessao.rollback()
+
+    thread = threading.Thread(target=concorrente)
+    thread.start()
+    thread.join(10)
+    assert len(erros) == 1  # Esperou a trava e desistiu pelo lock_timeout
+
+    primeira.commit()
+    primeira.close()
+    # Com a baixa da primeira confirmada, a segunda já não tem saldo
+    with Session(engine) as sessao:
+        with pytest.raises(EstoqueInsuficiente):
+            registrar_pecas_ordem(sessao, 2, [{'nome': 'Batería Moto G7', 'peca_id': 2}])
+        sessao.rollback()
+    assert _estoque(engine, 2) == 0
+
+
+def test_backfill_nao_mexe_no_estoque(engine):
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+
+    with engine.begin() as conexao:
+        conexao.execute(text("UPDATE ordens_servico SET pecas = CAST(:pecas AS JSON) WHERE id = 2"), {'pecas': json.dumps([
+            {'nome': 'tela galaxy a10', 'custo': '45.50'},
+            {'nome': 'Flex de carga', 'custo': 'a combinar'},
+            {'nome': '  '},
+        ])})
+
+    assert backfill_ordens(engine, lote=1, pausa=0) == {'ordens': 1, 'linhas': 2}
+    assert _linhas(engine, 2) == [(1, 'tela galaxy a10', False), (None, 'Flex de carga', False)]
+    assert _estoque(engine, 1) == 5
+    assert backfill_ordens(engine, lote=1, pausa=0) == {'ordens': 0, 'linhas': 0}  # Idempotente
+
+    # As peças antigas já tinham sido consumidas: excluir ou editar a ordem não devolve nada
+    with Session(engine) as sessao:
+        registrar_pecas_ordem(sessao, 2, [{'nome': 'tela galaxy a10', 'custo': 45.5}])
+        sessao.commit()
+    assert _estoque(engine, 1) == 5
+    with Session(engine) as sessao:
+        devolver_pecas_ordem(sessao, 2)
+        sessao.commit()
+    assert _estoque(engine, 1) == 5
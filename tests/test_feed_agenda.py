@@ -0,0 +1,49 @@
+"""Feed iCalendar da agenda do técnico atrás do middleware de compressão"""
+
+import json
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    import app as modulo_app
+
+    amanha = (date.today() + timedelta(days=1)).isoformat()
+    tecnicos = tmp_path / 'tecnicos.json'
+    tecnicos.write_text(json.dumps({'tecnicos': [{'id': 7, 'nome': 'Técnico Teste', 'ativo': True}]}), encoding='utf-8')
+    agendamentos = tmp_path / 'agendamentos.json'
+    # Agendamentos suficientes para o corpo passar do tamanho mínimo de compressão
+    agendamentos.write_text(json.dumps({'agendamentos': [
+        {'id': i, 'nome': f'Cliente {i}', 'telefone': '1100000000', 'tecnico_id': 7, 'data_agendamento': amanha,
+         'hora_agendamento': f'{8 + i % 10:02d}:00', 'tipo_servico': 'Reparación', 'status': 'pendente',
+         'observacoes': 'Heladera que no enfría ' * 3, 'data_criacao': '2024-01-01 10:00:00'}
+        for i in range(1, 21)
+    ]}), encoding='utf-8')
+    monkeypatch.setattr(modulo_app, 'TECNICOS_FILE', str(tecnicos))
+    monkeypatch.setattr(modulo_app, 'AGENDAMENTOS_FILE', str(agendamentos))
+    monkeypatch.setattr(modulo_app, 'use_database', lambda: False)
+    url = f"/agenda/tecnico/7.ics?token={modulo_app.token_feed(modulo_app.app.secret_key, 7)}"
+    return modulo_app.app.test_client(), url
+
+
+def test_etag_do_feed_comprimido_gera_304(cliente):
+    client, url = cliente
+    primeira = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert primeira.status_code == 200
+    assert primeira.headers.get('Content-Encoding') == 'gzip'
+    etag = primeira.headers['ETag']
+    assert etag.startswith('W/')  # O middleware enfraquece o ETag ao comprimir
+
+    # O cliente de calendário devolve exatamente o ETag que recebeu
+    segunda = client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert segunda.status_code == 304
+    assert segunda.data == b''
+
+
+def test_etag_forte_tambem_gera_304(cliente):
+    client, url = cliente
+    etag = client.get(url).headers['ETag']
+    assert not etag.startswith('W/')
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
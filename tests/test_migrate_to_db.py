@@ -0,0 +1,133 @@
+"""Migração JSON -> PostgreSQL em lotes (migrate_to_db.py)
+
+Os testes com banco rodam num schema próprio, com duas tabelas ligadas por
+FK no lugar das tabelas do app, e usam arquivos JSON temporários.
+"""
+
+import json
+
+import pytest
+
+import migrate_to_db
+from migrate_to_db import _ondas, ajustar_sequencias, carregar_checkpoint, migrar, migrar_entidade
+
+
+def _entidades():
+    return [
+        {
+            'nome': 'filhos', 'arquivo': 'data/familias.json', 'chave': 'familias', 'tabela': 'filhos',
+            'expandir': lambda familias: (dict(f, pai_id=p['id']) for p in familias for f in p.get('filhos', [])),
+            'depende': ('pais',),
+            'colunas': ('id', 'pai_id', 'nome'),
+            'conversor': lambda d: (d.get('id'), d.get('pai_id'), d.get('nome')),
+        },
+        {
+            'nome': 'pais', 'arquivo': 'data/familias.json', 'chave': 'familias', 'tabela': 'pais',
+            'colunas': ('id', 'nome'),
+            'conversor': lambda d: (d.get('id'), d.get('nome')),
+        },
+        {
+            'nome': 'vazia', 'arquivo': 'data/vazia.json', 'chave': 'itens', 'tabela': 'vazia',
+            'colunas': ('id', 'nome'),
+            'conversor': lambda d: (d.get('id'), d.get('nome')),
+        },
+    ]
+
+
+def test_ondas_respeitam_dependencias():
+    ondas = [[e['nome'] for e in onda] for onda in _ondas(migrate_to_db.ENTIDADES)]
+    posicao = {nome: i for i, onda in enumerate(ondas) for nome in onda}
+    assert posicao['ordens'] > posicao['clientes']
+    assert posicao['ordens'] > posicao['tecnicos']
+    assert len(ondas[0]) > 1  # As independentes rodam juntas
+
+
+def test_ondas_detectam_ciclo():
+    entidades = [{'nome': 'a', 'depende': ('b',)}, {'nome': 'b', 'depende': ('a',)}]
+    with pytest.raises(ValueError):
+        list(_ondas(entidades))
+
+
+# ==================== COM POSTGRES ====================
+
+@pytest.fixture
+def engine_migracao(pg_schema_engine, tmp_path, monkeypatch):
+    """Tabelas de teste no schema descartável, com o diretório de trabalho num temporário (JSON e checkpoint)"""
+    from sqlalchemy import text
+
+    engine = pg_schema_engine
+    with engine.begin() as conexao:
+        conexao.execute(text("CREATE TABLE pais (id SERIAL PRIMARY KEY, nome VARCHAR(100))"))
+        conexao.execute(text(
+            "CREATE TABLE filhos (id SERIAL PRIMARY KEY, pai_id INTEGER NOT NULL REFERENCES pais(id), nome VARCHAR(100))"
+        ))
+        conexao.execute(text("CREATE TABLE vazia (id SERIAL PRIMARY KEY, nome VARCHAR(100))"))
+
+    (tmp_path / 'data').mkdir()
+    familias = [{'id': i, 'nome': f'pai {i}', 'filhos': [{'id': i * 10 + j, 'nome': f'filho {j}'} for j in range(2)]}
+                for i in range(1, 8)]
+    (tmp_path / 'data' / 'familias.json').write_text(json.dumps({'familias': familias}), encoding='utf-8')
+    (tmp_path / 'data' / 'vazia.json').write_text(json.dumps({'itens': []}), encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(migrate_to_db, 'ENTIDADES', _entidades())
+    return engine
+
+
+def _contar(engine, tabela):
+    from sqlalchemy import text
+
+    with engine.connect() as conexao:
+        return conexao.execute(text(f"SELECT COUNT(*) FROM {tabela}")).scalar()
+
+
+def test_migra_em_ondas(engine_migracao):
+    # filhos vem antes de pais na lista: só entra sem violar a FK se rodar na onda seguinte
+    resultados = migrar(engine_migracao, tamanho_lote=3, workers=3)
+    assert resultados['pais']['inseridos'] == 7
+    assert resultados['filhos']['inseridos'] == 14
+    assert resultados['vazia']['lidos'] == 0
+    assert _contar(engine_migracao, 'filhos') == 14
+
+
+def test_rodar_de_novo_nao_duplica(engine_migracao):
+    migrar(engine_migracao, tamanho_lote=4, workers=2)
+    resultados = migrar(engine_migracao, tamanho_lote=4, workers=2, reiniciar=True)
+    assert resultados['pais'] == dict(resultados['pais'], lidos=7, inseridos=0)
+    assert resultados['filhos'] == dict(resultados['filhos'], lidos=14, inseridos=0)
+    assert (_contar(engine_migracao, 'pais'), _contar(engine_migracao, 'filhos')) == (7, 14)
+
+
+def test_ajustar_sequencias(engine_migracao):
+    from sqlalchemy import text
+
+    migrar(engine_migracao, nomes=['pais'], workers=1)
+    ajustar_sequencias(engine_migracao, ['pais', 'vazia'])
+    with engine_migracao.begin() as conexao:
+        novo_pai = conexao.execute(text("INSERT INTO pais (nome) VALUES ('novo') RETURNING id")).scalar()
+        novo_vazia = conexao.execute(text("INSERT INTO vazia (nome) VALUES ('primeiro') RETURNING id")).scalar()
+    assert novo_pai == 8  # Depois do maior id vindo do JSON
+    assert novo_vazia == 1  # Tabela vazia: a sequência começa do início
+
+
+def test_retoma_do_checkpoint(engine_migracao):
+    pais = next(e for e in migrate_to_db.ENTIDADES if e['nome'] == 'pais')
+    conversor = pais['conversor']
+    lidos = []
+
+    def conversor_que_falha(registro):
+        if len(lidos) == 5:
+            raise RuntimeError('interrompida')
+        lidos.append(registro['id'])
+        return conversor(registro)
+
+    # Lotes de 2: os dois primeiros são confirmados, o terceiro falha no meio
+    with pytest.raises(RuntimeError):
+        migrar_entidade(engine_migracao, dict(pais, conversor=conversor_que_falha), {}, tamanho_lote=2)
+    checkpoint = carregar_checkpoint()
+    assert checkpoint == {'pais': 4}
+    assert _contar(engine_migracao, 'pais') == 4
+
+    resultado = migrar_entidade(engine_migracao, pais, checkpoint, tamanho_lote=2)
+    assert resultado == dict(resultado, pulados_checkpoint=4, lidos=3, inseridos=3)
+    assert carregar_checkpoint() == {'pais': 7}
+    assert _contar(engine_migracao, 'pais') == 7
@@ -0,0 +1,129 @@
+"""Recálculo dos orçamentos pendentes quando a tabela de preços muda"""
+
+from decimal import Decimal
+
+import precificacao
+from precificacao import TabelaPreco, TABELA_PADRAO, recalcular_pendentes
+
+
+def _tabela_com_novos_precos():
+    dados = {'servicos': dict(TABELA_PADRAO['servicos']), 'materiais': dict(TABELA_PADRAO['materiais'])}
+    instalacao = dict(dados['servicos']['Instalação de Ar-Condicionado Split'])
+    instalacao['por_btu'] = {btu: preco + 100 for btu, preco in instalacao['por_btu'].items()}
+    dados['servicos']['Instalação de Ar-Condicionado Split'] = instalacao
+    return TabelaPreco(2, dados)
+
+
+class _Resultado:
+    def __init__(self, linhas):
+        self._linhas = linhas
+
+    def mappings(self):
+        return self
+
+    def all(self):
+        return self._linhas
+
+
+class _SessaoFalsa:
+    """Devolve os pendentes no SELECT e guarda os UPDATEs executados"""
+
+    def __init__(self, pendentes):
+        self.pendentes = pendentes
+        self.updates = []
+        self.commits = 0
+
+    def execute(self, sql, parametros=None):
+        if str(sql).lstrip().startswith('UPDATE'):
+            self.updates.append(parametros)
+            return _Resultado([])
+        return _Resultado(self.pendentes)
+
+    def commit(self):
+        self.commits += 1
+
+
+def _pendente(id_, btu, acesso='Fácil', valor_base=700.0):
+    return {'id': id_, 'tipo_servico': 'Instalação de Ar-Condicionado Split', 'potencia_btu': btu,
+            'tipo_acesso': acesso, 'material_adicional': None, 'valor_material_adicional': 0,
+            'custos_adicionais': None, 'valor_base': valor_base, 'valor_acesso': 0, 'valor_total': valor_base}
+
+
+def test_varios_alterados_num_unico_update():
+    sessao = _SessaoFalsa([_pendente(1, 12000), _pendente(2, 18000, valor_base=750.0), _pendente(3, 9000, valor_base=650.0)])
+    alterados = recalcular_pendentes(sessao, _tabela_com_novos_precos())
+
+    assert [item['id'] for item in alterados] == [1, 2, 3]
+    assert len(sessao.updates) == 1
+    parametros = sessao.updates[0]
+    assert isinstance(parametros, dict)
+    assert parametros['ids'] == [1, 2, 3]
+    assert parametros['valores_base'] == [800.0, 850.0, 750.0]
+    assert parametros['valores_total'] == [800.0, 850.0, 750.0]
+    assert parametros['status'] == list(precificacao.STATUS_RECALCULAVEIS)
+    assert sessao.commits == 1
+
+
+def test_sem_alterados_nao_atualiza():
+    sessao = _SessaoFalsa([_pendente(1, 12000)])
+    assert recalcular_pendentes(sessao, TabelaPreco(1, TABELA_PADRAO)) == []
+    assert sessao.updates == []
+
+
+_SQL_TABELA = """
+    CREATE TEMP TABLE orcamentos_ar_condicionado (
+        id INTEGER PRIMARY KEY,
+        tipo_servico VARCHAR(100) NOT NULL,
+        potencia_btu INTEGER NOT NULL,
+        tipo_acesso VARCHAR(50) NOT NULL,
+        material_adicional VARCHAR(100),
+        valor_material_adicional NUMERIC(10, 2) DEFAULT 0,
+        custos_adicionais JSON,
+        valor_base NUMERIC(10, 2) NOT NULL,
+        valor_acesso NUMERIC(10, 2) DEFAULT 0,
+        valor_total NUMERIC(10, 2) NOT NULL,
+        status VARCHAR(50) DEFAULT 'pendente',
+        data_atualizacao TIMESTAMP
+    )
+"""
+
+
+def test_valor_material_informado_sem_material():
+    """Como no cálculo antigo, o valor informado entra mesmo sem material escolhido"""
+    tabela = TabelaPreco(1, TABELA_PADRAO)
+    kit, preco_kit = next(iter(TABELA_PADRAO['materiais'].items()))
+    config = {'tipo_servico': 'Instalação de Ar-Condicionado Split', 'potencia_btu': 12000, 'tipo_acesso': 'Fácil'}
+    assert tabela.cotar(**config, valor_material_adicional=120)['valor_material'] == 120.0
+    assert tabela.cotar(**config, material_adicional=kit, valor_material_adicional=120)['valor_material'] == preco_kit
+    assert tabela.cotar(**config)['valor_material'] == 0.0
+
+
+def test_recalcular_pendentes_no_postgres(pg_engine):
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+
+    # Tabela temporária: só existe nesta conexão, que a sessão reaproveita
+    with pg_engine.connect() as conexao:
+        conexao.execute(text(_SQL_TABELA))
+        conexao.execute(text("""
+            INSERT INTO orcamentos_ar_condicionado
+                (id, tipo_servico, potencia_btu, tipo_acesso, valor_base, valor_acesso, valor_total, status)
+            VALUES (1, 'Instalação de Ar-Condicionado Split', 12000, 'Fácil', 700, 0, 700, 'pendente'),
+                   (2, 'Instalação de Ar-Condicionado Split', 18000, 'Moderado', 750, 75, 825, 'pendente'),
+                   (3, 'Instalação de Ar-Condicionado Split', 9000, 'Fácil', 650, 0, 650, 'aprovado')
+        """))
+        conexao.commit()
+
+        with Session(bind=conexao) as sessao:
+            alterados = recalcular_pendentes(sessao, _tabela_com_novos_precos())
+
+        assert sorted(item['id'] for item in alterados) == [1, 2]
+        linhas = conexao.execute(text(
+            "SELECT id, valor_base, valor_acesso, valor_total, data_atualizacao FROM orcamentos_ar_condicionado ORDER BY id"
+        )).mappings().all()
+        assert (linhas[0]['valor_base'], linhas[0]['valor_total']) == (Decimal('800.00'), Decimal('800.00'))
+        assert (linhas[1]['valor_base'], linhas[1]['valor_acesso'], linhas[1]['valor_total']) == \
+            (Decimal('850.00'), Decimal('85.00'), Decimal('935.00'))
+        assert linhas[1]['data_atualizacao'] is not None
+        # Fora de STATUS_RECALCULAVEIS: não é tocado
+        assert (linhas[2]['valor_total'], linhas[2]['data_atualizacao']) == (Decimal('650.00'), None)
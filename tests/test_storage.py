@@ -0,0 +1,99 @@
+"""Backends de blobs fora do banco (storage.py) com um cliente S3 falso no lugar do MinIO"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import storage
+from storage import LocalBackend, S3Backend, gravar_bytes, iter_blob, novo_writer, remover_blob
+
+
+class ClienteS3Falso:
+    """Multipart upload em memória com as chamadas do boto3 que o S3Backend usa"""
+
+    def __init__(self):
+        self.objetos = {}
+        self.uploads = {}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = (Key, {})
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploads[UploadId][1][PartNumber] = Body
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        chave, partes = self.uploads.pop(UploadId)
+        self.objetos[(Bucket, chave)] = b''.join(partes[p['PartNumber']] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+    def get_object(self, Bucket, Key):
+        dados = self.objetos[(Bucket, Key)]
+
+        class Corpo:
+            def iter_chunks(self, tamanho):
+                for inicio in range(0, len(dados), tamanho):
+                    yield dados[inicio:inicio + tamanho]
+
+        return {'Body': Corpo()}
+
+    def delete_object(self, Bucket, Key):
+        self.objetos.pop((Bucket, Key), None)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    backend = S3Backend('blobs')
+    backend._client = ClienteS3Falso()
+    monkeypatch.setitem(storage._backends, 's3', backend)
+    return backend
+
+
+@pytest.fixture
+def sessao():
+    with Session(create_engine('sqlite://')) as sessao:
+        yield sessao
+
+
+def test_s3_multipart_e_leitura(s3, sessao, monkeypatch):
+    monkeypatch.setattr(storage.S3MultipartWriter, 'TAMANHO_PARTE', 10)
+    dados = bytes(range(256)) * 3
+    chave = gravar_bytes(sessao, dados, s3)
+    sessao.commit()
+    assert chave.startswith('s3:')
+    assert b''.join(iter_blob(None, chave, 100)) == dados
+
+    remover_blob(sessao, chave)
+    assert s3.client.objetos  # Só some depois do commit
+    sessao.commit()
+    assert not s3.client.objetos
+
+
+def test_s3_rollback_remove_objeto_enviado(s3, sessao):
+    chave = gravar_bytes(sessao, b'pdf', s3)
+    assert s3.client.objetos
+    sessao.rollback()
+    assert not s3.client.objetos
+
+    # Depois do commit o rollback seguinte não mexe no que já foi gravado
+    chave = gravar_bytes(sessao, b'pdf', s3)
+    sessao.commit()
+    sessao.rollback()
+    assert b''.join(iter_blob(None, chave)) == b'pdf'
+
+
+def test_local_rollback_remove_arquivo(tmp_path, sessao, monkeypatch):
+    local = LocalBackend(str(tmp_path))
+    monkeypatch.setitem(storage._backends, 'local', local)
+    writer = novo_writer(sessao, local)
+    writer.write(b'imagem')
+    caminho = local.caminho_local(writer.close())
+    assert open(caminho, 'rb').read() == b'imagem'
+    sessao.rollback()
+    assert not os.path.exists(caminho)
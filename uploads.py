@@ -0,0 +1,84 @@
+"""
+Pipeline de upload em streaming
+Lê o arquivo enviado em blocos, valida tipo/tamanho, calcula o hash SHA-256 e
+grava direto no armazenamento de blobs (ver storage.py), sem nunca montar o
+arquivo inteiro como um único objeto bytes na memória do worker
+"""
+
+import hashlib
+
+from storage import CHUNK_SIZE
+
+# Assinaturas (magic bytes) aceitas - o tipo MIME vem do conteúdo, não do nome do arquivo
+ASSINATURAS = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+]
+
+TIPOS_IMAGEM = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+TIPOS_PDF = {'application/pdf'}
+
+
+class UploadInvalido(Exception):
+    """Upload rejeitado na validação (tipo, tamanho ou arquivo vazio)"""
+    pass
+
+
+def detectar_tipo_mime(cabecalho):
+    """Detecta o tipo MIME pelos primeiros bytes do arquivo"""
+    if not cabecalho:
+        return None
+    # WEBP: RIFF....WEBP
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'image/webp'
+    for assinatura, tipo_mime in ASSINATURAS:
+        if cabecalho.startswith(assinatura):
+            return tipo_mime
+    return None
+
+
+def stream_upload(file_storage, writer, max_size, tipos_permitidos, chunk_size=CHUNK_SIZE):
+    """Copia o upload para o writer em blocos, validando e calculando o hash
+
+    Retorna dict com storage_key, tamanho, sha256 e tipo_mime.
+    Levanta UploadInvalido se o tipo não for permitido ou o tamanho passar de max_size.
+    """
+    stream = file_storage.stream
+    try:
+        stream.seek(0)
+    except Exception:
+        pass
+
+    hasher = hashlib.sha256()
+    tamanho = 0
+    tipo_mime = None
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if tipo_mime is None:
+                tipo_mime = detectar_tipo_mime(chunk)
+                if tipo_mime not in tipos_permitidos:
+                    raise UploadInvalido('Tipo de arquivo não permitido')
+            tamanho += len(chunk)
+            if tamanho > max_size:
+                raise UploadInvalido(f'Arquivo muito grande. Tamanho máximo: {max_size // (1024 * 1024)}MB')
+            hasher.update(chunk)
+            writer.write(chunk)
+        if tamanho == 0:
+            raise UploadInvalido('Arquivo vazio')
+    except Exception:
+        writer.abort()
+        raise
+
+    return {
+        'storage_key': writer.close(),
+        'tamanho': tamanho,
+        'sha256': hasher.hexdigest(),
+        'tipo_mime': tipo_mime,
+    }
+